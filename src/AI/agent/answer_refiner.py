@@ -1,7 +1,5 @@
-import os
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage
+from src.AI.llm_gateway import complete
 
 load_dotenv()
 
@@ -9,12 +7,7 @@ load_dotenv()
 # =====================================================
 # REVIEW MODEL (temp ต่ำ = strict reasoning)
 # =====================================================
-review_llm = ChatOpenAI(
-    base_url=os.getenv("LOCALMODEL_BASE_URL"),
-    api_key=os.getenv("LOCALMODEL_API_KEY"),
-    model=os.getenv("LOCALMODEL_MODEL_SUM", "openai/gpt-oss-120b"),
-    temperature=0.0,
-)
+# role "review" ใน llm_gateway: LOCALMODEL_MODEL_SUM, temperature 0.0
 
 
 # =====================================================
@@ -48,8 +41,7 @@ def refine_answer(question: str, answer: str) -> str:
 ส่งเฉพาะคำตอบสุดท้าย
 """
 
-    result = review_llm.invoke([HumanMessage(content=prompt)])
-    return result.content.strip()
+    return complete("review", prompt)
 
 
 # =====================================================
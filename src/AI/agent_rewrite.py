@@ -1,5 +1,5 @@
 # src/analysis/agent_rewrite.py
-from typing import Optional, Callable, Tuple, Dict
+from typing import Optional, Awaitable, Callable, Tuple, Dict
 import json
 
 
@@ -87,6 +87,36 @@ def generate_rewrite_suggestion_for_row(
     except Exception:
         raw = ""
 
+    return parse_rewrite_output(raw)
+
+
+async def agenerate_rewrite_suggestion_for_row(
+    *,
+    change_type: str,
+    section_label: Optional[str],
+    old_text: Optional[str],
+    new_text: Optional[str],
+    risk_level: Optional[str],  # backward compatibility (ไม่ใช้)
+    acall_llm: Callable[[str], Awaitable[str]],
+) -> Tuple[str, str, Dict[str, float]]:
+    """
+    เหมือน generate_rewrite_suggestion_for_row แต่เรียก LLM แบบ async (ใช้กับ annotate job)
+    error ของ acall_llm ส่งต่อให้ผู้เรียก (นับเป็น failed ไม่ใช้คะแนน default)
+    """
+
+    prompt = build_rewrite_prompt(
+        change_type=change_type,
+        section_label=section_label,
+        old_text=old_text,
+        new_text=new_text,
+    )
+
+    raw = await acall_llm(prompt) or ""
+
+    return parse_rewrite_output(raw)
+
+
+def parse_rewrite_output(raw: str) -> Tuple[str, str, Dict[str, float]]:
     raw = raw.strip()
 
     # 🔹 default scores (สำคัญ: ต้องมีเสมอ)
@@ -4,10 +4,10 @@ import logging
 import time
 import json
 import re
+import contextvars
 from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import (
     HumanMessage,
     ToolMessage,
@@ -17,6 +17,11 @@ from langchain_core.messages import (
 from src.AI.Tools.tavily_search import get_web_tools
 from src.AI.Tools.get_change import get_change_paragraph
 
+from src.monitoring.metrics import llm_call_timer
+from src.AI.llm_concurrency import llm_slot_sync, llm_stream_slot_sync
+from src.AI.llm_gateway import get_llm, model_name
+from src.AI.llm_accounting import begin_call_tracking, iter_tracked
+from src.db.ops import save_llm_calls
 from src.AI.memory.loader_memory import load_memory
 from src.AI.memory.service_memory import (
     get_or_create_conversation,
@@ -76,14 +81,8 @@ def debug(title, value=None):
 # ==========================================================
 # LLM
 # ==========================================================
-llm = ChatOpenAI(
-    base_url=os.getenv("LOCALMODEL_BASE_URL"),
-    api_key=os.getenv("LOCALMODEL_API_KEY"),
-    model=os.getenv("LOCALMODEL_MODEL_SUM", "openai/gpt-oss-120b"),
-    temperature=0.3,
-    timeout=MODEL_TIMEOUT_SEC,
-    max_retries=1,
-)
+# client / timeout อยู่ใน llm_gateway (role "chat" ใช้ LOCALMODEL_TIMEOUT_SEC)
+MODEL_NAME = model_name("chat")
 
 # ==========================================================
 # TOOLS
@@ -93,7 +92,14 @@ tools = [
     *get_web_tools(),
 ]
 
-llm_with_tools = llm.bind_tools(tools)
+
+def _llm():
+    return get_llm("chat")
+
+
+def _llm_with_tools():
+    return get_llm("chat", tools=lambda: tools, tools_key="chat")
+
 
 debug("REGISTERED TOOLS", [t.name for t in tools])
 STATUS_PREFIX = "__STATUS__:"
@@ -140,10 +146,16 @@ def _needs_change_context(question: str) -> bool:
     return any(k in q for k in keywords)
 
 
+def _timed_invoke(messages: List):
+    with llm_slot_sync(MODEL_NAME), llm_call_timer("chat", MODEL_NAME):
+        return _llm_with_tools().invoke(messages)
+
+
 def _invoke_with_heartbeat(messages: List, heartbeat_message: str) -> Generator[str, None, object | None]:
     started = time.monotonic()
     with ThreadPoolExecutor(max_workers=1) as executor:
-        fut = executor.submit(llm_with_tools.invoke, messages)
+        # copy_context: ให้ call hook (llm_accounting) เห็น tracker ของรอบแชทนี้
+        fut = executor.submit(contextvars.copy_context().run, _timed_invoke, messages)
         while True:
             try:
                 result = fut.result(timeout=INVOKE_HEARTBEAT_SEC)
@@ -435,6 +447,21 @@ def stream_ai_chat(change_id: int, user_message: str, db) -> Generator[str, None
     conversation = get_or_create_conversation(db, change_id)
     debug("CONVERSATION ID", conversation.id)
 
+    # ⭐ บันทึกทุก LLM call ของรอบนี้ (chat / review / สรุป memory) ผูกกับ conversation
+    ctx = contextvars.copy_context()
+    tracker = ctx.run(begin_call_tracking)
+    try:
+        yield from iter_tracked(_stream_ai_chat(change_id, conversation, user_message, db), ctx)
+    finally:
+        try:
+            save_llm_calls(db, tracker.to_list(), conversation_id=conversation.id)
+        except Exception as e:
+            db.rollback()
+            debug("SAVE LLM CALLS ERROR", str(e))
+
+
+def _stream_ai_chat(change_id: int, conversation, user_message: str, db) -> Generator[str, None, None]:
+
     memory_messages = load_memory(db, conversation.id)
     debug("MEMORY COUNT", len(memory_messages))
 
@@ -522,13 +549,16 @@ change_id: {change_id}
         chunks: List[str] = []
         chunk_count = 0
         try:
-            for chunk in llm.stream(stream_messages):
-                text = _content_to_text(getattr(chunk, "content", None))
-                if not text:
-                    continue
-                chunks.append(text)
-                chunk_count += 1
-                yield text
+            # ⭐ AIMD วัดแค่เวลาถึง token แรก (stream ยาวแต่ปกติไม่ถือว่า server overload)
+            with llm_stream_slot_sync(MODEL_NAME) as first_token:
+                for chunk in _llm().stream(stream_messages):
+                    text = _content_to_text(getattr(chunk, "content", None))
+                    if not text:
+                        continue
+                    first_token()
+                    chunks.append(text)
+                    chunk_count += 1
+                    yield text
         except GeneratorExit:
             debug("TRUE STREAM INTERRUPTED", f"client disconnected after {chunk_count} chunks")
             return
@@ -547,7 +577,7 @@ change_id: {change_id}
             auto_summarize_if_needed(
                 db=db,
                 conversation_id=conversation.id,
-                llm=llm
+                llm=_llm()
             )
             return
 
@@ -594,5 +624,5 @@ change_id: {change_id}
     auto_summarize_if_needed(
         db=db,
         conversation_id=conversation.id,
-        llm=llm
+        llm=_llm()
     )
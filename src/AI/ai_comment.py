@@ -1,14 +1,29 @@
-import json
-import re
 import os
-from typing import List
+from typing import Callable, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 
 from src.diff.diff import Change
+from src.service.cancellation import CancellationToken, gather_cancellable
+from src.monitoring.metrics import llm_call_timer
+from src.AI.llm_cache import llm_cache, make_cache_key, record_lookup
+from src.AI.llm_concurrency import llm_slot
+from src.AI.llm_gateway import get_llm, model_name, role_temperature
+from src.AI.llm_retry import CircuitOpenError, RetryPolicy, aretry
+from src.AI.ai_schedule import by_priority, priority_key
+from src.diff.cluster import is_cluster_member
+from src.AI.model_router import candidate_models, planned_route, route_for
+from src.AI.prompt_compress import prompt_texts
+from src.AI.category_knn import prefilled_category
+from src.AI.structured_output import (
+    CommentBatchItem,
+    CommentOutput,
+    ainvoke_structured,
+    parse_structured,
+    parse_structured_items,
+)
 import asyncio
 
 load_dotenv()
@@ -16,12 +31,24 @@ load_dotenv()
 # ==================================================
 # LLM setup
 # ==================================================
-llm = ChatOpenAI(
-    base_url=os.getenv("LOCALMODEL_BASE_URL"),
-    api_key=os.getenv("LOCALMODEL_API_KEY"),
-    model=os.getenv("LOCALMODEL_MODEL_COMMENT"),
-    temperature=0.2,
-)
+MODEL_NAME = model_name("comment")
+TEMPERATURE = role_temperature("comment")
+
+# ⭐ เปลี่ยนเลขนี้ทุกครั้งที่แก้ prompt → cache เดิมจะไม่ถูกใช้
+PROMPT_VERSION = "comment-v2"
+
+# ==================================================
+# Batch mode (รวม change เล็ก ๆ หลายรายการใน 1 request → ส่ง rubric ครั้งเดียว)
+# ==================================================
+AI_COMMENT_BATCH = os.getenv("AI_COMMENT_BATCH", "true").lower() == "true"
+AI_COMMENT_BATCH_TOKEN_BUDGET = int(os.getenv("AI_COMMENT_BATCH_TOKEN_BUDGET", "3000"))
+AI_COMMENT_BATCH_ITEM_MAX_TOKENS = int(os.getenv("AI_COMMENT_BATCH_ITEM_MAX_TOKENS", "600"))
+AI_COMMENT_BATCH_MAX_ITEMS = int(os.getenv("AI_COMMENT_BATCH_MAX_ITEMS", "8"))
+
+BATCH_PROMPT_VERSION = "comment-batch-v2"
+
+# change ที่ kNN (category_knn) เดาหมวดไว้แล้วมั่นใจพอ → prompt ไม่มีส่วนจัดหมวด
+PREFILLED_PROMPT_VERSION = "comment-nocat-v1"
 
 # ==================================================
 # VALID CHANGE CATEGORY
@@ -37,39 +64,17 @@ VALID_CATEGORIES = {
     "architecture"
 }
 
-# ==================================================
-# Utility: Safe JSON Parser
-# ==================================================
-def _safe_parse_json(raw: str) -> dict:
-    """พยายามแปลงข้อความจาก LLM ให้เป็น JSON ที่ถูกต้อง"""
-    match = re.search(r"\{[\s\S]*\}", raw)
-    if not match:
-        print("⚠️ [DEBUG] ไม่พบ JSON ในข้อความ LLM")
-        return {}
-    try:
-        return json.loads(match.group(0))
-    except Exception as e:
-        print(f"⚠️ [DEBUG] JSON parse error: {e}")
-        cleaned = re.sub(r"[\x00-\x1f\x7f]", "", match.group(0))
-        try:
-            return json.loads(cleaned)
-        except Exception as e2:
-            print(f"⚠️ [DEBUG] Parse ล้มเหลวซ้ำ: {e2}")
-            return {}
+def estimate_tokens(text: Optional[str]) -> int:
+    """ประมาณจำนวน token แบบหยาบ (ภาษาไทย ~2 ตัวอักษร/token) ไม่ต้องโหลด tokenizer"""
+    return len(text or "") // 2 + 1
+
 
 # ==================================================
-# Generate FULL AI Analysis (ASYNC)
+# Prompt (rubric ใช้ร่วมกันทั้งแบบ change เดียวและแบบ batch)
 # ==================================================
-async def generate_ai_comment(change: Change) -> None:
-    """
-    วิเคราะห์ change แบบ full analysis:
-    - paragraph_topic
-    - change_category
-    - ai_comment
-    - change_details ⭐ NEW
-    """
-
-    prompt = ChatPromptTemplate.from_template("""
+# ⭐ rubric อยู่ใน system message (เหมือนกันทุก byte ทุก call) ข้อมูลของ change อยู่ใน human message
+#   → vLLM / Ollama ใช้ KV cache ของ prefix ซ้ำได้ ไม่ต้องประมวลผล rubric ใหม่ทุกครั้ง
+COMMENT_RUBRIC = """
 คุณคือผู้เชี่ยวชาญด้าน กฎหมาย การเงิน และการบริหารโครงการ
 
 งานของคุณมี 4 ส่วน:
@@ -298,7 +303,9 @@ format:
 ]
 
 
-----------------------------------------
+"""
+
+SINGLE_CHANGE_HUMAN = """----------------------------------------
 ประเภทการเปลี่ยนแปลง:
 {change_type}
 
@@ -324,83 +331,196 @@ OUTPUT FORMAT (JSON ONLY)
 ห้ามข้อความอื่น
 ห้าม markdown
 ห้ามอธิบายนอก JSON
-""")
+"""
 
-    chain = prompt | llm | StrOutputParser()
+BATCH_HUMAN = """----------------------------------------
+รายการการเปลี่ยนแปลงทั้งหมด {count} รายการ (แต่ละรายการมี index กำกับ)
+วิเคราะห์ทุกรายการแยกจากกัน ห้ามนำข้อมูลข้ามรายการ
 
-    print(f"\n🧠 [DEBUG] วิเคราะห์ FULL สำหรับ Change: {change.change_type}")
+{changes_block}
+----------------------------------------
 
-    try:
-        raw_output = await chain.ainvoke({
-            "change_type": change.change_type,
-            "old_text": change.old_text or "-",
-            "new_text": change.new_text or "-",
-        })
-
-        raw_output = raw_output.strip()
-        data = _safe_parse_json(raw_output)
-
-        # =========================
-        # ai_comment
-        # =========================
-        change.ai_comment = data.get(
-            "ai_comment",
-            "มีการเปลี่ยนแปลงในส่วนนี้ กรุณาตรวจสอบรายละเอียดเพิ่มเติม"
-        )
 
-        # =========================
-        # paragraph_topic
-        # =========================
-        change.paragraph_topic = data.get(
-            "paragraph_topic",
-            "ไม่สามารถสรุปหัวข้อได้"
-        )
+====================================================
+OUTPUT FORMAT (JSON ARRAY ONLY)
+====================================================
+
+ตอบเป็น JSON array โดยมี 1 object ต่อ 1 รายการ และใช้ index เดิมของรายการนั้น
+
+[
+  {{
+    "index": 0,
+    "paragraph_topic": "...",
+    "change_category": "...",
+    "ai_comment": "...",
+    "change_details": []
+  }}
+]
+
+ห้ามข้อความอื่น
+ห้าม markdown
+ห้ามอธิบายนอก JSON
+"""
+
+# ==================================================
+# Prompt แบบไม่จัดหมวด (หมวดมาจาก category_knn)
+# ==================================================
+# ตัดส่วนที่ 2 (นิยามหมวด + PRIORITY RULE ซึ่งยาวที่สุดใน rubric) ออกจาก rubric เดิม
+# → แก้ rubric ที่เดียว สองแบบไม่หลุดกัน
+_CATEGORY_SECTION_START = "========================================\n2) จัดประเภทการเปลี่ยนแปลง (change_category)"
+_CATEGORY_SECTION_END = "====================================================\n3) วิเคราะห์"
+
+COMMENT_RUBRIC_NO_CATEGORY = (
+    COMMENT_RUBRIC[:COMMENT_RUBRIC.index(_CATEGORY_SECTION_START)]
+    + "========================================\n"
+    + "2) หมวดของการเปลี่ยนแปลง (change_category) ระบบกำหนดไว้แล้ว ไม่ต้องระบุ\n"
+    + "========================================\n\n\n"
+    + COMMENT_RUBRIC[COMMENT_RUBRIC.index(_CATEGORY_SECTION_END):]
+)
+
+SINGLE_CHANGE_HUMAN_NO_CATEGORY = SINGLE_CHANGE_HUMAN.replace('  "change_category": "...",\n', "")
+
+# compile ครั้งเดียวตอน import
+SINGLE_CHANGE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", COMMENT_RUBRIC),
+    ("human", SINGLE_CHANGE_HUMAN),
+])
+BATCH_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", COMMENT_RUBRIC),
+    ("human", BATCH_HUMAN),
+])
+SINGLE_CHANGE_PROMPT_PREFILLED = ChatPromptTemplate.from_messages([
+    ("system", COMMENT_RUBRIC_NO_CATEGORY),
+    ("human", SINGLE_CHANGE_HUMAN_NO_CATEGORY),
+])
+
+
+def _single_prompt(change: Change):
+    """(prompt, prompt_version) ของ change เดี่ยว: มีหมวดจาก kNN แล้ว → prompt แบบไม่จัดหมวด"""
+    if prefilled_category(change):
+        return SINGLE_CHANGE_PROMPT_PREFILLED, PREFILLED_PROMPT_VERSION
+    return SINGLE_CHANGE_PROMPT, PROMPT_VERSION
+
+
+def _cache_key(model: str, change: Change) -> str:
+    # key แยกตาม prompt (ผลแบบไม่จัดหมวดไม่มี change_category → ห้ามปนกับ cache เดิม)
+    _, version = _single_prompt(change)
+    return make_cache_key(model, version, _comment_inputs(change), TEMPERATURE)
+
+
+# ==================================================
+# Generate FULL AI Analysis (ASYNC)
+# ==================================================
+async def generate_ai_comment(change: Change) -> None:
+    """
+    วิเคราะห์ change แบบ full analysis:
+    - paragraph_topic
+    - change_category
+    - ai_comment
+    - change_details ⭐ NEW
+    """
+
+    # ⭐ model เล็ก / ใหญ่ ตามความรุนแรงของ change (model_router)
+    route = route_for(change, "comment")
+    llm = get_llm(route.role)
+
+    print(f"\n🧠 [DEBUG] วิเคราะห์ FULL สำหรับ Change: {change.change_type} ({route.tier})")
+
+    inputs = _comment_inputs(change)
+    prompt, _ = _single_prompt(change)
+
+    async def _call_llm() -> dict:
+        async with llm_slot(route.model):
+            with llm_call_timer("comment", route.model):
+                # ⭐ server บังคับรูปแบบตาม CommentOutput (ถ้ารองรับ)
+                raw_output = await ainvoke_structured(prompt, llm, inputs, CommentOutput, route.model)
+        # ซ่อม JSON ก่อน / ไม่ผ่าน schema → OutputParseError → aretry (ไม่เก็บลง cache)
+        return parse_structured(raw_output, CommentOutput, "comment")
 
-        # =========================
-        # change_category
-        # =========================
-        cat = str(data.get("change_category", "")).lower().strip()
-        if cat not in VALID_CATEGORIES:
-            print(f"⚠️ [DEBUG] invalid category: {cat}")
-            cat = "unknown"
-        change.change_category = cat
+    try:
+        # ⭐ paragraph คู่เดิม (เช่น v2→v3 ที่ข้อความไม่เปลี่ยน) ใช้ผลจาก cache
+        data = await llm_cache.aget_or_compute(
+            "comment",
+            _cache_key(route.model, change),
+            _call_llm,
+        )
 
-        # =========================
-        # ⭐ NEW change_details
-        # =========================
-        change.change_details = data.get("change_details", [])
+        _apply_comment_data(change, data)
 
     except Exception as e:
         print(f"❌ [ERROR] วิเคราะห์ FULL ล่ม: {e}")
         raise
 
 
+def _comment_inputs(change: Change) -> dict:
+    # ⭐ ย่อหน้ายาวที่เปลี่ยนไม่กี่จุด → ส่งเฉพาะช่วงที่เปลี่ยน + บริบทรอบข้าง (prompt_compress)
+    old_text, new_text = prompt_texts(change)
+    return {
+        "change_type": change.change_type,
+        "old_text": old_text or "-",
+        "new_text": new_text or "-",
+    }
+
+
+def _apply_comment_data(change: Change, data: dict) -> None:
+    # =========================
+    # ai_comment
+    # =========================
+    change.ai_comment = data.get(
+        "ai_comment",
+        "มีการเปลี่ยนแปลงในส่วนนี้ กรุณาตรวจสอบรายละเอียดเพิ่มเติม"
+    )
+
+    # =========================
+    # paragraph_topic
+    # =========================
+    change.paragraph_topic = data.get(
+        "paragraph_topic",
+        "ไม่สามารถสรุปหัวข้อได้"
+    )
+
+    # =========================
+    # change_category (kNN มั่นใจแล้ว → ใช้หมวดนั้น)
+    # =========================
+    cat = prefilled_category(change) or str(data.get("change_category", "")).lower().strip()
+    if cat not in VALID_CATEGORIES:
+        print(f"⚠️ [DEBUG] invalid category: {cat}")
+        cat = "unknown"
+    change.change_category = cat
+
+    # =========================
+    # ⭐ NEW change_details
+    # =========================
+    change.change_details = data.get("change_details", [])
+
+
 # ==================================================
-# Async wrapper + RETRY
+# Async wrapper + RETRY (backoff + circuit breaker ใน llm_retry)
 # ==================================================
 async def generate_ai_comment_async(
     change: Change,
     semaphore: asyncio.Semaphore,
-    max_retries: int = 2
+    max_retries: int = 2,
+    on_done: Optional[Callable[[Change], None]] = None,
 ):
 
     async with semaphore:
-        last_error = None
-
-        for attempt in range(max_retries + 1):
-            try:
-                if attempt > 0:
-                    print(f"🔁 [RETRY {attempt}/{max_retries}] Change: {change.change_type}")
-
-                await generate_ai_comment(change)
-                return
-
-            except Exception as e:
-                last_error = e
-                print(f"❌ [ASYNC ERROR] attempt {attempt+1}: {e}")
-                await asyncio.sleep(1.0)
-
-        print(f"❌ [FATAL] วิเคราะห์ Change ไม่สำเร็จหลัง retry {max_retries} ครั้ง")
+        try:
+            await aretry(
+                lambda: generate_ai_comment(change),
+                role="comment",
+                model=route_for(change, "comment").model,
+                policy=RetryPolicy(max_retries=max_retries),
+            )
+            if on_done is not None:
+                on_done(change)
+            return
+
+        except CircuitOpenError:
+            print(f"⚡ [BREAKER] ข้าม ai_comment (model server ไม่พร้อม) Change: {change.change_type}")
+
+        except Exception as e:
+            print(f"❌ [FATAL] วิเคราะห์ Change ไม่สำเร็จหลัง retry {max_retries} ครั้ง: {e}")
 
         change.ai_comment = (
             "มีการเปลี่ยนแปลงในส่วนนี้ "
@@ -411,22 +531,239 @@ async def generate_ai_comment_async(
         change.change_details = []
 
 
+# ==================================================
+# Batch: หลาย change ใน 1 request
+# ==================================================
+def _pack_batches(pending: List[Tuple[int, Change]]):
+    """
+    แบ่ง change เป็น batch ตาม token budget
+    - change ใหญ่ (เกิน ITEM_MAX_TOKENS) ยิงเดี่ยวเหมือนเดิม
+    - batch ที่มีรายการเดียวก็ยิงเดี่ยว
+    """
+    batches: List[List[Tuple[int, Change]]] = []
+    singles: List[Tuple[int, Change]] = []
+
+    current: List[Tuple[int, Change]] = []
+    used = 0
+    for i, c in pending:
+        cost = estimate_tokens(c.old_text) + estimate_tokens(c.new_text)
+        if cost > AI_COMMENT_BATCH_ITEM_MAX_TOKENS:
+            singles.append((i, c))
+            continue
+        if current and (
+            used + cost > AI_COMMENT_BATCH_TOKEN_BUDGET
+            or len(current) >= AI_COMMENT_BATCH_MAX_ITEMS
+        ):
+            batches.append(current)
+            current, used = [], 0
+        current.append((i, c))
+        used += cost
+    if current:
+        batches.append(current)
+
+    for b in [b for b in batches if len(b) == 1]:
+        singles.extend(b)
+    return [b for b in batches if len(b) > 1], singles
+
+
+async def generate_ai_comment_batch(batch: List[Tuple[int, Change]]) -> List[Tuple[int, Change]]:
+    """
+    วิเคราะห์หลาย change ใน request เดียว
+    คืนรายการที่ยังไม่ได้ผล (parse ไม่ผ่าน / ไม่มีใน output) ให้ผู้เรียก fallback แบบเดี่ยว
+    """
+    # batch มีแต่ change tier เดียวกันที่ไม่ก้ำกึ่ง (แยกตอน pack) → ตัดสิน route ตอน dispatch ได้ผลเดียวกันทุกรายการ
+    # (บันทึก model_route ของทุกรายการ ไม่ใช่แค่ตัวแรก)
+    routes = [route_for(c, "comment") for _, c in batch]
+    route = routes[0]
+    chain = BATCH_PROMPT | get_llm(route.role) | StrOutputParser()
+
+    blocks = []
+    for pos, (_, c) in enumerate(batch):
+        inputs = _comment_inputs(c)
+        blocks.append(
+            f"[index {pos}]\n"
+            f"ประเภทการเปลี่ยนแปลง: {inputs['change_type']}\n"
+            f"ข้อความเดิม:\n{inputs['old_text']}\n"
+            f"ข้อความใหม่:\n{inputs['new_text']}\n"
+        )
+
+    print(f"\n🧠 [DEBUG] วิเคราะห์ FULL แบบ batch {len(batch)} รายการ")
+
+    async with llm_slot(route.model):
+        with llm_call_timer("comment_batch", route.model):
+            raw_output = await chain.ainvoke({
+                "count": len(batch),
+                "changes_block": "\n".join(blocks),
+            })
+
+    # batch = JSON array (server constraint ใช้ไม่ได้) → ซ่อม + ตรวจ schema ทีละ item
+    items = parse_structured_items(raw_output, CommentBatchItem, "comment_batch")
+
+    failed: List[Tuple[int, Change]] = []
+    for pos, (i, c) in enumerate(batch):
+        item = items.get(pos)
+        if item is None:
+            failed.append((i, c))
+            continue
+        data = {k: v for k, v in item.items() if v is not None}
+        _apply_comment_data(c, data)
+        # นับ miss เฉพาะรายการที่ได้ผลจาก batch (รายการที่ล้มไปนับตอน fallback แบบเดี่ยวผ่าน aget_or_compute)
+        record_lookup("comment", "miss")
+        # เก็บลง cache ด้วย key ของรายการเดี่ยว → ครั้งหน้าเจอ paragraph คู่เดิมไม่ต้องยิงใหม่
+        llm_cache.put(
+            "comment",
+            _cache_key(route.model, c),
+            data,
+        )
+    return failed
+
+
+async def generate_ai_comment_batch_async(
+    batch: List[Tuple[int, Change]],
+    semaphore: asyncio.Semaphore,
+    on_done: Optional[Callable[[int, Change], None]] = None,
+    stats: Optional[dict] = None,
+):
+    async with semaphore:
+        try:
+            # batch ไม่ retry เอง — รายการที่ล้มไปต่อที่แบบเดี่ยว (ซึ่ง retry แล้ว)
+            failed = await aretry(
+                lambda: generate_ai_comment_batch(batch),
+                role="comment",
+                model=route_for(batch[0][1], "comment").model,
+                policy=RetryPolicy(max_retries=0),
+            )
+        except Exception as e:
+            print(f"❌ [ASYNC ERROR] batch {len(batch)} รายการ: {e}")
+            failed = list(batch)
+
+    failed_ids = {i for i, _ in failed}
+    for i, c in batch:
+        if i not in failed_ids and on_done is not None:
+            on_done(i, c)
+
+    if stats is not None:
+        stats["batch_items_ok"] += len(batch) - len(failed)
+        stats["batch_fallbacks"] += len(failed)
+
+    # fallback: รายการที่ batch ตอบไม่ได้ → ยิงเดี่ยว (มี retry ของตัวเอง)
+    if failed:
+        print(f"↩️ [DEBUG] fallback แบบเดี่ยว {len(failed)} รายการ")
+        await asyncio.gather(*[
+            generate_ai_comment_async(
+                c,
+                semaphore,
+                max_retries=2,
+                on_done=(lambda ch, i=i: on_done(i, ch)) if on_done else None,
+            )
+            for i, c in failed
+        ])
+
+
 # ==================================================
 # Run parallel
 # ==================================================
-async def run_generate_ai_comment_parallel(changes: List[Change]):
+async def run_generate_ai_comment_parallel(
+    changes: List[Change],
+    cancel_token: Optional[CancellationToken] = None,
+    on_done: Optional[Callable[[int, Change], None]] = None,
+):
+    """
+    - ข้าม change ที่มี ai_comment อยู่แล้ว (เช่น resume จาก checkpoint)
+    - on_done(index, change) ถูกเรียกทันทีที่ change นั้นวิเคราะห์สำเร็จ
+    """
 
+    # semaphore นี้จำกัด fan-out ของงานนี้งานเดียว
+    # จำนวน request จริงไปที่ model server คุมโดย llm_slot (ใช้ร่วมกันทั้ง process)
     SEMAPHORE_LIMIT = int(os.getenv("LLM_PARALLEL_LIMIT", 8))
     semaphore = asyncio.Semaphore(SEMAPHORE_LIMIT)
 
-    results = await asyncio.gather(
-        *[
-            generate_ai_comment_async(c, semaphore, max_retries=2)
-            for c in changes
-        ],
-        return_exceptions=True
-    )
+    # ⭐ change รุนแรงก่อน (REMOVED / ADDED / HEAVY → MEDIUM → LIGHT)
+    # สมาชิกของกลุ่มการแก้ซ้ำรอรับผลจากตัวแทน (propagate_clusters)
+    pending = by_priority([
+        (i, c) for i, c in enumerate(changes)
+        if not getattr(c, "ai_comment", None) and not is_cluster_member(c)
+    ])
+
+    stats = {
+        "batch_requests": 0,
+        "batch_items_ok": 0,
+        "batch_fallbacks": 0,
+        "single_requests": 0,
+        "cache_hits": 0,
+    }
+
+    batches: List[List[Tuple[int, Change]]] = []
+    singles = pending
+    if AI_COMMENT_BATCH:
+        # รายการที่มีใน cache แล้วไม่ต้องรวม batch
+        # (peek ทุก model ที่อาจถูกเลือก — route จริงตัดสินตอน dispatch ไม่ใช่ตอนวางแผน)
+        uncached = []
+        for i, c in pending:
+            data = None
+            for model in candidate_models(c, "comment"):
+                data = llm_cache.peek("comment", _cache_key(model, c))
+                if data:
+                    break
+            if data:
+                _apply_comment_data(c, data)
+                stats["cache_hits"] += 1
+                if on_done is not None:
+                    on_done(i, c)
+            else:
+                uncached.append((i, c))
+        # batch ต่อ tier ของ model (model เล็ก / ใหญ่ ไม่ปนใน request เดียวกัน)
+        # change ที่มีหมวดจาก kNN แล้วยิงเดี่ยว (prompt แบบไม่จัดหมวด ไม่รวมกับ batch ที่ต้องจัดหมวด)
+        # change ก้ำกึ่งยิงเดี่ยว → route_for ตอนได้ semaphore เห็นคิว model ใหญ่ที่รวม backlog ของงานนี้แล้ว
+        by_tier: Dict[str, List[Tuple[int, Change]]] = {}
+        batches, singles = [], []
+        for i, c in uncached:
+            planned, borderline = planned_route(c, "comment")
+            if prefilled_category(c) or borderline:
+                singles.append((i, c))
+                continue
+            by_tier.setdefault(planned.role, []).append((i, c))
+        for group in by_tier.values():
+            tier_batches, tier_singles = _pack_batches(group)
+            batches.extend(tier_batches)
+            singles.extend(tier_singles)
+    stats["batch_requests"] = len(batches)
+    stats["single_requests"] = len(singles)
+
+    # เรียง batch + รายการเดี่ยวรวมกันตามความสำคัญ (semaphore ปล่อยงานตามลำดับที่เข้าคิว)
+    units = [
+        (min(priority_key(item) for item in b), f"batch {j}", b, None)
+        for j, b in enumerate(batches)
+    ] + [
+        (priority_key((i, c)), f"index {i}", None, (i, c))
+        for i, c in singles
+    ]
+    units.sort(key=lambda u: u[0])
+
+    # ถ้างานถูกยกเลิก → task ที่ค้าง (รวม HTTP request ไป model server) ถูก cancel
+    coros = [
+        generate_ai_comment_batch_async(b, semaphore, on_done=on_done, stats=stats)
+        if b is not None else
+        generate_ai_comment_async(
+            single[1],
+            semaphore,
+            max_retries=2,
+            on_done=(lambda ch, i=single[0]: on_done(i, ch)) if on_done else None,
+        )
+        for _, _, b, single in units
+    ]
+    labels = [label for _, label, _, _ in units]
 
-    for i, r in enumerate(results):
+    results = await gather_cancellable(coros, cancel_token)
+
+    for label, r in zip(labels, results):
         if isinstance(r, Exception):
-            print(f"⚠️ [PARALLEL ERROR] Change index {i}: {r}")
\ No newline at end of file
+            print(f"⚠️ [PARALLEL ERROR] Change {label}: {r}")
+
+    if batches:
+        print(
+            f"📦 ai_comment: {stats['batch_items_ok']} รายการใน {stats['batch_requests']} batch, "
+            f"fallback {stats['batch_fallbacks']}, เดี่ยว {stats['single_requests']}, "
+            f"cache {stats['cache_hits']}"
+        )
+    return stats
\ No newline at end of file
@@ -0,0 +1,224 @@
+"""
+ลำดับความสำคัญ + งบ LLM ต่อ comparison ของ stage AI (ai_comment / ai_suggestion)
+
+เดิมทุก change เข้า LLM ตามลำดับใน diff เท่ากันหมด
+→ เอกสารใหญ่ change HEAVY ด้านสัญญา/ค่าใช้จ่ายอาจถูกวิเคราะห์ท้ายสุด หรือโดน timeout
+
+ที่นี่:
+- เรียงงานตามความรุนแรง: REMOVED / ADDED / HEAVY → MEDIUM → LIGHT
+  (semaphore + llm_slot ปล่อยงานตามลำดับที่เข้าคิว → change สำคัญได้ slot ก่อน)
+- งบต่อ comparison (จำนวน call และ/หรือ token โดยประมาณ): วางแผนก่อนเริ่ม stage AI ตามลำดับความสำคัญ
+  change ที่เกินงบและไม่ใช่กลุ่มรุนแรงสุด → ใส่ข้อความ template + ai_status = "deferred"
+  (ขอวิเคราะห์เพิ่มภายหลังได้) / change กลุ่มรุนแรงสุดวิเคราะห์เสมอ
+- summary / impact ไม่นับในงบ (ต้องมีทุก comparison)
+"""
+
+import os
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.diff.diff import Change
+from src.AI.impact_aggregate import severity_weight
+from src.diff.cluster import is_cluster_member
+
+# ==================================================
+# Config (ปรับได้ผ่าน env, ส่งต่อ request ได้)
+# ==================================================
+LLM_BUDGET_MAX_CALLS = int(os.getenv("LLM_BUDGET_MAX_CALLS", "0"))      # 0 = ไม่จำกัด
+LLM_BUDGET_MAX_TOKENS = int(os.getenv("LLM_BUDGET_MAX_TOKENS", "0"))    # 0 = ไม่จำกัด
+# token คำตอบโดยประมาณต่อ call (ใช้คิดงบ token ก่อนเรียกจริง)
+LLM_BUDGET_COMPLETION_TOKENS = int(os.getenv("LLM_BUDGET_COMPLETION_TOKENS", "400"))
+
+# ai_comment + ai_suggestion
+CALLS_PER_CHANGE = 2
+
+PRIORITY_HIGH = 0
+PRIORITY_MEDIUM = 1
+PRIORITY_LOW = 2
+
+# ai_status ของ change (เก็บใน ChangeItem.ai_status)
+AI_STATUS_DONE = "done"
+AI_STATUS_TRIAGED = "triaged"
+AI_STATUS_DEFERRED = "deferred"
+AI_STATUS_FAILED = "failed"
+# mode=fast: ยังไม่ได้เรียก AI (ขอวิเคราะห์ทีละ change ผ่าน POST /changes/{id}/enrich)
+AI_STATUS_PENDING = "pending"
+# ผลคัดลอกจากตัวแทนของกลุ่มการแก้ซ้ำ (src.diff.cluster)
+AI_STATUS_CLUSTERED = "clustered"
+
+DEFERRED_COMMENT = (
+    "ยังไม่ได้วิเคราะห์ด้วย AI เนื่องจากเกินงบการวิเคราะห์ของการเปรียบเทียบนี้ "
+    "(ระดับการแก้ไข: {severity}) สามารถขอวิเคราะห์เพิ่มเติมภายหลังได้"
+)
+DEFERRED_SUGGESTION = "รอการวิเคราะห์เพิ่มเติม"
+
+
+# ==================================================
+# Priority
+# ==================================================
+def change_priority(change: Change) -> int:
+    """0 = REMOVED / ADDED / HEAVY, 1 = MEDIUM, 2 = LIGHT (น้ำหนักเดียวกับ impact_aggregate)"""
+    weight = severity_weight(change)
+    if weight >= 3:
+        return PRIORITY_HIGH
+    if weight == 2:
+        return PRIORITY_MEDIUM
+    return PRIORITY_LOW
+
+
+def priority_key(item: Tuple[int, Change]):
+    i, c = item
+    # กลุ่มเดียวกัน: ข้อความต่างมากก่อน แล้วตามลำดับเดิมใน diff
+    dissimilarity = 1.0 - (c.similarity if c.similarity is not None else 0.5)
+    return change_priority(c), -dissimilarity, i
+
+
+def by_priority(pending: List[Tuple[int, Change]]) -> List[Tuple[int, Change]]:
+    """เรียง (index, change) ตามความสำคัญ (index เดิมไม่เปลี่ยน → on_done / checkpoint ใช้ได้เหมือนเดิม)"""
+    return sorted(pending, key=priority_key)
+
+
+# ==================================================
+# Budget
+# ==================================================
+@dataclass
+class LLMBudget:
+    max_calls: int = 0      # 0 = ไม่จำกัด
+    max_tokens: int = 0     # 0 = ไม่จำกัด
+
+    @classmethod
+    def resolve(cls, max_calls: Optional[int] = None, max_tokens: Optional[int] = None) -> "LLMBudget":
+        """ค่าจาก request (None = ใช้ค่า env)"""
+        return cls(
+            max_calls=LLM_BUDGET_MAX_CALLS if max_calls is None else max_calls,
+            max_tokens=LLM_BUDGET_MAX_TOKENS if max_tokens is None else max_tokens,
+        )
+
+    @property
+    def unlimited(self) -> bool:
+        return self.max_calls <= 0 and self.max_tokens <= 0
+
+    def fits(self, calls: int, tokens: int) -> bool:
+        if self.max_calls > 0 and calls > self.max_calls:
+            return False
+        if self.max_tokens > 0 and tokens > self.max_tokens:
+            return False
+        return True
+
+    def to_dict(self) -> Dict:
+        return {"max_calls": self.max_calls, "max_tokens": self.max_tokens}
+
+
+def estimate_change_tokens(change: Change) -> int:
+    """token โดยประมาณของ ai_comment + ai_suggestion ของ change นี้ (prompt + คำตอบ)"""
+    # import ตอนเรียก: ai_comment / ai_suggestion import module นี้ (เรียงลำดับงาน)
+    from src.AI.ai_comment import COMMENT_RUBRIC, SINGLE_CHANGE_HUMAN, estimate_tokens
+    from src.AI.ai_suggestion import SUGGESTION_SYSTEM, SUGGESTION_HUMAN
+    from src.AI.prompt_compress import prompt_texts
+
+    # ข้อความที่ส่งจริงหลังบีบ prompt
+    old_text, new_text = prompt_texts(change)
+    comment = (
+        estimate_tokens(COMMENT_RUBRIC + SINGLE_CHANGE_HUMAN)
+        + estimate_tokens(old_text)
+        + estimate_tokens(new_text)
+        + LLM_BUDGET_COMPLETION_TOKENS
+    )
+    # prompt ของ suggestion = ai_comment (ยังไม่มี → ใช้ขนาดคำตอบโดยประมาณ)
+    suggestion = (
+        estimate_tokens(SUGGESTION_SYSTEM + SUGGESTION_HUMAN)
+        + LLM_BUDGET_COMPLETION_TOKENS * 2
+    )
+    return comment + suggestion
+
+
+def mark_deferred(change: Change) -> None:
+    change.ai_comment = DEFERRED_COMMENT.format(severity=change.edit_severity or change.change_type)
+    change.ai_suggestion = DEFERRED_SUGGESTION
+    # หมวดที่ได้มาก่อนหน้านี้ (category_knn / ตั้งไว้แล้ว) ยังใช้ได้ → ไม่ทับด้วย "unknown"
+    prefill = getattr(change, "category_prefill", None) or {}
+    change.change_category = (
+        prefill.get("category") or getattr(change, "change_category", None) or "unknown"
+    )
+    change.change_details = []
+    if not getattr(change, "paragraph_topic", None):
+        change.paragraph_topic = (change.new_text or change.old_text or "").strip()[:80]
+    change.ai_status = AI_STATUS_DEFERRED
+
+
+def mark_pending(changes: List[Change]) -> int:
+    """mode=fast: change ที่ยังไม่มีผล AI (ไม่รวม triage / defer) → ai_status = "pending" คืนจำนวน"""
+    count = 0
+    for c in changes:
+        if getattr(c, "ai_comment", None):
+            continue
+        c.ai_status = AI_STATUS_PENDING
+        count += 1
+    return count
+
+
+def apply_budget(
+    changes: List[Change],
+    budget: LLMBudget,
+    on_deferred: Optional[Callable[[int, Change], None]] = None,
+) -> Dict:
+    """
+    วางแผนงบก่อนเริ่ม stage AI (เฉพาะ change ที่ยังไม่มี ai_comment)
+    ไล่ตามลำดับความสำคัญ สะสม call/token โดยประมาณ → change ที่เกินงบ (ยกเว้น PRIORITY_HIGH) ถูก defer
+    """
+    # สมาชิกของกลุ่มการแก้ซ้ำไม่เรียก LLM (รับผลจากตัวแทน) → ไม่นับในงบ
+    pending = [
+        (i, c) for i, c in enumerate(changes)
+        if not getattr(c, "ai_comment", None) and not is_cluster_member(c)
+    ]
+
+    by_tier: Dict[int, int] = {}
+    for _, c in pending:
+        tier = change_priority(c)
+        by_tier[tier] = by_tier.get(tier, 0) + 1
+
+    stats = {
+        "budget": budget.to_dict(),
+        "pending": len(pending),
+        "by_priority": {"high": by_tier.get(0, 0), "medium": by_tier.get(1, 0), "low": by_tier.get(2, 0)},
+        "planned_calls": 0,
+        "planned_tokens": 0,
+        "deferred": 0,
+        "over_budget_high": 0,
+    }
+
+    calls = tokens = 0
+    for i, c in by_priority(pending):
+        cost = estimate_change_tokens(c)
+        over = not budget.unlimited and not budget.fits(calls + CALLS_PER_CHANGE, tokens + cost)
+
+        if over and change_priority(c) != PRIORITY_HIGH:
+            mark_deferred(c)
+            stats["deferred"] += 1
+            if on_deferred is not None:
+                on_deferred(i, c)
+            continue
+
+        if over:
+            # change รุนแรงสุดวิเคราะห์เสมอ (นับว่าเกินงบไว้ให้เห็น)
+            stats["over_budget_high"] += 1
+        calls += CALLS_PER_CHANGE
+        tokens += cost
+
+    stats["planned_calls"] = calls
+    stats["planned_tokens"] = tokens
+    return stats
+
+
+def ai_status_of(change: Change) -> Optional[str]:
+    """สถานะผล AI ของ change สำหรับบันทึกลง DB"""
+    status = getattr(change, "ai_status", None)
+    if status:
+        return status
+    if getattr(change, "triage", None):
+        return AI_STATUS_TRIAGED
+    if getattr(change, "paragraph_topic", None) == "analysis_failed":
+        return AI_STATUS_FAILED
+    if getattr(change, "ai_comment", None):
+        return AI_STATUS_DONE
+    return None
@@ -1,14 +1,20 @@
-﻿import json
-import re
-import os
-from typing import List
+﻿import os
+from typing import Callable, List, Optional
 from dotenv import load_dotenv
 
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
 
 from src.diff.diff import Change
+from src.service.cancellation import CancellationToken, gather_cancellable
+from src.monitoring.metrics import llm_call_timer
+from src.AI.llm_cache import llm_cache, make_cache_key
+from src.AI.llm_concurrency import llm_slot
+from src.AI.llm_gateway import get_llm, model_name, role_temperature
+from src.AI.llm_retry import CircuitOpenError, RetryPolicy, aretry
+from src.AI.ai_schedule import by_priority
+from src.diff.cluster import is_cluster_member
+from src.AI.model_router import route_for
+from src.AI.structured_output import SuggestionOutput, ainvoke_structured, parse_structured
 import asyncio
 
 # === 🔥 IMPORT TOOLS ของคุณ ===
@@ -19,50 +25,30 @@ load_dotenv()
 # ==================================================
 # LLM setup
 # ==================================================
-llm = ChatOpenAI(
-    base_url=os.getenv("LOCALMODEL_BASE_URL"),
-    api_key=os.getenv("LOCALMODEL_API_KEY"),
-    model=os.getenv("LOCALMODEL_MODEL_SUGGESTION"),
-    temperature=0.2,
-)
+MODEL_NAME = model_name("suggestion")
+TEMPERATURE = role_temperature("suggestion")
+
+# ⭐ เปลี่ยนเลขนี้ทุกครั้งที่แก้ prompt → cache เดิมจะไม่ถูกใช้
+PROMPT_VERSION = "suggestion-v2"
 
 # ==================================================
-# 🔧 REGISTER TOOLS (Tavily)
+# 🔧 REGISTER TOOLS (Tavily) — สร้างครั้งแรกที่ใช้ ไม่ใช่ตอน import
 # ==================================================
-tools = get_web_tools()  # ได้ TavilySearchResults เป็น list
+_tools = None
 
-# ผูก tools กับ LLM
-llm_with_tools = llm.bind_tools(tools)
 
-# ==================================================
-# Utility: Safe JSON Parser
-# ==================================================
-def _safe_parse_json(raw: str) -> dict:
-    """พยายามแปลงข้อความจาก LLM ให้เป็น JSON ที่ถูกต้อง"""
-    match = re.search(r"\{[\s\S]*\}", raw)
-    if not match:
-        print("⚠️ [DEBUG] ไม่พบ JSON ในข้อความ LLM")
-        return {}
-    try:
-        return json.loads(match.group(0))
-    except Exception as e:
-        print(f"⚠️ [DEBUG] JSON parse error: {e}")
-        cleaned = re.sub(r"[\x00-\x1f\x7f]", "", match.group(0))
-        try:
-            return json.loads(cleaned)
-        except Exception as e2:
-            print(f"⚠️ [DEBUG] Parse ล้มเหลวซ้ำ: {e2}")
-            return {}
+def _get_tools():
+    global _tools
+    if _tools is None:
+        _tools = get_web_tools()  # ได้ TavilySearchResults เป็น list
+    return _tools
 
 # ==================================================
-# Generate ai_suggestion (🔥 ASYNC + TOOLS)
+# Prompt
 # ==================================================
-async def generate_ai_suggestion(change: Change) -> None:
-    prompt = ChatPromptTemplate.from_template("""
-บริบทของการเปลี่ยนแปลง:
-{ai_comment}
-
-📡 TOOLS ที่คุณสามารถใช้ได้ (ถ้าจำเป็น):
+# ⭐ คำสั่งคงที่อยู่ใน system message (prefix เดียวกันทุก call → server ใช้ KV cache ซ้ำได้)
+#   ข้อมูลของ change (ai_comment) อยู่ใน human message ท้ายสุด
+SUGGESTION_SYSTEM = """📡 TOOLS ที่คุณสามารถใช้ได้ (ถ้าจำเป็น):
 - คุณสามารถค้นหาข้อมูลจากเว็บเพื่อช่วยวิเคราะห์ผลกระทบด้านกฎหมาย, ธุรกิจ หรือมาตรฐานอุตสาหกรรม
 - ถ้าคุณต้องอ้างอิงนิยาม, มาตรฐาน หรือแนวปฏิบัติ ให้ใช้เครื่องมือค้นหาแทนการเดาเอง
 
@@ -80,25 +66,54 @@ async def generate_ai_suggestion(change: Change) -> None:
   ใช้ภาษาทางการ กระชับ อธิบายเป็นข้อๆ , ไม่ต้องส่ง markdown อธิบายละเอียดได้แต่ให้อยู่ในขอบเขตที่เหมาะสม
 
 ตอบเฉพาะในรูปแบบ JSON: {{ "ai_suggestion": "..." }}
-""")
+"""
+
+SUGGESTION_HUMAN = """บริบทของการเปลี่ยนแปลง:
+{ai_comment}
+"""
 
-    chain = prompt | llm_with_tools | StrOutputParser()
+# compile ครั้งเดียวตอน import
+SUGGESTION_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", SUGGESTION_SYSTEM),
+    ("human", SUGGESTION_HUMAN),
+])
 
-    print(f"\n🛠️ [DEBUG] เริ่มวิเคราะห์ ai_suggestion สำหรับ Change: {change.change_type}")
+
+# ==================================================
+# Generate ai_suggestion (🔥 ASYNC + TOOLS)
+# ==================================================
+async def generate_ai_suggestion(change: Change) -> None:
+    # ⭐ model เล็ก / ใหญ่ ตามความรุนแรงของ change (model_router)
+    route = route_for(change, "suggestion")
+    # ผูก tools กับ LLM (handle ถูก cache ต่อ event loop ใน gateway)
+    llm_with_tools = get_llm(route.role, tools=_get_tools, tools_key="web")
+
+    print(f"\n🛠️ [DEBUG] เริ่มวิเคราะห์ ai_suggestion สำหรับ Change: {change.change_type} ({route.tier})")
+
+    # prompt ใช้แค่ ai_comment (ข้อความเดิม / ใหม่ไม่ได้ส่งไป → ไม่ใส่ใน inputs / cache key)
+    inputs = {
+        "ai_comment": change.ai_comment,
+        "legal": change.risk_scores.get("legal", 0) if hasattr(change, "risk_scores") else 0,
+        "financial": change.risk_scores.get("financial", 0) if hasattr(change, "risk_scores") else 0,
+        "operational": change.risk_scores.get("operational", 0) if hasattr(change, "risk_scores") else 0,
+        "change_type": change.change_type,
+    }
+
+    async def _call_llm() -> dict:
+        async with llm_slot(route.model):
+            with llm_call_timer("suggestion", route.model):
+                raw_output = await ainvoke_structured(
+                    SUGGESTION_PROMPT, llm_with_tools, inputs, SuggestionOutput, route.model
+                )
+        # ซ่อม JSON ก่อน / ไม่ผ่าน schema → OutputParseError → aretry (ไม่เก็บลง cache)
+        return parse_structured(raw_output, SuggestionOutput, "suggestion")
 
     try:
-        raw_output = await chain.ainvoke({
-            "ai_comment": change.ai_comment,
-            "legal": change.risk_scores.get("legal", 0) if hasattr(change, "risk_scores") else 0,
-            "financial": change.risk_scores.get("financial", 0) if hasattr(change, "risk_scores") else 0,
-            "operational": change.risk_scores.get("operational", 0) if hasattr(change, "risk_scores") else 0,
-            "change_type": change.change_type,
-            "old_text": change.old_text,
-            "new_text": change.new_text,
-        })
-
-        raw_output = raw_output.strip()
-        data = _safe_parse_json(raw_output)
+        data = await llm_cache.aget_or_compute(
+            "suggestion",
+            make_cache_key(route.model, PROMPT_VERSION, inputs, TEMPERATURE),
+            _call_llm,
+        )
 
         change.ai_suggestion = data.get(
             "ai_suggestion",
@@ -117,7 +132,8 @@ async def generate_ai_suggestion(change: Change) -> None:
 async def generate_ai_suggestion_async(
     change: Change,
     semaphore: asyncio.Semaphore,
-    max_retries: int = 2
+    max_retries: int = 2,
+    on_done: Optional[Callable[[Change], None]] = None,
 ):
     """
     Async wrapper สำหรับ generate_ai_suggestion
@@ -125,25 +141,22 @@ async def generate_ai_suggestion_async(
     """
 
     async with semaphore:
-        last_error = None
-
-        for attempt in range(max_retries + 1):
-            try:
-                if attempt > 0:
-                    print(
-                        f"🔁 [RETRY {attempt}/{max_retries}] "
-                        f"ai_suggestion | Change: {change.change_type}"
-                    )
-
-                await generate_ai_suggestion(change)
-                return  # สำเร็จ → ออกฟังก์ชัน
-
-            except Exception as e:
-                last_error = e
-                print(f"❌ [ASYNC ERROR] ai_suggestion attempt {attempt+1}: {e}")
-                await asyncio.sleep(1.0)
-
-        print(f"❌ [FATAL] ai_suggestion ล้มเหลวหลัง retry {max_retries} ครั้ง")
+        try:
+            await aretry(
+                lambda: generate_ai_suggestion(change),
+                role="suggestion",
+                model=route_for(change, "suggestion").model,
+                policy=RetryPolicy(max_retries=max_retries),
+            )
+            if on_done is not None:
+                on_done(change)
+            return  # สำเร็จ → ออกฟังก์ชัน
+
+        except CircuitOpenError:
+            print(f"⚡ [BREAKER] ข้าม ai_suggestion (model server ไม่พร้อม) Change: {change.change_type}")
+
+        except Exception as e:
+            print(f"❌ [FATAL] ai_suggestion ล้มเหลวหลัง retry {max_retries} ครั้ง: {e}")
 
         # fallback (ปลอดภัยเสมอ)
         change.ai_suggestion = (
@@ -155,25 +168,45 @@ async def generate_ai_suggestion_async(
 # ==================================================
 # Run ai_suggestion in parallel
 # ==================================================
-async def run_generate_ai_suggestion_parallel(changes: List[Change]):
+async def run_generate_ai_suggestion_parallel(
+    changes: List[Change],
+    cancel_token: Optional[CancellationToken] = None,
+    on_done: Optional[Callable[[int, Change], None]] = None,
+):
     """
     ยิง generate_ai_suggestion พร้อมกันหลาย Change
     - สร้าง semaphore ภายใน event loop เดียวกัน (ป้องกัน error)
+    - ถ้า cancel_token ถูกยกเลิก → cancel task ที่ค้างแล้ว raise JobCancelled
+    - ข้าม change ที่มี ai_suggestion อยู่แล้ว, on_done(index, change) เมื่อสำเร็จ
     """
 
+    # semaphore นี้จำกัด fan-out ของงานนี้งานเดียว
+    # จำนวน request จริงไปที่ model server คุมโดย llm_slot (ใช้ร่วมกันทั้ง process)
     SEMAPHORE_LIMIT = int(os.getenv("LLM_PARALLEL_LIMIT", 8))
     semaphore = asyncio.Semaphore(SEMAPHORE_LIMIT)  # ✅ สร้างตรงนี้ (ถูกต้อง)
 
-    results = await asyncio.gather(
-        *[
-            generate_ai_suggestion_async(c, semaphore, max_retries=2)
-            for c in changes
+    # ⭐ change รุนแรงก่อน (REMOVED / ADDED / HEAVY → MEDIUM → LIGHT)
+    # สมาชิกของกลุ่มการแก้ซ้ำรอรับผลจากตัวแทน (propagate_clusters)
+    pending = by_priority([
+        (i, c) for i, c in enumerate(changes)
+        if not getattr(c, "ai_suggestion", None) and not is_cluster_member(c)
+    ])
+
+    results = await gather_cancellable(
+        [
+            generate_ai_suggestion_async(
+                c,
+                semaphore,
+                max_retries=2,
+                on_done=(lambda ch, i=i: on_done(i, ch)) if on_done else None,
+            )
+            for i, c in pending
         ],
-        return_exceptions=True
+        cancel_token,
     )
 
     # Debug: แสดงเฉพาะเคสที่ยัง error จริง ๆ
-    for i, r in enumerate(results):
+    for (i, _), r in zip(pending, results):
         if isinstance(r, Exception):
             print(f"⚠️ [PARALLEL ERROR] ai_suggestion | Change index {i}: {r}")
 
@@ -1,17 +1,25 @@
 import os
-import json
+import asyncio
 import re
 from collections import Counter
-from typing import List
+from typing import Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 
 from src.diff.diff import Change
-from src.AI.ai_comment import generate_ai_comment
-from src.AI.ai_suggestion import generate_ai_suggestion
+from src.AI.ai_comment import generate_ai_comment_async, estimate_tokens
+from src.AI.ai_suggestion import generate_ai_suggestion_async
+from src.AI.impact_aggregate import aggregate_changes, render_impact_input
+from src.monitoring.metrics import llm_call_timer
+from src.AI.llm_cache import llm_cache, make_cache_key
+from src.AI.llm_accounting import llm_stage
+from src.AI.llm_concurrency import llm_slot
+from src.AI.llm_gateway import get_llm, model_name, role_temperature
+from src.AI.llm_retry import aretry
+from src.AI.structured_output import ImpactOutput, MapOutput, ainvoke_structured, parse_structured
+from src.service.cancellation import CancellationToken, gather_cancellable
 
 # ==================================================
 # Load environment variables
@@ -19,32 +27,23 @@ from src.AI.ai_suggestion import generate_ai_suggestion
 load_dotenv()
 
 # ✅ ตั้งค่าโมเดล LangChain LLM
-llm = ChatOpenAI(
-    base_url=os.getenv("LOCALMODEL_BASE_URL"),
-    api_key=os.getenv("LOCALMODEL_API_KEY"),
-    model=os.getenv("LOCALMODEL_MODEL_SUM"),
-    temperature=0.2,
-)
+MODEL_NAME = model_name("sum")
+TEMPERATURE = role_temperature("sum")
+
+# ⭐ เปลี่ยนเลขนี้ทุกครั้งที่แก้ prompt → cache เดิมจะไม่ถูกใช้
+SUMMARY_PROMPT_VERSION = "summary-v2"
+IMPACT_PROMPT_VERSION = "impact-v3"
+SUMMARY_MAP_PROMPT_VERSION = "summary-map-v2"
 
 # ==================================================
-# Utility: Safe JSON Parser
+# Map-reduce config (ปรับได้ผ่าน env)
 # ==================================================
-def _safe_parse_json(raw: str) -> dict:
-    match = re.search(r"\{[\s\S]*\}", raw)
-    if not match:
-        print("⚠️ [DEBUG] ไม่พบ JSON ในข้อความ LLM")
-        return {}
-
-    try:
-        return json.loads(match.group(0))
-    except Exception as e:
-        print(f"⚠️ [DEBUG] JSON parse error: {e}")
-        cleaned = re.sub(r"[\x00-\x1f\x7f]", "", match.group(0))
-        try:
-            return json.loads(cleaned)
-        except Exception as e2:
-            print(f"⚠️ [DEBUG] Parse ล้มเหลวซ้ำ: {e2}")
-            return {}
+# token สูงสุดของข้อมูลราย change ใน 1 prompt (ไม่รวม rubric) — เกินนี้ → สรุปเป็นกลุ่มก่อน
+SUMMARY_CONTEXT_BUDGET_TOKENS = int(os.getenv("SUMMARY_CONTEXT_BUDGET_TOKENS", "6000"))
+# จัดกลุ่มตาม "page" (ช่วงหน้าติดกัน) หรือ "category" (change_category เดียวกัน)
+SUMMARY_GROUP_BY = os.getenv("SUMMARY_GROUP_BY", "page")
+SUMMARY_MAP_CONCURRENCY = int(os.getenv("SUMMARY_MAP_CONCURRENCY", "4"))
+SUMMARY_MAX_LEVELS = int(os.getenv("SUMMARY_MAX_LEVELS", "3"))
 
 # ==================================================
 # 🔥 SAFE FLOAT
@@ -67,76 +66,236 @@ def _safe_float(val) -> float:
     return 0.0
 
 # ==================================================
-def _add_ai_comments(changes: List[Change]) -> None:
-    for idx, c in enumerate(changes, 1):
-        print(f"\n🚀 [DEBUG] กำลังประมวลผล Paragraph {idx}/{len(changes)} ({c.change_type})")
+# เติม AI field ที่ยังขาด (ปกติ runner ทำครบแล้ว → ไม่มีงาน)
+# ==================================================
+async def _enrich_missing(changes: List[Change], cancel_token: Optional[CancellationToken] = None) -> dict:
+    """วิเคราะห์เฉพาะ change ที่ยังไม่มี ai_comment / ai_suggestion (พร้อมกัน จำกัดด้วย LLM_PARALLEL_LIMIT)"""
+    missing_comment = [c for c in changes if not getattr(c, "ai_comment", None)]
+    missing_suggestion = [c for c in changes if not getattr(c, "ai_suggestion", None)]
+    if not missing_comment and not missing_suggestion:
+        return {"comment": 0, "suggestion": 0}
+
+    print(
+        f"🚀 [DEBUG] summary: เติม ai_comment {len(missing_comment)} / "
+        f"ai_suggestion {len(missing_suggestion)} รายการที่ยังขาด"
+    )
+    semaphore = asyncio.Semaphore(int(os.getenv("LLM_PARALLEL_LIMIT", 8)))
+    # ถ้างานถูกยกเลิก → task ที่ค้าง (รวม HTTP request ไป model server) ถูก cancel
+    await gather_cancellable(
+        [generate_ai_comment_async(c, semaphore) for c in missing_comment]
+        + [generate_ai_suggestion_async(c, semaphore) for c in missing_suggestion],
+        cancel_token,
+    )
+    return {"comment": len(missing_comment), "suggestion": len(missing_suggestion)}
 
-        related_comments = [
-            other.ai_comment for other in changes
-            if other != c and getattr(other, "ai_comment", None)
-        ]
 
-        if not getattr(c, "ai_comment", None):
-            generate_ai_comment(c, related_comments)
+# ==================================================
+# LLM call (async: slot + retry + cache)
+# ==================================================
+async def _acall(prompt, inputs: dict, cache_role: str, prompt_version: str, schema=None) -> dict:
+    """schema = pydantic model ของคำตอบ JSON (None = ข้อความล้วน → {"text": raw})"""
+    llm = get_llm("sum")
+
+    async def _invoke() -> dict:
+        async with llm_slot(MODEL_NAME):
+            with llm_call_timer("sum", MODEL_NAME):
+                if schema is None:
+                    raw = await (prompt | llm | StrOutputParser()).ainvoke(inputs)
+                else:
+                    raw = await ainvoke_structured(prompt, llm, inputs, schema, MODEL_NAME)
+        if schema is None:
+            return {"text": raw.strip()}
+        # ซ่อม JSON ก่อน / ไม่ผ่าน schema → OutputParseError → aretry (ไม่เก็บลง cache)
+        return parse_structured(raw, schema, cache_role)
+
+    # handle "sum" ใช้ร่วมกันหลาย prompt → บันทึก call ด้วยชื่อ prompt (summary / impact / summary_map)
+    with llm_stage(cache_role):
+        return await llm_cache.aget_or_compute(
+            cache_role,
+            make_cache_key(MODEL_NAME, prompt_version, inputs, TEMPERATURE),
+            lambda: aretry(_invoke, role="sum", model=MODEL_NAME),
+        )
 
-        if not getattr(c, "ai_suggestion", None):
-            generate_ai_suggestion(c)
+# ==================================================
+# Map-reduce (เอกสารใหญ่: สรุปเป็นกลุ่มก่อน แล้วค่อยรวม)
+# ==================================================
+# ⭐ คำสั่งคงที่ = system message / ข้อมูลกลุ่ม = human message (prefix เดียวกันทุก call)
+MAP_SYSTEM = """คุณคือผู้ช่วยสรุปการเปลี่ยนแปลงเอกสาร
+จะได้รับผลวิเคราะห์รายย่อหน้าของการเปลี่ยนแปลง 1 กลุ่ม
 
-        print(f"✅ [DEBUG] เสร็จสิ้น Paragraph {idx}")
+ให้ย่อข้อมูลกลุ่มนี้เพื่อนำไปสรุปภาพรวมต่อ โดย
+- changes_digest: สรุปการเปลี่ยนแปลงสำคัญของกลุ่ม (ระบุหน้า ตัวเลข/ค่าที่เปลี่ยน ครบถ้วน)
+- suggestions_digest: สรุปข้อเสนอแนะที่สำคัญของกลุ่ม
+- risk_evidence: หลักฐานสำหรับประเมินผลกระทบ แยกตามหมวด (scope / timeline / cost / resource / risk / contract / stakeholder / architecture) เฉพาะหมวดที่มีหลักฐาน
 
-# ==================================================
-def build_summary_text(changes: List[Change]) -> dict:
-    if not changes:
-        return {
-            "summary_text": "ไม่มีการเปลี่ยนแปลงเนื้อหาสำคัญระหว่างสองเวอร์ชัน",
-            "impact_scores": {
-                "scope_impact_score": 0,
-                "timeline_impact_score": 0,
-                "cost_impact_score": 0,
-                "resource_impact_score": 0,
-                "risk_impact_score": 0,
-                "contract_impact_score": 0,
-                "stakeholder_impact_score": 0,
-                "architecture_impact_score": 0,
-            },
-            "risk_comment": "ไม่มีความเสี่ยงเนื่องจากไม่มีการเปลี่ยนแปลง",
-            "overall_risk_level": "LOW",
-        }
+ห้ามเพิ่มข้อมูลที่ไม่มีในผลวิเคราะห์ ห้าม markdown
 
-    # ===============================
-    # STEP 1 — Summary (เหมือนเดิม)
-    # ===============================
-    _add_ai_comments(changes)
+ตอบกลับเป็น JSON เท่านั้น:
+{{
+  "changes_digest": "...",
+  "suggestions_digest": "...",
+  "risk_evidence": "..."
+}}
+"""
 
-    type_counter = Counter(c.change_type for c in changes)
-    total = len(changes)
+MAP_HUMAN = """ผลวิเคราะห์รายย่อหน้าของกลุ่ม: {group_label}
 
-    base_summary = (
-        f"โดยรวมมีการเปลี่ยนแปลงจำนวน {total} รายการ "
-        f"(เพิ่ม {type_counter.get('ADDED', 0)} รายการ, "
-        f"ลบ {type_counter.get('REMOVED', 0)} รายการ, "
-        f"แก้ไข {type_counter.get('MODIFIED', 0)} รายการ)"
-    )
+{items}
+"""
 
-    all_ai_comments = "\n".join(
-        f"- Page {c.section_label}: {getattr(c, 'ai_comment', 'ไม่มี AI Comment')}"
-        for c in changes
+MAP_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", MAP_SYSTEM),
+    ("human", MAP_HUMAN),
+])
+
+
+def _page_no(change: Change) -> int:
+    m = re.search(r"\d+", change.section_label or "")
+    return int(m.group(0)) if m else 0
+
+
+def _item_block(change: Change) -> str:
+    """ข้อมูลของ change 1 รายการสำหรับ prompt ขั้น map"""
+    return (
+        f"[Page {change.section_label}] ({change.change_type}, "
+        f"{getattr(change, 'change_category', '') or 'unknown'})\n"
+        f"Topic: {getattr(change, 'paragraph_topic', '') or '-'}\n"
+        f"AI Analysis: {getattr(change, 'ai_comment', '') or '-'}\n"
+        f"Suggestion: {getattr(change, 'ai_suggestion', '') or '-'}\n"
+        f"Change Details: {getattr(change, 'change_details', []) or []}"
     )
 
-    all_ai_suggestions = "\n".join(
-        f"- Page {c.section_label}: {getattr(c, 'ai_suggestion', 'ไม่มี AI Suggestion')}"
-        for c in changes
+
+def _group_label(changes: List[Change]) -> str:
+    pages = sorted({_page_no(c) for c in changes})
+    cats = Counter(getattr(c, "change_category", None) or "unknown" for c in changes)
+    cat_text = ", ".join(f"{k} {v}" for k, v in cats.most_common())
+    page_text = f"หน้า {pages[0]}" if len(pages) == 1 else f"หน้า {pages[0]}–{pages[-1]}"
+    return f"{page_text} ({len(changes)} รายการ; {cat_text})"
+
+
+def _pack_groups(items: List[Tuple[str, str, str]], budget: int) -> List[List[Tuple[str, str, str]]]:
+    """
+    items = [(group_key, label_hint, block)] เรียงแล้ว
+    ตัดกลุ่มเมื่อ token เกิน budget หรือ group_key เปลี่ยน (category) → ขนาดกลุ่มปรับตาม budget เอง
+    """
+    groups: List[List[Tuple[str, str, str]]] = []
+    current: List[Tuple[str, str, str]] = []
+    used = 0
+    for item in items:
+        cost = estimate_tokens(item[2])
+        if current and (used + cost > budget or item[0] != current[-1][0]):
+            groups.append(current)
+            current, used = [], 0
+        current.append(item)
+        used += cost
+    if current:
+        groups.append(current)
+    return groups
+
+
+async def _map_one(inputs: Dict[str, str], semaphore: asyncio.Semaphore) -> dict:
+    async with semaphore:
+        try:
+            return await _acall(MAP_PROMPT, inputs, "summary_map", SUMMARY_MAP_PROMPT_VERSION, MapOutput)
+        except Exception as e:
+            print(f"⚠️ [DEBUG] summary map ล่ม ({inputs['group_label']}): {e}")
+            return {}
+
+
+async def _run_map(
+    groups: List[Tuple[str, str]],
+    cancel_token: Optional[CancellationToken] = None,
+) -> List[dict]:
+    """groups = [(label, items_text)] → สรุปทุกกลุ่มพร้อมกัน (จำกัดด้วย SUMMARY_MAP_CONCURRENCY + llm_slot)"""
+    semaphore = asyncio.Semaphore(SUMMARY_MAP_CONCURRENCY)
+    results = await gather_cancellable(
+        [_map_one({"group_label": label, "items": items}, semaphore) for label, items in groups],
+        cancel_token,
     )
+    return [r if isinstance(r, dict) else {} for r in results]
+
+
+async def _map_reduce_inputs(
+    changes: List[Change],
+    budget: int,
+    cancel_token: Optional[CancellationToken] = None,
+) -> Tuple[str, str, str, dict]:
+    """
+    ย่อข้อมูลราย change → digest รายกลุ่ม จนทั้งหมดพอดี budget
+    คืน (all_ai_comments, all_ai_suggestions, group_evidence, stats)
+    - comments / suggestions → prompt summary เดิม
+    - group_evidence (risk evidence รายกลุ่ม) → ต่อท้ายข้อมูลของ impact scoring
+    """
+    if SUMMARY_GROUP_BY == "category":
+        ordered = sorted(changes, key=lambda c: (getattr(c, "change_category", None) or "unknown", _page_no(c)))
+        key = lambda c: getattr(c, "change_category", None) or "unknown"
+    else:
+        ordered = sorted(changes, key=_page_no)
+        key = lambda c: ""
+
+    groups = _pack_groups([(key(c), "", _item_block(c)) for c in ordered], budget)
+
+    # ระดับแรก: กลุ่มของ change จริง
+    change_groups: List[List[Change]] = []
+    i = 0
+    for g in groups:
+        change_groups.append(ordered[i:i + len(g)])
+        i += len(g)
+
+    labels = [_group_label(cs) for cs in change_groups]
+    digests = await _run_map(
+        [(label, "\n\n".join(b for _, _, b in g)) for label, g in zip(labels, groups)],
+        cancel_token,
+    )
+    entries = list(zip(labels, digests))
+    levels = 1
+
+    def _entry_block(label: str, d: dict) -> str:
+        return (
+            f"[{label}]\n"
+            f"Changes: {d.get('changes_digest', '') or '-'}\n"
+            f"Suggestions: {d.get('suggestions_digest', '') or '-'}\n"
+            f"Risk Evidence: {d.get('risk_evidence', '') or '-'}"
+        )
+
+    # ระดับถัดไป: digest ยังยาวเกิน budget → รวม digest เป็นกลุ่มแล้วสรุปซ้ำ
+    while (
+        levels < SUMMARY_MAX_LEVELS
+        and len(entries) > 1
+        and sum(estimate_tokens(_entry_block(l, d)) for l, d in entries) > budget
+    ):
+        packed = _pack_groups([("", l, _entry_block(l, d)) for l, d in entries], budget)
+        if len(packed) >= len(entries):
+            break
+        merged = [
+            (f"{g[0][1]} … {g[-1][1]}" if len(g) > 1 else g[0][1], "\n\n".join(b for _, _, b in g))
+            for g in packed
+        ]
+        entries = list(zip([label for label, _ in merged], await _run_map(merged, cancel_token)))
+        levels += 1
 
-    summary_prompt = ChatPromptTemplate.from_template("""
-ข้อมูลสรุปเชิงปริมาณ:
-{base_summary}
+    all_ai_comments = "\n".join(f"- {l}: {d.get('changes_digest', '') or '-'}" for l, d in entries)
+    all_ai_suggestions = "\n".join(f"- {l}: {d.get('suggestions_digest', '') or '-'}" for l, d in entries)
+    group_evidence = "\n".join(
+        f"- {l}: {d.get('risk_evidence', '') or '-'}" for l, d in entries
+    )
+    stats = {
+        "mode": "map_reduce",
+        "group_by": SUMMARY_GROUP_BY,
+        "groups": len(change_groups),
+        "levels": levels,
+        "failed_groups": sum(1 for d in digests if not d),
+    }
+    return all_ai_comments, all_ai_suggestions, group_evidence, stats
 
-ความเห็น AI แยกตามหน้าเอกสาร:
-{all_ai_comments}
 
-ข้อเสนอแนะ AI แยกตามหน้าเอกสาร:
-{all_ai_suggestions}
+# ==================================================
+# Prompts (compile ครั้งเดียวตอน import)
+# ==================================================
+# ⭐ rubric / คำสั่งคงที่อยู่ใน system message (เหมือนกันทุก byte) ข้อมูลของ comparison อยู่ใน human message
+#   → vLLM / Ollama ใช้ KV cache ของ prefix ซ้ำได้
+SUMMARY_SYSTEM = """คุณจะได้รับข้อมูลสรุปเชิงปริมาณ ความเห็น AI และข้อเสนอแนะ AI แยกตามหน้าเอกสาร
 
 กรุณาจัดทำสรุปภาพรวม 2 ส่วน ดังนี้:
 
@@ -148,57 +307,39 @@ def build_summary_text(changes: List[Change]) -> dict:
 
 ตอบด้วยภาษาทางการ กระชับ เป็นข้อ ๆ
 ห้าม markdown
-""")
-
-    summary_chain = summary_prompt | llm | StrOutputParser()
-
-    try:
-        raw_summary = summary_chain.invoke({
-            "base_summary": base_summary,
-            "all_ai_comments": all_ai_comments,
-            "all_ai_suggestions": all_ai_suggestions
-        }).strip()
-
-        full_summary_text = f"{base_summary}\n\n{raw_summary}" if raw_summary else base_summary
+"""
 
-    except Exception as e:
-        print(f"⚠️ [DEBUG] summary ล่ม: {e}")
-        full_summary_text = base_summary
+SUMMARY_HUMAN = """ข้อมูลสรุปเชิงปริมาณ:
+{base_summary}
 
-    # ===============================
-    # STEP 2 — Impact Scoring (⭐ แก้ใหม่)
-    # ===============================
+ความเห็น AI แยกตามหน้าเอกสาร:
+{all_ai_comments}
 
-    structured_analysis = "\n".join(
-        f"""
-Paragraph: {c.section_label}
-Topic: {getattr(c, "paragraph_topic", "")}
-Change Category: {getattr(c, "change_category", "")}
-AI Analysis: {getattr(c, "ai_comment", "")}
-Change Details: {getattr(c, "change_details", [])}
+ข้อเสนอแนะ AI แยกตามหน้าเอกสาร:
+{all_ai_suggestions}
 """
-        for c in changes
-    )
 
-    impact_prompt = ChatPromptTemplate.from_template("""
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", SUMMARY_SYSTEM),
+    ("human", SUMMARY_HUMAN),
+])
+
+IMPACT_SYSTEM = """
 คุณคือผู้เชี่ยวชาญด้านการประเมินความเสี่ยงโครงการระดับองค์กร (Enterprise Project Risk Assessor)
 
 IMPORTANT RULES:
 - ห้ามวิเคราะห์จาก summary
 - ห้ามตีความข้อความเอกสารต้นฉบับ
 - ห้ามใช้ความรู้ภายนอก
-- ให้ใช้เฉพาะ structured analysis ด้านล่างเท่านั้น
+- ให้ใช้เฉพาะ structured analysis ที่ได้รับ (ข้อความถัดไป) เท่านั้น
+- structured analysis ประกอบด้วย: ตารางจำนวน change ต่อหมวด (severity_weighted = ผลรวมน้ำหนัก LIGHT=1 MEDIUM=2 HEAVY/ADDED/REMOVED=3),
+  รายการ change details ที่ไม่ซ้ำ (xN = พบ N ครั้ง) และข้อความของ change ที่รุนแรงที่สุด
 - ทุกคะแนนต้องมีเหตุผลจาก structured analysis 
 - ถ้าไม่มีหลักฐาน → ให้คะแนนต่ำ
 - ห้ามตีความและให้คะแนนจาก ai_comment 
 - ให้ใช้ ai_comment เป็นข้อมูลประกอบเสริมสำหรับ risk_comment เท่านั้น
 
 
-========================================
-STRUCTURED CHANGE ANALYSIS
-========================================
-{structured_analysis}
-========================================
 
 
 ====================================================
@@ -378,16 +519,163 @@ STRICT OUTPUT RULES:
 - ห้าม markdown
 - ห้ามข้อความอื่น
 - ห้ามอธิบายนอก JSON
-""")
+"""
 
-    impact_chain = impact_prompt | llm | StrOutputParser()
+IMPACT_HUMAN = """========================================
+STRUCTURED CHANGE ANALYSIS
+========================================
+{structured_analysis}
+========================================
+"""
 
-    try:
-        raw_risk = impact_chain.invoke({
-            "structured_analysis": structured_analysis
-        }).strip()
+IMPACT_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", IMPACT_SYSTEM),
+    ("human", IMPACT_HUMAN),
+])
 
-        data = _safe_parse_json(raw_risk)
+
+# ==================================================
+def base_summary_text(changes: List[Change]) -> str:
+    """ประโยคนับจำนวน change ตามประเภท (ไม่ใช้ LLM)"""
+    type_counter = Counter(c.change_type for c in changes)
+    return (
+        f"โดยรวมมีการเปลี่ยนแปลงจำนวน {len(changes)} รายการ "
+        f"(เพิ่ม {type_counter.get('ADDED', 0)} รายการ, "
+        f"ลบ {type_counter.get('REMOVED', 0)} รายการ, "
+        f"แก้ไข {type_counter.get('MODIFIED', 0)} รายการ)"
+    )
+
+
+def pending_summary(changes: List[Change]) -> dict:
+    """
+    ผลสรุปของ mode=fast (ยังไม่เรียก LLM): ข้อความนับจำนวน + คะแนน 0 + overall_risk_level = "PENDING"
+    ขอสรุปจริงภายหลังผ่าน POST /comparisons/{id}/summary
+    """
+    return {
+        "summary_text": base_summary_text(changes),
+        "impact_scores": {
+            "scope_impact_score": 0,
+            "timeline_impact_score": 0,
+            "cost_impact_score": 0,
+            "resource_impact_score": 0,
+            "risk_impact_score": 0,
+            "contract_impact_score": 0,
+            "stakeholder_impact_score": 0,
+            "architecture_impact_score": 0,
+        },
+        "risk_comment": "ยังไม่ได้ประเมินผลกระทบด้วย AI (ขอสรุปได้ภายหลัง)",
+        "overall_risk_level": "PENDING",
+        "summary_stats": {"mode": "pending", "groups": 0, "levels": 0},
+    }
+
+
+# ==================================================
+async def abuild_summary_text(
+    changes: List[Change],
+    enrich: bool = True,
+    cancel_token: Optional[CancellationToken] = None,
+) -> dict:
+    """
+    สรุปภาพรวม + impact scoring ของทุก change
+    - prompt summary กับ impact ไม่ขึ้นต่อกัน → ยิงพร้อมกัน
+    - ไม่มี sync LLM call บน event loop
+    - enrich=False: ไม่เติม ai_comment / ai_suggestion ที่ยังขาด (สรุปตามผลที่มีอยู่ เช่น mode=fast)
+    - cancel_token ถูกยกเลิก → LLM call ที่ค้าง (enrich / map / summary / impact) ถูก cancel แล้ว raise JobCancelled
+    """
+    if not changes:
+        return {
+            "summary_text": "ไม่มีการเปลี่ยนแปลงเนื้อหาสำคัญระหว่างสองเวอร์ชัน",
+            "impact_scores": {
+                "scope_impact_score": 0,
+                "timeline_impact_score": 0,
+                "cost_impact_score": 0,
+                "resource_impact_score": 0,
+                "risk_impact_score": 0,
+                "contract_impact_score": 0,
+                "stakeholder_impact_score": 0,
+                "architecture_impact_score": 0,
+            },
+            "risk_comment": "ไม่มีความเสี่ยงเนื่องจากไม่มีการเปลี่ยนแปลง",
+            "overall_risk_level": "LOW",
+        }
+
+    # ===============================
+    # STEP 1 — Summary (เหมือนเดิม)
+    # ===============================
+    enriched = await _enrich_missing(changes, cancel_token) if enrich else {"comment": 0, "suggestion": 0}
+
+    base_summary = base_summary_text(changes)
+
+    all_ai_comments = "\n".join(
+        f"- Page {c.section_label}: {getattr(c, 'ai_comment', None) or 'ไม่มี AI Comment'}"
+        for c in changes
+    )
+
+    all_ai_suggestions = "\n".join(
+        f"- Page {c.section_label}: {getattr(c, 'ai_suggestion', None) or 'ไม่มี AI Suggestion'}"
+        for c in changes
+    )
+
+    # ⭐ ข้อมูลราย change เกิน context budget → map-reduce (สรุปเป็นกลุ่มพร้อมกัน แล้วใช้ prompt เดิมรวม)
+    summary_stats = {"mode": "single", "groups": 1, "levels": 0}
+    group_evidence = ""
+    input_tokens = estimate_tokens(all_ai_comments) + estimate_tokens(all_ai_suggestions)
+    if input_tokens > SUMMARY_CONTEXT_BUDGET_TOKENS:
+        all_ai_comments, all_ai_suggestions, group_evidence, summary_stats = await _map_reduce_inputs(
+            changes, SUMMARY_CONTEXT_BUDGET_TOKENS, cancel_token
+        )
+        print(
+            f"🧩 [DEBUG] summary map-reduce: ~{input_tokens} tokens → "
+            f"{summary_stats['groups']} กลุ่ม, {summary_stats['levels']} ระดับ"
+        )
+    summary_stats["input_tokens"] = input_tokens
+    summary_stats["enriched"] = enriched
+
+
+    summary_inputs = {
+        "base_summary": base_summary,
+        "all_ai_comments": all_ai_comments,
+        "all_ai_suggestions": all_ai_suggestions
+    }
+
+    # ===============================
+    # STEP 2 — Impact Scoring (⭐ แก้ใหม่)
+    # ===============================
+    # ⭐ สรุปในเครื่องก่อน: ตารางต่อ category + details ไม่ซ้ำ + ข้อความเต็มเฉพาะ top-N ที่รุนแรงสุด
+    aggregate = aggregate_changes(changes)
+    structured_analysis = render_impact_input(aggregate)
+    if group_evidence:
+        structured_analysis += f"\n\nRISK EVIDENCE PER GROUP:\n{group_evidence}"
+    summary_stats["impact_input_tokens"] = estimate_tokens(structured_analysis)
+
+
+    impact_inputs = {"structured_analysis": structured_analysis}
+
+    # ===============================
+    # STEP 3 — ยิง summary + impact พร้อมกัน
+    # ===============================
+    summary_res, impact_res = await gather_cancellable(
+        [
+            _acall(SUMMARY_PROMPT, summary_inputs, "summary", SUMMARY_PROMPT_VERSION),
+            _acall(IMPACT_PROMPT, impact_inputs, "impact", IMPACT_PROMPT_VERSION, ImpactOutput),
+        ],
+        cancel_token,
+    )
+    for res in (summary_res, impact_res):
+        if isinstance(res, asyncio.CancelledError):
+            raise res
+
+    if isinstance(summary_res, Exception):
+        print(f"⚠️ [DEBUG] summary ล่ม: {summary_res}")
+        full_summary_text = base_summary
+    else:
+        raw_summary = summary_res.get("text", "")
+        full_summary_text = f"{base_summary}\n\n{raw_summary}" if raw_summary else base_summary
+
+    try:
+        if isinstance(impact_res, Exception):
+            raise impact_res
+        data = impact_res
 
         return {
             "summary_text": full_summary_text,
@@ -401,11 +689,10 @@ STRICT OUTPUT RULES:
                 "stakeholder_impact_score": _safe_float(data.get("impact_scores", {}).get("stakeholder_impact_score", 0)),
                 "architecture_impact_score": _safe_float(data.get("impact_scores", {}).get("architecture_impact_score", 0)),
             },
-            "risk_comment": data.get(
-                "risk_comment",
-                "ไม่พบความเสี่ยงที่มีนัยสำคัญจากภาพรวมการเปลี่ยนแปลง"
-            ),
+            "risk_comment": data.get("risk_comment")
+            or "ไม่พบความเสี่ยงที่มีนัยสำคัญจากภาพรวมการเปลี่ยนแปลง",
             "overall_risk_level": str(data.get("overall_risk_level", "LOW")).upper(),
+            "summary_stats": summary_stats,
         }
 
     except Exception as e:
@@ -425,4 +712,5 @@ STRICT OUTPUT RULES:
             },
             "risk_comment": "ระบบไม่สามารถประเมินผลกระทบได้",
             "overall_risk_level": "LOW",
+            "summary_stats": summary_stats,
         }
\ No newline at end of file
@@ -0,0 +1,488 @@
+"""
+เดา change_category (scope / timeline / cost / ...) จาก ChangeItem ในอดีตด้วย kNN ก่อนเรียก LLM
+
+เดิม LLM เป็นคนจัดหมวดทุก change (rubric ส่วนนิยามหมวดยาวที่สุดใน prompt ของ ai_comment)
+ทั้งที่ DB มี ChangeItem ที่ LLM จัดหมวดไว้แล้วหลายพันแถว
+
+ที่นี่:
+- index = embedding ของย่อหน้า (ข้อความใหม่ / ข้อความเดิมถ้า REMOVED) + change_category + paragraph_topic
+  เก็บแบบ append-only: ไฟล์ .npz 1 ไฟล์ต่อ comparison ใน CATEGORY_INDEX_DIR
+  (compare service กับ history service เขียนพร้อมกันได้ ไม่ทับแถวของกันและกัน / โหลดเฉพาะไฟล์ใหม่)
+- change ใหม่: cosine กับทุกแถว → top-k → โหวตถ่วงด้วย similarity (หลัก ms สำหรับหลายพันแถว)
+  มั่นใจพอ (confidence + similarity ของเพื่อนบ้านใกล้สุด) → change.category_prefill
+  → ai_comment ใช้ prompt ที่ไม่มีส่วนจัดหมวด และใช้หมวดจาก kNN
+- index โตเองทีละ comparison หลังบันทึกลง DB (เฉพาะหมวดที่ LLM ตัดสิน ไม่เอาผลของ kNN / triage / cluster)
+  ที่มาของหมวดเก็บใน ChangeItem.category_source → rebuild จาก DB ไม่เอาหมวดที่ kNN เดาเองกลับมาสอนตัวเอง
+- ครั้งแรก / ย้อนหลัง: python -m src.AI.category_knn (embed ChangeItem เดิมที่ยังไม่อยู่ใน index)
+"""
+
+import os
+import threading
+import time
+import logging
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.diff.diff import Change
+from src.AI.ai_schedule import (
+    AI_STATUS_CLUSTERED,
+    AI_STATUS_DONE,
+    AI_STATUS_FAILED,
+    AI_STATUS_TRIAGED,
+    ai_status_of,
+)
+from src.monitoring.metrics import counter
+
+logger = logging.getLogger(__name__)
+
+# ==================================================
+# Config (ปรับได้ผ่าน env)
+# ==================================================
+CATEGORY_KNN_ENABLED = os.getenv("CATEGORY_KNN_ENABLED", "true").lower() == "true"
+CATEGORY_INDEX_DIR = os.getenv("CATEGORY_INDEX_DIR", "data/category_index")
+# ไฟล์ index เดิม (ไฟล์เดียวทั้ง index) → แยกเป็นไฟล์ต่อ comparison ครั้งแรกที่โหลด
+CATEGORY_INDEX_PATH = os.getenv("CATEGORY_INDEX_PATH", "data/category_index.npz")
+# process อื่นเพิ่ม comparison ลง index → เห็นภายในกี่วินาที (สแกน directory หาไฟล์ใหม่)
+CATEGORY_INDEX_REFRESH_SEC = float(os.getenv("CATEGORY_INDEX_REFRESH_SEC", "30"))
+CATEGORY_KNN_K = int(os.getenv("CATEGORY_KNN_K", "7"))
+# สัดส่วนคะแนนโหวตของหมวดที่ชนะ (ถ่วงด้วย similarity)
+CATEGORY_KNN_MIN_CONFIDENCE = float(os.getenv("CATEGORY_KNN_MIN_CONFIDENCE", "0.8"))
+# cosine ของเพื่อนบ้านใกล้สุดต้องถึงค่านี้ (e5 ให้ cosine สูงแม้ข้อความไม่เกี่ยวกัน → ตั้งสูงไว้)
+CATEGORY_KNN_MIN_SIMILARITY = float(os.getenv("CATEGORY_KNN_MIN_SIMILARITY", "0.88"))
+# index เล็กกว่านี้ยังไม่ใช้ทำนาย
+CATEGORY_KNN_MIN_ITEMS = int(os.getenv("CATEGORY_KNN_MIN_ITEMS", "50"))
+
+# ที่มาของ change_category (ChangeItem.category_source)
+CATEGORY_SOURCE_LLM = "llm"
+CATEGORY_SOURCE_KNN = "knn"
+CATEGORY_SOURCE_TRIAGE = "triage"
+CATEGORY_SOURCE_CLUSTER = "cluster"
+
+CATEGORY_KNN_PREDICTIONS = counter(
+    "category_knn_predictions_total",
+    "kNN change_category predictions per outcome (prefilled / low_confidence / no_vector)",
+    ["outcome"],
+)
+
+
+@dataclass
+class CategoryPrediction:
+    category: str
+    confidence: float       # สัดส่วนคะแนนโหวตของหมวดนี้ใน top-k
+    similarity: float       # cosine ของเพื่อนบ้านใกล้สุด
+    neighbors: int
+    topic_hint: Optional[str] = None   # paragraph_topic ของเพื่อนบ้านใกล้สุดในหมวดนี้
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+def _normalize(m: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(m, axis=-1, keepdims=True)
+    return m / np.maximum(norms, 1e-12)
+
+
+# ==================================================
+# Index
+# ==================================================
+class CategoryIndex:
+    """
+    embedding (normalize แล้ว) + หมวด + หัวข้อ + comparison_id ต่อแถว
+    1 ไฟล์ต่อ comparison ({directory}/{comparison_id}.npz) เขียนครั้งเดียว ไม่แก้ทีหลัง
+    - comparison ที่มีไฟล์แล้วไม่ถูกเพิ่มซ้ำ (ใช้เป็น watermark ของการ rebuild ข้าม process ได้)
+    - add เขียนแค่ไฟล์ของ comparison นั้น (ไม่เขียนทั้ง index ใหม่)
+    - แถวที่ process อื่นเพิ่ม → refresh โหลดเฉพาะไฟล์ที่ยังไม่เคยโหลด
+    """
+
+    def __init__(
+        self,
+        directory: str = CATEGORY_INDEX_DIR,
+        legacy_path: Optional[str] = CATEGORY_INDEX_PATH,
+        refresh_sec: float = CATEGORY_INDEX_REFRESH_SEC,
+    ):
+        self.directory = Path(directory)
+        self.legacy_path = Path(legacy_path) if legacy_path else None
+        self.refresh_sec = refresh_sec
+        self._lock = threading.Lock()
+        self._migrated = False
+        self._refreshed_at: Optional[float] = None
+        self._loaded_ids: set = set()
+        self.vectors: Optional[np.ndarray] = None
+        self.labels = np.array([], dtype=str)
+        self.topics = np.array([], dtype=str)
+        self.comparison_ids = np.array([], dtype=np.int64)
+
+    def _segment_path(self, comparison_id: int) -> Path:
+        return self.directory / f"{int(comparison_id)}.npz"
+
+    @staticmethod
+    def _write_segment(path: Path, vectors: np.ndarray, labels: np.ndarray, topics: np.ndarray) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, vectors=vectors, labels=labels, topics=topics)
+        os.replace(tmp, path)
+
+    def _migrate_legacy_locked(self) -> None:
+        """ไฟล์ index เดิม (ไฟล์เดียว) → ไฟล์ต่อ comparison แล้วเปลี่ยนชื่อไฟล์เดิมเป็น .migrated"""
+        if self._migrated:
+            return
+        self._migrated = True
+        if self.legacy_path is None or not self.legacy_path.exists():
+            return
+        try:
+            with np.load(self.legacy_path, allow_pickle=False) as data:
+                vectors = data["vectors"].astype(np.float32)
+                labels, topics, ids = data["labels"], data["topics"], data["comparison_ids"]
+            for cid in np.unique(ids):
+                path = self._segment_path(int(cid))
+                if path.exists():
+                    continue
+                mask = ids == cid
+                self._write_segment(path, vectors[mask], labels[mask], topics[mask])
+            os.replace(self.legacy_path, self.legacy_path.with_name(self.legacy_path.name + ".migrated"))
+            print(f"🏷️ category index: แยก {self.legacy_path} เป็นไฟล์ต่อ comparison ใน {self.directory}")
+        except FileNotFoundError:
+            # process อื่นแยกไปแล้ว
+            pass
+        except Exception as e:
+            logger.warning("migrate category index failed (%s): %s", self.legacy_path, e)
+
+    def _refresh_locked(self, force: bool = False) -> None:
+        """โหลดไฟล์ของ comparison ที่ยังไม่เคยโหลด (ทุก refresh_sec วินาที หรือเมื่อ force)"""
+        now = time.monotonic()
+        if not force and self._refreshed_at is not None and now - self._refreshed_at < self.refresh_sec:
+            return
+        self._refreshed_at = now
+        self._migrate_legacy_locked()
+        if not self.directory.is_dir():
+            return
+
+        new_ids = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".npz") or entry.name.startswith("."):
+                continue
+            try:
+                cid = int(entry.name[:-4])
+            except ValueError:
+                continue
+            if cid not in self._loaded_ids:
+                new_ids.append(cid)
+        if not new_ids:
+            return
+
+        parts = []
+        for cid in sorted(new_ids):
+            try:
+                with np.load(self._segment_path(cid), allow_pickle=False) as data:
+                    parts.append((cid, data["vectors"].astype(np.float32), data["labels"], data["topics"]))
+            except Exception as e:
+                logger.warning("load category index segment %s failed: %s", cid, e)
+        before = len(self.labels)
+        self._append_locked(parts)
+        print(
+            f"🏷️ category index: โหลด {len(parts)} comparison (+{len(self.labels) - before} แถว "
+            f"รวม {len(self.labels)}) จาก {self.directory}"
+        )
+
+    def _append_locked(self, parts: List[Tuple[int, np.ndarray, np.ndarray, np.ndarray]]) -> None:
+        dim = self.vectors.shape[1] if self.vectors is not None and len(self.vectors) else None
+        keep = []
+        for cid, vecs, labels, topics in parts:
+            self._loaded_ids.add(cid)
+            if not len(vecs):
+                continue
+            if dim is not None and vecs.shape[1] != dim:
+                logger.warning(
+                    "category index dim %s != %s (comparison %s, เปลี่ยน embedding model?) → ข้าม",
+                    dim, vecs.shape[1], cid,
+                )
+                continue
+            dim = vecs.shape[1]
+            keep.append((cid, vecs, labels, topics))
+        if not keep:
+            return
+        vectors = [v for _, v, _, _ in keep]
+        if self.vectors is not None and len(self.vectors):
+            vectors.insert(0, self.vectors)
+        self.vectors = np.vstack(vectors)
+        self.labels = np.concatenate([self.labels] + [l for _, _, l, _ in keep])
+        self.topics = np.concatenate([self.topics] + [t for _, _, _, t in keep])
+        self.comparison_ids = np.concatenate(
+            [self.comparison_ids] + [np.full(len(v), cid, dtype=np.int64) for cid, v, _, _ in keep]
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh_locked()
+            return len(self.labels)
+
+    def indexed_comparisons(self) -> set:
+        with self._lock:
+            self._refresh_locked(force=True)
+            return set(self._loaded_ids)
+
+    def add(self, comparison_id: int, rows: List[Tuple[Sequence[float], str, Optional[str]]]) -> int:
+        """rows = [(embedding, category, topic)] ของ comparison เดียว คืนจำนวนแถวที่เพิ่ม"""
+        if not rows:
+            return 0
+        vecs = _normalize(np.asarray([r[0] for r in rows], dtype=np.float32))
+        labels = np.array([r[1] for r in rows], dtype=str)
+        topics = np.array([r[2] or "" for r in rows], dtype=str)
+        path = self._segment_path(comparison_id)
+        with self._lock:
+            self._migrate_legacy_locked()
+            # มีไฟล์แล้ว (process นี้ / process อื่นเพิ่มไปแล้ว) → ไม่เพิ่มซ้ำ
+            if comparison_id in self._loaded_ids or path.exists():
+                return 0
+            if self.vectors is not None and len(self.vectors) and self.vectors.shape[1] != vecs.shape[1]:
+                logger.warning(
+                    "category index dim %s != %s (เปลี่ยน embedding model?) → ไม่เพิ่ม",
+                    self.vectors.shape[1], vecs.shape[1],
+                )
+                return 0
+            self._write_segment(path, vecs, labels, topics)
+            self._append_locked([(comparison_id, vecs, labels, topics)])
+        return len(rows)
+
+    def predict(self, vector: Sequence[float], k: int = CATEGORY_KNN_K) -> Optional[CategoryPrediction]:
+        with self._lock:
+            self._refresh_locked()
+            vectors, labels, topics = self.vectors, self.labels, self.topics
+        if vectors is None or len(labels) < max(CATEGORY_KNN_MIN_ITEMS, 1):
+            return None
+        q = _normalize(np.asarray(vector, dtype=np.float32))
+        if q.shape[0] != vectors.shape[1]:
+            return None
+
+        sims = vectors @ q
+        k = min(k, len(sims))
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+
+        votes: Dict[str, float] = {}
+        for i in top:
+            votes[str(labels[i])] = votes.get(str(labels[i]), 0.0) + max(float(sims[i]), 0.0)
+        total = sum(votes.values())
+        if total <= 0:
+            return None
+        category = max(votes, key=votes.get)
+        hint = next((str(topics[i]) for i in top if str(labels[i]) == category and topics[i]), None)
+        return CategoryPrediction(
+            category=category,
+            confidence=round(votes[category] / total, 4),
+            similarity=round(float(sims[top[0]]), 4),
+            neighbors=k,
+            topic_hint=hint,
+        )
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._refresh_locked()
+            cats, counts = np.unique(self.labels, return_counts=True)
+            return {
+                "path": str(self.directory),
+                "rows": len(self.labels),
+                "comparisons": len(self._loaded_ids),
+                "by_category": {str(c): int(n) for c, n in zip(cats, counts)},
+            }
+
+
+_index: Optional[CategoryIndex] = None
+_index_lock = threading.Lock()
+
+
+def category_index() -> CategoryIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = CategoryIndex()
+        return _index
+
+
+# ==================================================
+# ใช้ใน compare
+# ==================================================
+def change_vector(
+    change: Change,
+    old_embeddings: Optional[Sequence],
+    new_embeddings: Optional[Sequence],
+) -> Optional[Sequence[float]]:
+    """embedding ของย่อหน้าใหม่ (REMOVED → ย่อหน้าเดิม) จาก paragraph index ของ change"""
+    if change.change_type == "REMOVED":
+        embeddings, index = old_embeddings, change.old_index
+    else:
+        embeddings, index = new_embeddings, change.new_index
+    if embeddings is None or index is None or not (0 <= index < len(embeddings)):
+        return None
+    return embeddings[index]
+
+
+def prefilled_category(change: Change) -> Optional[str]:
+    prefill = getattr(change, "category_prefill", None)
+    return prefill.get("category") if prefill else None
+
+
+def category_of(change: Change) -> Optional[str]:
+    """หมวดที่บันทึกลง DB: ผลวิเคราะห์ หรือหมวดจาก kNN ถ้ายังไม่ได้วิเคราะห์ (mode=fast / defer)"""
+    return getattr(change, "change_category", None) or prefilled_category(change)
+
+
+def category_source_of(change: Change) -> Optional[str]:
+    """ที่มาของหมวด (llm / knn / triage / cluster) หรือ None ถ้าไม่มีหมวดจริง (pending / deferred / failed)"""
+    status = ai_status_of(change)
+    # วิเคราะห์ไม่สำเร็จ → หมวด "unknown" จาก fallback ไม่ใช่ของ kNN / LLM
+    if status == AI_STATUS_FAILED:
+        return None
+    if prefilled_category(change):
+        return CATEGORY_SOURCE_KNN
+    if not getattr(change, "change_category", None):
+        return None
+    if status == AI_STATUS_TRIAGED:
+        return CATEGORY_SOURCE_TRIAGE
+    if status == AI_STATUS_CLUSTERED:
+        return CATEGORY_SOURCE_CLUSTER
+    if status == AI_STATUS_DONE:
+        return CATEGORY_SOURCE_LLM
+    return None
+
+
+def prefill_categories(
+    changes: List[Change],
+    old_embeddings: Optional[Sequence],
+    new_embeddings: Optional[Sequence],
+) -> Optional[Dict]:
+    """
+    ทำนายหมวดของ change ที่ยังไม่มีผล AI → มั่นใจพอ = change.category_prefill (dict ของ CategoryPrediction)
+    คืน None ถ้าปิดอยู่ / index ยังเล็กเกินไป
+    """
+    if not CATEGORY_KNN_ENABLED:
+        return None
+    index = category_index()
+    size = len(index)
+    if size < CATEGORY_KNN_MIN_ITEMS:
+        return None
+
+    started = time.perf_counter()
+    stats = {"index_size": size, "predicted": 0, "prefilled": 0, "low_confidence": 0, "no_vector": 0}
+    for c in changes:
+        if getattr(c, "ai_comment", None):
+            continue
+        vector = change_vector(c, old_embeddings, new_embeddings)
+        pred = index.predict(vector) if vector is not None else None
+        if pred is None:
+            outcome = "no_vector"
+        elif pred.confidence >= CATEGORY_KNN_MIN_CONFIDENCE and pred.similarity >= CATEGORY_KNN_MIN_SIMILARITY:
+            c.category_prefill = pred.to_dict()
+            outcome = "prefilled"
+        else:
+            outcome = "low_confidence"
+        if pred is not None:
+            stats["predicted"] += 1
+        stats[outcome] += 1
+        CATEGORY_KNN_PREDICTIONS.inc(outcome=outcome)
+    stats["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return stats
+
+
+def _llm_labeled(change: Change) -> bool:
+    """หมวดที่ LLM ตัดสินเอง (ไม่ใช่ kNN / triage / คัดลอกจากตัวแทนกลุ่ม / defer / failed)"""
+    # import ตอนเรียก: ai_comment import module นี้ (prefilled_category)
+    from src.AI.ai_comment import VALID_CATEGORIES
+
+    return (
+        getattr(change, "change_category", None) in VALID_CATEGORIES
+        and category_source_of(change) == CATEGORY_SOURCE_LLM
+    )
+
+
+def index_comparison(
+    comparison_id: int,
+    changes: List[Change],
+    old_embeddings: Optional[Sequence],
+    new_embeddings: Optional[Sequence],
+) -> int:
+    """
+    เพิ่ม change ของ comparison ที่เพิ่งบันทึกลง index (incremental) คืนจำนวนแถวที่เพิ่ม
+    ไม่มี embedding (resume จาก checkpoint) → ข้าม ให้ rebuild_from_db เก็บตกภายหลัง
+    """
+    if not CATEGORY_KNN_ENABLED or old_embeddings is None or new_embeddings is None:
+        return 0
+    rows = []
+    for c in changes:
+        if not _llm_labeled(c):
+            continue
+        vector = change_vector(c, old_embeddings, new_embeddings)
+        if vector is not None:
+            rows.append((vector, c.change_category, getattr(c, "paragraph_topic", None)))
+    return category_index().add(comparison_id, rows)
+
+
+# ==================================================
+# Rebuild ย้อนหลังจาก DB (ChangeItem ที่ยังไม่อยู่ใน index)
+# ==================================================
+def rebuild_from_db(batch_size: int = 64) -> Dict:
+    """
+    embed ข้อความของ ChangeItem ที่ LLM จัดหมวดไว้ (category_source = llm) ของ comparison ที่ยังไม่อยู่ใน index
+    ใช้ EmbeddingService ตัวเดียวกับ compare → ช้า (โหลด model) ใช้ตอนติดตั้งครั้งแรก / ย้อนหลัง
+    """
+    from sqlalchemy import and_, or_
+
+    from src.AI.ai_comment import VALID_CATEGORIES
+    from src.db.models import ChangeItem
+    from src.db.session import SessionLocal
+    from src.embedding.embed import EmbeddingService
+    from src.ingestion.paragraph import Paragraph
+
+    index = category_index()
+    done = index.indexed_comparisons()
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(ChangeItem)
+            .filter(
+                ChangeItem.change_category.in_(sorted(VALID_CATEGORIES)),
+                or_(
+                    ChangeItem.category_source == CATEGORY_SOURCE_LLM,
+                    # แถวก่อนมี ai_status / category_source (ผลจาก LLM ทั้งหมด)
+                    # แถวที่มี ai_status แต่ไม่มี category_source แยกไม่ได้ว่ามาจาก kNN หรือไม่ → ไม่เอา
+                    and_(ChangeItem.category_source.is_(None), ChangeItem.ai_status.is_(None)),
+                ),
+            )
+            .order_by(ChangeItem.comparison_id, ChangeItem.id)
+            .all()
+        )
+        by_comparison: Dict[int, list] = {}
+        for r in rows:
+            if r.comparison_id not in done and (r.new_text or r.old_text):
+                by_comparison.setdefault(r.comparison_id, []).append(
+                    (r.new_text if r.change_type != "REMOVED" else r.old_text, r.change_category, r.paragraph_topic)
+                )
+    finally:
+        db.close()
+
+    if not by_comparison:
+        return {"added": 0, "comparisons": 0, **index.stats()}
+
+    embedder = EmbeddingService()
+    added = 0
+    for comparison_id, items in by_comparison.items():
+        paragraphs = [Paragraph(page_number=0, index=i, text=text or "") for i, (text, _, _) in enumerate(items)]
+        for start in range(0, len(paragraphs), batch_size):
+            embedder.embed_paragraphs(paragraphs[start:start + batch_size])
+        rows = [
+            (p.embedding, cat, topic)
+            for p, (_, cat, topic) in zip(paragraphs, items)
+            if p.embedding is not None
+        ]
+        added += index.add(comparison_id, rows)
+        print(f"🏷️ category index: comparison {comparison_id} +{len(rows)} แถว")
+    return {"added": added, "comparisons": len(by_comparison), **index.stats()}
+
+
+if __name__ == "__main__":
+    result = rebuild_from_db()
+    print(f"✅ category index: เพิ่ม {result['added']} แถว รวม {result['rows']} แถว {result['by_category']}")
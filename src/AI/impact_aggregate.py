@@ -0,0 +1,146 @@
+"""
+สรุปข้อมูล change ในเครื่องก่อนส่งให้ impact scoring
+
+เดิม prompt impact ได้ข้อความเต็มของทุก change (topic / category / ai_comment / details)
+→ ยาวขึ้นตามจำนวน change และให้ LLM นับ/ชั่งน้ำหนักเอง
+
+ที่นี่คำนวณเอง:
+- จำนวน change ต่อ change_category (แยก ADDED / REMOVED / MODIFIED)
+- histogram ถ่วงน้ำหนักตาม edit_severity ต่อ category
+- change_details ที่ไม่ซ้ำ (นับจำนวนครั้งที่พบ)
+- ข้อความเต็มเฉพาะ top-N change ที่รุนแรงที่สุด
+→ ขนาด prompt แทบคงที่ไม่ว่าจะมีกี่ change
+"""
+
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List
+
+from src.diff.diff import Change
+
+# ==================================================
+# Config (ปรับได้ผ่าน env)
+# ==================================================
+IMPACT_TOP_N = int(os.getenv("IMPACT_TOP_N", "12"))
+IMPACT_MAX_DETAILS = int(os.getenv("IMPACT_MAX_DETAILS", "40"))
+
+# น้ำหนักความรุนแรงของการแก้ไข (ADDED / REMOVED ทั้งย่อหน้า = เท่ากับ HEAVY)
+SEVERITY_WEIGHTS = {"LIGHT": 1, "MEDIUM": 2, "HEAVY": 3}
+WHOLE_PARAGRAPH_WEIGHT = 3
+
+CATEGORIES = (
+    "scope", "timeline", "cost", "resource",
+    "risk", "contract", "stakeholder", "architecture",
+)
+
+# หมวดที่ไม่มีผลต่อคะแนน (triage / วิเคราะห์ไม่ได้)
+_NON_SCORING = ("editorial", "unknown")
+
+_WS_RE = re.compile(r"\s+")
+
+
+def severity_weight(change: Change) -> int:
+    if change.change_type in ("ADDED", "REMOVED"):
+        return WHOLE_PARAGRAPH_WEIGHT
+    return SEVERITY_WEIGHTS.get((change.edit_severity or "").upper(), 2)
+
+
+def _category(change: Change) -> str:
+    return getattr(change, "change_category", None) or "unknown"
+
+
+def _severity_label(change: Change) -> str:
+    if change.change_type in ("ADDED", "REMOVED"):
+        return change.change_type
+    return (change.edit_severity or "MEDIUM").upper()
+
+
+def _severity_score(change: Change) -> float:
+    """ใช้จัดลำดับ top-N: น้ำหนัก severity + จำนวน detail + ยิ่งข้อความต่างมากยิ่งสูง"""
+    details = getattr(change, "change_details", None) or []
+    dissimilarity = 1.0 - (change.similarity if change.similarity is not None else 0.5)
+    scoring = 0 if _category(change) in _NON_SCORING else 1
+    return severity_weight(change) * 10 * scoring + len(details) + dissimilarity
+
+
+def _norm(text: str) -> str:
+    return _WS_RE.sub(" ", str(text or "")).strip()
+
+
+def aggregate_changes(changes: List[Change], top_n: int = IMPACT_TOP_N) -> Dict:
+    by_category: Dict[str, Counter] = defaultdict(Counter)
+    weighted: Counter = Counter()
+    histogram: Dict[str, Counter] = defaultdict(Counter)
+    details: Counter = Counter()
+    detail_categories: Dict[str, str] = {}
+
+    for c in changes:
+        cat = _category(c)
+        by_category[cat][c.change_type] += 1
+        weighted[cat] += severity_weight(c)
+        histogram[cat][_severity_label(c)] += 1
+
+        for d in getattr(c, "change_details", None) or []:
+            if isinstance(d, dict):
+                text = _norm(d.get("description"))
+                kind = str(d.get("type") or "modified").lower()
+            else:
+                text, kind = _norm(d), "modified"
+            if not text:
+                continue
+            key = f"{kind}: {text}"
+            details[key] += 1
+            detail_categories.setdefault(key, cat)
+
+    ranked = sorted(changes, key=_severity_score, reverse=True)
+
+    return {
+        "total": len(changes),
+        "by_category": {k: dict(v) for k, v in by_category.items()},
+        "weighted_by_category": dict(weighted),
+        "severity_histogram": {k: dict(v) for k, v in histogram.items()},
+        "details": [
+            {"detail": k, "count": n, "category": detail_categories[k]}
+            for k, n in details.most_common(IMPACT_MAX_DETAILS)
+        ],
+        "details_total": len(details),
+        "top_changes": ranked[:top_n],
+    }
+
+
+def render_impact_input(agg: Dict) -> str:
+    """แปลงผล aggregate_changes เป็นข้อความสำหรับ {structured_analysis} ของ impact prompt"""
+    lines = [f"TOTAL CHANGES: {agg['total']}", "", "CHANGES PER CATEGORY:"]
+    lines.append("category | added | removed | modified | severity_weighted | LIGHT/MEDIUM/HEAVY")
+
+    cats = list(CATEGORIES) + sorted(k for k in agg["by_category"] if k not in CATEGORIES)
+    for cat in cats:
+        counts = agg["by_category"].get(cat)
+        if not counts:
+            continue
+        hist = agg["severity_histogram"].get(cat, {})
+        lines.append(
+            f"{cat} | {counts.get('ADDED', 0)} | {counts.get('REMOVED', 0)} | "
+            f"{counts.get('MODIFIED', 0)} | {agg['weighted_by_category'].get(cat, 0)} | "
+            f"{hist.get('LIGHT', 0)}/{hist.get('MEDIUM', 0)}/{hist.get('HEAVY', 0)}"
+        )
+
+    lines.append("")
+    lines.append(f"UNIQUE CHANGE DETAILS ({len(agg['details'])} of {agg['details_total']}):")
+    for d in agg["details"]:
+        suffix = f" (x{d['count']})" if d["count"] > 1 else ""
+        lines.append(f"- [{d['category']}] {d['detail']}{suffix}")
+
+    lines.append("")
+    lines.append(f"MOST SEVERE CHANGES (top {len(agg['top_changes'])}):")
+    for c in agg["top_changes"]:
+        lines.append(
+            f"""
+Paragraph: {c.section_label} ({_severity_label(c)})
+Topic: {getattr(c, "paragraph_topic", "")}
+Change Category: {_category(c)}
+AI Analysis: {getattr(c, "ai_comment", "")}"""
+        )
+
+    return "\n".join(lines)
@@ -0,0 +1,190 @@
+"""
+บันทึก LLM call ทุกครั้งของงานหนึ่งงาน (compare / annotate / chat) เพื่อเก็บลงตาราง llm_call_logs
+
+- เริ่มนับด้วย begin_call_tracking() ใน context ของงานนั้น (เหมือน llm_cache.begin_cache_scope)
+- call จริง: มาจาก call hook ของ llm_gateway (latency + token + error)
+- cache hit / coalesced: มาจาก lookup hook ของ llm_cache (token = 0, cache_hit = True)
+- retries: ลำดับ attempt จาก llm_retry ของ call นั้น
+- llm_stage("impact") แยก role ย่อยของ handle เดียวกัน (sum → summary / impact / summary_map)
+- ผล parse คำตอบ (ok / repaired / failed ต่อ role): มาจาก parse hook ของ structured_output
+  (failed = ซ่อม JSON ไม่ได้ → retry ที่เกิดจาก parse) — ไม่ลง DB อยู่ใน summary() ของงานเท่านั้น
+"""
+
+import contextvars
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, asdict
+from typing import Dict, Generator, Iterator, List, Optional
+
+from src.AI import llm_cache
+from src.AI.llm_gateway import CallEvent, add_call_hook
+from src.AI.llm_retry import current_attempt
+from src.AI.structured_output import add_parse_hook
+from src.service.profiler import percentile
+
+# outcome ของ llm_cache ที่ไม่ได้เรียก model จริง
+_CACHE_HIT_OUTCOMES = ("hit", "coalesced")
+
+
+@dataclass
+class LLMCallRecord:
+    role: str
+    model: Optional[str]
+    prompt_tokens: Optional[int]
+    completion_tokens: Optional[int]
+    latency_seconds: float
+    retries: int = 0
+    cache_hit: bool = False
+    error: Optional[str] = None
+
+
+class LLMCallTracker:
+    """รายการ LLM call ของงานเดียว (task หลายตัวใน gather / thread ของ chat เขียนพร้อมกันได้)"""
+
+    def __init__(self):
+        self.calls: List[LLMCallRecord] = []
+        self.parse: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, rec: LLMCallRecord) -> None:
+        with self._lock:
+            self.calls.append(rec)
+
+    def record_parse(self, role: str, outcome: str) -> None:
+        with self._lock:
+            by_outcome = self.parse.setdefault(role, {})
+            by_outcome[outcome] = by_outcome.get(outcome, 0) + 1
+
+    def to_list(self) -> List[dict]:
+        with self._lock:
+            return [asdict(c) for c in self.calls]
+
+    def summary(self) -> Dict:
+        out = summarize_calls(self.to_list())
+        with self._lock:
+            out["parse"] = {role: dict(v) for role, v in sorted(self.parse.items())}
+        return out
+
+
+_tracker_var: ContextVar[Optional[LLMCallTracker]] = ContextVar("llm_call_tracker", default=None)
+_stage_var: ContextVar[Optional[str]] = ContextVar("llm_call_stage", default=None)
+
+
+def begin_call_tracking() -> LLMCallTracker:
+    """
+    เริ่มเก็บ LLM call ของงานใน context ปัจจุบัน
+    (task ลูกจาก asyncio.gather เห็น tracker ตัวเดียวกัน)
+    """
+    tracker = LLMCallTracker()
+    _tracker_var.set(tracker)
+    return tracker
+
+
+@contextmanager
+def llm_stage(name: str):
+    """ตั้งชื่อ role ที่จะบันทึกของ call ภายใน with (แทน role ของ handle)"""
+    token = _stage_var.set(name)
+    try:
+        yield
+    finally:
+        _stage_var.reset(token)
+
+
+def iter_tracked(gen: Generator, ctx: contextvars.Context) -> Iterator:
+    """
+    วน generator โดยให้ทุกรอบรันใน ctx เดียวกัน
+    (StreamingResponse เรียก next() คนละ thread / คนละ context → contextvar ที่ตั้งไว้จะหาย)
+    """
+    try:
+        while True:
+            try:
+                item = ctx.run(next, gen)
+            except StopIteration:
+                return
+            yield item
+    finally:
+        ctx.run(gen.close)
+
+
+# ==================================================
+# Hooks
+# ==================================================
+def _on_call(event: CallEvent) -> None:
+    tracker = _tracker_var.get()
+    if tracker is None:
+        return
+    tracker.record(LLMCallRecord(
+        role=_stage_var.get() or event.role,
+        model=event.model,
+        prompt_tokens=event.prompt_tokens,
+        completion_tokens=event.completion_tokens,
+        latency_seconds=round(event.latency_sec, 4),
+        retries=current_attempt(),
+        error=event.error,
+    ))
+
+
+def _on_lookup(role: str, outcome: str) -> None:
+    if outcome not in _CACHE_HIT_OUTCOMES:
+        return
+    tracker = _tracker_var.get()
+    if tracker is None:
+        return
+    tracker.record(LLMCallRecord(
+        role=_stage_var.get() or role,
+        model=None,
+        prompt_tokens=0,
+        completion_tokens=0,
+        latency_seconds=0.0,
+        cache_hit=True,
+    ))
+
+
+def _on_parse(role: str, outcome: str) -> None:
+    tracker = _tracker_var.get()
+    if tracker is not None:
+        tracker.record_parse(role, outcome)
+
+
+add_call_hook(_on_call)
+llm_cache.add_lookup_hook(_on_lookup)
+add_parse_hook(_on_parse)
+
+
+# ==================================================
+# Summary (ใช้ทั้งผลของงาน และ endpoint ของ history)
+# ==================================================
+def _latency_stats(latencies: List[float]) -> Dict:
+    return {
+        "p50": round(percentile(latencies, 50), 4),
+        "p90": round(percentile(latencies, 90), 4),
+        "p99": round(percentile(latencies, 99), 4),
+        "max": round(max(latencies), 4) if latencies else 0.0,
+    }
+
+
+def _totals(calls: List[dict]) -> Dict:
+    model_calls = [c for c in calls if not c.get("cache_hit")]
+    return {
+        "calls": len(calls),
+        "model_calls": len(model_calls),
+        "cache_hits": len(calls) - len(model_calls),
+        "retries": sum(1 for c in model_calls if (c.get("retries") or 0) > 0),
+        "errors": sum(1 for c in model_calls if c.get("error")),
+        "prompt_tokens": sum(c.get("prompt_tokens") or 0 for c in model_calls),
+        "completion_tokens": sum(c.get("completion_tokens") or 0 for c in model_calls),
+        "latency_seconds_total": round(sum(c.get("latency_seconds") or 0.0 for c in model_calls), 4),
+        # latency เฉพาะ call ที่เรียก model จริง (cache hit = 0 จะดึง percentile ลง)
+        "latency": _latency_stats([c.get("latency_seconds") or 0.0 for c in model_calls]),
+    }
+
+
+def summarize_calls(calls: List[dict]) -> Dict:
+    by_role: Dict[str, List[dict]] = {}
+    for c in calls:
+        by_role.setdefault(c["role"], []).append(c)
+
+    out = _totals(calls)
+    out["by_role"] = {role: _totals(items) for role, items in sorted(by_role.items())}
+    return out
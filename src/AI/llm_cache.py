@@ -0,0 +1,393 @@
+"""
+Cache ผลลัพธ์ของ LLM (ai_comment / ai_suggestion / summary) แบบถาวรใน SQLite
+
+- key = sha256 ของ (model, prompt version, inputs ที่ render ลง prompt, temperature)
+- เก็บเฉพาะผลที่ parse แล้ว (dict) พร้อม TTL และจำกัดจำนวนแถว
+- request ที่ key เดียวกันและยิงพร้อมกัน (ข้าม thread / event loop) จะรอผลจากตัวแรกตัวเดียว
+- ข้าม cache ได้เฉพาะเมื่อสั่ง refresh อย่างชัดเจน (refresh=True)
+- นับ hit / miss ต่อ comparison ผ่าน contextvar
+"""
+
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from src.monitoring.metrics import counter
+
+logger = logging.getLogger(__name__)
+
+# ==================================================
+# Config (ปรับได้ผ่าน env)
+# ==================================================
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "data/llm_cache.db")
+LLM_CACHE_TTL_SEC = float(os.getenv("LLM_CACHE_TTL_SEC", str(30 * 24 * 3600)))
+LLM_CACHE_MAX_ROWS = int(os.getenv("LLM_CACHE_MAX_ROWS", "50000"))
+
+LLM_CACHE_LOOKUPS = counter(
+    "llm_cache_lookups_total",
+    "LLM response cache lookups per role and outcome (hit / miss / coalesced / refresh)",
+    ["role", "outcome"],
+)
+
+
+def make_cache_key(
+    model: Optional[str],
+    prompt_version: str,
+    inputs: Dict[str, Any],
+    temperature: Optional[float],
+) -> str:
+    payload = json.dumps(
+        {
+            "model": model or "",
+            "prompt_version": prompt_version,
+            "inputs": inputs,
+            "temperature": temperature,
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# ==================================================
+# Per-comparison stats (contextvar)
+# ==================================================
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.by_role: Dict[str, Dict[str, int]] = {}
+
+    def record(self, role: str, outcome: str) -> None:
+        with self._lock:
+            row = self.by_role.setdefault(role, {"hit": 0, "miss": 0, "coalesced": 0, "refresh": 0})
+            row[outcome] = row.get(outcome, 0) + 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            by_role = {r: dict(v) for r, v in self.by_role.items()}
+
+        hits = sum(v["hit"] + v["coalesced"] for v in by_role.values())
+        lookups = sum(sum(v.values()) for v in by_role.values())
+        return {
+            "lookups": lookups,
+            "hits": hits,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "by_role": by_role,
+        }
+
+
+_stats_var: ContextVar[Optional[CacheStats]] = ContextVar("llm_cache_stats", default=None)
+_refresh_var: ContextVar[bool] = ContextVar("llm_cache_refresh", default=False)
+
+
+def begin_cache_scope(refresh: bool = False) -> CacheStats:
+    """
+    เริ่มนับ cache ของ 1 comparison ใน context ปัจจุบัน
+    (เรียกใน coroutine ของงานนั้น — asyncio.run / task มี context แยกของตัวเองอยู่แล้ว
+    และ task ลูกจาก asyncio.gather จะเห็น stats ตัวเดียวกัน)
+    """
+    stats = CacheStats()
+    _stats_var.set(stats)
+    _refresh_var.set(refresh)
+    return stats
+
+
+@contextmanager
+def llm_cache_scope(refresh: bool = False):
+    """เหมือน begin_cache_scope แต่คืนค่าเดิมเมื่อออกจาก with"""
+    t_stats = _stats_var.set(CacheStats())
+    t_refresh = _refresh_var.set(refresh)
+    try:
+        yield _stats_var.get()
+    finally:
+        _stats_var.reset(t_stats)
+        _refresh_var.reset(t_refresh)
+
+
+def record_lookup(role: str, outcome: str) -> None:
+    """นับ lookup เอง (ใช้กับรายการที่ไม่ได้ผ่าน aget_or_compute เช่นรายการใน batch)"""
+    _record(role, outcome)
+
+
+_lookup_hooks: List[Callable[[str, str], None]] = []
+
+
+def add_lookup_hook(fn: Callable[[str, str], None]) -> None:
+    """fn(role, outcome) ถูกเรียกทุก lookup (ห้าม raise)"""
+    _lookup_hooks.append(fn)
+
+
+def _record(role: str, outcome: str) -> None:
+    LLM_CACHE_LOOKUPS.inc(role=role, outcome=outcome)
+    stats = _stats_var.get()
+    if stats is not None:
+        stats.record(role, outcome)
+    for fn in list(_lookup_hooks):
+        try:
+            fn(role, outcome)
+        except Exception as e:
+            logger.warning("llm cache lookup hook failed: %s", e)
+
+
+def _for_followers(e: BaseException) -> Exception:
+    # ถ้า leader ถูก cancel (เช่นงานของอีก job ถูกยกเลิก) ผู้รอไม่ควรถูก cancel ตาม → ให้ retry เอง
+    if isinstance(e, Exception):
+        return e
+    return RuntimeError(f"coalesced LLM request aborted: {type(e).__name__}")
+
+
+# ==================================================
+# SQLite store
+# ==================================================
+class LLMResponseCache:
+    def __init__(
+        self,
+        path: str = LLM_CACHE_PATH,
+        ttl_sec: float = LLM_CACHE_TTL_SEC,
+        max_rows: int = LLM_CACHE_MAX_ROWS,
+        enabled: bool = LLM_CACHE_ENABLED,
+    ):
+        self.path = path
+        self.ttl_sec = ttl_sec
+        self.max_rows = max_rows
+        self.enabled = enabled
+
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._inflight: Dict[str, concurrent.futures.Future] = {}
+        self._writes = 0
+
+    # --------------------------------------------------
+    # connection (lazy, ใช้ร่วมกันทุก thread ภายใต้ lock)
+    # --------------------------------------------------
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    role TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_hit_at REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_last_hit ON llm_cache(last_hit_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            row = db.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if now - created_at > self.ttl_sec:
+                db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                db.commit()
+                return None
+            db.execute(
+                "UPDATE llm_cache SET last_hit_at = ?, hits = hits + 1 WHERE key = ?",
+                (now, key),
+            )
+            db.commit()
+        try:
+            return json.loads(value)
+        except ValueError:
+            return None
+
+    def set(self, key: str, role: str, value: dict) -> None:
+        now = time.time()
+        payload = json.dumps(value, ensure_ascii=False, default=str)
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, role, value, created_at, last_hit_at, hits) "
+                "VALUES (?, ?, ?, ?, ?, 0)",
+                (key, role, payload, now, now),
+            )
+            db.commit()
+            self._writes += 1
+            # ตัดแถวเป็นระยะ ไม่ต้องทำทุกครั้งที่เขียน
+            if self._writes % 100 == 1:
+                self._evict_locked(now)
+
+    def _evict_locked(self, now: float) -> int:
+        db = self._db()
+        removed = db.execute(
+            "DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_sec,)
+        ).rowcount
+        total = db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        if total > self.max_rows:
+            removed += db.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "SELECT key FROM llm_cache ORDER BY last_hit_at ASC LIMIT ?)",
+                (total - self.max_rows,),
+            ).rowcount
+        db.commit()
+        return removed
+
+    def evict(self) -> int:
+        with self._lock:
+            return self._evict_locked(time.time())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            db = self._db()
+            rows = db.execute(
+                "SELECT role, COUNT(*), COALESCE(SUM(hits), 0) FROM llm_cache GROUP BY role"
+            ).fetchall()
+            inflight = len(self._inflight)
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "by_role": {r: {"rows": n, "hits": h} for r, n, h in rows},
+            "inflight": inflight,
+            "limits": {"ttl_sec": self.ttl_sec, "max_rows": self.max_rows},
+        }
+
+    # --------------------------------------------------
+    # coalescing
+    # --------------------------------------------------
+    def _claim(self, key: str):
+        """คืน (future, is_leader) — leader เป็นคนเรียก LLM, ที่เหลือรอ future เดียวกัน"""
+        with self._lock:
+            fut = self._inflight.get(key)
+            if fut is not None:
+                return fut, False
+            fut = concurrent.futures.Future()
+            self._inflight[key] = fut
+            return fut, True
+
+    def _release(self, key: str, fut: concurrent.futures.Future) -> None:
+        with self._lock:
+            if self._inflight.get(key) is fut:
+                del self._inflight[key]
+
+    def _lookup(self, role: str, key: str, refresh: bool) -> Optional[dict]:
+        if refresh:
+            return None
+        try:
+            return self.get(key)
+        except sqlite3.Error as e:
+            logger.warning("llm cache read failed: %s", e)
+            return None
+
+    def _store(self, role: str, key: str, value: dict) -> None:
+        # ไม่ cache ผลว่าง (parse ไม่ได้) เพื่อให้ครั้งหน้าลองใหม่
+        if not value:
+            return
+        try:
+            self.set(key, role, value)
+        except sqlite3.Error as e:
+            logger.warning("llm cache write failed: %s", e)
+
+    def peek(self, role: str, key: str) -> Optional[dict]:
+        """อ่าน cache อย่างเดียว (นับเป็น hit ถ้าเจอ) — ใช้ตอนแยกรายการก่อนยิงแบบ batch"""
+        if not self.enabled:
+            return None
+        cached = self._lookup(role, key, _refresh_var.get())
+        if cached is not None:
+            _record(role, "hit")
+        return cached
+
+    def put(self, role: str, key: str, value: dict) -> None:
+        """เขียนผลที่ได้จากทางอื่น (เช่นแยกจากผล batch) ลง cache ภายใต้ key ของรายการเดี่ยว"""
+        if self.enabled:
+            self._store(role, key, value)
+
+    async def aget_or_compute(
+        self,
+        role: str,
+        key: str,
+        compute: Callable[[], Awaitable[dict]],
+    ) -> dict:
+        if not self.enabled:
+            return await compute()
+
+        refresh = _refresh_var.get()
+        cached = self._lookup(role, key, refresh)
+        if cached is not None:
+            _record(role, "hit")
+            return cached
+
+        fut, leader = self._claim(key)
+        if not leader:
+            _record(role, "coalesced")
+            return await asyncio.wrap_future(fut)
+
+        _record(role, "refresh" if refresh else "miss")
+        try:
+            value = await compute()
+        except BaseException as e:
+            fut.set_exception(_for_followers(e))
+            # กัน warning "exception was never retrieved" ถ้าไม่มีใครรอ
+            fut.exception()
+            raise
+        else:
+            self._store(role, key, value)
+            fut.set_result(value)
+            return value
+        finally:
+            self._release(key, fut)
+
+    def get_or_compute(
+        self,
+        role: str,
+        key: str,
+        compute: Callable[[], dict],
+    ) -> dict:
+        """เวอร์ชัน sync (สำหรับ code ที่ยังไม่ใช่ async)"""
+        if not self.enabled:
+            return compute()
+
+        refresh = _refresh_var.get()
+        cached = self._lookup(role, key, refresh)
+        if cached is not None:
+            _record(role, "hit")
+            return cached
+
+        fut, leader = self._claim(key)
+        if not leader:
+            _record(role, "coalesced")
+            return fut.result()
+
+        _record(role, "refresh" if refresh else "miss")
+        try:
+            value = compute()
+        except BaseException as e:
+            fut.set_exception(_for_followers(e))
+            fut.exception()
+            raise
+        else:
+            self._store(role, key, value)
+            fut.set_result(value)
+            return value
+        finally:
+            self._release(key, fut)
+
+
+# ใช้ร่วมกันทั้ง process
+llm_cache = LLMResponseCache()
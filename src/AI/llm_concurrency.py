@@ -0,0 +1,395 @@
+"""
+ตัวคุมจำนวน LLM request พร้อมกันทั้ง process (AIMD ต่อ model)
+
+เดิมแต่ละ run_generate_*_parallel สร้าง asyncio.Semaphore(8) ของตัวเอง
+→ 2 งานพร้อมกัน = 16 request, 10 งาน = 80 request ไปที่ model server ตัวเดียว
+
+ที่นี่ทุก caller (comment / suggestion / summary / annotate / chat) ขอ slot จาก limiter ของ model เดียวกัน
+- ใช้ได้ทั้ง sync (thread) และ async (event loop ไหนก็ได้ — แต่ละงาน compare รัน asyncio.run ใน thread ของตัวเอง)
+- latency ต่ำกว่า target → เพิ่ม limit ทีละ 1 ต่อรอบ (additive increase)
+- timeout / 429 / 5xx หรือ latency เกิน target → ลด limit ครึ่งหนึ่ง (multiplicative decrease) ไม่เกิน 1 ครั้งต่อ cooldown
+- limit / in-flight / คิว export เป็น gauge ต่อ model
+
+หมายเหตุ: limit เป็นของแต่ละ process (compare / history / chat แยก container)
+ตั้ง LLM_CONCURRENCY_MAX ให้ผลรวมทุก worker ไม่เกินที่ model server รับได้
+"""
+
+import asyncio
+import os
+import threading
+import time
+import logging
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Deque, Dict, Optional
+
+from src.monitoring.metrics import gauge
+
+logger = logging.getLogger(__name__)
+
+# ==================================================
+# Config (ปรับได้ผ่าน env)
+# ==================================================
+LLM_CONCURRENCY_INITIAL = int(os.getenv("LLM_CONCURRENCY_INITIAL", "4"))
+LLM_CONCURRENCY_MIN = int(os.getenv("LLM_CONCURRENCY_MIN", "1"))
+LLM_CONCURRENCY_MAX = int(os.getenv("LLM_CONCURRENCY_MAX", os.getenv("LLM_PARALLEL_LIMIT", "16")))
+LLM_TARGET_LATENCY_SEC = float(os.getenv("LLM_TARGET_LATENCY_SEC", "30"))
+LLM_DECREASE_FACTOR = float(os.getenv("LLM_DECREASE_FACTOR", "0.5"))
+LLM_DECREASE_COOLDOWN_SEC = float(os.getenv("LLM_DECREASE_COOLDOWN_SEC", "5"))
+
+# เวลารอ slot (queue latency) เฉลี่ยแบบ EWMA ใช้ได้ภายในกี่วินาทีหลังวัดล่าสุด (ใช้โดย model_router)
+LLM_QUEUE_WAIT_ALPHA = float(os.getenv("LLM_QUEUE_WAIT_ALPHA", "0.3"))
+LLM_QUEUE_WAIT_WINDOW_SEC = float(os.getenv("LLM_QUEUE_WAIT_WINDOW_SEC", "30"))
+
+# budget สูงสุดต่อ model เช่น "openai/gpt-oss-120b=8,qwen2.5-7b=16"
+LLM_CONCURRENCY_BUDGETS = os.getenv("LLM_CONCURRENCY_BUDGETS", "")
+
+LLM_CONCURRENCY_LIMIT = gauge(
+    "llm_concurrency_limit",
+    "Current adaptive (AIMD) concurrency limit per model",
+    ["model"],
+)
+LLM_CONCURRENCY_IN_FLIGHT = gauge(
+    "llm_concurrency_in_flight",
+    "LLM requests currently holding a slot per model",
+    ["model"],
+)
+LLM_CONCURRENCY_QUEUE = gauge(
+    "llm_concurrency_queue_length",
+    "LLM requests waiting for a slot per model",
+    ["model"],
+)
+
+
+def _parse_budgets(raw: str) -> Dict[str, int]:
+    budgets: Dict[str, int] = {}
+    for part in raw.split(","):
+        if "=" not in part:
+            continue
+        name, value = part.rsplit("=", 1)
+        try:
+            budgets[name.strip()] = int(value)
+        except ValueError:
+            logger.warning("invalid LLM_CONCURRENCY_BUDGETS entry: %s", part)
+    return budgets
+
+
+# ==================================================
+# Error classification
+# ==================================================
+def _status_code(e: BaseException) -> Optional[int]:
+    code = getattr(e, "status_code", None)
+    if code is None:
+        response = getattr(e, "response", None)
+        code = getattr(response, "status_code", None)
+    try:
+        return int(code) if code is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def is_overload_error(e: BaseException) -> bool:
+    """timeout / 429 / 5xx = model server รับไม่ไหว → ควรลด concurrency"""
+    if isinstance(e, (TimeoutError, asyncio.TimeoutError)):
+        return True
+    name = type(e).__name__
+    if "Timeout" in name or name in ("RateLimitError", "APIConnectionError"):
+        return True
+    code = _status_code(e)
+    return code is not None and (code == 429 or code >= 500)
+
+
+# ==================================================
+# AIMD limiter
+# ==================================================
+class _Waiter:
+    __slots__ = ("loop", "future", "event", "granted", "abandoned", "queued_at")
+
+    def __init__(self, loop=None, future=None, event=None):
+        self.loop = loop
+        self.future = future
+        self.event = event
+        self.granted = False
+        self.abandoned = False
+        self.queued_at = time.monotonic()
+
+
+def _resolve(fut: asyncio.Future) -> None:
+    if not fut.done():
+        fut.set_result(None)
+
+
+class AIMDLimiter:
+    def __init__(
+        self,
+        name: str,
+        initial: int = LLM_CONCURRENCY_INITIAL,
+        min_limit: int = LLM_CONCURRENCY_MIN,
+        max_limit: int = LLM_CONCURRENCY_MAX,
+        target_latency: float = LLM_TARGET_LATENCY_SEC,
+        decrease_factor: float = LLM_DECREASE_FACTOR,
+        cooldown: float = LLM_DECREASE_COOLDOWN_SEC,
+    ):
+        self.name = name
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+
+        self.in_flight = 0
+        self._waiters: Deque[_Waiter] = deque()
+        self._lock = threading.Lock()
+        self._last_decrease = 0.0
+
+        self.completed = 0
+        self.overloads = 0
+
+        # queue latency: EWMA ของเวลารอ slot + เวลาที่วัดล่าสุด
+        self._wait_ewma = 0.0
+        self._wait_at = 0.0
+
+    # --------------------------------------------------
+    # slot bookkeeping (ต้องถือ lock)
+    # --------------------------------------------------
+    def _has_capacity(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    def _grant_waiters_locked(self) -> None:
+        while self._waiters and self._has_capacity():
+            w = self._waiters.popleft()
+            if w.abandoned:
+                continue
+            self.in_flight += 1
+            w.granted = True
+            if w.event is not None:
+                w.event.set()
+                continue
+            try:
+                w.loop.call_soon_threadsafe(_resolve, w.future)
+            except RuntimeError:
+                # event loop ของผู้รอปิดไปแล้ว → คืน slot
+                self.in_flight -= 1
+                w.granted = False
+
+    def _release_locked(self) -> None:
+        self.in_flight -= 1
+        self._grant_waiters_locked()
+
+    # --------------------------------------------------
+    # acquire / release
+    # --------------------------------------------------
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if not self._waiters and self._has_capacity():
+                self.in_flight += 1
+                return
+            w = _Waiter(loop=loop, future=loop.create_future())
+            self._waiters.append(w)
+
+        try:
+            await w.future
+        except asyncio.CancelledError:
+            with self._lock:
+                if w.granted:
+                    self._release_locked()
+                else:
+                    w.abandoned = True
+            raise
+
+    def acquire_sync(self, timeout: Optional[float] = None) -> bool:
+        with self._lock:
+            if not self._waiters and self._has_capacity():
+                self.in_flight += 1
+                return True
+            w = _Waiter(event=threading.Event())
+            self._waiters.append(w)
+
+        if w.event.wait(timeout):
+            return True
+        with self._lock:
+            if w.granted:
+                return True
+            w.abandoned = True
+        return False
+
+    def _record_wait(self, waited: float) -> None:
+        with self._lock:
+            self._wait_ewma += LLM_QUEUE_WAIT_ALPHA * (waited - self._wait_ewma)
+            self._wait_at = time.monotonic()
+
+    def queue_latency(self) -> float:
+        """
+        เวลารอ slot ตอนนี้ (วินาที): ค่ามากกว่าระหว่าง
+        - อายุของ request ที่รอนานสุดในคิว
+        - EWMA ของเวลารอช่วงล่าสุด (เก่ากว่า LLM_QUEUE_WAIT_WINDOW_SEC = ไม่นับ)
+        """
+        now = time.monotonic()
+        with self._lock:
+            oldest = next((w for w in self._waiters if not w.abandoned), None)
+            head = now - oldest.queued_at if oldest is not None else 0.0
+            recent = self._wait_ewma if now - self._wait_at <= LLM_QUEUE_WAIT_WINDOW_SEC else 0.0
+        return max(head, recent)
+
+    def release(self, latency: Optional[float] = None, error: Optional[BaseException] = None) -> None:
+        now = time.monotonic()
+        with self._lock:
+            overloaded = (
+                (error is not None and is_overload_error(error))
+                or (error is None and latency is not None and latency > self.target_latency)
+            )
+
+            if overloaded:
+                self.overloads += 1
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(float(self.min_limit), self.limit * self.decrease_factor)
+                    self._last_decrease = now
+                    logger.info("LLM limit ↓ %s → %.1f", self.name, self.limit)
+            elif error is None and latency is not None:
+                self.completed += 1
+                # +1 ต่อ limit request ที่สำเร็จ (≈ +1 ต่อรอบ)
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / max(self.limit, 1.0))
+
+            self._release_locked()
+
+    # --------------------------------------------------
+    # context managers
+    # --------------------------------------------------
+    @asynccontextmanager
+    async def slot(self):
+        queued = time.perf_counter()
+        await self.acquire()
+        start = time.perf_counter()
+        self._record_wait(start - queued)
+        try:
+            yield
+        except asyncio.CancelledError:
+            # ถูกยกเลิกไม่ใช่สัญญาณว่า server ช้า → ไม่ปรับ limit
+            self.release()
+            raise
+        except BaseException as e:
+            self.release(time.perf_counter() - start, error=e)
+            raise
+        self.release(time.perf_counter() - start)
+
+    @contextmanager
+    def slot_sync(self):
+        queued = time.perf_counter()
+        self.acquire_sync()
+        start = time.perf_counter()
+        self._record_wait(start - queued)
+        try:
+            yield
+        except BaseException as e:
+            self.release(time.perf_counter() - start, error=e)
+            raise
+        self.release(time.perf_counter() - start)
+
+    @contextmanager
+    def stream_slot_sync(self):
+        """
+        slot สำหรับ streaming: ถือ slot จนจบ stream (server ยังสร้าง token อยู่ → นับเป็น in-flight)
+        แต่ latency ที่ใช้ปรับ limit = เวลาถึง token แรก (ผู้ใช้เรียก first_token() ที่ yield ให้)
+        → stream ยาวแต่ปกติไม่ถูกนับเป็น overload
+        """
+        queued = time.perf_counter()
+        self.acquire_sync()
+        start = time.perf_counter()
+        self._record_wait(start - queued)
+        marks = {"first": None}
+
+        def first_token() -> None:
+            if marks["first"] is None:
+                marks["first"] = time.perf_counter()
+
+        def latency() -> float:
+            return (marks["first"] or time.perf_counter()) - start
+
+        try:
+            yield first_token
+        except GeneratorExit:
+            # client ตัดการเชื่อมต่อ ไม่ใช่สัญญาณว่า server ช้า → ไม่ปรับ limit
+            self.release()
+            raise
+        except BaseException as e:
+            self.release(latency(), error=e)
+            raise
+        self.release(latency())
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "model": self.name,
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "queued": sum(1 for w in self._waiters if not w.abandoned),
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "target_latency_sec": self.target_latency,
+                "queue_wait_ewma_sec": round(self._wait_ewma, 3),
+                "completed": self.completed,
+                "overloads": self.overloads,
+            }
+
+
+# ==================================================
+# Controller (1 limiter ต่อ model ทั้ง process)
+# ==================================================
+class LLMConcurrencyController:
+    def __init__(self, budgets: Optional[Dict[str, int]] = None):
+        self.budgets = budgets if budgets is not None else _parse_budgets(LLM_CONCURRENCY_BUDGETS)
+        self._limiters: Dict[str, AIMDLimiter] = {}
+        self._lock = threading.Lock()
+
+        LLM_CONCURRENCY_LIMIT.add_callback(lambda: self._gauge("limit"))
+        LLM_CONCURRENCY_IN_FLIGHT.add_callback(lambda: self._gauge("in_flight"))
+        LLM_CONCURRENCY_QUEUE.add_callback(lambda: self._gauge("queued"))
+
+    def limiter(self, model: Optional[str]) -> AIMDLimiter:
+        model = model or "unknown"
+        with self._lock:
+            lim = self._limiters.get(model)
+            if lim is None:
+                max_limit = self.budgets.get(model, LLM_CONCURRENCY_MAX)
+                lim = AIMDLimiter(
+                    model,
+                    initial=min(LLM_CONCURRENCY_INITIAL, max_limit),
+                    max_limit=max_limit,
+                )
+                self._limiters[model] = lim
+            return lim
+
+    def _gauge(self, field: str) -> Dict:
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return {(lim.name,): float(lim.stats()[field]) for lim in limiters}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return {"models": [lim.stats() for lim in limiters]}
+
+
+llm_concurrency = LLMConcurrencyController()
+
+
+def queue_latency(model: Optional[str]) -> float:
+    """เวลารอ slot ของ model นี้ตอนนี้ (วินาที)"""
+    return llm_concurrency.limiter(model).queue_latency()
+
+
+def llm_slot(model: Optional[str]):
+    """async with llm_slot(MODEL_NAME): ... — ครอบ LLM call 1 ครั้ง"""
+    return llm_concurrency.limiter(model).slot()
+
+
+def llm_slot_sync(model: Optional[str]):
+    """with llm_slot_sync(MODEL_NAME): ... — สำหรับ code ที่ยัง sync"""
+    return llm_concurrency.limiter(model).slot_sync()
+
+
+def llm_stream_slot_sync(model: Optional[str]):
+    """with llm_stream_slot_sync(MODEL_NAME) as first_token: ... — streaming (AIMD ใช้เวลาถึง token แรก)"""
+    return llm_concurrency.limiter(model).stream_slot_sync()
@@ -0,0 +1,346 @@
+"""
+จุดเดียวที่สร้าง client ไปยัง model server
+
+- 1 connection pool (keep-alive) ต่อ base URL: httpx.Client ใช้ร่วมกันทั้ง process,
+  httpx.AsyncClient แยกต่อ event loop (งาน compare แต่ละงานรัน asyncio.run ใน thread ของตัวเอง)
+- สร้าง ChatOpenAI ต่อ role แบบ lazy (import module ไม่ต่อ network / ไม่สร้าง client)
+- timeout / retry ตั้งที่นี่ที่เดียว (ปรับต่อ role ได้)
+- invoke / ainvoke / complete ครอบ concurrency slot + metrics ให้แล้ว
+- hook ต่อ call: latency + token (add_call_hook)
+"""
+
+import asyncio
+import os
+import threading
+import time
+import uuid
+import weakref
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_openai import ChatOpenAI
+
+from src.AI.llm_concurrency import llm_slot, llm_slot_sync
+from src.monitoring.metrics import llm_call_timer
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# ==================================================
+# Config (ปรับได้ผ่าน env)
+# ==================================================
+LLM_BASE_URL = os.getenv("LOCALMODEL_BASE_URL", "http://localhost:11434/v1")
+LLM_API_KEY = os.getenv("LOCALMODEL_API_KEY") or "local-dev-key"
+
+# ค่าเดิมของ client ที่ไม่ได้ตั้ง timeout (default ของ openai SDK = 600 วินาที)
+LLM_TIMEOUT_SEC = float(os.getenv("LLM_TIMEOUT_SEC", "600"))
+LLM_CONNECT_TIMEOUT_SEC = float(os.getenv("LLM_CONNECT_TIMEOUT_SEC", "10"))
+# retry ระดับ SDK ของ role ที่ไม่ได้ตั้งเอง: comment / suggestion / sum retry ผ่าน llm_retry.aretry อยู่แล้ว
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "0"))
+
+LLM_POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "64"))
+LLM_POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "32"))
+LLM_POOL_KEEPALIVE_EXPIRY_SEC = float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY_SEC", "60"))
+
+
+@dataclass(frozen=True)
+class RoleConfig:
+    model_env: str
+    default_model: Optional[str] = None
+    temperature: float = 0.2
+    timeout: Optional[float] = None     # None = LLM_TIMEOUT_SEC
+    max_tokens: Optional[int] = None
+    max_retries: Optional[int] = None   # retry ของ SDK, None = LLM_MAX_RETRIES
+
+
+# role → model (env เดิมของแต่ละ module)
+ROLES: Dict[str, RoleConfig] = {
+    "comment": RoleConfig("LOCALMODEL_MODEL_COMMENT"),
+    "suggestion": RoleConfig("LOCALMODEL_MODEL_SUGGESTION"),
+    # tier เล็กของ model_router (ไม่ตั้ง model = ทุก change ไป model ใหญ่เหมือนเดิม)
+    "comment_small": RoleConfig("LOCALMODEL_MODEL_COMMENT_SMALL", os.getenv("LOCALMODEL_MODEL_SMALL")),
+    "suggestion_small": RoleConfig("LOCALMODEL_MODEL_SUGGESTION_SMALL", os.getenv("LOCALMODEL_MODEL_SMALL")),
+    "sum": RoleConfig("LOCALMODEL_MODEL_SUM"),
+    "chat": RoleConfig(
+        "LOCALMODEL_MODEL_SUM",
+        "openai/gpt-oss-120b",
+        temperature=0.3,
+        timeout=float(os.getenv("LOCALMODEL_TIMEOUT_SEC", "90")),
+        max_retries=1,
+    ),
+    # ไม่ได้ผ่าน aretry → คง retry ของ SDK แบบเดิม (default ของ ChatOpenAI = 2)
+    "review": RoleConfig("LOCALMODEL_MODEL_SUM", "openai/gpt-oss-120b", temperature=0.0, max_retries=2),
+    "annotate": RoleConfig("LOCALMODEL_MODEL", "openai/gpt-oss-120b", timeout=300.0, max_tokens=2048, max_retries=0),
+}
+
+
+def role_config(role: str) -> RoleConfig:
+    try:
+        return ROLES[role]
+    except KeyError:
+        raise ValueError(f"unknown LLM role: {role}")
+
+
+def model_name(role: str) -> Optional[str]:
+    cfg = role_config(role)
+    return os.getenv(cfg.model_env, cfg.default_model)
+
+
+def role_temperature(role: str) -> float:
+    return role_config(role).temperature
+
+
+def _timeout(role: str) -> httpx.Timeout:
+    total = role_config(role).timeout or LLM_TIMEOUT_SEC
+    return httpx.Timeout(total, connect=LLM_CONNECT_TIMEOUT_SEC)
+
+
+def _max_retries(role: str) -> int:
+    retries = role_config(role).max_retries
+    return LLM_MAX_RETRIES if retries is None else retries
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=LLM_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=LLM_POOL_KEEPALIVE_EXPIRY_SEC,
+    )
+
+
+# ==================================================
+# Call hooks (latency / token ต่อ call)
+# ==================================================
+@dataclass
+class CallEvent:
+    role: str
+    model: Optional[str]
+    latency_sec: float
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    error: Optional[str] = None
+
+
+_hooks: List[Callable[[CallEvent], None]] = []
+
+
+def add_call_hook(fn: Callable[[CallEvent], None]) -> None:
+    """fn(CallEvent) ถูกเรียกหลัง LLM call ทุกครั้งที่ผ่าน gateway (ห้าม raise)"""
+    _hooks.append(fn)
+
+
+def _emit(event: CallEvent) -> None:
+    for fn in list(_hooks):
+        try:
+            fn(event)
+        except Exception as e:
+            logger.warning("llm call hook failed: %s", e)
+
+
+def _token_usage(response) -> Tuple[Optional[int], Optional[int]]:
+    usage = (getattr(response, "llm_output", None) or {}).get("token_usage") or {}
+    prompt = usage.get("prompt_tokens")
+    completion = usage.get("completion_tokens")
+    if prompt is None:
+        try:
+            meta = response.generations[0][0].message.usage_metadata or {}
+            prompt = meta.get("input_tokens")
+            completion = meta.get("output_tokens")
+        except (AttributeError, IndexError, TypeError):
+            pass
+    return prompt, completion
+
+
+class _GatewayCallback(BaseCallbackHandler):
+    """วัด latency + token ของทุก call ที่ออกจาก handle ของ gateway (รวม chain / stream)"""
+
+    # รันใน context ของผู้เรียก (hook อ่าน contextvar ของงานนั้นได้ เช่น llm_accounting)
+    run_inline = True
+
+    def __init__(self, role: str, model: Optional[str]):
+        self.role = role
+        self.model = model
+        self._started: Dict[uuid.UUID, float] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        start = self._started.pop(run_id, None)
+        if start is None:
+            return
+        prompt, completion = _token_usage(response)
+        _emit(CallEvent(self.role, self.model, time.perf_counter() - start, prompt, completion))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        start = self._started.pop(run_id, None)
+        if start is None:
+            return
+        _emit(CallEvent(self.role, self.model, time.perf_counter() - start, error=type(error).__name__))
+
+
+# ==================================================
+# HTTP pools
+# ==================================================
+_lock = threading.Lock()
+_sync_clients: Dict[str, httpx.Client] = {}
+# event loop → {base_url: AsyncClient} (หายไปเองเมื่อ loop ถูกเก็บ)
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, httpx.AsyncClient]]" = weakref.WeakKeyDictionary()
+_handles: Dict[Tuple, Any] = {}
+_loop_handles: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple, Any]]" = weakref.WeakKeyDictionary()
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def sync_http_client(base_url: str = LLM_BASE_URL) -> httpx.Client:
+    with _lock:
+        client = _sync_clients.get(base_url)
+        if client is None:
+            client = httpx.Client(limits=_limits(), timeout=LLM_TIMEOUT_SEC)
+            _sync_clients[base_url] = client
+        return client
+
+
+def async_http_client(base_url: str = LLM_BASE_URL) -> Optional[httpx.AsyncClient]:
+    """AsyncClient ของ event loop ปัจจุบัน (None ถ้าไม่ได้อยู่ใน loop)"""
+    loop = _running_loop()
+    if loop is None:
+        return None
+    with _lock:
+        per_loop = _async_clients.setdefault(loop, {})
+        client = per_loop.get(base_url)
+        if client is None:
+            client = httpx.AsyncClient(limits=_limits(), timeout=LLM_TIMEOUT_SEC)
+            per_loop[base_url] = client
+        return client
+
+
+async def aclose_loop_clients() -> None:
+    """ปิด AsyncClient ของ loop ปัจจุบัน (เรียกก่อน asyncio.run จบ)"""
+    loop = _running_loop()
+    with _lock:
+        clients = _async_clients.pop(loop, {}) if loop is not None else {}
+        _loop_handles.pop(loop, None)
+    for client in clients.values():
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.warning("close async http client failed: %s", e)
+
+
+async def with_loop_clients(coro):
+    """asyncio.run(with_loop_clients(run_compare(...))) — ปิด pool ของ loop งานเมื่อจบ"""
+    try:
+        return await coro
+    finally:
+        await aclose_loop_clients()
+
+
+# ==================================================
+# Model handles
+# ==================================================
+def get_llm(
+    role: str,
+    *,
+    tools: Optional[Callable[[], Sequence[Any]]] = None,
+    tools_key: Optional[str] = None,
+    base_url: str = LLM_BASE_URL,
+):
+    """
+    คืน ChatOpenAI ของ role (สร้างครั้งแรกที่ขอ แล้ว cache ไว้)
+    - เรียกใน event loop → handle ผูกกับ AsyncClient ของ loop นั้น
+    - tools: factory ที่คืน list tools (เรียกครั้งแรกที่ต้องใช้เท่านั้น) + tools_key สำหรับ cache
+    """
+    loop = _running_loop()
+    key = (role, base_url, tools_key)
+
+    with _lock:
+        cache = _loop_handles.setdefault(loop, {}) if loop is not None else _handles
+        handle = cache.get(key)
+    if handle is not None:
+        return handle
+
+    model = model_name(role)
+    kwargs = dict(
+        base_url=base_url,
+        api_key=LLM_API_KEY,
+        model=model,
+        temperature=role_temperature(role),
+        timeout=_timeout(role),
+        max_retries=_max_retries(role),
+        http_client=sync_http_client(base_url),
+        callbacks=[_GatewayCallback(role, model)],
+    )
+    if role_config(role).max_tokens:
+        kwargs["max_tokens"] = role_config(role).max_tokens
+    http_async = async_http_client(base_url)
+    if http_async is not None:
+        kwargs["http_async_client"] = http_async
+
+    handle = ChatOpenAI(**kwargs)
+    if tools is not None:
+        handle = handle.bind_tools(list(tools()))
+
+    with _lock:
+        cache = _loop_handles.setdefault(loop, {}) if loop is not None else _handles
+        return cache.setdefault(key, handle)
+
+
+# ==================================================
+# Call paths
+# ==================================================
+def _as_messages(prompt_or_messages, system: Optional[str] = None):
+    if not isinstance(prompt_or_messages, str):
+        return prompt_or_messages
+    messages = [HumanMessage(content=prompt_or_messages)]
+    if system:
+        messages.insert(0, SystemMessage(content=system))
+    return messages
+
+
+def invoke(role: str, prompt_or_messages, **kwargs):
+    """sync call 1 ครั้ง (slot + metrics)"""
+    model = model_name(role)
+    llm = get_llm(role, **kwargs)
+    with llm_slot_sync(model), llm_call_timer(role, model):
+        return llm.invoke(_as_messages(prompt_or_messages))
+
+
+async def ainvoke(role: str, prompt_or_messages, **kwargs):
+    """async call 1 ครั้ง (slot + metrics)"""
+    model = model_name(role)
+    llm = get_llm(role, **kwargs)
+    async with llm_slot(model):
+        with llm_call_timer(role, model):
+            return await llm.ainvoke(_as_messages(prompt_or_messages))
+
+
+def _text(message) -> str:
+    content = getattr(message, "content", message)
+    if isinstance(content, list):
+        return "".join(
+            part.get("text", "") if isinstance(part, dict) else str(part)
+            for part in content
+        )
+    return str(content or "")
+
+
+def complete(role: str, prompt: str, system: Optional[str] = None) -> str:
+    return _text(invoke(role, _as_messages(prompt, system))).strip()
+
+
+async def acomplete(role: str, prompt: str, system: Optional[str] = None) -> str:
+    return _text(await ainvoke(role, _as_messages(prompt, system))).strip()
@@ -0,0 +1,417 @@
+"""
+นโยบาย retry กลางของ LLM call (exponential backoff + full jitter + circuit breaker)
+
+เดิม ai_comment / ai_suggestion retry ด้วย asyncio.sleep(1.0) คงที่ และ safe_call_llm ใช้ time.sleep
+→ ตอน model server รับไม่ไหว ทุก task (หลายร้อย) retry พร้อมกันหลัง 1 วินาทีเป๊ะ ซ้ำเติม overload
+
+ที่นี่:
+- delay = random(0, min(max_delay, base_delay * 2^attempt))  (full jitter → retry กระจายกันเอง)
+  server ส่ง Retry-After มา → รออย่างน้อยเท่านั้น (เกิน max_delay ได้) / นานเกิน LLM_RETRY_AFTER_MAX_SEC → fail ทันที
+- retry เฉพาะ error ที่ลองใหม่แล้วมีโอกาสผ่าน (timeout / 429 / 5xx / output parse ไม่ได้)
+  output parse ไม่ได้ (structured_output.OutputParseError) → retry ทันทีไม่ backoff + นับแยกใน llm_parse_retries_total
+  401 / 403 / 400 / 404 / 422 = ลองกี่รอบก็ไม่ผ่าน → fail ทันที
+- circuit breaker ต่อ model: error rate ใน window ล่าสุดเกิน threshold → OPEN
+  ระหว่าง OPEN ทุก call fail ทันที (CircuitOpenError) → ผู้เรียกใช้ fallback text เดิม
+  ครบ cooldown → HALF_OPEN: ปล่อย probe ทีละน้อย (1, 2, 3, ... พร้อมกัน)
+  probe ถูกติดป้ายตอนผ่าน allow() — call ที่เริ่มตอน CLOSED แล้วจบตอน HALF_OPEN ไม่นับเป็น probe
+  probe สำเร็จครบ LLM_BREAKER_PROBES_TO_CLOSE → CLOSED / probe ล้ม → OPEN อีกรอบ (cooldown x2)
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+import logging
+from collections import deque
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+from src.AI.llm_concurrency import _status_code, is_overload_error
+from src.monitoring.metrics import LLM_RETRIES, counter, gauge
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# ==================================================
+# Config (ปรับได้ผ่าน env)
+# ==================================================
+LLM_RETRY_MAX = int(os.getenv("LLM_RETRY_MAX", "2"))
+LLM_RETRY_BASE_DELAY_SEC = float(os.getenv("LLM_RETRY_BASE_DELAY_SEC", "1.0"))
+LLM_RETRY_MAX_DELAY_SEC = float(os.getenv("LLM_RETRY_MAX_DELAY_SEC", "30"))
+# Retry-After ของ server นานกว่านี้ → ไม่รอ (fail ให้ผู้เรียกใช้ fallback)
+LLM_RETRY_AFTER_MAX_SEC = float(os.getenv("LLM_RETRY_AFTER_MAX_SEC", "120"))
+
+LLM_BREAKER_ENABLED = os.getenv("LLM_BREAKER_ENABLED", "true").lower() == "true"
+LLM_BREAKER_WINDOW = int(os.getenv("LLM_BREAKER_WINDOW", "20"))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "10"))
+LLM_BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5"))
+LLM_BREAKER_COOLDOWN_SEC = float(os.getenv("LLM_BREAKER_COOLDOWN_SEC", "30"))
+LLM_BREAKER_MAX_COOLDOWN_SEC = float(os.getenv("LLM_BREAKER_MAX_COOLDOWN_SEC", "300"))
+LLM_BREAKER_PROBES_TO_CLOSE = int(os.getenv("LLM_BREAKER_PROBES_TO_CLOSE", "5"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+_STATE_VALUE = {CLOSED: 0.0, HALF_OPEN: 1.0, OPEN: 2.0}
+
+LLM_BREAKER_STATE = gauge(
+    "llm_breaker_state",
+    "Circuit breaker state per model (0=closed, 1=half_open, 2=open)",
+    ["model"],
+)
+LLM_BREAKER_TRANSITIONS = counter(
+    "llm_breaker_transitions_total",
+    "Circuit breaker state transitions per model",
+    ["model", "state"],
+)
+LLM_PARSE_RETRIES = counter(
+    "llm_parse_retries_total",
+    "LLM retries caused by output that could not be parsed / validated (structured_output)",
+    ["role", "model"],
+)
+LLM_BREAKER_REJECTED = counter(
+    "llm_breaker_rejected_total",
+    "LLM calls fast-failed by an open circuit breaker",
+    ["role", "model"],
+)
+
+
+class CircuitOpenError(RuntimeError):
+    """breaker เปิดอยู่ → ไม่ยิง request (ผู้เรียกใช้ fallback)"""
+
+
+# ==================================================
+# Error classification
+# ==================================================
+_NON_RETRYABLE_STATUS = (400, 401, 403, 404, 422)
+_NON_RETRYABLE_NAMES = (
+    "AuthenticationError",
+    "PermissionDeniedError",
+    "BadRequestError",
+    "NotFoundError",
+    "UnprocessableEntityError",
+)
+
+
+def is_retryable_error(e: BaseException) -> bool:
+    if isinstance(e, (asyncio.CancelledError, CircuitOpenError)):
+        return False
+    if is_overload_error(e):
+        return True
+    if type(e).__name__ in _NON_RETRYABLE_NAMES:
+        return False
+    code = _status_code(e)
+    if code in _NON_RETRYABLE_STATUS:
+        return False
+    # JSON parse ไม่ได้ / output ไม่ครบ → model ตอบใหม่มักผ่าน
+    return True
+
+
+# ==================================================
+# Backoff
+# ==================================================
+class RetryPolicy:
+    def __init__(
+        self,
+        max_retries: int = LLM_RETRY_MAX,
+        base_delay: float = LLM_RETRY_BASE_DELAY_SEC,
+        max_delay: float = LLM_RETRY_MAX_DELAY_SEC,
+        retry_after_max: float = LLM_RETRY_AFTER_MAX_SEC,
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_after_max = retry_after_max
+
+    def allows_wait(self, error: Optional[BaseException]) -> bool:
+        """Retry-After นานเกิน retry_after_max → ไม่ retry"""
+        retry_after = _retry_after(error)
+        return retry_after is None or retry_after <= self.retry_after_max
+
+    def delay(self, attempt: int, error: Optional[BaseException] = None) -> float:
+        """attempt เริ่มที่ 0 (= รอก่อน retry ครั้งแรก)"""
+        if getattr(error, "parse_error", False):
+            # server ตอบได้ปกติ แค่ output ใช้ไม่ได้ → รอไปก็ไม่ช่วย ยิงใหม่ทันที
+            return 0.0
+        cap = min(self.max_delay, self.base_delay * (2 ** attempt))
+        # server บอก Retry-After มา → รออย่างน้อยเท่านั้น แม้เกิน max_delay (jitter ด้านบนไม่เกิน cap)
+        retry_after = _retry_after(error)
+        if retry_after:
+            return retry_after + random.uniform(0, cap)
+        return random.uniform(0, cap)
+
+
+def _retry_after(e: Optional[BaseException]) -> Optional[float]:
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+DEFAULT_POLICY = RetryPolicy()
+
+
+# ==================================================
+# Circuit breaker
+# ==================================================
+# ผลของ allow(): NOT_PROBE = call ปกติ / ค่า > 0 = probe ของ HALF_OPEN รอบนั้น (generation)
+NOT_PROBE = 0
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        window: int = LLM_BREAKER_WINDOW,
+        min_calls: int = LLM_BREAKER_MIN_CALLS,
+        error_rate: float = LLM_BREAKER_ERROR_RATE,
+        cooldown: float = LLM_BREAKER_COOLDOWN_SEC,
+        max_cooldown: float = LLM_BREAKER_MAX_COOLDOWN_SEC,
+        probes_to_close: int = LLM_BREAKER_PROBES_TO_CLOSE,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.probes_to_close = max(1, probes_to_close)
+
+        self.state = CLOSED
+        self.cooldown = cooldown
+        self._outcomes: Deque[bool] = deque(maxlen=window)   # True = ล้ม
+        self._opened_at = 0.0
+        self._probe_ok = 0
+        self._probes_in_flight = 0
+        self._half_open_gen = 0
+        self._lock = threading.Lock()
+
+        self.rejected = 0
+
+    def _transition_locked(self, state: str) -> None:
+        if state == self.state:
+            return
+        print(f"⚡ [BREAKER] {self.name}: {self.state} → {state}")
+        self.state = state
+        LLM_BREAKER_TRANSITIONS.inc(model=self.name, state=state)
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        elif state == HALF_OPEN:
+            self._probe_ok = 0
+            self._probes_in_flight = 0
+            self._half_open_gen += 1
+        elif state == CLOSED:
+            self._outcomes.clear()
+            self.cooldown = self.base_cooldown
+
+    def allow(self) -> Optional[int]:
+        """
+        None = ไม่ให้ยิง / NOT_PROBE = call ปกติ / ค่า > 0 = probe
+        ส่งค่าที่ได้กลับใน record_* / release_probe เสมอ
+        """
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.cooldown:
+                    self.rejected += 1
+                    return None
+                self._transition_locked(HALF_OPEN)
+
+            if self.state == HALF_OPEN:
+                # ปล่อย probe เพิ่มทีละขั้นตามจำนวน probe ที่ผ่านแล้ว (1, 2, 3, ...)
+                if self._probes_in_flight >= self._probe_ok + 1:
+                    self.rejected += 1
+                    return None
+                self._probes_in_flight += 1
+                return self._half_open_gen
+            return NOT_PROBE
+
+    def _is_current_probe_locked(self, ticket: int) -> bool:
+        return ticket != NOT_PROBE and self.state == HALF_OPEN and ticket == self._half_open_gen
+
+    def record_success(self, ticket: int = NOT_PROBE) -> None:
+        with self._lock:
+            if self._is_current_probe_locked(ticket):
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                self._probe_ok += 1
+                if self._probe_ok >= self.probes_to_close:
+                    self._transition_locked(CLOSED)
+                return
+            # call ที่เริ่มก่อน breaker เปิด / probe ของรอบก่อน → ไม่ใช่หลักฐานของรอบนี้
+            if ticket == NOT_PROBE and self.state == CLOSED:
+                self._outcomes.append(False)
+
+    def record_failure(self, error: BaseException, ticket: int = NOT_PROBE) -> None:
+        # error ฝั่งผู้เรียก (prompt ผิด / parse ไม่ได้) ไม่ได้บอกว่า server ป่วย
+        counts = is_overload_error(error)
+        with self._lock:
+            if self._is_current_probe_locked(ticket):
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if counts:
+                    self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+                    self._transition_locked(OPEN)
+                return
+            if ticket != NOT_PROBE or self.state != CLOSED:
+                return
+            self._outcomes.append(counts)
+            if len(self._outcomes) >= self.min_calls:
+                rate = sum(self._outcomes) / len(self._outcomes)
+                if rate >= self.error_rate:
+                    self._transition_locked(OPEN)
+
+    def release_probe(self, ticket: int = NOT_PROBE) -> None:
+        """call ถูกยกเลิกกลางทาง (ไม่ใช่ทั้งสำเร็จและล้ม)"""
+        with self._lock:
+            if self._is_current_probe_locked(ticket):
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            failures = sum(self._outcomes)
+            return {
+                "model": self.name,
+                "state": self.state,
+                "window_calls": len(self._outcomes),
+                "window_error_rate": round(failures / len(self._outcomes), 3) if self._outcomes else 0.0,
+                "cooldown_sec": self.cooldown,
+                "probe_successes": self._probe_ok if self.state == HALF_OPEN else None,
+                "rejected": self.rejected,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def circuit_breaker(model: Optional[str]) -> CircuitBreaker:
+    model = model or "unknown"
+    with _breakers_lock:
+        br = _breakers.get(model)
+        if br is None:
+            br = CircuitBreaker(model)
+            _breakers[model] = br
+        return br
+
+
+def breaker_stats() -> Dict:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {"models": [br.stats() for br in breakers]}
+
+
+def _state_gauge() -> Dict:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {(br.name,): _STATE_VALUE[br.state] for br in breakers}
+
+
+LLM_BREAKER_STATE.add_callback(_state_gauge)
+
+
+# ==================================================
+# Retry loops
+# ==================================================
+def _before_call(breaker: Optional[CircuitBreaker], role: str, model: Optional[str]) -> int:
+    """คืน ticket ของ breaker (NOT_PROBE / probe) / breaker เปิด → CircuitOpenError"""
+    if breaker is None:
+        return NOT_PROBE
+    ticket = breaker.allow()
+    if ticket is None:
+        LLM_BREAKER_REJECTED.inc(role=role, model=model or "unknown")
+        raise CircuitOpenError(f"LLM circuit open for {model}")
+    return ticket
+
+
+# ลำดับ attempt ของ call ที่กำลังรัน (0 = ครั้งแรก) → llm_accounting บันทึกเป็น retries
+_attempt_var: ContextVar[int] = ContextVar("llm_retry_attempt", default=0)
+
+
+def current_attempt() -> int:
+    return _attempt_var.get()
+
+
+def _should_retry(e: BaseException, attempt: int, policy: RetryPolicy) -> bool:
+    return attempt < policy.max_retries and is_retryable_error(e) and policy.allows_wait(e)
+
+
+def _log_retry(role: str, model: Optional[str], attempt: int, policy: RetryPolicy, delay: float, e) -> None:
+    LLM_RETRIES.inc(role=role, model=model or "unknown")
+    # OutputParseError (ซ่อม JSON แล้วยังไม่ผ่าน) แยกนับจาก error ของ server
+    parse_error = getattr(e, "parse_error", False)
+    if parse_error:
+        LLM_PARSE_RETRIES.inc(role=role, model=model or "unknown")
+    print(
+        f"🔁 [RETRY {attempt + 1}/{policy.max_retries}] {role}{' (parse)' if parse_error else ''} "
+        f"รอ {delay:.2f}s ({type(e).__name__}: {e})"
+    )
+
+
+async def aretry(
+    fn: Callable[[], Awaitable[T]],
+    *,
+    role: str,
+    model: Optional[str],
+    policy: RetryPolicy = DEFAULT_POLICY,
+) -> T:
+    """await fn() พร้อม backoff + breaker (error สุดท้าย / CircuitOpenError ส่งต่อให้ผู้เรียก)"""
+    breaker = circuit_breaker(model) if LLM_BREAKER_ENABLED else None
+    attempt = 0
+    while True:
+        ticket = _before_call(breaker, role, model)
+        token = _attempt_var.set(attempt)
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            if breaker is not None:
+                breaker.release_probe(ticket)
+            raise
+        except Exception as e:
+            if breaker is not None:
+                breaker.record_failure(e, ticket)
+            if not _should_retry(e, attempt, policy):
+                raise
+            delay = policy.delay(attempt, e)
+            _log_retry(role, model, attempt, policy, delay, e)
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        finally:
+            _attempt_var.reset(token)
+        if breaker is not None:
+            breaker.record_success(ticket)
+        return result
+
+
+def retry_sync(
+    fn: Callable[[], T],
+    *,
+    role: str,
+    model: Optional[str],
+    policy: RetryPolicy = DEFAULT_POLICY,
+) -> T:
+    """เหมือน aretry สำหรับ code sync (ห้ามเรียกใน event loop — ใช้ asyncio.to_thread)"""
+    breaker = circuit_breaker(model) if LLM_BREAKER_ENABLED else None
+    attempt = 0
+    while True:
+        ticket = _before_call(breaker, role, model)
+        token = _attempt_var.set(attempt)
+        try:
+            result = fn()
+        except Exception as e:
+            if breaker is not None:
+                breaker.record_failure(e, ticket)
+            if not _should_retry(e, attempt, policy):
+                raise
+            delay = policy.delay(attempt, e)
+            _log_retry(role, model, attempt, policy, delay, e)
+            time.sleep(delay)
+            attempt += 1
+            continue
+        finally:
+            _attempt_var.reset(token)
+        if breaker is not None:
+            breaker.record_success(ticket)
+        return result
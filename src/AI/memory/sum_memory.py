@@ -1,5 +1,7 @@
 from langchain_core.messages import HumanMessage
 
+from src.AI.llm_concurrency import llm_slot_sync
+
 def summarize_conversation(llm, text):
 
     prompt = f"""
@@ -8,5 +10,6 @@ def summarize_conversation(llm, text):
 {text}
 """
 
-    response = llm.invoke([HumanMessage(content=prompt)])
+    with llm_slot_sync(getattr(llm, "model_name", None)):
+        response = llm.invoke([HumanMessage(content=prompt)])
     return response.content
\ No newline at end of file
@@ -0,0 +1,175 @@
+"""
+เลือก model (เล็ก / ใหญ่) ของ ai_comment / ai_suggestion ทีละ change
+
+เดิมทุก change ไป LOCALMODEL_MODEL_COMMENT / LOCALMODEL_MODEL_SUGGESTION (model ใหญ่)
+แม้เป็นการแก้ตัวอักษรตัวเดียวระดับ LIGHT
+
+ที่นี่:
+- LIGHT / MEDIUM (ข้อความไม่ยาว) → model เล็ก (role comment_small / suggestion_small)
+- HEAVY / REMOVED / ADDED หรือข้อความยาว → model ใหญ่
+- change "ก้ำกึ่ง" (MEDIUM ที่ยาวเกิน / HEAVY ที่ข้อความสั้น) ถูกลดไป model เล็กอัตโนมัติ
+  เมื่อคิวของ model ใหญ่รอนานเกิน SLO (queue latency จาก llm_concurrency)
+- ทุกการตัดสินใจถูกบันทึกไว้ที่ change.model_route (ลง ChangeItem.model_route) + metric llm_route_decisions_total
+- ไม่ได้ตั้ง model เล็ก → ทุก change ไป model ใหญ่เหมือนเดิม
+"""
+
+import json
+import os
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Tuple
+
+from src.diff.diff import Change
+from src.AI.ai_schedule import PRIORITY_HIGH, change_priority
+from src.AI.llm_concurrency import queue_latency
+from src.AI.llm_gateway import model_name
+from src.monitoring.metrics import counter
+
+# ==================================================
+# Config (ปรับได้ผ่าน env)
+# ==================================================
+MODEL_ROUTER_ENABLED = os.getenv("MODEL_ROUTER_ENABLED", "true").lower() == "true"
+# MEDIUM ที่ข้อความ (เดิม + ใหม่) ยาวกว่านี้ → model ใหญ่
+ROUTER_SMALL_MAX_CHARS = int(os.getenv("ROUTER_SMALL_MAX_CHARS", "1500"))
+# HEAVY ที่ข้อความสั้นกว่านี้ = ก้ำกึ่ง (ลดไป model เล็กได้เมื่อเกิน SLO)
+ROUTER_BORDERLINE_CHARS = int(os.getenv("ROUTER_BORDERLINE_CHARS", "300"))
+# queue latency ของ model ใหญ่ที่ยอมรับได้ (วินาที)
+ROUTER_LARGE_QUEUE_SLO_SEC = float(os.getenv("ROUTER_LARGE_QUEUE_SLO_SEC", "10"))
+
+TIER_SMALL = "small"
+TIER_LARGE = "large"
+
+ROUTED_ROLES = ("comment", "suggestion")
+
+LLM_ROUTE_DECISIONS = counter(
+    "llm_route_decisions_total",
+    "Model routing decisions per role, tier and reason",
+    ["role", "tier", "reason"],
+)
+
+
+@dataclass
+class RouteDecision:
+    role: str               # role ของ llm_gateway ที่ใช้จริง (comment / comment_small / ...)
+    model: Optional[str]
+    tier: str               # small / large
+    reason: str
+    downgraded: bool = False
+    queue_latency_sec: Optional[float] = None
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+def small_role(role: str) -> str:
+    return f"{role}_small"
+
+
+def router_active(role: str) -> bool:
+    return MODEL_ROUTER_ENABLED and bool(model_name(small_role(role)))
+
+
+def _text_chars(change: Change) -> int:
+    return len(change.old_text or "") + len(change.new_text or "")
+
+
+def _large(role: str, reason: str) -> RouteDecision:
+    return RouteDecision(role=role, model=model_name(role), tier=TIER_LARGE, reason=reason)
+
+
+def _small(role: str, reason: str, **kwargs) -> RouteDecision:
+    return RouteDecision(
+        role=small_role(role), model=model_name(small_role(role)), tier=TIER_SMALL, reason=reason, **kwargs
+    )
+
+
+def _classify(change: Change, role: str) -> Tuple[RouteDecision, bool]:
+    """tier ตามเนื้อ change ล้วน (ไม่ดูคิว) + change นี้ก้ำกึ่ง (ลดไป model เล็กได้) หรือไม่"""
+    if not router_active(role):
+        return _large(role, "no_small_model" if MODEL_ROUTER_ENABLED else "disabled"), False
+
+    chars = _text_chars(change)
+    if change_priority(change) == PRIORITY_HIGH:
+        # REMOVED / ADDED ไป model ใหญ่เสมอ / HEAVY ที่สั้น = ก้ำกึ่ง
+        borderline = change.change_type == "MODIFIED" and chars <= ROUTER_BORDERLINE_CHARS
+        return _large(role, "severity"), borderline
+    if chars > ROUTER_SMALL_MAX_CHARS:
+        return _large(role, "long_text"), True
+    return _small(role, "light_edit"), False
+
+
+def route_change(change: Change, role: str) -> RouteDecision:
+    """ตัดสินใจ tier ของ change นี้สำหรับ role (comment / suggestion) — ไม่บันทึก"""
+    decision, borderline = _classify(change, role)
+    if borderline:
+        waited = queue_latency(model_name(role))
+        if waited > ROUTER_LARGE_QUEUE_SLO_SEC:
+            return _small(role, "slo_downgrade", downgraded=True, queue_latency_sec=round(waited, 3))
+    return decision
+
+
+def planned_route(change: Change, role: str) -> Tuple[RouteDecision, bool]:
+    """
+    tier ตอนวางแผน (ก่อนเข้าคิว) — ไม่ดูคิว ไม่บันทึกลง change.model_route
+    change ก้ำกึ่ง (ค่าที่สอง) ต้องตัดสินจริงตอน dispatch ด้วย route_for
+    เพราะคิว model ใหญ่ ณ ตอนนั้นรวม backlog ของงานนี้เองแล้ว
+    """
+    saved = (getattr(change, "model_route", None) or {}).get(role)
+    if saved is not None:
+        return RouteDecision(**saved), False
+    return _classify(change, role)
+
+
+def candidate_models(change: Change, role: str) -> List[Optional[str]]:
+    """model ที่ change นี้อาจถูกส่งไป (ใช้ peek cache ก่อนตัดสิน route จริง)"""
+    decision, borderline = planned_route(change, role)
+    models = [decision.model]
+    if borderline:
+        models.append(model_name(small_role(role)))
+    return models
+
+
+def route_for(change: Change, role: str) -> RouteDecision:
+    """
+    tier ของ change (ตัดสินครั้งแรกที่ขอ แล้วใช้ค่าเดิม → batch / retry / fallback ไป model เดียวกัน)
+    การตัดสินใจถูกเก็บไว้ที่ change.model_route[role]
+    เรียกตอน dispatch (หลังได้ semaphore) — ตอนวางแผนใช้ planned_route / candidate_models
+    """
+    routes = getattr(change, "model_route", None)
+    if routes is None:
+        routes = {}
+        change.model_route = routes
+    saved = routes.get(role)
+    if saved is not None:
+        return RouteDecision(**saved)
+
+    decision = route_change(change, role)
+    routes[role] = decision.to_dict()
+    LLM_ROUTE_DECISIONS.inc(role=role, tier=decision.tier, reason=decision.reason)
+    if decision.downgraded:
+        print(
+            f"🔀 [ROUTER] {role}: ลดไป model เล็ก ({decision.model}) "
+            f"คิว model ใหญ่รอ {decision.queue_latency_sec}s > SLO {ROUTER_LARGE_QUEUE_SLO_SEC}s"
+        )
+    return decision
+
+
+def route_json(change: Change) -> Optional[str]:
+    """change.model_route สำหรับเก็บลง ChangeItem.model_route"""
+    routes = getattr(change, "model_route", None)
+    return json.dumps(routes, ensure_ascii=False) if routes else None
+
+
+def routing_summary(changes: List[Change]) -> Dict:
+    """จำนวน change ต่อ tier / เหตุผล ของแต่ละ role (ใส่ในผล compare)"""
+    by_role: Dict[str, Dict] = {}
+    for c in changes:
+        for role, d in (getattr(c, "model_route", None) or {}).items():
+            entry = by_role.setdefault(role, {"small": 0, "large": 0, "downgraded": 0, "by_reason": {}})
+            entry[d["tier"]] += 1
+            entry["downgraded"] += 1 if d.get("downgraded") else 0
+            entry["by_reason"][d["reason"]] = entry["by_reason"].get(d["reason"], 0) + 1
+    return {
+        "enabled": any(router_active(r) for r in ROUTED_ROLES),
+        "large_queue_slo_sec": ROUTER_LARGE_QUEUE_SLO_SEC,
+        "by_role": by_role,
+    }
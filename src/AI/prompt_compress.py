@@ -0,0 +1,193 @@
+"""
+บีบ old_text / new_text ก่อนส่งเข้า prompt ของ ai_comment (single + batch)
+(prompt ของ ai_suggestion ใช้แค่ ai_comment ไม่มีข้อความเดิม / ใหม่ → ไม่เกี่ยว)
+
+เดิมส่งข้อความเต็มทั้งสองฉบับ แม้ย่อหน้า 3,000 ตัวอักษรเปลี่ยนแค่ตัวเลขตัวเดียว
+→ เวลา prefill ของ model โตตามความยาว input
+
+ที่นี่:
+- หา opcodes ระดับตัวอักษร (Levenshtein แบบเดียวกับ triage) แล้วเก็บเฉพาะช่วงที่เปลี่ยน
+  + ข้อความรอบข้างช่วงละ PROMPT_COMPRESS_CONTEXT_CHARS ตัวอักษร
+- ช่วงที่เหมือนกันยาว ๆ ถูกแทนด้วย marker บอกว่าละไว้กี่ตัวอักษร (เหมือนกันทั้งสองฉบับ)
+- ใช้ข้อความเต็มเหมือนเดิมเมื่อ: ย่อหน้าสั้น / ADDED / REMOVED / HEAVY / แก้เกือบทั้งย่อหน้า / บีบแล้วได้ไม่คุ้ม
+- นับ token ที่ประหยัดได้ต่อ comparison (begin_compression_scope เหมือน llm_cache.begin_cache_scope)
+"""
+
+import os
+import threading
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+import Levenshtein
+
+from src.diff.diff import Change
+from src.monitoring.metrics import counter
+
+# ==================================================
+# Config (ปรับได้ผ่าน env)
+# ==================================================
+PROMPT_COMPRESS_ENABLED = os.getenv("PROMPT_COMPRESS_ENABLED", "true").lower() == "true"
+# old + new สั้นกว่านี้ → ส่งเต็ม
+PROMPT_COMPRESS_MIN_CHARS = int(os.getenv("PROMPT_COMPRESS_MIN_CHARS", "1200"))
+# ข้อความรอบช่วงที่เปลี่ยน (ตัวอักษร ต่อด้าน)
+PROMPT_COMPRESS_CONTEXT_CHARS = int(os.getenv("PROMPT_COMPRESS_CONTEXT_CHARS", "150"))
+# ความเหมือน (Levenshtein ratio) ต่ำกว่านี้ = เขียนใหม่เกือบทั้งย่อหน้า → ส่งเต็ม
+PROMPT_COMPRESS_MIN_RATIO = float(os.getenv("PROMPT_COMPRESS_MIN_RATIO", "0.5"))
+# บีบแล้วลดได้น้อยกว่านี้ (สัดส่วน) → ส่งเต็ม
+PROMPT_COMPRESS_MIN_SAVING = float(os.getenv("PROMPT_COMPRESS_MIN_SAVING", "0.2"))
+
+# ขยับจุดตัดไปที่ช่องว่างใกล้ที่สุด (ไม่ตัดกลางคำภาษาอังกฤษ / ตัวเลข)
+_SNAP_CHARS = 20
+
+ELISION_MARKER = " [… ละข้อความที่เหมือนกันทั้งสองฉบับ {n} ตัวอักษร …] "
+
+PROMPT_COMPRESS_TOKENS = counter(
+    "prompt_compress_tokens_total",
+    "Estimated prompt tokens of change texts before (original) and after (sent) compression",
+    ["kind"],
+)
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """เหมือน ai_comment.estimate_tokens (ภาษาไทย ~2 ตัวอักษร/token)"""
+    return len(text or "") // 2 + 1
+
+
+# ==================================================
+# Compression
+# ==================================================
+def _snap_head(seg: str, n: int) -> str:
+    """n ตัวอักษรแรก (ขยายไปจบที่ช่องว่างถ้ามีใกล้ ๆ)"""
+    cut = seg.find(" ", n, n + _SNAP_CHARS)
+    return seg[: cut if cut != -1 else n]
+
+
+def _snap_tail(seg: str, n: int) -> str:
+    """n ตัวอักษรสุดท้าย (ขยายไปเริ่มหลังช่องว่างถ้ามีใกล้ ๆ)"""
+    start = len(seg) - n
+    cut = seg.rfind(" ", max(0, start - _SNAP_CHARS), start)
+    return seg[cut + 1 if cut != -1 else start:]
+
+
+def _elide(seg: str, keep_head: int, keep_tail: int) -> str:
+    marker_len = len(ELISION_MARKER)
+    if len(seg) <= keep_head + keep_tail + marker_len:
+        return seg
+    head = _snap_head(seg, keep_head) if keep_head else ""
+    tail = _snap_tail(seg, keep_tail) if keep_tail else ""
+    elided = len(seg) - len(head) - len(tail)
+    if elided <= marker_len:
+        return seg
+    return head + ELISION_MARKER.format(n=elided) + tail
+
+
+def compress_pair(
+    old_text: Optional[str],
+    new_text: Optional[str],
+    edit_severity: Optional[str] = None,
+    context_chars: int = PROMPT_COMPRESS_CONTEXT_CHARS,
+) -> Tuple[Optional[str], Optional[str], str]:
+    """
+    คืน (old, new, outcome)
+    outcome = "compressed" หรือเหตุผลที่ส่งเต็ม: disabled / one_sided / short / heavy / low_ratio / low_saving
+    """
+    if not PROMPT_COMPRESS_ENABLED:
+        return old_text, new_text, "disabled"
+    if not old_text or not new_text or old_text == new_text:
+        return old_text, new_text, "one_sided"
+    total = len(old_text) + len(new_text)
+    if total < PROMPT_COMPRESS_MIN_CHARS:
+        return old_text, new_text, "short"
+    if edit_severity == "HEAVY":
+        return old_text, new_text, "heavy"
+    if Levenshtein.ratio(old_text, new_text) < PROMPT_COMPRESS_MIN_RATIO:
+        return old_text, new_text, "low_ratio"
+
+    ops = Levenshtein.opcodes(old_text, new_text)
+    old_parts, new_parts = [], []
+    last = len(ops) - 1
+    for k, (tag, i1, i2, j1, j2) in enumerate(ops):
+        if tag != "equal":
+            old_parts.append(old_text[i1:i2])
+            new_parts.append(new_text[j1:j2])
+            continue
+        # ส่วนที่เหมือนกัน: เก็บท้ายช่วงก่อนหน้า + หัวช่วงถัดไป ที่เหลือแทนด้วย marker (เหมือนกันทั้งสองฝั่ง)
+        piece = _elide(
+            old_text[i1:i2],
+            keep_head=context_chars if k > 0 else 0,
+            keep_tail=context_chars if k < last else 0,
+        )
+        old_parts.append(piece)
+        new_parts.append(piece)
+
+    old_c, new_c = "".join(old_parts).strip(), "".join(new_parts).strip()
+    if 1 - (len(old_c) + len(new_c)) / total < PROMPT_COMPRESS_MIN_SAVING:
+        return old_text, new_text, "low_saving"
+    return old_c, new_c, "compressed"
+
+
+# ==================================================
+# Stats ต่อ comparison
+# ==================================================
+class PromptCompressionStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.changes = 0
+        self.compressed = 0
+        self.by_outcome: Dict[str, int] = {}
+        self.original_tokens = 0
+        self.sent_tokens = 0
+
+    def record(self, outcome: str, original_tokens: int, sent_tokens: int) -> None:
+        with self._lock:
+            self.changes += 1
+            self.compressed += 1 if outcome == "compressed" else 0
+            self.by_outcome[outcome] = self.by_outcome.get(outcome, 0) + 1
+            self.original_tokens += original_tokens
+            self.sent_tokens += sent_tokens
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            saved = self.original_tokens - self.sent_tokens
+            return {
+                "changes": self.changes,
+                "compressed": self.compressed,
+                "by_outcome": dict(self.by_outcome),
+                "original_tokens": self.original_tokens,
+                "sent_tokens": self.sent_tokens,
+                "saved_tokens": saved,
+                "saved_ratio": round(saved / self.original_tokens, 4) if self.original_tokens else 0.0,
+            }
+
+
+_stats_var: ContextVar[Optional[PromptCompressionStats]] = ContextVar("prompt_compress_stats", default=None)
+
+
+def begin_compression_scope() -> PromptCompressionStats:
+    """เริ่มนับ token ที่ประหยัดได้ของ 1 comparison ใน context ปัจจุบัน"""
+    stats = PromptCompressionStats()
+    _stats_var.set(stats)
+    return stats
+
+
+def prompt_texts(change: Change) -> Tuple[Optional[str], Optional[str]]:
+    """
+    old / new ที่จะใส่ใน prompt ของ change นี้
+    คำนวณครั้งเดียวต่อ change (เก็บไว้ที่ change.prompt_texts) → cache key ของ comment / batch ตรงกัน
+    token ที่ประหยัดนับครั้งเดียวต่อ change = ของ call ai_comment (suggestion ไม่ได้ส่งข้อความเหล่านี้)
+    """
+    cached = getattr(change, "prompt_texts", None)
+    if cached is not None:
+        return cached
+
+    old_c, new_c, outcome = compress_pair(change.old_text, change.new_text, change.edit_severity)
+    change.prompt_texts = (old_c, new_c)
+
+    original = estimate_tokens(change.old_text) + estimate_tokens(change.new_text)
+    sent = estimate_tokens(old_c) + estimate_tokens(new_c)
+    PROMPT_COMPRESS_TOKENS.inc(original, kind="original")
+    PROMPT_COMPRESS_TOKENS.inc(sent, kind="sent")
+    stats = _stats_var.get()
+    if stats is not None:
+        stats.record(outcome, original, sent)
+    return old_c, new_c
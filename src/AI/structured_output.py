@@ -0,0 +1,382 @@
+"""
+คำตอบ JSON ของ LLM แบบมี schema (ai_comment / ai_suggestion / ai_sum)
+
+เดิมแต่ละ module มี _safe_parse_json ของตัวเอง: regex `\\{[\\s\\S]*\\}` แบบ greedy + ลบ control char
+→ ข้อความนอก JSON มีปีกกา / model ตอบขาดกลางทาง (max_tokens) / มี trailing comma = parse ไม่ได้
+→ ได้ {} (ค่า default ถูกเก็บลง cache) หรือ raise แล้วเรียก LLM ใหม่ทั้ง call
+
+ที่นี่:
+- pydantic model ต่อชนิดคำตอบ (CommentOutput / SuggestionOutput / ImpactOutput / MapOutput / CommentBatchItem)
+- ขอให้ server บังคับรูปแบบคำตอบตาม schema (LLM_STRUCTURED_OUTPUT):
+    json_schema → response_format={"type": "json_schema", ...}  (OpenAI / vLLM / Ollama รุ่นใหม่)
+    guided_json → extra_body={"guided_json": schema}              (vLLM guided decoding)
+    json_object → response_format={"type": "json_object"}
+    off         → ไม่ส่ง (พึ่ง prompt อย่างเดียวเหมือนเดิม)
+  server ตอบ 400 / 422 ว่าไม่รองรับ → จำไว้ต่อ model แล้วเรียกแบบไม่บังคับแทน (ไม่ fail งาน)
+- repair parser ก่อน retry: ตัด code fence, หา JSON ก้อนแรกแบบนับวงเล็บ (รู้จัก string / escape),
+  escape control char ใน string, ลบ trailing comma
+- คำตอบถูกตัดกลางทาง (max_tokens / stream ขาด: วงเล็บ / string ยังไม่ปิด) → ไม่ปิดให้เอง
+  (ปิดแล้วผ่าน schema ได้ทั้งที่ field ท้ายหาย) → OutputParseError ให้ retry
+- ซ่อมไม่ได้ / ไม่ผ่าน schema → OutputParseError (llm_retry นับเป็น parse retry, ไม่ถูกเก็บลง cache)
+- นับผล parse (ok / repaired / failed) ต่อ role: metric llm_parse_outcomes_total + hook ให้ llm_accounting
+"""
+
+import json
+import os
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from langchain_core.output_parsers import StrOutputParser
+from pydantic import BaseModel, ValidationError, field_validator
+
+from src.AI.llm_concurrency import _status_code
+from src.monitoring.metrics import counter
+
+# ==================================================
+# Config (ปรับได้ผ่าน env)
+# ==================================================
+STRUCTURED_MODES = ("json_schema", "guided_json", "json_object", "off")
+LLM_STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "json_schema").lower()
+if LLM_STRUCTURED_OUTPUT not in STRUCTURED_MODES:
+    print(f"⚠️ LLM_STRUCTURED_OUTPUT={LLM_STRUCTURED_OUTPUT} ไม่รู้จัก → ใช้ off")
+    LLM_STRUCTURED_OUTPUT = "off"
+
+PARSE_OK = "ok"
+PARSE_REPAIRED = "repaired"
+PARSE_FAILED = "failed"
+
+LLM_PARSE_OUTCOMES = counter(
+    "llm_parse_outcomes_total",
+    "Structured LLM output parse outcomes per role (ok / repaired / failed)",
+    ["role", "outcome"],
+)
+LLM_STRUCTURED_FALLBACKS = counter(
+    "llm_structured_fallbacks_total",
+    "Calls re-sent without schema constraints because the server rejected them",
+    ["model", "mode"],
+)
+
+
+class OutputParseError(ValueError):
+    """คำตอบของ LLM ซ่อมเป็น JSON ตาม schema ไม่ได้ (retry ได้ — llm_retry นับแยกเป็น parse retry)"""
+
+    parse_error = True
+
+
+# ==================================================
+# Schemas
+# ==================================================
+def _to_text(v: Any) -> Any:
+    """model บางตัวตอบ list / ตัวเลขแทน string → แปลงเป็นข้อความ"""
+    if v is None or isinstance(v, str):
+        return v
+    if isinstance(v, list):
+        return "\n".join(str(x) for x in v)
+    if isinstance(v, dict):
+        return json.dumps(v, ensure_ascii=False)
+    return str(v)
+
+
+def _to_score(v: Any) -> float:
+    """คะแนน impact: รับทั้งตัวเลข และข้อความที่มีตัวเลข ("45", "45 คะแนน") เหมือน ai_sum._safe_float เดิม"""
+    if v is None or isinstance(v, bool):
+        return 0.0
+    if isinstance(v, (int, float)):
+        return float(v)
+    nums = re.findall(r"-?\d+\.?\d*", str(v))
+    return float(nums[0]) if nums else 0.0
+
+
+class CommentOutput(BaseModel):
+    paragraph_topic: Optional[str] = None
+    change_category: Optional[str] = None
+    ai_comment: str
+    change_details: List[Any] = []
+
+    @field_validator("paragraph_topic", "change_category", "ai_comment", mode="before")
+    @classmethod
+    def coerce_text(cls, v: Any) -> Any:
+        return _to_text(v)
+
+    @field_validator("ai_comment")
+    @classmethod
+    def non_empty(cls, v: str) -> str:
+        if not v.strip():
+            raise ValueError("ai_comment ว่าง")
+        return v
+
+    @field_validator("change_details", mode="before")
+    @classmethod
+    def details_list(cls, v: Any) -> List[Any]:
+        if v is None:
+            return []
+        return v if isinstance(v, list) else [v]
+
+
+class CommentBatchItem(CommentOutput):
+    index: int
+    change_category: str
+
+
+class SuggestionOutput(BaseModel):
+    ai_suggestion: str
+
+    @field_validator("ai_suggestion", mode="before")
+    @classmethod
+    def coerce_text(cls, v: Any) -> Any:
+        return _to_text(v)
+
+
+class ImpactScores(BaseModel):
+    scope_impact_score: float = 0.0
+    timeline_impact_score: float = 0.0
+    cost_impact_score: float = 0.0
+    resource_impact_score: float = 0.0
+    risk_impact_score: float = 0.0
+    contract_impact_score: float = 0.0
+    stakeholder_impact_score: float = 0.0
+    architecture_impact_score: float = 0.0
+
+    @field_validator("*", mode="before")
+    @classmethod
+    def coerce_score(cls, v: Any) -> float:
+        return _to_score(v)
+
+
+class ImpactOutput(BaseModel):
+    # ทุก field บังคับ: ขาด field ท้าย (เช่นคำตอบถูกตัด) ต้อง retry ไม่ใช่ได้ LOW ลง cache
+    impact_scores: ImpactScores
+    risk_comment: str
+    overall_risk_level: str
+
+    @field_validator("risk_comment", "overall_risk_level", mode="before")
+    @classmethod
+    def coerce_text(cls, v: Any) -> Any:
+        return _to_text(v)
+
+    @field_validator("risk_comment", "overall_risk_level")
+    @classmethod
+    def non_empty(cls, v: str) -> str:
+        if not v.strip():
+            raise ValueError("ค่าว่าง")
+        return v
+
+
+class MapOutput(BaseModel):
+    changes_digest: str = ""
+    suggestions_digest: str = ""
+    risk_evidence: str = ""
+
+    @field_validator("*", mode="before")
+    @classmethod
+    def coerce_text(cls, v: Any) -> Any:
+        return _to_text(v) or ""
+
+
+# ==================================================
+# Repair parser
+# ==================================================
+_FENCE_RE = re.compile(r"```(?:json|JSON)?")
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_CLOSERS = {"{": "}", "[": "]"}
+_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+
+def _scan(text: str, start: int) -> Tuple[str, List[str], bool, bool]:
+    """
+    อ่านจาก text[start] (ต้องเป็น { หรือ [) จนวงเล็บปิดครบ
+    คืน (ข้อความ JSON, วงเล็บที่ยังไม่ปิด, จบกลาง string หรือไม่, มีการ escape control char หรือไม่)
+    """
+    out: List[str] = []
+    stack: List[str] = []
+    in_string = escaped = fixed = False
+    for ch in text[start:]:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            elif ch < " " or ch == "\x7f":
+                # newline ดิบใน string = JSON ไม่ถูกต้อง (model ชอบใส่มาใน ai_comment)
+                out.append(_CONTROL_ESCAPES.get(ch, ""))
+                fixed = True
+                continue
+            out.append(ch)
+            continue
+
+        if ch == '"':
+            in_string = True
+        elif ch in _CLOSERS:
+            stack.append(_CLOSERS[ch])
+        elif ch in "}]":
+            if not stack or stack[-1] != ch:
+                # วงเล็บปิดไม่ตรงคู่ → ข้าม
+                fixed = True
+                continue
+            stack.pop()
+            out.append(ch)
+            if not stack:
+                break
+            continue
+        out.append(ch)
+    return "".join(out), stack, in_string, fixed
+
+
+def extract_json(raw: Optional[str], root: Optional[str] = "{") -> Tuple[Any, bool]:
+    """
+    JSON ก้อนแรกในคำตอบของ LLM (root = "{" / "[" / None = อะไรก็ได้ที่มาก่อน)
+    คืน (ค่า, ต้องซ่อมหรือไม่) / ซ่อมไม่ได้ หรือถูกตัดกลางทาง → OutputParseError
+    """
+    text = _FENCE_RE.sub("", raw or "")
+    if root is None:
+        starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+        start = min(starts) if starts else -1
+    else:
+        start = text.find(root)
+    if start == -1:
+        raise OutputParseError("ไม่พบ JSON ในคำตอบของ LLM")
+
+    body, stack, in_string, fixed = _scan(text, start)
+    if stack or in_string:
+        # ปิดวงเล็บให้เองไม่ได้: field ที่ถูกตัดหายไปเงียบ ๆ แล้วผลเสียถูกเก็บลง cache
+        raise OutputParseError(
+            f"คำตอบของ LLM ถูกตัดกลางทาง (วงเล็บค้าง {len(stack)}{', จบกลาง string' if in_string else ''})"
+        )
+
+    try:
+        return json.loads(body), fixed
+    except ValueError:
+        pass
+    try:
+        return json.loads(_TRAILING_COMMA_RE.sub(r"\1", body)), True
+    except ValueError as e:
+        raise OutputParseError(f"JSON ซ่อมไม่ได้: {e}") from e
+
+
+# ==================================================
+# Parse + validate (นับผลต่อ role)
+# ==================================================
+ParseHook = Callable[[str, str], None]
+_parse_hooks: List[ParseHook] = []
+
+
+def add_parse_hook(fn: ParseHook) -> None:
+    """fn(role, outcome) ทุกครั้งที่ parse คำตอบ (llm_accounting ใช้นับต่องาน)"""
+    _parse_hooks.append(fn)
+
+
+def _record(role: str, outcome: str) -> None:
+    LLM_PARSE_OUTCOMES.inc(role=role, outcome=outcome)
+    for fn in _parse_hooks:
+        try:
+            fn(role, outcome)
+        except Exception:
+            pass
+
+
+def parse_structured(raw: Optional[str], schema: Type[BaseModel], role: str) -> Dict:
+    """คำตอบของ LLM → dict ตาม schema (ซ่อมก่อนถ้าจำเป็น) / ไม่ได้ → OutputParseError"""
+    try:
+        value, repaired = extract_json(raw, root="{")
+        data = schema.model_validate(value).model_dump()
+    except ValidationError as e:
+        _record(role, PARSE_FAILED)
+        print(f"⚠️ [PARSE] {role}: ไม่ตรง schema {schema.__name__} ({e.error_count()} errors)")
+        raise OutputParseError(f"{schema.__name__}: {e}") from e
+    except OutputParseError as e:
+        _record(role, PARSE_FAILED)
+        print(f"⚠️ [PARSE] {role}: {e}")
+        raise
+
+    _record(role, PARSE_REPAIRED if repaired else PARSE_OK)
+    if repaired:
+        print(f"🩹 [PARSE] {role}: ซ่อม JSON สำเร็จ")
+    return data
+
+
+def parse_structured_items(raw: Optional[str], schema: Type[BaseModel], role: str) -> Dict[int, Dict]:
+    """
+    คำตอบแบบ array (batch) → {index: item} เก็บเฉพาะ item ที่ผ่าน schema
+    (item ที่เสีย / ขาดไป ผู้เรียก fallback ทีละรายการเอง → ไม่ raise)
+    """
+    try:
+        value, repaired = extract_json(raw, root=None)
+    except OutputParseError as e:
+        _record(role, PARSE_FAILED)
+        print(f"⚠️ [PARSE] {role}: {e}")
+        return {}
+    if isinstance(value, dict):
+        # บางครั้ง model ห่อมาเป็น {"items": [...]}
+        value = value.get("items")
+    if not isinstance(value, list):
+        _record(role, PARSE_FAILED)
+        return {}
+
+    out: Dict[int, Dict] = {}
+    for item in value:
+        try:
+            data = schema.model_validate(item).model_dump()
+        except ValidationError:
+            continue
+        out[data.pop("index")] = data
+    _record(role, PARSE_FAILED if not out else PARSE_REPAIRED if repaired else PARSE_OK)
+    return out
+
+
+# ==================================================
+# Server-side constraint (response_format / guided decoding)
+# ==================================================
+_unsupported: Dict[str, str] = {}
+_unsupported_lock = threading.Lock()
+_UNSUPPORTED_HINTS = ("response_format", "json_schema", "guided", "schema", "not supported", "unsupported")
+
+
+def _bind_kwargs(schema: Type[BaseModel], model: Optional[str]) -> Dict:
+    if LLM_STRUCTURED_OUTPUT == "off":
+        return {}
+    with _unsupported_lock:
+        if (model or "") in _unsupported:
+            return {}
+    if LLM_STRUCTURED_OUTPUT == "json_schema":
+        return {"response_format": {
+            "type": "json_schema",
+            # strict=False: schema มี field optional / default (strict ของ OpenAI บังคับ required ทุก field)
+            "json_schema": {"name": schema.__name__, "schema": schema.model_json_schema(), "strict": False},
+        }}
+    if LLM_STRUCTURED_OUTPUT == "guided_json":
+        return {"extra_body": {"guided_json": schema.model_json_schema()}}
+    return {"response_format": {"type": "json_object"}}
+
+
+def _is_unsupported(e: BaseException) -> bool:
+    if _status_code(e) not in (400, 422):
+        return False
+    msg = str(e).lower()
+    return any(h in msg for h in _UNSUPPORTED_HINTS)
+
+
+def structured_stats() -> Dict:
+    with _unsupported_lock:
+        return {"mode": LLM_STRUCTURED_OUTPUT, "unsupported_models": dict(_unsupported)}
+
+
+async def ainvoke_structured(prompt, llm, inputs: dict, schema: Type[BaseModel], model: Optional[str]) -> str:
+    """
+    prompt | llm (+ schema constraint) → ข้อความคำตอบ
+    server ไม่รองรับ constraint → จำ model นี้ไว้ แล้วเรียกซ้ำแบบไม่บังคับทันที (ไม่นับเป็น retry)
+    """
+    kwargs = _bind_kwargs(schema, model)
+    if kwargs:
+        try:
+            return await (prompt | llm.bind(**kwargs) | StrOutputParser()).ainvoke(inputs)
+        except Exception as e:
+            if not _is_unsupported(e):
+                raise
+            with _unsupported_lock:
+                _unsupported[model or ""] = LLM_STRUCTURED_OUTPUT
+            LLM_STRUCTURED_FALLBACKS.inc(model=model or "unknown", mode=LLM_STRUCTURED_OUTPUT)
+            print(f"⚠️ [STRUCTURED] {model} ไม่รองรับ {LLM_STRUCTURED_OUTPUT} → ใช้ prompt อย่างเดียว ({e})")
+    return await (prompt | llm | StrOutputParser()).ainvoke(inputs)
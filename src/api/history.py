@@ -3,20 +3,36 @@ from fastapi.middleware.cors import CORSMiddleware
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
+import json
 import uuid
 import threading
 import asyncio
 from enum import Enum
 
-from src.db.session import SessionLocal
+from src.db.session import SessionLocal, engine, Base, ensure_columns
 from src.db.models import Comparison
-from src.db.ops import delete_comparison_by_id
+from src.db.ops import delete_comparison_by_id, get_stage_profiles, get_llm_calls
+from src.AI.llm_gateway import with_loop_clients
 from src.service.compare_v2 import run_compare_v2
+from src.service.compare import COMPARE_MODES
+from src.service.job_registry import JobRegistry
+from src.service.cancellation import CancellationToken, JobCancelled
+from src.service.profiler import percentile
+from src.AI.llm_accounting import summarize_calls
+from src.AI.ai_schedule import LLMBudget
+from src.monitoring.metrics import instrument_app
 
 # =========================
 # ✅ FastAPI App
 # =========================
 app = FastAPI(title="History API")
+instrument_app(app, "history")
+
+@app.on_event("startup")
+def on_startup():
+    # ตารางใหม่ (เช่น comparison_stage_profiles) อาจยังไม่มีถ้า service นี้ขึ้นก่อน
+    Base.metadata.create_all(bind=engine)
+    ensure_columns()
 
 # =========================
 # 🔹 POLLING: Job Store (เหมือน service compare)
@@ -26,9 +42,10 @@ class JobStatus(str, Enum):
     running = "running"
     done = "done"
     error = "error"
+    cancelled = "cancelled"
 
-# In-memory job store สำหรับ /compare/continue
-continue_jobs: Dict[str, Dict[str, Any]] = {}
+# In-memory job store สำหรับ /compare/continue (จำกัดขนาด + offload result ลงดิสก์)
+continue_jobs = JobRegistry("continue")
 
 # =========================
 # DB Dependency
@@ -60,6 +77,10 @@ class ChangeItemModel(BaseModel):
     risk_level: Optional[str] = None
     ai_comment: Optional[str] = None
     ai_suggestion: Optional[str] = None
+    ai_status: Optional[str] = None     # done / triaged / deferred / pending / clustered / failed
+    model_route: Optional[Dict[str, Any]] = None   # model เล็ก / ใหญ่ ที่ model_router เลือกต่อ role
+    cluster_id: Optional[int] = None    # กลุ่มการแก้ซ้ำ (เลขเดียวกัน = แก้แบบเดียวกัน, UI ยุบรวมได้)
+    category_source: Optional[str] = None   # ที่มาของ change_category: llm / knn / triage / cluster
     
 
 class ComparisonDetailModel(BaseModel):
@@ -99,6 +120,106 @@ class ImpactScoresModel(BaseModel):
     stakeholder_impact_score: float
     architecture_impact_score: float  
 
+class StageProfileModel(BaseModel):
+    stage: str
+    wall_seconds: float
+    cpu_seconds: Optional[float] = None          # CPU ของ thread ที่รันงาน
+    peak_rss_delta_mb: Optional[float] = None    # process-wide (รวมงานอื่นที่รันพร้อมกัน)
+    items: Optional[int] = None
+
+class StageProfileStatsModel(BaseModel):
+    stage: str
+    runs: int
+    wall_p50: float
+    wall_p90: float
+    wall_p99: float
+    wall_max: float
+    cpu_p50: float
+    cpu_p90: float
+    rss_delta_p90_mb: float
+    rss_delta_max_mb: float
+    items_p50: float
+    share_of_total_p50: float
+
+class LLMCacheStatsModel(BaseModel):
+    lookups: int
+    hits: int
+    hit_rate: float
+    by_role: Dict[str, Dict[str, int]] = {}
+
+
+class TriageStatsModel(BaseModel):
+    triaged: int
+    by_kind: Dict[str, int] = {}
+    llm_calls_saved: int
+
+
+class ClusterStatsModel(BaseModel):
+    clusters: int
+    members: int
+    by_size: Dict[str, int] = {}
+    llm_calls_saved: int
+
+
+class CategoryKnnStatsModel(BaseModel):
+    index_size: int
+    predicted: int
+    prefilled: int
+    low_confidence: int
+    no_vector: int
+    elapsed_ms: float
+
+
+class LLMBudgetStatsModel(BaseModel):
+    budget: Dict[str, int]
+    pending: int
+    by_priority: Dict[str, int]
+    planned_calls: int
+    planned_tokens: int
+    deferred: int
+    over_budget_high: int
+
+
+class SummaryStatsModel(BaseModel):
+    mode: str                       # single / map_reduce
+    groups: int
+    levels: int
+    input_tokens: Optional[int] = None
+    group_by: Optional[str] = None
+    failed_groups: Optional[int] = None
+    impact_input_tokens: Optional[int] = None
+    enriched: Optional[Dict[str, int]] = None
+
+
+class LLMLatencyModel(BaseModel):
+    p50: float
+    p90: float
+    p99: float
+    max: float
+
+
+class LLMUsageTotalsModel(BaseModel):
+    calls: int                      # รวม cache hit
+    model_calls: int                # เรียก model จริง
+    cache_hits: int
+    retries: int
+    errors: int
+    prompt_tokens: int
+    completion_tokens: int
+    latency_seconds_total: float
+    latency: LLMLatencyModel
+
+
+class LLMUsageModel(LLMUsageTotalsModel):
+    by_role: Dict[str, LLMUsageTotalsModel] = {}
+    # ผล parse คำตอบต่อ role {role: {ok / repaired / failed: n}} (เฉพาะผลของงาน ไม่ได้เก็บลง DB)
+    parse: Optional[Dict[str, Dict[str, int]]] = None
+
+
+class ComparisonLLMUsageModel(LLMUsageModel):
+    comparison_id: int
+
+
 class CompareResultModel(BaseModel):
     doc_name: str
     v1_label: str
@@ -123,6 +244,17 @@ class CompareResultModel(BaseModel):
     run_id: int
     runtime_minutes: int
     runtime_seconds: float
+    stage_profile: Optional[List[StageProfileModel]] = None
+    llm_cache: Optional[LLMCacheStatsModel] = None
+    triage: Optional[TriageStatsModel] = None
+    clusters: Optional[ClusterStatsModel] = None
+    category_knn: Optional[CategoryKnnStatsModel] = None
+    llm_budget: Optional[LLMBudgetStatsModel] = None
+    summary_stats: Optional[SummaryStatsModel] = None
+    llm_usage: Optional[LLMUsageModel] = None
+    routing: Optional[Dict[str, Any]] = None
+    prompt_compression: Optional[Dict[str, Any]] = None
+    mode: str = "full"
     
 
 # =========================
@@ -146,7 +278,10 @@ async def get_comparison_detail(
             new_text=ch.new_text,
             ai_comment=ch.ai_comment,
             ai_suggestion=ch.ai_suggestion,
-            
+            ai_status=ch.ai_status,
+            model_route=json.loads(ch.model_route) if ch.model_route else None,
+            cluster_id=ch.cluster_id,
+            category_source=ch.category_source,
         )
         for ch in comp.changes
     ]
@@ -166,6 +301,102 @@ async def get_comparison_detail(
         changes=changes_models,
     )
 
+# =========================
+# GET /comparisons/profiles/stats
+# =========================
+@app.get("/comparisons/profiles/stats", response_model=List[StageProfileStatsModel])
+async def get_stage_profile_stats(limit_runs: int = 100, db: Session = Depends(get_db)):
+    """
+    รวม percentile ของเวลา/ทรัพยากรต่อ stage จาก run ล่าสุด limit_runs รายการ
+    """
+    rows = get_stage_profiles(db, limit_runs=limit_runs)
+
+    by_stage: Dict[str, List[Any]] = {}
+    run_totals: Dict[int, float] = {}
+    for r in rows:
+        by_stage.setdefault(r.stage, []).append(r)
+        run_totals[r.comparison_id] = run_totals.get(r.comparison_id, 0.0) + (r.wall_seconds or 0.0)
+
+    stats = []
+    for stage, items in by_stage.items():
+        walls = [r.wall_seconds or 0.0 for r in items]
+        cpus = [r.cpu_seconds or 0.0 for r in items]
+        rss = [r.peak_rss_delta_mb or 0.0 for r in items]
+        counts = [r.items or 0 for r in items]
+        shares = [
+            (r.wall_seconds or 0.0) / run_totals[r.comparison_id]
+            for r in items
+            if run_totals.get(r.comparison_id)
+        ]
+
+        stats.append(
+            StageProfileStatsModel(
+                stage=stage,
+                runs=len({r.comparison_id for r in items}),
+                wall_p50=round(percentile(walls, 50), 3),
+                wall_p90=round(percentile(walls, 90), 3),
+                wall_p99=round(percentile(walls, 99), 3),
+                wall_max=round(max(walls), 3),
+                cpu_p50=round(percentile(cpus, 50), 3),
+                cpu_p90=round(percentile(cpus, 90), 3),
+                rss_delta_p90_mb=round(percentile(rss, 90), 2),
+                rss_delta_max_mb=round(max(rss), 2),
+                items_p50=percentile(counts, 50),
+                share_of_total_p50=round(percentile(shares, 50), 4),
+            )
+        )
+
+    # stage ที่กินเวลามากสุดขึ้นก่อน
+    stats.sort(key=lambda s: s.wall_p50, reverse=True)
+    return stats
+
+# =========================
+# GET /comparisons/{id}/profile
+# =========================
+@app.get("/comparisons/{comparison_id}/profile", response_model=List[StageProfileModel])
+async def get_comparison_profile(comparison_id: int, db: Session = Depends(get_db)):
+    rows = get_stage_profiles(db, comparison_id=comparison_id)
+    if not rows:
+        raise HTTPException(status_code=404, detail="No stage profile for this comparison")
+
+    return [
+        StageProfileModel(
+            stage=r.stage,
+            wall_seconds=r.wall_seconds,
+            cpu_seconds=r.cpu_seconds,
+            peak_rss_delta_mb=r.peak_rss_delta_mb,
+            items=r.items,
+        )
+        for r in rows
+    ]
+
+# =========================
+# GET /comparisons/{id}/llm-usage
+# =========================
+@app.get("/comparisons/{comparison_id}/llm-usage", response_model=ComparisonLLMUsageModel)
+async def get_comparison_llm_usage(comparison_id: int, db: Session = Depends(get_db)):
+    """
+    รวม LLM call ของ comparison (compare + annotate): token / retry / cache hit / percentile ของ latency
+    แยกตาม role (comment / suggestion / summary / impact / summary_map / annotate)
+    """
+    rows = get_llm_calls(db, comparison_id=comparison_id)
+    if not rows:
+        raise HTTPException(status_code=404, detail="No LLM call log for this comparison")
+
+    calls = [
+        {
+            "role": r.role,
+            "prompt_tokens": r.prompt_tokens,
+            "completion_tokens": r.completion_tokens,
+            "latency_seconds": r.latency_seconds,
+            "retries": r.retries,
+            "cache_hit": r.cache_hit,
+            "error": r.error,
+        }
+        for r in rows
+    ]
+    return ComparisonLLMUsageModel(comparison_id=comparison_id, **summarize_calls(calls))
+
 # =========================
 # GET /comparisons
 # =========================
@@ -240,36 +471,44 @@ def process_continue_job(
     document_id: int,
     v2_bytes: bytes,
     v2_label: str,
+    refresh_cache: bool = False,
+    llm_budget: Optional[LLMBudget] = None,
+    mode: str = "full",
 ):
+    cancel_token: CancellationToken = continue_jobs[job_id]["cancel_token"]
     try:
-        continue_jobs[job_id]["status"] = JobStatus.running
+        continue_jobs.set_status(job_id, JobStatus.running)
 
         # ⭐ callback แบบ v1 (message only)
         def progress_callback(message, progress=None):
-            continue_jobs[job_id]["current_step"] = message
-            continue_jobs[job_id]["logs"].append(message)
-
-            if progress is not None:
-                continue_jobs[job_id]["progress"] = progress
+            continue_jobs.push_log(job_id, message, progress)
 
-        result = asyncio.run(
+        result = asyncio.run(with_loop_clients(
             run_compare_v2(
                 document_id=document_id,
                 v2_file_bytes=v2_bytes,
                 v2_label=v2_label,
                 progress_callback=progress_callback,
+                cancel_token=cancel_token,
+                refresh_cache=refresh_cache,
+                llm_budget=llm_budget,
+                mode=mode,
             )
-        )
+        ))
+
+        continue_jobs.set_result(job_id, result, status=JobStatus.done)
+        continue_jobs.push_log(job_id, "Completed")
 
-        continue_jobs[job_id]["status"] = JobStatus.done
-        continue_jobs[job_id]["result"] = result
-        continue_jobs[job_id]["current_step"] = "Completed"
-        continue_jobs[job_id]["logs"].append("Completed")
+    except JobCancelled as e:
+        print(f"🛑 Job {job_id} cancelled: {e}")
+        continue_jobs.set_status(job_id, JobStatus.cancelled)
 
     except Exception as e:
         print(f"❌ Job {job_id} failed: {e}")
-        continue_jobs[job_id]["status"] = JobStatus.error
-        continue_jobs[job_id]["error"] = str(e)
+        if cancel_token.cancelled:
+            continue_jobs.set_status(job_id, JobStatus.cancelled)
+        else:
+            continue_jobs.set_status(job_id, JobStatus.error, error=str(e))
 
 
 # ======================================================
@@ -281,8 +520,15 @@ async def compare_continue_start(
     document_id: int = Form(...),
     v2_label: str = Form("v2"),
     file_v2: UploadFile = File(...),
+    refresh_cache: bool = Form(False),
+    llm_budget_calls: Optional[int] = Form(None),
+    llm_budget_tokens: Optional[int] = Form(None),
+    mode: str = Form("full"),   # fast = ผล diff อย่างเดียว ไม่เรียก AI
     db: Session = Depends(get_db),
 ):
+    if mode not in COMPARE_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {list(COMPARE_MODES)}")
+
     latest_comp = (
         db.query(Comparison)
         .filter(Comparison.document_id == document_id)
@@ -302,20 +548,20 @@ async def compare_continue_start(
 
     job_id = str(uuid.uuid4())
 
-    continue_jobs[job_id] = {
-    "status": JobStatus.pending,
-    "result": None,
-    "error": None,
-
-    # ⭐ log system
-    "progress": 0,
-    "current_step": "Starting comparison",
-    "logs": ["Starting comparison"],
-    } 
+    continue_jobs.create(
+        job_id,
+        status=JobStatus.pending,
+        current_step="Starting comparison",
+        logs=["Starting comparison"],
+        cancel_token=CancellationToken(),
+    )
 
     threading.Thread(
         target=process_continue_job,
-        args=(job_id, document_id, v2_bytes, v2_label),
+        args=(
+            job_id, document_id, v2_bytes, v2_label, refresh_cache,
+            LLMBudget.resolve(llm_budget_calls, llm_budget_tokens), mode,
+        ),
         daemon=True,
     ).start()
 
@@ -327,37 +573,67 @@ async def compare_continue_start(
 
 @app.get("/compare/continue/status/{job_id}")
 def get_continue_status(job_id: str):
-    if job_id not in continue_jobs:
+    job = continue_jobs.get(job_id)
+    if job is None:
         return {"status": "not_found"}
 
-    job = continue_jobs[job_id]
-
     return {
         "status": job["status"],
         "progress": job.get("progress", 0),
         "current_step": job.get("current_step"),
-        "logs": job.get("logs", [])[-50:],  # จำกัด log
+        "logs": continue_jobs.tail_logs(job_id, 50),  # จำกัด log
     }
 
 
+# ======================================================
+# 🔹 DELETE /compare/continue/{job_id}
+# ======================================================
+
+@app.delete("/compare/continue/{job_id}")
+def cancel_continue_job(job_id: str):
+    job = continue_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if job["status"] not in [JobStatus.pending, JobStatus.running]:
+        return {"job_id": job_id, "status": job["status"], "cancelled": False}
+
+    job["cancel_token"].cancel()
+    continue_jobs.set_status(job_id, JobStatus.cancelled)
+    continue_jobs.push_log(job_id, "Cancelled")
+
+    return {"job_id": job_id, "status": JobStatus.cancelled, "cancelled": True}
+
+
+# ======================================================
+# 🔹 GET /compare/continue/jobs/stats
+# ======================================================
+
+@app.get("/compare/continue/jobs/stats")
+def get_continue_job_stats():
+    return continue_jobs.stats()
+
+
 # ======================================================
 # 🔹 GET /compare/continue/result/{job_id}
 # ======================================================
 
 @app.get("/compare/continue/result/{job_id}", response_model=CompareResultModel)
 def get_continue_result(job_id: str):
-    if job_id not in continue_jobs:
+    job = continue_jobs.get(job_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
 
-    job = continue_jobs[job_id]
-
     if job["status"] in [JobStatus.pending, JobStatus.running]:
         raise HTTPException(status_code=202, detail="Job still processing")
 
     if job["status"] == JobStatus.error:
         raise HTTPException(status_code=500, detail=job["error"])
 
-    r = job["result"]
+    if job["status"] == JobStatus.cancelled:
+        raise HTTPException(status_code=409, detail="Job was cancelled")
+
+    r = continue_jobs.load_result(job_id)
 
     safe_result = {
         "doc_name": r["doc_name"],
@@ -380,6 +656,17 @@ def get_continue_result(job_id: str):
         "run_id": r["run_id"],
         "runtime_minutes": r["runtime_minutes"],
         "runtime_seconds": r["runtime_seconds"],
+        "stage_profile": r.get("stage_profile"),
+        "llm_cache": r.get("llm_cache"),
+        "triage": r.get("triage"),
+        "clusters": r.get("clusters"),
+        "category_knn": r.get("category_knn"),
+        "llm_budget": r.get("llm_budget"),
+        "summary_stats": r.get("summary_stats"),
+        "llm_usage": r.get("llm_usage"),
+        "routing": r.get("routing"),
+        "prompt_compression": r.get("prompt_compression"),
+        "mode": r.get("mode", "full"),
     }
 
     return safe_result
@@ -0,0 +1,611 @@
+"""
+LLM stub: OpenAI-compatible server (/v1/chat/completions) สำหรับ benchmark / load test โดยไม่ต้องใช้ model server จริง
+
+รัน:
+    uvicorn src.api.llm_stub:app --host 0.0.0.0 --port 8090
+แล้วชี้ service อื่นมาที่ stub:
+    LOCALMODEL_BASE_URL=http://localhost:8090/v1
+
+mode (LLM_STUB_MODE):
+- synthetic : สร้างคำตอบเองตามชนิดของ prompt (comment / comment_batch / suggestion / summary /
+              summary_map / impact / annotate / chat) → parse ผ่านทุก module, ผลเหมือนเดิมทุกครั้ง (hash ของ prompt)
+- record    : ส่งต่อไป model server จริง (LLM_STUB_UPSTREAM_URL) แล้วเก็บคำตอบเป็น fixture
+- replay    : ตอบจาก fixture (ไม่เจอ → synthetic หรือ error ตาม LLM_STUB_REPLAY_MISS)
+
+จำลองพฤติกรรม model server (synthetic / replay):
+- latency ก่อน token แรก ตาม distribution: fixed:S | uniform:A,B | normal:MEAN,STD | lognormal:MEDIAN,SIGMA | exp:MEAN
+  (ตั้งแยกตามชนิด prompt ได้ เช่น LLM_STUB_LATENCY_IMPACT=lognormal:6,0.4)
+- ความเร็วสร้าง token (LLM_STUB_TOKENS_PER_SEC) → ทั้ง stream และ non-stream ใช้เวลาตามจำนวน token
+- error injection: HTTP error (429 มี Retry-After / 5xx), request ค้าง (client timeout), stream ขาดกลางทาง
+- stream (SSE) + tool calls (chat ที่ส่ง tools มา → เรียก tool ก่อน 1 รอบ แล้วค่อยตอบ)
+
+ปรับค่าระหว่างรันได้ที่ POST /stub/config, ดูสถิติที่ GET /stub/stats
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import time
+import uuid
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# ==================================================
+# Config (ปรับได้ผ่าน env / POST /stub/config)
+# ==================================================
+LLM_STUB_MODE = os.getenv("LLM_STUB_MODE", "synthetic")
+LLM_STUB_FIXTURE_DIR = Path(os.getenv("LLM_STUB_FIXTURE_DIR", "data/llm_fixtures"))
+LLM_STUB_UPSTREAM_URL = os.getenv("LLM_STUB_UPSTREAM_URL", "http://localhost:11434/v1").rstrip("/")
+LLM_STUB_UPSTREAM_KEY = os.getenv("LLM_STUB_UPSTREAM_KEY") or os.getenv("LOCALMODEL_API_KEY") or "local-dev-key"
+LLM_STUB_UPSTREAM_TIMEOUT_SEC = float(os.getenv("LLM_STUB_UPSTREAM_TIMEOUT_SEC", "300"))
+
+# ชนิด prompt ที่ record เก็บเป็น fixture (ว่าง = ทุกชนิด)
+LLM_STUB_RECORD_KINDS = [
+    k.strip() for k in os.getenv(
+        "LLM_STUB_RECORD_KINDS", "comment,comment_batch,suggestion,summary,summary_map,impact"
+    ).split(",") if k.strip()
+]
+# replay ไม่เจอ fixture: synthetic = สร้างคำตอบเอง / error = ตอบ 404
+LLM_STUB_REPLAY_MISS = os.getenv("LLM_STUB_REPLAY_MISS", "synthetic")
+# latency ตอน replay: model = ตาม distribution ที่ตั้ง / recorded = เท่ากับตอน record / none = ไม่หน่วง
+LLM_STUB_REPLAY_LATENCY = os.getenv("LLM_STUB_REPLAY_LATENCY", "model")
+# รวมชื่อ model ใน key ของ fixture (ปิดไว้ → record กับ model หนึ่ง replay ด้วยชื่ออื่นได้)
+LLM_STUB_KEY_INCLUDE_MODEL = os.getenv("LLM_STUB_KEY_INCLUDE_MODEL", "false").lower() == "true"
+
+KINDS = ("comment", "comment_batch", "suggestion", "summary", "summary_map", "impact", "annotate", "chat")
+
+CONFIG: Dict[str, Any] = {
+    "latency": os.getenv("LLM_STUB_LATENCY", "lognormal:0.8,0.5"),
+    "latency_by_kind": {
+        k: os.getenv(f"LLM_STUB_LATENCY_{k.upper()}")
+        for k in KINDS
+        if os.getenv(f"LLM_STUB_LATENCY_{k.upper()}")
+    },
+    # เวลาประมวลผล prompt (prefill) ต่อ token — 0 = ไม่คิด
+    "prefill_tokens_per_sec": float(os.getenv("LLM_STUB_PREFILL_TOKENS_PER_SEC", "0")),
+    "tokens_per_sec": float(os.getenv("LLM_STUB_TOKENS_PER_SEC", "40")),
+    "chunk_tokens": int(os.getenv("LLM_STUB_CHUNK_TOKENS", "4")),
+    "error_rate": float(os.getenv("LLM_STUB_ERROR_RATE", "0")),
+    "error_codes": [int(c) for c in os.getenv("LLM_STUB_ERROR_CODES", "429,500,503").split(",") if c.strip()],
+    "retry_after_sec": float(os.getenv("LLM_STUB_RETRY_AFTER_SEC", "1")),
+    "timeout_rate": float(os.getenv("LLM_STUB_TIMEOUT_RATE", "0")),
+    "hang_sec": float(os.getenv("LLM_STUB_HANG_SEC", "600")),
+    "stream_error_rate": float(os.getenv("LLM_STUB_STREAM_ERROR_RATE", "0")),
+    "tool_calls": os.getenv("LLM_STUB_TOOL_CALLS", "true").lower() == "true",
+}
+
+_rng = random.Random(int(os.getenv("LLM_STUB_SEED", "42")))
+
+STATS: Dict[str, Any] = {
+    "requests": 0,
+    "streams": 0,
+    "by_kind": {},
+    "injected_errors": 0,
+    "injected_timeouts": 0,
+    "injected_stream_errors": 0,
+    "replay_hits": 0,
+    "replay_misses": 0,
+    "recorded": 0,
+    "upstream_errors": 0,
+    "prompt_tokens": 0,
+    "completion_tokens": 0,
+}
+
+app = FastAPI(title="LLM Stub (OpenAI-compatible)")
+
+
+def _estimate_tokens(text: str) -> int:
+    """เหมือน ai_comment.estimate_tokens (ภาษาไทย ~2 ตัวอักษร/token)"""
+    return len(text or "") // 2 + 1
+
+
+# ==================================================
+# Latency distribution
+# ==================================================
+def sample_latency(spec: str) -> float:
+    """spec = "<dist>:<p1>,<p2>" (วินาที) → เวลาสุ่ม 1 ค่า (>= 0)"""
+    name, _, params = (spec or "fixed:0").partition(":")
+    p = [float(x) for x in params.split(",") if x.strip()] or [0.0]
+    name = name.strip().lower()
+    if name == "fixed":
+        value = p[0]
+    elif name == "uniform":
+        value = _rng.uniform(p[0], p[1] if len(p) > 1 else p[0])
+    elif name == "normal":
+        value = _rng.gauss(p[0], p[1] if len(p) > 1 else 0.0)
+    elif name == "lognormal":
+        # p[0] = median, p[1] = sigma ของ log
+        value = _rng.lognormvariate(math.log(max(p[0], 1e-6)), p[1] if len(p) > 1 else 0.0)
+    elif name == "exp":
+        value = _rng.expovariate(1.0 / p[0]) if p[0] > 0 else 0.0
+    else:
+        raise ValueError(f"unknown latency distribution: {spec}")
+    return max(value, 0.0)
+
+
+def _first_token_delay(kind: str, prompt_tokens: int) -> float:
+    spec = CONFIG["latency_by_kind"].get(kind) or CONFIG["latency"]
+    delay = sample_latency(spec)
+    if CONFIG["prefill_tokens_per_sec"] > 0:
+        delay += prompt_tokens / CONFIG["prefill_tokens_per_sec"]
+    return delay
+
+
+def _generation_time(completion_tokens: int) -> float:
+    rate = CONFIG["tokens_per_sec"]
+    return completion_tokens / rate if rate > 0 else 0.0
+
+
+# ==================================================
+# Request helpers
+# ==================================================
+def _content_text(content: Any) -> str:
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(
+            part.get("text", "") if isinstance(part, dict) else str(part)
+            for part in content
+        )
+    return str(content)
+
+
+def _all_text(messages: List[Dict]) -> str:
+    return "\n".join(_content_text(m.get("content")) for m in messages)
+
+
+def classify(body: Dict) -> str:
+    """เดาชนิด prompt จากข้อความ (ผูกกับ prompt ใน ai_comment / ai_suggestion / ai_sum / annotate)"""
+    messages = body.get("messages") or []
+    system = "\n".join(_content_text(m.get("content")) for m in messages if m.get("role") == "system")
+    # ผล tool (เช่น get_change_paragraph) มีคำเหล่านี้ได้ → ไม่นับ
+    text = _all_text([m for m in messages if m.get("role") != "tool"])
+
+    if "impact_scores" in system:
+        return "impact"
+    if "changes_digest" in system:
+        return "summary_map"
+    if "paragraph_topic" in system:
+        return "comment_batch" if "JSON ARRAY ONLY" in text else "comment"
+    if '"ai_suggestion"' in system:
+        return "suggestion"
+    if "impact_comment" in text or "rewrite_suggestion" in text:
+        return "annotate"
+    if "สรุปภาพรวม" in system and "ข้อมูลสรุปเชิงปริมาณ" in text:
+        return "summary"
+    return "chat"
+
+
+def fixture_key(body: Dict) -> str:
+    """key ของ fixture: messages + tools + temperature (+ model ถ้าตั้งไว้)"""
+    messages = [
+        {
+            "role": m.get("role"),
+            "content": _content_text(m.get("content")),
+            "tool_calls": m.get("tool_calls"),
+            "tool_call_id": m.get("tool_call_id"),
+        }
+        for m in body.get("messages") or []
+    ]
+    payload = {
+        "messages": messages,
+        "tools": sorted((t.get("function") or {}).get("name", "") for t in body.get("tools") or []),
+        "temperature": body.get("temperature"),
+    }
+    if LLM_STUB_KEY_INCLUDE_MODEL:
+        payload["model"] = body.get("model")
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# ==================================================
+# Synthetic responses (ผลเหมือนเดิมทุกครั้งสำหรับ prompt เดิม)
+# ==================================================
+_CATEGORIES = ("scope", "timeline", "cost", "resource", "risk", "contract", "stakeholder", "architecture")
+_BATCH_INDEX_RE = re.compile(r"\[index (\d+)\]")
+_CHANGE_ID_RE = re.compile(r"change_id\s*[:=]\s*(\d+)", re.IGNORECASE)
+
+
+def _seed_of(text: str) -> random.Random:
+    return random.Random(int(hashlib.md5(text.encode("utf-8")).hexdigest()[:12], 16))
+
+
+def _comment_item(r: random.Random) -> Dict:
+    category = r.choice(_CATEGORIES)
+    return {
+        "paragraph_topic": f"[stub] หัวข้อเกี่ยวกับ {category}",
+        "change_category": category,
+        "ai_comment": f"[stub] การเปลี่ยนแปลงนี้เกี่ยวข้องกับ {category} ควรตรวจสอบรายละเอียดก่อนอนุมัติ",
+        "change_details": [
+            {"type": r.choice(("added", "removed", "modified")), "description": f"[stub] รายละเอียด {i + 1}"}
+            for i in range(r.randint(0, 3))
+        ],
+    }
+
+
+def _last_user_text(messages: List[Dict]) -> str:
+    for m in reversed(messages):
+        if m.get("role") == "user":
+            return _content_text(m.get("content"))
+    return ""
+
+
+def _synthetic_tool_call(body: Dict, r: random.Random) -> Optional[Dict]:
+    """chat ที่ส่ง tools มาและยังไม่มีผล tool → เรียก tool 1 ครั้ง"""
+    tools = body.get("tools") or []
+    messages = body.get("messages") or []
+    if not CONFIG["tool_calls"] or not tools or any(m.get("role") == "tool" for m in messages):
+        return None
+
+    names = [(t.get("function") or {}).get("name") for t in tools]
+    text = _all_text(messages)
+    match = _CHANGE_ID_RE.search(text)
+    if "get_change_paragraph" in names and match:
+        name, args = "get_change_paragraph", {"change_id": int(match.group(1))}
+    else:
+        name, args = names[0], {"query": _last_user_text(messages)[:200]}
+    return {
+        "id": f"call_{r.getrandbits(48):012x}",
+        "type": "function",
+        "function": {"name": name, "arguments": json.dumps(args, ensure_ascii=False)},
+    }
+
+
+def synthetic_message(kind: str, body: Dict) -> Dict:
+    """คืน message ของ assistant ({"content": ..., "tool_calls": [...]})"""
+    text = _all_text(body.get("messages") or [])
+    r = _seed_of(kind + "\n" + text)
+
+    if kind == "comment":
+        content = json.dumps(_comment_item(r), ensure_ascii=False)
+    elif kind == "comment_batch":
+        indices = [int(i) for i in _BATCH_INDEX_RE.findall(text)] or [0]
+        content = json.dumps([{"index": i, **_comment_item(r)} for i in indices], ensure_ascii=False)
+    elif kind == "suggestion":
+        content = json.dumps({
+            "ai_suggestion": (
+                "[stub] 1) มุมมองผู้ได้รับบริการ: ตรวจสอบผลกระทบต่อข้อกำหนดที่เปลี่ยน\n"
+                "2) มุมมองผู้ให้บริการ: ประเมินต้นทุนและระยะเวลาที่ต้องปรับ"
+            )
+        }, ensure_ascii=False)
+    elif kind == "summary_map":
+        content = json.dumps({
+            "changes_digest": "[stub] สรุปการเปลี่ยนแปลงสำคัญของกลุ่ม",
+            "suggestions_digest": "[stub] สรุปข้อเสนอแนะของกลุ่ม",
+            "risk_evidence": f"[stub] {r.choice(_CATEGORIES)}: มีการแก้ไขที่มีผลต่อโครงการ",
+        }, ensure_ascii=False)
+    elif kind == "summary":
+        content = (
+            "ส่วนที่ 1: [stub] เอกสารมีการเปลี่ยนแปลงหลายส่วน\n"
+            "ส่วนที่ 2: [stub] ผู้ได้รับบริการและผู้ให้บริการควรทบทวนข้อกำหนดร่วมกัน\n"
+            "ส่วนที่ 3: [stub] ผู้มีส่วนได้ส่วนเสียหลักคือฝ่ายจัดซื้อและผู้รับจ้าง"
+        )
+    elif kind == "impact":
+        scores = {f"{c}_impact_score": r.randint(0, 80) for c in _CATEGORIES}
+        top = max(scores.values())
+        level = "HIGH" if top > 60 else "MEDIUM" if top > 25 else "LOW"
+        content = json.dumps({
+            "impact_scores": scores,
+            "risk_comment": "[stub] มิติที่มีผลสูงสุดคำนวณจาก structured analysis",
+            "overall_risk_level": level,
+        }, ensure_ascii=False)
+    elif kind == "annotate":
+        content = json.dumps({
+            "impact_comment": "[stub] การเปลี่ยนแปลงนี้อาจกระทบเงื่อนไขของสัญญา",
+            "rewrite_suggestion": "[stub] ควรระบุเงื่อนไขให้ชัดเจนขึ้น",
+            "risk_scores": {k: r.randint(1, 5) for k in ("legal", "financial", "operational")},
+        }, ensure_ascii=False)
+    else:
+        tool_call = _synthetic_tool_call(body, r)
+        if tool_call is not None:
+            return {"role": "assistant", "content": None, "tool_calls": [tool_call]}
+        question = _last_user_text(body.get("messages") or [])[:80]
+        content = f"[stub] คำตอบจำลองสำหรับคำถาม: {question}\n" + "รายละเอียดเพิ่มเติมของคำตอบ " * r.randint(5, 30)
+
+    return {"role": "assistant", "content": content}
+
+
+def _completion(model: str, message: Dict, prompt_tokens: int) -> Dict:
+    text = _content_text(message.get("content"))
+    for call in message.get("tool_calls") or []:
+        text += call["function"]["arguments"]
+    completion_tokens = _estimate_tokens(text)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": message,
+            "finish_reason": "tool_calls" if message.get("tool_calls") else "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+# ==================================================
+# Fixtures (record / replay)
+# ==================================================
+def _fixture_path(kind: str, key: str) -> Path:
+    return LLM_STUB_FIXTURE_DIR / kind / f"{key}.json"
+
+
+def load_fixture(kind: str, key: str) -> Optional[Dict]:
+    path = _fixture_path(kind, key)
+    if not path.exists():
+        return None
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except Exception as e:
+        logger.warning("broken fixture %s: %s", path, e)
+        return None
+
+
+def save_fixture(kind: str, key: str, body: Dict, response: Dict, latency_sec: float) -> None:
+    path = _fixture_path(kind, key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = {
+        "key": key,
+        "kind": kind,
+        "latency_sec": round(latency_sec, 4),
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "request": {k: body.get(k) for k in ("model", "messages", "tools", "temperature") if k in body},
+        "response": response,
+    }
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+async def _forward_upstream(body: Dict) -> Tuple[Dict, float]:
+    payload = {**body, "stream": False}
+    payload.pop("stream_options", None)
+    started = time.perf_counter()
+    async with httpx.AsyncClient(timeout=LLM_STUB_UPSTREAM_TIMEOUT_SEC) as client:
+        resp = await client.post(
+            f"{LLM_STUB_UPSTREAM_URL}/chat/completions",
+            json=payload,
+            headers={"Authorization": f"Bearer {LLM_STUB_UPSTREAM_KEY}"},
+        )
+    if resp.status_code >= 400:
+        STATS["upstream_errors"] += 1
+        raise HTTPException(status_code=resp.status_code, detail=resp.text[:500])
+    return resp.json(), time.perf_counter() - started
+
+
+# ==================================================
+# Error injection
+# ==================================================
+def _error_response(status: int) -> JSONResponse:
+    headers = {}
+    if status == 429:
+        headers["Retry-After"] = f"{CONFIG['retry_after_sec']:g}"
+    return JSONResponse(
+        status_code=status,
+        headers=headers,
+        content={"error": {
+            "message": f"[stub] injected error {status}",
+            "type": "rate_limit_error" if status == 429 else "server_error",
+            "code": status,
+        }},
+    )
+
+
+async def _maybe_inject_failure() -> Optional[JSONResponse]:
+    if CONFIG["timeout_rate"] > 0 and _rng.random() < CONFIG["timeout_rate"]:
+        STATS["injected_timeouts"] += 1
+        await asyncio.sleep(CONFIG["hang_sec"])
+    if CONFIG["error_rate"] > 0 and _rng.random() < CONFIG["error_rate"]:
+        STATS["injected_errors"] += 1
+        return _error_response(_rng.choice(CONFIG["error_codes"] or [500]))
+    return None
+
+
+# ==================================================
+# Streaming (SSE แบบ OpenAI)
+# ==================================================
+def _chunk(base: Dict, delta: Dict, finish_reason: Optional[str] = None, usage: Optional[Dict] = None) -> str:
+    data = {
+        "id": base["id"],
+        "object": "chat.completion.chunk",
+        "created": base["created"],
+        "model": base["model"],
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if usage is None else [],
+    }
+    if usage is not None:
+        data["usage"] = usage
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _split_tokens(text: str, chunk_tokens: int) -> List[str]:
+    size = max(chunk_tokens, 1) * 2     # ~2 ตัวอักษร/token
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+async def _stream_completion(completion: Dict, first_delay: float, per_token: bool, include_usage: bool):
+    message = completion["choices"][0]["message"]
+    finish_reason = completion["choices"][0]["finish_reason"]
+    rate = CONFIG["tokens_per_sec"]
+    chunk_tokens = CONFIG["chunk_tokens"]
+    fail_midway = CONFIG["stream_error_rate"] > 0 and _rng.random() < CONFIG["stream_error_rate"]
+
+    await asyncio.sleep(first_delay)
+    yield _chunk(completion, {"role": "assistant", "content": ""})
+
+    for i, call in enumerate(message.get("tool_calls") or []):
+        yield _chunk(completion, {"tool_calls": [{
+            "index": i,
+            "id": call["id"],
+            "type": "function",
+            "function": {"name": call["function"]["name"], "arguments": ""},
+        }]})
+        for piece in _split_tokens(call["function"]["arguments"], chunk_tokens):
+            if per_token and rate > 0:
+                await asyncio.sleep(chunk_tokens / rate)
+            yield _chunk(completion, {"tool_calls": [{"index": i, "function": {"arguments": piece}}]})
+
+    pieces = _split_tokens(_content_text(message.get("content")), chunk_tokens) if message.get("content") else []
+    for n, piece in enumerate(pieces):
+        if fail_midway and n >= len(pieces) // 2:
+            STATS["injected_stream_errors"] += 1
+            raise RuntimeError("[stub] injected stream error")
+        if per_token and rate > 0:
+            await asyncio.sleep(chunk_tokens / rate)
+        yield _chunk(completion, {"content": piece})
+
+    yield _chunk(completion, {}, finish_reason=finish_reason)
+    if include_usage:
+        yield _chunk(completion, {}, usage=completion["usage"])
+    yield "data: [DONE]\n\n"
+
+
+# ==================================================
+# Endpoints
+# ==================================================
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    messages = body.get("messages") or []
+    model = body.get("model") or "stub-model"
+    stream = bool(body.get("stream"))
+    include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+    kind = classify(body)
+    STATS["requests"] += 1
+    STATS["by_kind"][kind] = STATS["by_kind"].get(kind, 0) + 1
+    if stream:
+        STATS["streams"] += 1
+
+    prompt_tokens = _estimate_tokens(_all_text(messages))
+    first_delay: Optional[float] = None
+    per_token = True
+
+    if LLM_STUB_MODE == "record":
+        # ส่งต่อ model server จริง (ไม่หน่วง / ไม่ inject error เพิ่ม)
+        completion, latency = await _forward_upstream(body)
+        if not LLM_STUB_RECORD_KINDS or kind in LLM_STUB_RECORD_KINDS:
+            save_fixture(kind, fixture_key(body), body, completion, latency)
+            STATS["recorded"] += 1
+        first_delay, per_token = 0.0, False
+    else:
+        failure = await _maybe_inject_failure()
+        if failure is not None:
+            return failure
+
+        completion = None
+        if LLM_STUB_MODE == "replay":
+            fixture = load_fixture(kind, fixture_key(body))
+            if fixture is not None:
+                STATS["replay_hits"] += 1
+                completion = {**fixture["response"], "model": model}
+                if LLM_STUB_REPLAY_LATENCY == "recorded":
+                    first_delay, per_token = fixture.get("latency_sec") or 0.0, False
+                elif LLM_STUB_REPLAY_LATENCY == "none":
+                    first_delay, per_token = 0.0, False
+            else:
+                STATS["replay_misses"] += 1
+                if LLM_STUB_REPLAY_MISS == "error":
+                    raise HTTPException(status_code=404, detail=f"[stub] no fixture for {kind} prompt")
+
+        if completion is None:
+            completion = _completion(model, synthetic_message(kind, body), prompt_tokens)
+
+    usage = completion.get("usage") or {}
+    completion_tokens = usage.get("completion_tokens") or 0
+    STATS["prompt_tokens"] += usage.get("prompt_tokens") or 0
+    STATS["completion_tokens"] += completion_tokens
+
+    if first_delay is None:
+        first_delay = _first_token_delay(kind, usage.get("prompt_tokens") or prompt_tokens)
+
+    if stream:
+        return StreamingResponse(
+            _stream_completion(completion, first_delay, per_token, include_usage),
+            media_type="text/event-stream",
+        )
+
+    delay = first_delay + (_generation_time(completion_tokens) if per_token else 0.0)
+    await asyncio.sleep(delay)
+    return completion
+
+
+@app.get("/v1/models")
+def list_models():
+    return {"object": "list", "data": [{"id": "stub-model", "object": "model", "owned_by": "stub"}]}
+
+
+@app.get("/health")
+def health():
+    return {"status": "ok", "mode": LLM_STUB_MODE}
+
+
+class StubConfigUpdate(BaseModel):
+    latency: Optional[str] = None
+    latency_by_kind: Optional[Dict[str, str]] = None
+    prefill_tokens_per_sec: Optional[float] = None
+    tokens_per_sec: Optional[float] = None
+    chunk_tokens: Optional[int] = None
+    error_rate: Optional[float] = None
+    error_codes: Optional[List[int]] = None
+    retry_after_sec: Optional[float] = None
+    timeout_rate: Optional[float] = None
+    hang_sec: Optional[float] = None
+    stream_error_rate: Optional[float] = None
+    tool_calls: Optional[bool] = None
+    seed: Optional[int] = None
+
+
+@app.get("/stub/config")
+def get_config():
+    return {"mode": LLM_STUB_MODE, "fixture_dir": str(LLM_STUB_FIXTURE_DIR), **CONFIG}
+
+
+@app.post("/stub/config")
+def update_config(req: StubConfigUpdate):
+    """ปรับพฤติกรรมระหว่างรัน (เช่น load test ช่วง error rate สูง แล้วปิด)"""
+    updates = req.model_dump(exclude_none=True)
+    try:
+        for spec in [updates.get("latency"), *(updates.get("latency_by_kind") or {}).values()]:
+            if spec:
+                sample_latency(spec)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    seed = updates.pop("seed", None)
+    if seed is not None:
+        _rng.seed(seed)
+    CONFIG.update(updates)
+    return get_config()
+
+
+@app.get("/stub/stats")
+def get_stats():
+    return STATS
+
+
+@app.post("/stub/stats/reset")
+def reset_stats():
+    for k, v in STATS.items():
+        STATS[k] = {} if isinstance(v, dict) else 0
+    return STATS
@@ -1,6 +1,6 @@
 import sys
 import os
-import time
+import asyncio
 from pathlib import Path
 import threading
 import uuid
@@ -10,56 +10,76 @@ sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 from fastapi import FastAPI, UploadFile, File, Form, Depends, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
 from typing import List, Optional, Dict, Any
 import logging
 from pydantic import BaseModel
 
-from service.compare import run_compare
+from service.compare import run_compare, COMPARE_MODES
 from service.compare_v2 import run_compare_v2
-from db.session import SessionLocal, engine, Base
+from db.session import SessionLocal, engine, Base, ensure_columns
 from db.models import Comparison
 from db.ops import (
     get_comparison_with_changes,
 )
-from AI.agent_rewrite import generate_rewrite_suggestion_for_row
+from src.service.job_registry import JobRegistry
+from src.service.cancellation import CancellationToken, JobCancelled
+from src.service.checkpoint import CompareCheckpoint
+from src.AI.llm_cache import llm_cache
+from src.AI.llm_concurrency import llm_concurrency
+from src.AI.llm_gateway import model_name, with_loop_clients
+from src.AI.llm_retry import breaker_stats
+from src.service.annotate import run_annotate
+from src.service.enrich import enrich_change, run_comparison_summary
+from src.AI.ai_schedule import LLMBudget
+from src.monitoring.metrics import instrument_app
 from sqlalchemy.orm import Session
 from src.report.report_builder import ReportBuilder
 from src.diff.diff import Change as DiffChange
 
-from openai import OpenAI
 from dotenv import load_dotenv
 load_dotenv()
 
 # ----------------- Config -----------------
 LOCALMODEL_API_KEY = os.getenv("LOCALMODEL_API_KEY")
 LOCALMODEL_BASE_URL = os.getenv("LOCALMODEL_BASE_URL", "http://localhost:11434/v1")
-LOCALMODEL_MODEL = os.getenv("LOCALMODEL_MODEL", "openai/gpt-oss-120b")
+LOCALMODEL_MODEL = model_name("annotate")
+COMPARE_RESUME_ON_STARTUP = os.getenv("COMPARE_RESUME_ON_STARTUP", "true").lower() == "true"
+ANNOTATE_MAX_JOBS = int(os.getenv("ANNOTATE_MAX_JOBS", "2"))
+SUMMARY_MAX_JOBS = int(os.getenv("SUMMARY_MAX_JOBS", "2"))
 
 print("🔧 LOCALMODEL_BASE_URL =", LOCALMODEL_BASE_URL)
 print("🔧 LOCALMODEL_MODEL    =", LOCALMODEL_MODEL)
 print("🔧 HAS_API_KEY         =", bool(LOCALMODEL_API_KEY))
 
-_effective_api_key = LOCALMODEL_API_KEY or "local-dev-key"
-
-local_client = OpenAI(
-    api_key=_effective_api_key,
-    base_url=LOCALMODEL_BASE_URL,
-    timeout=300,
-    max_retries=0,
-)
+# client ของ annotate (timeout 300s, max_tokens 2048) อยู่ใน llm_gateway role "annotate"
 
 logger = logging.getLogger(__name__)
 
 # ----------------- FastAPI -----------------
 app = FastAPI(title="Document Versioning Compare API")
+instrument_app(app, "compare")
 
 @app.on_event("startup")
 def on_startup():
     Path("data").mkdir(parents=True, exist_ok=True)
     Path("data/outputs").mkdir(parents=True, exist_ok=True)
     Base.metadata.create_all(bind=engine)
+    added = ensure_columns()
+    if added:
+        logger.info(f"🧱 เพิ่ม column ใหม่: {added}")
     logger.info("✅ DB tables ensured (create_all)")
 
+    removed = CompareCheckpoint.prune()
+    if removed:
+        logger.info(f"🧹 ลบ checkpoint ที่หมดอายุ {removed} งาน")
+
+    # ⭐ งานที่ค้างอยู่ตอน container ถูก restart → ทำต่อจาก checkpoint
+    if COMPARE_RESUME_ON_STARTUP:
+        for ckpt in CompareCheckpoint.list_resumable():
+            logger.info(f"♻️ resume compare job {ckpt.job_id}")
+            start_job_from_checkpoint(ckpt)
+
 # ----------------- Middleware -----------------
 app.add_middleware(
     CORSMiddleware,
@@ -83,44 +103,82 @@ def get_db():
 # 🔥🔥🔥  เพิ่มส่วน JOB + POLLING ตรงนี้  🔥🔥🔥
 # ======================================================
 
-# เก็บสถานะงาน (In-Memory)
-jobs: Dict[str, Dict[str, Any]] = {}
+# เก็บสถานะงาน (In-Memory, จำกัดขนาด + offload result ลงดิสก์)
+jobs = JobRegistry("compare")
 
 def push_log(job_id: str, message: str, progress: int = None):
-    job = jobs[job_id]
-
-    job["logs"].append(message)
-    job["current_step"] = message
-
-    if progress is not None:
-        job["progress"] = progress
+    jobs.push_log(job_id, message, progress)
 
     print(f"[JOB {job_id}] {message}")
 
 def process_compare_job(job_id: str, doc_name: str, v1_label: str, v2_label: str,
-                        file_v1_bytes: bytes, file_v2_bytes: bytes):
+                        file_v1_bytes: bytes, file_v2_bytes: bytes,
+                        refresh_cache: bool = False,
+                        llm_budget: Optional[LLMBudget] = None,
+                        mode: str = "full"):
+    cancel_token: CancellationToken = jobs[job_id]["cancel_token"]
+    checkpoint = CompareCheckpoint(job_id)
     try:
         # 🔹 ต้องรัน async function ใน Thread ด้วย asyncio.run
         import asyncio
 
-        result = asyncio.run(
+        result = asyncio.run(with_loop_clients(
             run_compare(
                 doc_name=doc_name,
                 v1_file_bytes=file_v1_bytes,
                 v2_file_bytes=file_v2_bytes,
                 v1_label=v1_label,
                 v2_label=v2_label,
-                progress_callback=lambda m,p: push_log(job_id, m, p)   # ⭐ เพิ่ม
+                progress_callback=lambda m,p: push_log(job_id, m, p),   # ⭐ เพิ่ม
+                cancel_token=cancel_token,
+                checkpoint=checkpoint,
+                refresh_cache=refresh_cache,
+                llm_budget=llm_budget,
+                mode=mode,
             )
-        )
+        ))
 
-        jobs[job_id]["status"] = "done"
-        jobs[job_id]["result"] = result
+        jobs.set_result(job_id, result)
+        checkpoint.discard()
+
+    except JobCancelled as e:
+        logger.info(f"Job {job_id} cancelled: {e}")
+        jobs.set_status(job_id, "cancelled")
+        checkpoint.discard()
 
     except Exception as e:
         logger.exception(f"Job {job_id} failed")
-        jobs[job_id]["status"] = "error"
-        jobs[job_id]["error"] = str(e)
+        if cancel_token.cancelled:
+            jobs.set_status(job_id, "cancelled")
+            checkpoint.discard()
+        else:
+            jobs.set_status(job_id, "error", error=str(e))
+            # เก็บ checkpoint ไว้ให้ POST /compare/{job_id}/resume ทำต่อได้
+            checkpoint.set_state("failed", error=str(e))
+
+
+def start_job_from_checkpoint(checkpoint: CompareCheckpoint):
+    meta, v1_bytes, v2_bytes = checkpoint.load_inputs()
+    checkpoint.set_state("running")
+
+    jobs.create(checkpoint.job_id, status="processing", cancel_token=CancellationToken())
+    push_log(checkpoint.job_id, "♻️ ทำงานต่อจาก checkpoint")
+
+    threading.Thread(
+        target=process_compare_job,
+        args=(
+            checkpoint.job_id,
+            meta["doc_name"],
+            meta["v1_label"],
+            meta["v2_label"],
+            v1_bytes,
+            v2_bytes,
+            meta.get("refresh_cache", False),
+            LLMBudget.resolve(meta.get("llm_budget_calls"), meta.get("llm_budget_tokens")),
+            meta.get("mode", "full"),
+        ),
+        daemon=True,
+    ).start()
 
 # --------- (ใหม่) API #1: เริ่มงาน → ได้ job_id ---------
 @app.post("/compare")
@@ -130,26 +188,45 @@ async def start_compare_job(
     v2_label: str = Form("v2"),
     file_v1: UploadFile = File(...),
     file_v2: UploadFile = File(...),
+    refresh_cache: bool = Form(False),   # ⭐ True = ไม่ใช้ผล LLM จาก cache (เรียกใหม่ทั้งหมด)
+    # ⭐ งบ LLM ของ comparison นี้ (ไม่ส่ง = ค่าจาก env, 0 = ไม่จำกัด) เกินงบ → change ที่ไม่รุนแรงถูก defer
+    llm_budget_calls: Optional[int] = Form(None),
+    llm_budget_tokens: Optional[int] = Form(None),
+    # ⭐ fast = คืนผล diff (match / severity / highlight) ภายในไม่กี่วินาที ไม่เรียก AI
+    mode: str = Form("full"),
 ):
+    if mode not in COMPARE_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {list(COMPARE_MODES)}")
+
     job_id = str(uuid.uuid4())
 
     v1_bytes = await file_v1.read()
     v2_bytes = await file_v2.read()
 
-    jobs[job_id] = {
-        "status": "processing",
-        "result": None,
-        "error": None,
-        "logs": [],              # ⭐ เพิ่ม
-        "progress": 0,           # ⭐ เพิ่ม
-        "current_step": "starting"  # ⭐ เพิ่ม
-
-    }
+    jobs.create(job_id, status="processing", cancel_token=CancellationToken())
+
+    # ⭐ เก็บ input ไว้ก่อน เผื่อ container restart ระหว่างงาน
+    CompareCheckpoint(job_id).save_inputs(
+        {
+            "doc_name": doc_name,
+            "v1_label": v1_label,
+            "v2_label": v2_label,
+            "refresh_cache": refresh_cache,
+            "llm_budget_calls": llm_budget_calls,
+            "llm_budget_tokens": llm_budget_tokens,
+            "mode": mode,
+        },
+        v1_bytes,
+        v2_bytes,
+    )
 
     # รันงานใน Thread แยก
     threading.Thread(
         target=process_compare_job,
-        args=(job_id, doc_name, v1_label, v2_label, v1_bytes, v2_bytes),
+        args=(
+            job_id, doc_name, v1_label, v2_label, v1_bytes, v2_bytes, refresh_cache,
+            LLMBudget.resolve(llm_budget_calls, llm_budget_tokens), mode,
+        ),
         daemon=True,
     ).start()
 
@@ -158,28 +235,78 @@ async def start_compare_job(
 # --------- (ใหม่) API #2: เช็คสถานะงาน ---------
 @app.get("/compare/status/{job_id}")
 def check_status(job_id: str):
-    if job_id not in jobs:
+    job = jobs.get(job_id)
+    if job is None:
         return {"status": "not_found"}
 
-    job = jobs[job_id]
-
     return {
     "status": job["status"],
     "progress": job.get("progress", 0),
     "current_step": job.get("current_step"),
-    "logs": job.get("logs", [])[-50:]
+    "logs": jobs.tail_logs(job_id, 50)
     }
 
 # --------- (ใหม่) API #3: ดึงผลลัพธ์ ---------
 @app.get("/compare/result/{job_id}")
 def get_result(job_id: str):
-    if job_id not in jobs:
+    job = jobs.get(job_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
 
-    if jobs[job_id]["status"] != "done":
+    if job["status"] != "done":
         raise HTTPException(status_code=400, detail="Job not ready")
 
-    return jobs[job_id]["result"]
+    return jobs.load_result(job_id)
+
+# --------- API #4: ยกเลิกงาน ---------
+@app.delete("/compare/{job_id}")
+def cancel_compare_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if job["status"] != "processing":
+        return {"job_id": job_id, "status": job["status"], "cancelled": False}
+
+    # ตั้ง token → pipeline หยุดที่ stage ถัดไป + cancel LLM calls ที่ค้างอยู่
+    job["cancel_token"].cancel()
+    jobs.set_status(job_id, "cancelled")
+    push_log(job_id, "🛑 ยกเลิกงานแล้ว")
+
+    return {"job_id": job_id, "status": "cancelled", "cancelled": True}
+
+# --------- API #5: ทำงานต่อจาก checkpoint (งานที่ error / ค้างหลัง restart) ---------
+@app.post("/compare/{job_id}/resume")
+def resume_compare_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is not None and job["status"] == "processing":
+        raise HTTPException(status_code=409, detail="Job is still processing")
+
+    checkpoint = CompareCheckpoint(job_id)
+    if not checkpoint.exists:
+        raise HTTPException(status_code=404, detail="Checkpoint not found")
+
+    start_job_from_checkpoint(checkpoint)
+    return {"job_id": job_id, "status": "processing", "resumed": True}
+
+# --------- API #6: ขนาด/สถานะของ job registry ---------
+@app.get("/compare/jobs/stats")
+def get_job_stats():
+    return jobs.stats()
+
+# --------- API #7: ขนาด/สถานะของ LLM response cache ---------
+@app.get("/llm-cache/stats")
+def get_llm_cache_stats():
+    return llm_cache.stats()
+
+# --------- API #8: AIMD concurrency limit ต่อ model ---------
+@app.get("/llm-concurrency/stats")
+def get_llm_concurrency_stats():
+    return llm_concurrency.stats()
+
+@app.get("/llm-breaker/stats")
+def get_llm_breaker_stats():
+    return breaker_stats()
 
 # ======================================================
 # 🔥🔥🔥  จบส่วน JOB + POLLING  🔥🔥🔥
@@ -239,6 +366,38 @@ class AnnotateResultModel(BaseModel):
     comparison_id: int
     updated_count: int
     message: str
+    failed_count: Optional[int] = None
+    failed_change_ids: List[int] = []
+    elapsed_sec: Optional[float] = None
+    llm_usage: Optional[Dict[str, Any]] = None
+
+class EnrichResultModel(BaseModel):
+    change_id: int
+    comparison_id: int
+    ai_status: Optional[str] = None
+    ai_comment: Optional[str] = None
+    ai_suggestion: Optional[str] = None
+    paragraph_topic: Optional[str] = None
+    change_category: Optional[str] = None
+    change_details: Optional[List[Any]] = None
+    model_route: Optional[Dict[str, Any]] = None
+    cluster_id: Optional[int] = None
+    # change อื่นในกลุ่มเดียวกันที่ได้ผลนี้ไปด้วย
+    propagated_to: List[int] = []
+    cached: bool = False
+    elapsed_sec: Optional[float] = None
+
+class SummaryResultModel(BaseModel):
+    comparison_id: int
+    summary_text: str
+    overall_risk_level: str
+    impact_scores: Dict[str, float]
+    risk_comment: str
+    summary_stats: Optional[Dict[str, Any]] = None
+    enriched_count: int = 0
+    pending_count: int = 0
+    elapsed_sec: Optional[float] = None
+    llm_usage: Optional[Dict[str, Any]] = None
 
 class AIChatRequest(BaseModel):
     question: str
@@ -246,120 +405,236 @@ class AIChatRequest(BaseModel):
 class AIChatResponse(BaseModel):
     answer: str
 
-# ----------------- AI / LLM Helpers -----------------
-def call_llm(prompt: str) -> str:
-    if not LOCALMODEL_API_KEY:
-        raise RuntimeError("LOCALMODEL_API_KEY is not set in environment variables")
-
-    print("🚀 CALL_LLM → model =", LOCALMODEL_MODEL, "base =", LOCALMODEL_BASE_URL)
-
-    resp = local_client.chat.completions.create(
-        model=LOCALMODEL_MODEL,
-        messages=[
-            {"role": "system", "content": "..."},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0.2,
-        max_tokens=2048,
-    )
+# ----------------- AI Annotate (background job) -----------------
+# เก็บสถานะงาน annotate แยกจาก compare (status / progress / logs แบบเดียวกัน)
+annotate_jobs = JobRegistry("annotate")
+# จำนวนงาน annotate ที่รันพร้อมกัน (ที่เหลือรอคิว status = "pending")
+_annotate_slots = threading.Semaphore(ANNOTATE_MAX_JOBS)
 
-    content = resp.choices[0].message.content
-    if isinstance(content, list):
-        text = "".join(part.get("text", "") for part in content)
-    else:
-        text = str(content)
 
-    return text.strip()
+def process_annotate_job(job_id: str, comparison_id: int):
+    cancel_token: CancellationToken = annotate_jobs[job_id]["cancel_token"]
 
-def safe_call_llm(prompt: str, retries: int = 2, delay: float = 1.0) -> str:
-    last_exc = None
-    for attempt in range(retries + 1):
+    with _annotate_slots:
+        if cancel_token.cancelled:
+            return
+        annotate_jobs.set_status(job_id, "processing")
         try:
-            return call_llm(prompt)
+            result = asyncio.run(with_loop_clients(
+                run_annotate(
+                    comparison_id,
+                    progress_callback=lambda m, p: annotate_jobs.push_log(job_id, m, p),
+                    cancel_token=cancel_token,
+                )
+            ))
+            annotate_jobs.set_result(job_id, result)
+
+        except JobCancelled as e:
+            logger.info(f"Annotate job {job_id} cancelled: {e}")
+            annotate_jobs.set_status(job_id, "cancelled")
+
         except Exception as e:
-            last_exc = e
-            logger.warning("call_llm attempt %d failed: %s", attempt + 1, str(e))
-            time.sleep(delay)
-    logger.exception("LLM unreachable after retries: %s", last_exc)
-    return ""
-
-# ----------------- AI Annotate Endpoint -----------------
-@app.post("/comparisons/{comparison_id}/annotate", response_model=AnnotateResultModel)
-async def annotate_comparison(comparison_id: int, db=Depends(get_db)):
-    comp = get_comparison_with_changes(db, comparison_id=comparison_id)
+            logger.exception(f"Annotate job {job_id} failed")
+            if cancel_token.cancelled:
+                annotate_jobs.set_status(job_id, "cancelled")
+            else:
+                annotate_jobs.set_status(job_id, "error", error=str(e))
+
+
+@app.post("/comparisons/{comparison_id}/annotate")
+def start_annotate_job(comparison_id: int, db=Depends(get_db)):
+    comp = db.query(Comparison.id).filter(Comparison.id == comparison_id).first()
     if not comp:
         raise HTTPException(status_code=404, detail="Comparison not found")
 
-    updated = 0
-    for ch in comp.changes:
-        try:
-            impact_comment, rewrite_suggestion, scores = generate_rewrite_suggestion_for_row(
-                change_type=ch.change_type,
-                section_label=ch.section_label,
-                old_text=ch.old_text,
-                new_text=ch.new_text,
-                risk_level=ch.risk_level,
-                call_llm=safe_call_llm,
-            )
-        except Exception as e:
-            logger.exception("annotate error for change id=%s: %s", ch.id, e)
-            impact_comment = "การวิเคราะห์ล้มเหลว ช่วยตรวจสอบด้วยตนเอง"
-            rewrite_suggestion = ""
-            scores = {"legal": 0, "financial": 0, "operational": 0}
-
-        ch.ai_comment = impact_comment
-        ch.ai_suggestion = rewrite_suggestion
-
-        ch.legal_score = scores.get("legal", 0)
-        ch.financial_score = scores.get("financial", 0)
-        ch.operational_score = scores.get("operational", 0)
-
-        avg = (ch.legal_score + ch.financial_score + ch.operational_score) / 3
-        if avg >= 3.6:
-            ch.risk_level = "HIGH"
-        elif avg >= 2:
-            ch.risk_level = "MEDIUM"
-        else:
-            ch.risk_level = "LOW"
+    # comparison เดิมกำลัง annotate อยู่ → คืน job เดิม (ไม่ยิง LLM ซ้ำ)
+    for job_id, job in annotate_jobs.items():
+        if job.get("comparison_id") == comparison_id and job["status"] in ("pending", "processing"):
+            return {"job_id": job_id, "comparison_id": comparison_id, "status": job["status"]}
 
-        updated += 1
+    job_id = str(uuid.uuid4())
+    annotate_jobs.create(
+        job_id,
+        status="pending",
+        cancel_token=CancellationToken(),
+        comparison_id=comparison_id,
+    )
+    threading.Thread(
+        target=process_annotate_job,
+        args=(job_id, comparison_id),
+        daemon=True,
+    ).start()
 
-    legal_scores = [c.legal_score for c in comp.changes]
-    financial_scores = [c.financial_score for c in comp.changes]
-    operational_scores = [c.operational_score for c in comp.changes]
+    return {"job_id": job_id, "comparison_id": comparison_id, "status": "pending"}
 
-    def avg_list(xs):
-        return sum(xs) / len(xs) if xs else 0
 
-    comp.legal_score_avg = round(avg_list(legal_scores), 2)
-    comp.financial_score_avg = round(avg_list(financial_scores), 2)
-    comp.operational_score_avg = round(avg_list(operational_scores), 2)
+@app.get("/annotate/status/{job_id}")
+def check_annotate_status(job_id: str):
+    job = annotate_jobs.get(job_id)
+    if job is None:
+        return {"status": "not_found"}
 
-    overall_avg = (
-        comp.legal_score_avg
-        + comp.financial_score_avg
-        + comp.operational_score_avg
-    ) / 3
+    return {
+        "status": job["status"],
+        "comparison_id": job.get("comparison_id"),
+        "progress": job.get("progress", 0),
+        "current_step": job.get("current_step"),
+        "error": job.get("error"),
+        "logs": annotate_jobs.tail_logs(job_id, 50),
+    }
 
-    if overall_avg >= 3.6:
-        comp.overall_risk_level = "HIGH"
-    elif overall_avg >= 2:
-        comp.overall_risk_level = "MEDIUM"
-    else:
-        comp.overall_risk_level = "LOW"
 
-    try:
-        db.commit()
-    except Exception as e:
-        logger.exception("DB commit failed: %s", e)
-        db.rollback()
-        raise HTTPException(status_code=500, detail="Failed to commit AI annotations")
+@app.get("/annotate/result/{job_id}", response_model=AnnotateResultModel)
+def get_annotate_result(job_id: str):
+    job = annotate_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if job["status"] != "done":
+        raise HTTPException(status_code=400, detail="Job not ready")
+
+    return annotate_jobs.load_result(job_id)
+
+
+@app.delete("/annotate/{job_id}")
+def cancel_annotate_job(job_id: str):
+    job = annotate_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if job["status"] not in ("pending", "processing"):
+        return {"job_id": job_id, "status": job["status"], "cancelled": False}
+
+    # ผลที่ commit ไปแล้วยังอยู่ใน DB (commit เป็นชุด)
+    job["cancel_token"].cancel()
+    annotate_jobs.set_status(job_id, "cancelled")
+    annotate_jobs.push_log(job_id, "🛑 ยกเลิกงานแล้ว")
+
+    return {"job_id": job_id, "status": "cancelled", "cancelled": True}
+
+# ----------------- AI เมื่อถูกขอ (คู่กับ compare mode=fast) -----------------
+def _enrich_in_thread(change_id: int, force: bool):
+    # DB (sync) + LLM รันใน thread ของตัวเอง + event loop ของตัวเอง (เหมือน job อื่น) ไม่บล็อก loop หลักของ server
+    return asyncio.run(with_loop_clients(enrich_change(change_id, force=force)))
+
+
+@app.post("/changes/{change_id}/enrich", response_model=EnrichResultModel)
+async def enrich_change_endpoint(change_id: int, force: bool = False):
+    """ai_comment + ai_suggestion ของ change เดียว (วิเคราะห์แล้ว → คืนผลเดิมจาก DB, force=true วิเคราะห์ใหม่)"""
+    result = await run_in_threadpool(_enrich_in_thread, change_id, force)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Change not found")
+    return result
+
+
+# summary / impact ของ comparison เป็น background job (status / progress / logs แบบเดียวกับ annotate)
+summary_jobs = JobRegistry("summary")
+_summary_slots = threading.Semaphore(SUMMARY_MAX_JOBS)
+
+
+def process_summary_job(job_id: str, comparison_id: int, enrich: bool):
+    cancel_token: CancellationToken = summary_jobs[job_id]["cancel_token"]
+
+    with _summary_slots:
+        if cancel_token.cancelled:
+            return
+        summary_jobs.set_status(job_id, "processing")
+        try:
+            result = asyncio.run(with_loop_clients(
+                run_comparison_summary(
+                    comparison_id,
+                    enrich=enrich,
+                    progress_callback=lambda m, p: summary_jobs.push_log(job_id, m, p),
+                    cancel_token=cancel_token,
+                )
+            ))
+            summary_jobs.set_result(job_id, result)
+
+        except JobCancelled as e:
+            logger.info(f"Summary job {job_id} cancelled: {e}")
+            summary_jobs.set_status(job_id, "cancelled")
+
+        except Exception as e:
+            logger.exception(f"Summary job {job_id} failed")
+            if cancel_token.cancelled:
+                summary_jobs.set_status(job_id, "cancelled")
+            else:
+                summary_jobs.set_status(job_id, "error", error=str(e))
+
+
+@app.post("/comparisons/{comparison_id}/summary")
+def start_summary_job(comparison_id: int, enrich: bool = False, db=Depends(get_db)):
+    """
+    สรุปภาพรวม + impact เมื่อถูกขอ
+    enrich=true → วิเคราะห์ change ที่ยังรอ (pending / deferred) ให้ครบก่อนสรุป
+    """
+    comp = db.query(Comparison.id).filter(Comparison.id == comparison_id).first()
+    if not comp:
+        raise HTTPException(status_code=404, detail="Comparison not found")
+
+    # comparison เดิมกำลังสรุปอยู่ → คืน job เดิม
+    for job_id, job in summary_jobs.items():
+        if job.get("comparison_id") == comparison_id and job["status"] in ("pending", "processing"):
+            return {"job_id": job_id, "comparison_id": comparison_id, "status": job["status"]}
 
-    return AnnotateResultModel(
+    job_id = str(uuid.uuid4())
+    summary_jobs.create(
+        job_id,
+        status="pending",
+        cancel_token=CancellationToken(),
         comparison_id=comparison_id,
-        updated_count=updated,
-        message=f"annotated {updated} changes with AI comments, suggestions & scores",
     )
+    threading.Thread(
+        target=process_summary_job,
+        args=(job_id, comparison_id, enrich),
+        daemon=True,
+    ).start()
+
+    return {"job_id": job_id, "comparison_id": comparison_id, "status": "pending"}
+
+
+@app.get("/summary/status/{job_id}")
+def check_summary_status(job_id: str):
+    job = summary_jobs.get(job_id)
+    if job is None:
+        return {"status": "not_found"}
+
+    return {
+        "status": job["status"],
+        "comparison_id": job.get("comparison_id"),
+        "progress": job.get("progress", 0),
+        "current_step": job.get("current_step"),
+        "error": job.get("error"),
+        "logs": summary_jobs.tail_logs(job_id, 50),
+    }
+
+
+@app.get("/summary/result/{job_id}", response_model=SummaryResultModel)
+def get_summary_result(job_id: str):
+    job = summary_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if job["status"] != "done":
+        raise HTTPException(status_code=400, detail="Job not ready")
+
+    return summary_jobs.load_result(job_id)
+
+
+@app.delete("/summary/{job_id}")
+def cancel_summary_job(job_id: str):
+    job = summary_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if job["status"] not in ("pending", "processing"):
+        return {"job_id": job_id, "status": job["status"], "cancelled": False}
+
+    job["cancel_token"].cancel()
+    summary_jobs.set_status(job_id, "cancelled")
+    summary_jobs.push_log(job_id, "🛑 ยกเลิกงานแล้ว")
+
+    return {"job_id": job_id, "status": "cancelled", "cancelled": True}
 
 # ----------------- Generate Report from DB -----------------
 @app.get("/comparisons/{comparison_id}/report")
@@ -1,12 +1,18 @@
 import logging
+import time
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 
-from src.db.session import SessionLocal
+from src.db.session import SessionLocal, engine, Base, ensure_columns
 from src.AI.ai_chat.ai_chat_pipeline import stream_ai_chat, STATUS_PREFIX
+from src.monitoring.metrics import (
+    instrument_app,
+    CHAT_STREAM_DURATION,
+    CHAT_STREAMS_ACTIVE,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +21,13 @@ app = FastAPI(
     title="AI Chat API",
     description="AI streaming chat endpoint for document change discussion"
 )
+instrument_app(app, "chat")
+
+@app.on_event("startup")
+def on_startup():
+    # ตาราง llm_call_logs อาจยังไม่มีถ้า service นี้ขึ้นก่อน
+    Base.metadata.create_all(bind=engine)
+    ensure_columns()
 
 app.add_middleware(
     CORSMiddleware,
@@ -57,16 +70,31 @@ def ai_chat(
             return f"event: {event_name}\n{data_lines}\n"
 
         def generator():
-            for token in stream_ai_chat(
-                change_id=change_id,
-                user_message=req.question,
-                db=db
-            ):
-                if token.startswith(STATUS_PREFIX):
-                    status_text = token[len(STATUS_PREFIX):].strip()
-                    yield _to_sse_event("status", status_text)
-                else:
-                    yield _to_sse_event("chunk", token)
+            started = time.perf_counter()
+            outcome = "ok"
+            CHAT_STREAMS_ACTIVE.inc()
+            try:
+                for token in stream_ai_chat(
+                    change_id=change_id,
+                    user_message=req.question,
+                    db=db
+                ):
+                    if token.startswith(STATUS_PREFIX):
+                        status_text = token[len(STATUS_PREFIX):].strip()
+                        yield _to_sse_event("status", status_text)
+                    else:
+                        if token.startswith("[ERROR]"):
+                            outcome = "error"
+                        yield _to_sse_event("chunk", token)
+            except GeneratorExit:
+                outcome = "disconnected"
+                raise
+            except Exception:
+                outcome = "error"
+                raise
+            finally:
+                CHAT_STREAMS_ACTIVE.dec()
+                CHAT_STREAM_DURATION.observe(time.perf_counter() - started, outcome=outcome)
 
         return StreamingResponse(
             generator(),
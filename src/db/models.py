@@ -6,6 +6,7 @@ from sqlalchemy import (
     ForeignKey,
     DateTime,
     Float,
+    Boolean,
 )
 from sqlalchemy.orm import relationship, Session
 from datetime import datetime
@@ -96,6 +97,59 @@ class Comparison(Base):
     )
 
     changes = relationship("ChangeItem", back_populates="comparison", cascade="all, delete-orphan")
+    stage_profiles = relationship(
+        "ComparisonStageProfile",
+        back_populates="comparison",
+        cascade="all, delete-orphan",
+    )
+    llm_calls = relationship(
+        "LLMCallLog",
+        back_populates="comparison",
+        cascade="all, delete-orphan",
+    )
+
+
+class ComparisonStageProfile(Base):
+    __tablename__ = "comparison_stage_profiles"
+
+    id = Column(Integer, primary_key=True, index=True)
+    comparison_id = Column(Integer, ForeignKey("comparisons.id"), nullable=False, index=True)
+
+    # load / split / embed / match / resolve / diff / ai_comment / ... / report
+    stage = Column(String(50), nullable=False)
+    wall_seconds = Column(Float, nullable=False)
+    cpu_seconds = Column(Float, nullable=True)
+    peak_rss_delta_mb = Column(Float, nullable=True)
+    items = Column(Integer, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    comparison = relationship("Comparison", back_populates="stage_profiles")
+
+
+class LLMCallLog(Base):
+    __tablename__ = "llm_call_logs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # ผูกกับ comparison (compare / annotate) หรือ conversation (chat) อย่างใดอย่างหนึ่ง
+    comparison_id = Column(Integer, ForeignKey("comparisons.id"), nullable=True, index=True)
+    conversation_id = Column(Integer, ForeignKey("chat_conversations.id"), nullable=True, index=True)
+
+    # comment / suggestion / summary / impact / summary_map / annotate / chat / review
+    role = Column(String(50), nullable=False)
+    model = Column(String(255), nullable=True)
+    prompt_tokens = Column(Integer, nullable=True)
+    completion_tokens = Column(Integer, nullable=True)
+    latency_seconds = Column(Float, nullable=False, default=0.0)
+    # ลำดับ retry ของ call นี้ (0 = ครั้งแรก)
+    retries = Column(Integer, nullable=False, default=0)
+    # ได้ผลจาก llm_cache (ไม่ได้เรียก model จริง → token = 0)
+    cache_hit = Column(Boolean, nullable=False, default=False)
+    error = Column(String(100), nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    comparison = relationship("Comparison", back_populates="llm_calls")
 
 
 class ChangeItem(Base):
@@ -113,7 +167,15 @@ class ChangeItem(Base):
     ai_suggestion = Column(Text, nullable=True)
     paragraph_topic = Column(Text, nullable=True)
     change_category = Column(String(50), nullable=True)
+    # ที่มาของ change_category: llm / knn (category_knn) / triage / cluster — index ของ kNN ใช้เฉพาะ llm
+    category_source = Column(String(20), nullable=True)
     change_details = Column(Text, nullable=True)
+    # done / triaged / deferred (เกินงบ LLM รอวิเคราะห์ภายหลัง) / pending (mode=fast) / clustered / failed
+    ai_status = Column(String(20), nullable=True, index=True)
+    # การเลือก model ของ model_router ต่อ role (JSON: {"comment": {"tier": "small", ...}, ...})
+    model_route = Column(Text, nullable=True)
+    # กลุ่มของการแก้ซ้ำ (src.diff.cluster) เลขเดียวกัน = แก้แบบเดียวกัน ผล AI มาจาก change แรกของกลุ่ม (UI ยุบรวมได้)
+    cluster_id = Column(Integer, nullable=True)
     comparison = relationship("Comparison", back_populates="changes")
 
 
@@ -5,7 +5,16 @@ from sqlalchemy.orm import Session
 from fastapi import HTTPException
 import logging
 from src.diff.diff import Change
-from .models import Document, DocumentVersion, Comparison, ChangeItem, DocumentPageText, DocumentVersionText
+from .models import (
+    Document,
+    DocumentVersion,
+    Comparison,
+    ChangeItem,
+    DocumentPageText,
+    DocumentVersionText,
+    ComparisonStageProfile,
+    LLMCallLog,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -84,7 +93,11 @@ def bulk_insert_changes(
             ai_suggestion=ch.get("ai_suggestion"),
             paragraph_topic=ch.get("paragraph_topic"),
             change_category=ch.get("change_category"),
+            category_source=ch.get("category_source"),
             change_details=ch.get("change_details"),
+            ai_status=ch.get("ai_status"),
+            model_route=ch.get("model_route"),
+            cluster_id=ch.get("cluster_id"),
         )
 
         db.add(item)
@@ -205,4 +218,100 @@ def save_document_pages(
         )
 
     db.bulk_save_objects(page_records)
-    db.commit()
\ No newline at end of file
+    db.commit()
+
+def save_stage_profiles(
+    db: Session,
+    comparison_id: int,
+    profiles: List[dict],
+) -> None:
+    """
+    บันทึกเวลา/ทรัพยากรต่อ stage ของ run นั้น (มาจาก StageProfiler.to_list())
+    """
+    db.bulk_save_objects(
+        [
+            ComparisonStageProfile(
+                comparison_id=comparison_id,
+                stage=p["stage"],
+                wall_seconds=p["wall_seconds"],
+                cpu_seconds=p.get("cpu_seconds"),
+                peak_rss_delta_mb=p.get("peak_rss_delta_mb"),
+                items=p.get("items"),
+            )
+            for p in profiles
+        ]
+    )
+    db.commit()
+
+
+def get_stage_profiles(
+    db: Session,
+    comparison_id: Optional[int] = None,
+    limit_runs: Optional[int] = None,
+) -> List[ComparisonStageProfile]:
+    """
+    ดึง stage profile ของ run เดียว หรือของ run ล่าสุด limit_runs รายการ
+    """
+    q = db.query(ComparisonStageProfile)
+
+    if comparison_id is not None:
+        q = q.filter(ComparisonStageProfile.comparison_id == comparison_id)
+    elif limit_runs:
+        recent_ids = [
+            r[0]
+            for r in db.query(ComparisonStageProfile.comparison_id)
+            .distinct()
+            .order_by(desc(ComparisonStageProfile.comparison_id))
+            .limit(limit_runs)
+            .all()
+        ]
+        q = q.filter(ComparisonStageProfile.comparison_id.in_(recent_ids))
+
+    return q.order_by(ComparisonStageProfile.id).all()
+
+
+def save_llm_calls(
+    db: Session,
+    records: List[dict],
+    comparison_id: Optional[int] = None,
+    conversation_id: Optional[int] = None,
+) -> None:
+    """
+    บันทึก LLM call ของงานนั้น (มาจาก LLMCallTracker.to_list())
+    """
+    if not records:
+        return
+    db.bulk_save_objects(
+        [
+            LLMCallLog(
+                comparison_id=comparison_id,
+                conversation_id=conversation_id,
+                role=r["role"],
+                model=r.get("model"),
+                prompt_tokens=r.get("prompt_tokens"),
+                completion_tokens=r.get("completion_tokens"),
+                latency_seconds=r.get("latency_seconds") or 0.0,
+                retries=r.get("retries") or 0,
+                cache_hit=bool(r.get("cache_hit")),
+                error=r.get("error"),
+            )
+            for r in records
+        ]
+    )
+    db.commit()
+
+
+def get_llm_calls(
+    db: Session,
+    comparison_id: Optional[int] = None,
+    conversation_id: Optional[int] = None,
+) -> List[LLMCallLog]:
+    """
+    ดึง LLM call ทั้งหมดของ comparison หรือ conversation
+    """
+    q = db.query(LLMCallLog)
+    if comparison_id is not None:
+        q = q.filter(LLMCallLog.comparison_id == comparison_id)
+    if conversation_id is not None:
+        q = q.filter(LLMCallLog.conversation_id == conversation_id)
+    return q.order_by(LLMCallLog.id).all()
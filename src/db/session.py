@@ -1,6 +1,6 @@
 # src/db/session.py
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 DATABASE_URL = "sqlite:///./data/versioning.db"
@@ -18,3 +18,25 @@ SessionLocal = sessionmaker(
 )
 
 Base = declarative_base()
+
+
+def ensure_columns(bind=engine) -> list:
+    """
+    create_all ไม่เพิ่ม column ใหม่ให้ตารางที่มีอยู่แล้ว
+    → ALTER TABLE ADD COLUMN ให้ column ที่ model มีแต่ตารางยังไม่มี (เฉพาะ column ที่เป็น NULL ได้)
+    เรียกหลัง Base.metadata.create_all ตอน startup
+    """
+    insp = inspect(bind)
+    added = []
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not insp.has_table(table.name):
+                continue
+            existing = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in existing or not col.nullable:
+                    continue
+                col_type = col.type.compile(dialect=bind.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{col.name}" {col_type}'))
+                added.append(f"{table.name}.{col.name}")
+    return added
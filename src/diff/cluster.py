@@ -0,0 +1,289 @@
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import Levenshtein
+import numpy as np
+
+from src.diff.diff import Change
+from src.monitoring.metrics import counter
+
+# ==================================================
+# Config (ปรับได้ผ่าน env)
+# ==================================================
+CLUSTER_ENABLED = os.getenv("CLUSTER_ENABLED", "true").lower() == "true"
+# ตัวอักษรที่เปลี่ยน (รวมสองฝั่ง) มากกว่านี้ = ไม่ใช่ "การแก้ซ้ำทั้งเอกสาร" → ไม่จัดกลุ่ม
+CLUSTER_MAX_EDIT_CHARS = int(os.getenv("CLUSTER_MAX_EDIT_CHARS", "120"))
+# cosine ของ embedding delta (new - old) ขั้นต่ำที่ถือว่าเป็นการแก้แบบเดียวกันในบริบทที่คล้ายกัน
+CLUSTER_MIN_DELTA_COSINE = float(os.getenv("CLUSTER_MIN_DELTA_COSINE", "0.6"))
+# การแก้ที่มีแต่ตัวเลข (ค่าปรับ 5 → 7 / ส่วนลด 5 → 7) บริบทต่างกันได้มาก → ต้องชี้ทางเดียวกันชัดกว่า
+CLUSTER_MIN_DELTA_COSINE_NUMERIC = float(os.getenv("CLUSTER_MIN_DELTA_COSINE_NUMERIC", "0.85"))
+
+# ช่วงที่เหมือนกันสั้นกว่านี้ระหว่างจุดแก้ 2 จุด → รวมเป็นจุดแก้เดียว (opcode ระดับตัวอักษรแตกคำไม่เหมือนกันทุกครั้ง)
+_MERGE_GAP_CHARS = 3
+
+# ai_comment + ai_suggestion ต่อ change (เหมือน triage)
+LLM_CALLS_PER_CHANGE = 2
+
+ROLE_REPRESENTATIVE = "representative"
+ROLE_MEMBER = "member"
+
+# field ที่คัดลอกจากตัวแทนไปให้สมาชิก (paragraph_topic ของสมาชิกมาจากข้อความของตัวเอง)
+PROPAGATED_FIELDS = ("ai_comment", "ai_suggestion", "change_category", "change_details")
+
+CLUSTERED_CHANGES = counter(
+    "cluster_changes_total",
+    "Changes grouped into near-duplicate edit clusters, by role",
+    ["role"],
+)
+
+EditSignature = Tuple[Tuple[str, str], ...]
+
+_NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)*")
+
+
+def paragraph_embeddings(paragraphs) -> Optional[List]:
+    """embedding ของย่อหน้าตาม index (None = ไม่มีย่อหน้าในหน่วยความจำ เช่น resume จาก checkpoint)"""
+    if paragraphs is None:
+        return None
+    return [getattr(p, "embedding", None) for p in paragraphs]
+
+
+def is_cluster_member(change: Change) -> bool:
+    """สมาชิกของกลุ่ม (ไม่ใช่ตัวแทน) → runner ของ AI / งบ LLM ข้ามไป รอรับผลจากตัวแทน"""
+    return getattr(change, "cluster_role", None) == ROLE_MEMBER
+
+
+class EditClusterer:
+    """
+    จัดกลุ่ม change ที่เป็น "การแก้แบบเดียวกันซ้ำทั้งเอกสาร" (เปลี่ยนชื่อหน่วยงาน / รูปแบบวันที่ / อัตราค่าปรับ ...)
+    ให้ LLM วิเคราะห์เฉพาะตัวแทนของแต่ละกลุ่ม แล้วคัดลอกผลไปให้สมาชิก (propagate)
+
+    - signature: จุดที่แก้จาก Levenshtein opcodes (ข้อความเดิม → ข้อความใหม่ ของทุกจุด) ต้องตรงกันทุกตัวอักษร
+      + ตัวเลขทั้งจำนวนที่หายไป / เพิ่มมาต้องตรงกัน (opcode ระดับตัวอักษรของ 15 → 17 กับ 25 → 27 เหมือนกัน)
+    - embedding delta: (embedding ย่อหน้าใหม่ - ย่อหน้าเดิม) ของสมาชิกต้องชี้ทางเดียวกับตัวแทน
+      (การแก้ตัวเลขเดียวกันในบริบทต่างกัน เช่น ค่าปรับ vs ส่วนลด → delta ต่างทิศ ไม่รวมกลุ่ม)
+      signature ที่มีแต่ตัวเลข → ใช้ cosine ขั้นต่ำที่สูงกว่า (min_delta_cosine_numeric)
+      ไม่มี embedding (resume จาก checkpoint ของ matches) → ใช้ signature อย่างเดียว
+    - ตัวแทน = change แรกตามลำดับในเอกสาร / cluster_id เริ่มที่ 1 ต่อ comparison
+
+    เฉพาะ MODIFIED ที่ยังไม่มี ai_comment (หลัง triage)
+    """
+
+    def __init__(
+        self,
+        max_edit_chars: int = CLUSTER_MAX_EDIT_CHARS,
+        min_delta_cosine: float = CLUSTER_MIN_DELTA_COSINE,
+        min_delta_cosine_numeric: float = CLUSTER_MIN_DELTA_COSINE_NUMERIC,
+    ):
+        self.max_edit_chars = max_edit_chars
+        self.min_delta_cosine = min_delta_cosine
+        self.min_delta_cosine_numeric = min_delta_cosine_numeric
+
+    # --------------------------------------------------
+    # signature
+    # --------------------------------------------------
+    def signature(self, old_text: Optional[str], new_text: Optional[str]) -> Optional[EditSignature]:
+        """จุดแก้ทั้งหมดของ change เป็น ((เดิม, ใหม่), ...) หรือ None ถ้าแก้มากเกินกว่าจะเป็นการแก้ซ้ำ"""
+        if not old_text or not new_text or old_text == new_text:
+            return None
+
+        spans: List[List[str]] = []
+        gap: Optional[str] = None
+        edited = 0
+        for tag, i1, i2, j1, j2 in Levenshtein.opcodes(old_text, new_text):
+            if tag == "equal":
+                gap = old_text[i1:i2]
+                continue
+            removed, added = old_text[i1:i2], new_text[j1:j2]
+            edited += len(removed) + len(added)
+            if edited > self.max_edit_chars:
+                return None
+            if spans and gap is not None and len(gap) < _MERGE_GAP_CHARS:
+                spans[-1][0] += gap + removed
+                spans[-1][1] += gap + added
+            else:
+                spans.append([removed, added])
+            gap = None
+
+        sig = tuple((" ".join(a.split()), " ".join(b.split())) for a, b in spans)
+        sig = tuple(s for s in sig if s[0] or s[1])
+        return sig or None
+
+    @staticmethod
+    def number_edits(old_text: str, new_text: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+        """ตัวเลขทั้งจำนวนที่หายไปจากข้อความเดิม / เพิ่มมาในข้อความใหม่"""
+        old_nums = Counter(_NUMBER_RE.findall(old_text))
+        new_nums = Counter(_NUMBER_RE.findall(new_text))
+        return tuple(sorted((old_nums - new_nums).elements())), tuple(sorted((new_nums - old_nums).elements()))
+
+    @staticmethod
+    def is_numeric(sig: EditSignature) -> bool:
+        """ทุกจุดที่แก้เป็นตัวเลขล้วน (ไม่นับ , . และช่องว่าง)"""
+        return all(
+            not re.sub(r"[\d.,\s]", "", a + b) and any(ch.isdigit() for ch in a + b)
+            for a, b in sig
+        )
+
+    # --------------------------------------------------
+    # embedding delta
+    # --------------------------------------------------
+    @staticmethod
+    def _delta(
+        change: Change,
+        old_embeddings: Optional[Sequence],
+        new_embeddings: Optional[Sequence],
+    ) -> Optional[np.ndarray]:
+        if old_embeddings is None or new_embeddings is None:
+            return None
+        if change.old_index is None or change.new_index is None:
+            return None
+        try:
+            old_vec = old_embeddings[change.old_index]
+            new_vec = new_embeddings[change.new_index]
+        except IndexError:
+            return None
+        if old_vec is None or new_vec is None:
+            return None
+        delta = np.asarray(new_vec, dtype=np.float32) - np.asarray(old_vec, dtype=np.float32)
+        norm = float(np.linalg.norm(delta))
+        if norm < 1e-6:
+            return None
+        return delta / norm
+
+    def _same_direction(self, a: Optional[np.ndarray], b: Optional[np.ndarray], numeric: bool = False) -> bool:
+        if a is None or b is None:
+            # ไม่มี embedding ฝั่งใดฝั่งหนึ่ง → เชื่อ signature
+            return True
+        threshold = self.min_delta_cosine_numeric if numeric else self.min_delta_cosine
+        return float(np.dot(a, b)) >= threshold
+
+    # --------------------------------------------------
+    # apply
+    # --------------------------------------------------
+    def cluster(
+        self,
+        changes: List[Change],
+        old_embeddings: Optional[Sequence] = None,
+        new_embeddings: Optional[Sequence] = None,
+    ) -> Dict:
+        """
+        old_embeddings / new_embeddings: embedding ของย่อหน้า V1 / V2 ตาม paragraph index (None = ไม่มี)
+        ตั้ง change.cluster_id / change.cluster_role ให้ทุก change ที่อยู่ในกลุ่มขนาด >= 2
+        """
+        by_sig: Dict[Tuple, List[Change]] = {}
+        for c in changes:
+            if c.change_type != "MODIFIED" or getattr(c, "ai_comment", None):
+                continue
+            sig = self.signature(c.old_text, c.new_text)
+            if sig is not None:
+                key = (sig, self.number_edits(c.old_text, c.new_text))
+                by_sig.setdefault(key, []).append(c)
+
+        # ภายใน signature เดียวกัน: แยกกลุ่มตามทิศของ embedding delta (leader = ตัวแรกในเอกสาร)
+        groups: List[List[Change]] = []
+        for (sig, _), members in by_sig.items():
+            if len(members) < 2:
+                continue
+            numeric = self.is_numeric(sig)
+            leaders: List[Tuple[Optional[np.ndarray], List[Change]]] = []
+            for c in members:
+                delta = self._delta(c, old_embeddings, new_embeddings)
+                for leader_delta, group in leaders:
+                    if self._same_direction(leader_delta, delta, numeric):
+                        group.append(c)
+                        break
+                else:
+                    leaders.append((delta, [c]))
+            groups.extend(g for _, g in leaders if len(g) >= 2)
+
+        # cluster_id ตามลำดับตัวแทนในเอกสาร (เหมือนกันทุกครั้งที่รันซ้ำ)
+        position = {id(c): i for i, c in enumerate(changes)}
+        groups.sort(key=lambda g: position[id(g[0])])
+
+        sizes: Counter = Counter()
+        for cluster_id, group in enumerate(groups, start=1):
+            for k, c in enumerate(group):
+                c.cluster_id = cluster_id
+                c.cluster_role = ROLE_REPRESENTATIVE if k == 0 else ROLE_MEMBER
+            sizes[len(group)] += 1
+            CLUSTERED_CHANGES.inc(role=ROLE_REPRESENTATIVE)
+            CLUSTERED_CHANGES.inc(len(group) - 1, role=ROLE_MEMBER)
+
+        members_count = sum(len(g) - 1 for g in groups)
+        return {
+            "clusters": len(groups),
+            "members": members_count,
+            "by_size": {str(k): v for k, v in sorted(sizes.items())},
+            "llm_calls_saved": members_count * LLM_CALLS_PER_CHANGE,
+        }
+
+
+# ==================================================
+# Propagate ผลของตัวแทน → สมาชิก
+# ==================================================
+def _representatives(changes: List[Change]) -> Dict[int, Change]:
+    return {
+        c.cluster_id: c for c in changes
+        if getattr(c, "cluster_role", None) == ROLE_REPRESENTATIVE
+    }
+
+
+def restore_cluster_roles(changes: List[Change]) -> None:
+    """change ที่โหลดจาก DB มีแต่ cluster_id → ตัวแทน = change แรกของแต่ละกลุ่มตามลำดับในเอกสาร"""
+    seen = set()
+    for c in changes:
+        cluster_id = getattr(c, "cluster_id", None)
+        if cluster_id is None:
+            continue
+        c.cluster_role = ROLE_MEMBER if cluster_id in seen else ROLE_REPRESENTATIVE
+        seen.add(cluster_id)
+
+
+def copy_analysis(rep: Change, member: Change, status: str) -> None:
+    # import ตอนเรียก: category_knn → ai_schedule → module นี้
+    from src.AI.category_knn import prefilled_category
+
+    for f in PROPAGATED_FIELDS:
+        if hasattr(rep, f):
+            setattr(member, f, getattr(rep, f))
+    # สมาชิกที่ kNN จัดหมวดของตัวเองไว้แล้ว → ใช้หมวดของตัวเอง ไม่ใช่ของตัวแทน
+    own_category = prefilled_category(member)
+    if own_category:
+        member.change_category = own_category
+    if not getattr(member, "paragraph_topic", None):
+        member.paragraph_topic = (member.new_text or member.old_text or "").strip()[:80]
+    member.ai_status = status
+
+
+def propagate_clusters(
+    changes: List[Change],
+    status_of,
+    on_done=None,
+) -> List[Change]:
+    """
+    คัดลอกผล AI ของตัวแทนไปให้สมาชิกที่ยังไม่มีผล
+    - status_of(rep) → ai_status ของตัวแทน: ผลจริง → สมาชิกได้ "clustered" / deferred → deferred ตาม
+    - ตัวแทนวิเคราะห์ไม่สำเร็จ (failed / ไม่มีผล) → ปลดสมาชิกออกจากกลุ่ม (ให้ผู้เรียกส่งเข้า LLM เอง)
+    on_done(index, change) ของสมาชิกที่ได้ผล (บันทึก checkpoint) / คืนรายการสมาชิกที่ถูกปลด
+    """
+    # import ตอนเรียก: ai_schedule import module นี้ (is_cluster_member)
+    from src.AI.ai_schedule import AI_STATUS_CLUSTERED, AI_STATUS_DEFERRED, AI_STATUS_FAILED
+
+    reps = _representatives(changes)
+    detached: List[Change] = []
+    for i, c in enumerate(changes):
+        if not is_cluster_member(c) or getattr(c, "ai_comment", None):
+            continue
+        rep = reps.get(c.cluster_id)
+        rep_status = status_of(rep) if rep is not None else None
+        if rep is None or not getattr(rep, "ai_comment", None) or rep_status == AI_STATUS_FAILED:
+            c.cluster_role = None
+            c.cluster_id = None
+            detached.append(c)
+            continue
+        copy_analysis(rep, c, AI_STATUS_DEFERRED if rep_status == AI_STATUS_DEFERRED else AI_STATUS_CLUSTERED)
+        if on_done is not None:
+            on_done(i, c)
+    return detached
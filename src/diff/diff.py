@@ -25,6 +25,10 @@ class Change:
     coverage: Optional[float] = None
     mean_similarity: Optional[float] = None
 
+    # --- ตำแหน่งย่อหน้าใน V1 / V2 (index ของ ParagraphSplitter, ใช้หา embedding ตอนจัดกลุ่ม) ---
+    old_index: Optional[int] = None
+    new_index: Optional[int] = None
+
 
 # ==================================================
 # Diff Engine
@@ -70,6 +74,9 @@ class DiffEngine:
                         similarity=m.similarity,
                         coverage=m.chunk_coverage,
                         mean_similarity=m.mean_chunk_similarity,
+
+                        old_index=m.old_paragraph_index,
+                        new_index=m.new_paragraph_index,
                     )
                 )
 
@@ -87,6 +94,7 @@ class DiffEngine:
                         section_label=f"page {page}" if page is not None else "unknown",
                         old_text=m.old_text,
                         new_text=None,
+                        old_index=m.old_paragraph_index,
                     )
                 )
 
@@ -104,6 +112,7 @@ class DiffEngine:
                         section_label=f"page {page}" if page is not None else "unknown",
                         old_text=None,
                         new_text=m.new_text,
+                        new_index=m.new_paragraph_index,
                     )
                 )
 
@@ -0,0 +1,289 @@
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Tuple
+
+import Levenshtein
+
+from src.diff.diff import Change
+from src.monitoring.metrics import counter
+
+# ==================================================
+# Config (ปรับได้ผ่าน env)
+# ==================================================
+TRIAGE_ENABLED = os.getenv("TRIAGE_ENABLED", "true").lower() == "true"
+TRIAGE_MAX_EDIT_CHARS = int(os.getenv("TRIAGE_MAX_EDIT_CHARS", "3"))
+TRIAGE_MIN_RATIO = float(os.getenv("TRIAGE_MIN_RATIO", "0.95"))
+# ตัวอักษรที่แก้ได้ต่อคำ (สลับตัวอักษรติดกัน recieve → receive นับ 1)
+# เกินนี้ = คนละคำ (increase → decrease / minimum → maximum / ผู้ว่าจ้าง → ผู้รับจ้าง)
+TRIAGE_MAX_WORD_EDIT_CHARS = int(os.getenv("TRIAGE_MAX_WORD_EDIT_CHARS", "1"))
+# รายการคำ (1 คำต่อบรรทัด) → คำเดิมและคำใหม่เป็นคำที่มีอยู่จริงทั้งคู่ = เปลี่ยนคำ ไม่ใช่แก้คำผิด (form → from)
+# ไม่มีไฟล์ → ใช้เพดาน TRIAGE_MAX_WORD_EDIT_CHARS อย่างเดียว
+TRIAGE_WORDLIST_PATH = os.getenv("TRIAGE_WORDLIST_PATH", "/usr/share/dict/words")
+
+# change ที่ triage ตัดสินได้ ไม่ต้องเรียก ai_comment + ai_suggestion (2 calls)
+LLM_CALLS_PER_CHANGE = 2
+
+TRIAGED_CHANGES = counter(
+    "triage_changes_total",
+    "Changes answered by local triage instead of the LLM, by kind",
+    ["kind"],
+)
+
+_THAI_DIGITS = str.maketrans("๐๑๒๓๔๕๖๗๘๙", "0123456789")
+
+# วรรณยุกต์ (่ ้ ๊ ๋): เปลี่ยนจากตัวหนึ่งเป็นอีกตัว = คนละคำ (ค่าปรับ → ค้าปรับ) ไม่ใช่แก้คำผิด
+_THAI_TONE_MARKS = set("\u0e48\u0e49\u0e4a\u0e4b")
+
+# คำปฏิเสธ / modal ที่เพิ่ม/ลบ/เปลี่ยนแค่ไม่กี่ตัวอักษรแต่เปลี่ยนภาระผูกพัน
+_BLOCKED_WORDS = (
+    "ไม่", "มิ", "ห้าม", "not", "no", "n't",
+    "may", "must", "shall", "should",
+    "ต้อง", "อาจ", "ควร",
+)
+
+_WS_RE = re.compile(r"\s+")
+
+_wordlist: Optional[frozenset] = None
+_wordlist_lock = threading.Lock()
+
+
+def known_words() -> frozenset:
+    """คำจาก TRIAGE_WORDLIST_PATH (โหลดครั้งแรกที่ใช้ / ไม่มีไฟล์ = เซตว่าง)"""
+    global _wordlist
+    with _wordlist_lock:
+        if _wordlist is None:
+            try:
+                with open(TRIAGE_WORDLIST_PATH, encoding="utf-8", errors="ignore") as f:
+                    _wordlist = frozenset(w.strip().lower() for w in f if w.strip())
+                print(f"📖 [TRIAGE] โหลดรายการคำ {len(_wordlist)} คำจาก {TRIAGE_WORDLIST_PATH}")
+            except OSError:
+                print(f"⚠️ [TRIAGE] ไม่พบรายการคำ {TRIAGE_WORDLIST_PATH} → ใช้เพดานตัวอักษรต่อคำอย่างเดียว")
+                _wordlist = frozenset()
+        return _wordlist
+
+
+# เครื่องหมายที่เปลี่ยนความหมายของตัวเลข/ค่า (ลบ, เปอร์เซ็นต์, สกุลเงิน, เศษส่วน) → ไม่นับเป็นวรรคตอน
+_MEANINGFUL_PUNCT = set("+-−%$฿€£¥/")
+
+
+def _is_punct(ch: str) -> bool:
+    return unicodedata.category(ch).startswith("P") and ch not in _MEANINGFUL_PUNCT
+
+
+def _strip_ws(text: str) -> str:
+    return _WS_RE.sub("", text)
+
+
+def _strip_punct(text: str) -> str:
+    """ลบช่องว่าง + วรรคตอน ยกเว้นวรรคตอนระหว่างตัวเลข (1,000 / 10.5 → ค่าต่างกันถ้าแก้)"""
+    s = _strip_ws(text)
+    return "".join(
+        ch for i, ch in enumerate(s)
+        if not _is_punct(ch)
+        or (0 < i < len(s) - 1 and s[i - 1].isdigit() and s[i + 1].isdigit())
+    )
+
+
+def _is_content_symbol(ch: str) -> bool:
+    """ตัวเลข / เครื่องหมายที่เหลือหลัง _strip_punct (วรรคตอนในตัวเลข, % ฿ - /) → แก้แล้วค่าเปลี่ยน"""
+    return ch.isdigit() or unicodedata.category(ch)[0] in "PS"
+
+
+def _is_transposition(wa: str, wb: str) -> bool:
+    """สลับตัวอักษรติดกัน 1 คู่ (recieve → receive) = แก้ 1 ครั้ง ไม่ใช่ 2"""
+    if len(wa) != len(wb):
+        return False
+    diff = [i for i, (x, y) in enumerate(zip(wa, wb)) if x != y]
+    return len(diff) == 2 and diff[1] == diff[0] + 1 and wa[diff[0]] == wb[diff[1]] and wa[diff[1]] == wb[diff[0]]
+
+
+# ==================================================
+# Templates
+# ==================================================
+NO_ACTION_SUGGESTION = "ไม่จำเป็นต้องดำเนินการใดๆ เพิ่มเติม"
+
+TEMPLATES = {
+    "whitespace": {
+        "ai_comment": "เป็นการแก้ไขการเว้นวรรคหรือการจัดรูปแบบข้อความเท่านั้น ไม่มีผลต่อเนื้อหา",
+        "detail": "ปรับการเว้นวรรค/การขึ้นบรรทัด",
+    },
+    "punctuation": {
+        "ai_comment": "เป็นการแก้ไขเครื่องหมายวรรคตอนเท่านั้น ไม่มีผลต่อความหมาย",
+        "detail": "ปรับเครื่องหมายวรรคตอน",
+    },
+    "digit_format": {
+        "ai_comment": "เป็นการเปลี่ยนรูปแบบตัวเลข (เลขไทย ↔ เลขอารบิก) ค่าตัวเลขไม่เปลี่ยน",
+        "detail": "เปลี่ยนรูปแบบตัวเลขระหว่างเลขไทยและเลขอารบิก",
+    },
+    "spelling": {
+        "ai_comment": "เป็นการแก้ไขการสะกดคำเล็กน้อย ไม่มีผลต่อความหมาย",
+        "detail": "แก้ไขการสะกดคำ",
+    },
+}
+
+# หมวดสำหรับการแก้ไขเชิงรูปแบบ (ไม่อยู่ใน 8 หมวดของ impact scoring)
+TRIAGE_CATEGORY = "editorial"
+
+
+class TrivialEditTriage:
+    """
+    คัดกรอง change ที่เป็นการแก้ไขเชิงรูปแบบล้วน ๆ (หลัง MatchResolver / DiffEngine)
+    แล้วเติม ai_comment / ai_suggestion / change_category / change_details จาก template
+
+    ตรวจตามลำดับ:
+    - whitespace   : ต่างกันแค่ช่องว่าง / ขึ้นบรรทัด
+    - punctuation  : ต่างกันแค่เครื่องหมายวรรคตอน
+    - digit_format : เลขไทย ↔ เลขอารบิก ค่าเท่าเดิม
+    - spelling     : แก้ไม่เกิน 1 ตัวอักษรต่อคำ ไม่เพิ่ม/แทนทั้งคำ ไม่เปลี่ยนคำจริงเป็นคำจริงอีกคำ
+                     ไม่แตะตัวเลข / คำปฏิเสธ / modal
+
+    change ที่มี ai_comment แล้ว runner ของ AI จะข้ามไปเอง
+    """
+
+    def __init__(
+        self,
+        max_edit_chars: int = TRIAGE_MAX_EDIT_CHARS,
+        min_ratio: float = TRIAGE_MIN_RATIO,
+    ):
+        self.max_edit_chars = max_edit_chars
+        self.min_ratio = min_ratio
+
+    # --------------------------------------------------
+    # classify
+    # --------------------------------------------------
+    def classify(self, old_text: Optional[str], new_text: Optional[str]) -> Optional[Tuple[str, List[str]]]:
+        """คืน (kind, รายการรายละเอียด) หรือ None ถ้าต้องให้ LLM วิเคราะห์"""
+        if not old_text or not new_text or old_text == new_text:
+            return None
+
+        a, b = _strip_ws(old_text), _strip_ws(new_text)
+        if a == b:
+            return "whitespace", []
+
+        pa, pb = _strip_punct(old_text), _strip_punct(new_text)
+        if pa == pb:
+            return "punctuation", []
+
+        if pa.translate(_THAI_DIGITS) == pb.translate(_THAI_DIGITS):
+            return "digit_format", []
+
+        return self._classify_spelling(old_text, new_text)
+
+    def _classify_spelling(self, old_text: str, new_text: str) -> Optional[Tuple[str, List[str]]]:
+        """
+        แก้คำผิดเล็กน้อย: เทียบทีละคำ (แยกด้วยช่องว่าง)
+        - เพิ่ม / ลบ / แทนทั้งคำ → ไม่ใช่คำผิด
+        - แต่ละคำ: แก้ไม่เกิน TRIAGE_MAX_WORD_EDIT_CHARS ตัว และรวมทั้ง change <= max_edit_chars
+          (นับสระ/วรรณยุกต์ด้วย, เปลี่ยนวรรณยุกต์เป็นอีกตัว = คนละคำ)
+          ภาษาไทยแยกด้วยช่องว่างได้ทั้งวลี → เพดานต่อ "คำ" ไม่ขึ้นกับความยาว (ไม่ใช้สัดส่วน)
+        - คำเดิมและคำใหม่อยู่ในรายการคำทั้งคู่ → เปลี่ยนคำ ไม่ใช่แก้คำผิด
+        - ไม่แตะตัวเลข / คำปฏิเสธ / modal
+        """
+        if Levenshtein.ratio(_strip_punct(old_text), _strip_punct(new_text)) < self.min_ratio:
+            return None
+
+        la, lb = old_text.lower(), new_text.lower()
+        if any(la.count(w) != lb.count(w) for w in _BLOCKED_WORDS):
+            return None
+
+        words_a = [w for w in (_strip_punct(t) for t in old_text.split()) if w]
+        words_b = [w for w in (_strip_punct(t) for t in new_text.split()) if w]
+
+        edited = 0
+        edits: List[str] = []
+        for tag, i1, i2, j1, j2 in SequenceMatcher(None, words_a, words_b, autojunk=False).get_opcodes():
+            if tag == "equal":
+                continue
+            # เพิ่ม / ลบทั้งคำ หรือจำนวนคำไม่เท่ากัน (contractor → sub contractor)
+            if tag != "replace" or i2 - i1 != j2 - j1:
+                return None
+            for wa, wb in zip(words_a[i1:i2], words_b[j1:j2]):
+                cost = self._word_edit_cost(wa, wb)
+                if cost is None:
+                    return None
+                edited += cost
+                if edited > self.max_edit_chars:
+                    return None
+                edits.append(f"{wa} → {wb}")
+
+        if not edits:
+            return None
+        return "spelling", edits
+
+    @staticmethod
+    def _word_edit_cost(wa: str, wb: str) -> Optional[int]:
+        """ระยะแก้ไขของคำที่ถือว่าเป็นการแก้คำผิด หรือ None ถ้าเป็นคนละคำ"""
+        # เพิ่มคำนำหน้า/ต่อท้ายทั้งก้อน (contractor → subcontractor, day → days ยังได้)
+        if (wa in wb or wb in wa) and abs(len(wa) - len(wb)) >= 2:
+            return None
+
+        words = known_words()
+        if wa.lower() in words and wb.lower() in words:
+            return None
+
+        cost = 0
+        for tag, i1, i2, j1, j2 in Levenshtein.opcodes(wa, wb):
+            if tag == "equal":
+                continue
+            removed, added = wa[i1:i2], wb[j1:j2]
+            # ตัวเลข / วรรคตอนในตัวเลข / % ฿ เปลี่ยน = เนื้อหาเปลี่ยน (เช่น 30 วัน → 60 วัน)
+            if any(_is_content_symbol(ch) for ch in removed + added):
+                return None
+            if set(removed) & _THAI_TONE_MARKS and set(added) & _THAI_TONE_MARKS:
+                return None
+            cost += max(len(removed), len(added))
+
+        if _is_transposition(wa, wb):
+            cost = 1
+
+        if cost > TRIAGE_MAX_WORD_EDIT_CHARS:
+            return None
+        return cost
+
+    # --------------------------------------------------
+    # apply
+    # --------------------------------------------------
+    def _fill(self, change: Change, kind: str, edits: List[str]) -> None:
+        tpl = TEMPLATES[kind]
+
+        details = [{"type": "modified", "description": tpl["detail"]}]
+        for e in edits[:5]:
+            details.append({"type": "modified", "description": f"{tpl['detail']}: {e}"})
+
+        change.ai_comment = tpl["ai_comment"]
+        change.ai_suggestion = NO_ACTION_SUGGESTION
+        change.change_category = TRIAGE_CATEGORY
+        change.change_details = details
+        if not getattr(change, "paragraph_topic", None):
+            change.paragraph_topic = (change.new_text or "").strip()[:80]
+        change.triage = kind
+
+    def triage(self, changes: List[Change]) -> Dict:
+        by_kind: Counter = Counter()
+
+        for c in changes:
+            if c.change_type != "MODIFIED" or getattr(c, "ai_comment", None):
+                continue
+            # HEAVY = resolver เห็นว่าเนื้อหาเปลี่ยนมาก ไม่ต้องลอง
+            if c.edit_severity == "HEAVY":
+                continue
+
+            result = self.classify(c.old_text, c.new_text)
+            if result is None:
+                continue
+
+            kind, edits = result
+            self._fill(c, kind, edits)
+            by_kind[kind] += 1
+            TRIAGED_CHANGES.inc(kind=kind)
+
+        triaged = sum(by_kind.values())
+        return {
+            "triaged": triaged,
+            "by_kind": dict(by_kind),
+            "llm_calls_saved": triaged * LLM_CALLS_PER_CHANGE,
+        }
@@ -1,8 +1,10 @@
+import time
 import torch
 import numpy as np
 from transformers import AutoTokenizer, AutoModel
 from typing import List
 from src.ingestion.paragraph import Paragraph
+from src.monitoring.metrics import observe_embedding
 
 
 class EmbeddingService:
@@ -114,8 +116,12 @@ class EmbeddingService:
         - p.embedding        : mean(chunk_embeddings)
         """
 
+        started = time.perf_counter()
+        chunk_count = 0
+
         for p in paragraphs:
             token_chunks = self._chunk_tokens(p.text)
+            chunk_count += len(token_chunks)
             chunk_tensor = self._embed_token_chunks(token_chunks)
 
             if chunk_tensor.numel() == 0:
@@ -130,3 +136,5 @@ class EmbeddingService:
 
             # ✅ paragraph embedding (สำหรับ matcher)
             p.embedding = np.mean(chunk_tensor.cpu().numpy(), axis=0).tolist()
+
+        observe_embedding(len(paragraphs), chunk_count, time.perf_counter() - started)
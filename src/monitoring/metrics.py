@@ -0,0 +1,367 @@
+"""
+Metrics แบบ Prometheus text format (ไม่พึ่ง service/ไลบรารีภายนอก)
+
+ใช้ร่วมกันทั้ง 3 service (compare / history / chat):
+- latency ต่อ route ของ HTTP
+- จำนวนงานที่รอ / กำลังรันใน JobRegistry
+- latency / error / retry ของ LLM ต่อ role + model
+- throughput ของ embedding
+- ระยะเวลา SSE stream ของ chat
+"""
+
+import math
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+STREAM_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(v: float) -> str:
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+# ==================================================
+# Metric types
+# ==================================================
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, v in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}"
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._callbacks: List[Callable[[], Dict[Tuple[str, ...], float]]] = []
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def add_callback(self, fn: Callable[[], Dict[Tuple[str, ...], float]]) -> None:
+        """fn() คืน {label_values_tuple: value} ตอน scrape"""
+        with self._lock:
+            self._callbacks.append(fn)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+            callbacks = list(self._callbacks)
+        for fn in callbacks:
+            try:
+                for key, v in fn().items():
+                    values[key] = values.get(key, 0.0) + v
+            except Exception:
+                continue
+        for key, v in values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}"
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = HTTP_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(k, list(c), self._sums.get(k, 0.0)) for k, c in self._counts.items()]
+        for key, counts, total in items:
+            for bound, c in zip(self.buckets, counts):
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {c}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {counts[-1]}"
+
+
+# ==================================================
+# Registry
+# ==================================================
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(m.render() for m in metrics) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name, documentation, labelnames=()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=HTTP_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# ==================================================
+# Shared metrics
+# ==================================================
+HTTP_LATENCY = histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency per route",
+    ["service", "method", "route", "status"],
+)
+
+JOBS = gauge(
+    "jobs_current",
+    "Jobs currently held in a job registry, by status",
+    ["registry", "status"],
+)
+JOBS_QUEUE_DEPTH = gauge(
+    "jobs_queue_depth",
+    "Jobs accepted but not started yet",
+    ["registry"],
+)
+JOBS_RUNNING = gauge(
+    "jobs_running",
+    "Jobs currently running",
+    ["registry"],
+)
+
+LLM_LATENCY = histogram(
+    "llm_call_duration_seconds",
+    "LLM call latency per role and model",
+    ["role", "model", "outcome"],
+    buckets=LLM_BUCKETS,
+)
+LLM_ERRORS = counter(
+    "llm_call_errors_total",
+    "LLM call failures per role, model and error class",
+    ["role", "model", "error"],
+)
+LLM_RETRIES = counter(
+    "llm_call_retries_total",
+    "LLM call retries per role and model",
+    ["role", "model"],
+)
+
+EMBED_PARAGRAPHS = counter(
+    "embedding_paragraphs_total",
+    "Paragraphs embedded",
+)
+EMBED_CHUNKS = counter(
+    "embedding_chunks_total",
+    "Token chunks embedded",
+)
+EMBED_SECONDS = counter(
+    "embedding_seconds_total",
+    "Wall time spent embedding (paragraphs_total / seconds_total = throughput)",
+)
+
+CHAT_STREAM_DURATION = histogram(
+    "chat_stream_duration_seconds",
+    "SSE chat stream duration from first byte to close",
+    ["outcome"],
+    buckets=STREAM_BUCKETS,
+)
+CHAT_STREAMS_ACTIVE = gauge(
+    "chat_streams_active",
+    "SSE chat streams currently open",
+)
+
+
+# ==================================================
+# Helpers
+# ==================================================
+_QUEUED_STATUSES = {"pending"}
+_RUNNING_STATUSES = {"processing", "running"}
+
+
+def track_job_registry(registry) -> None:
+    """ผูก JobRegistry เข้ากับ gauge (อ่านค่าตอน scrape, ไม่ถือ reference ถาวร)"""
+    ref = weakref.ref(registry)
+
+    def _by_status():
+        reg = ref()
+        if reg is None:
+            return {}
+        return {(reg.name, s): float(n) for s, n in reg.status_counts().items()}
+
+    def _filtered(statuses):
+        def _fn():
+            reg = ref()
+            if reg is None:
+                return {}
+            counts = reg.status_counts()
+            return {(reg.name,): float(sum(counts.get(s, 0) for s in statuses))}
+        return _fn
+
+    JOBS.add_callback(_by_status)
+    JOBS_QUEUE_DEPTH.add_callback(_filtered(_QUEUED_STATUSES))
+    JOBS_RUNNING.add_callback(_filtered(_RUNNING_STATUSES))
+
+
+def observe_llm_call(
+    role: str,
+    model: Optional[str],
+    seconds: float,
+    error: Optional[BaseException] = None,
+) -> None:
+    model = model or "unknown"
+    outcome = "error" if error is not None else "ok"
+    LLM_LATENCY.observe(seconds, role=role, model=model, outcome=outcome)
+    if error is not None:
+        LLM_ERRORS.inc(role=role, model=model, error=type(error).__name__)
+
+
+@contextmanager
+def llm_call_timer(role: str, model: Optional[str]):
+    """จับเวลา LLM call 1 ครั้ง (นับ error ตาม class ของ exception)"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        observe_llm_call(role, model, time.perf_counter() - start, error=e)
+        raise
+    observe_llm_call(role, model, time.perf_counter() - start)
+
+
+def observe_embedding(paragraphs: int, chunks: int, seconds: float) -> None:
+    EMBED_PARAGRAPHS.inc(paragraphs)
+    EMBED_CHUNKS.inc(chunks)
+    EMBED_SECONDS.inc(seconds)
+
+
+def render_latest() -> str:
+    return REGISTRY.render()
+
+
+# ==================================================
+# FastAPI integration
+# ==================================================
+def instrument_app(app, service: str) -> None:
+    """เพิ่ม middleware วัด latency ต่อ route + endpoint GET /metrics"""
+    from fastapi import Request
+    from fastapi.responses import Response
+
+    @app.middleware("http")
+    async def _metrics_middleware(request: Request, call_next):
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = request.scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            if route_path != "/metrics":
+                HTTP_LATENCY.observe(
+                    time.perf_counter() - start,
+                    service=service,
+                    method=request.method,
+                    route=route_path,
+                    status=str(status),
+                )
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics_endpoint():
+        return Response(content=render_latest(), media_type=CONTENT_TYPE)
@@ -0,0 +1,205 @@
+import os
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+from src.db.session import SessionLocal
+from src.db.ops import get_comparison_with_changes, save_llm_calls
+from src.AI.llm_accounting import begin_call_tracking
+from src.AI.agent_rewrite import agenerate_rewrite_suggestion_for_row
+from src.AI.llm_gateway import acomplete, model_name
+from src.AI.llm_retry import CircuitOpenError, RetryPolicy, aretry
+from src.service.cancellation import CancellationToken, gather_cancellable
+
+logger = logging.getLogger(__name__)
+
+# ==================================================
+# Config (ปรับได้ผ่าน env)
+# ==================================================
+# fan-out ของงาน annotate งานเดียว (request จริงไป model server คุมโดย llm_slot ใน gateway)
+ANNOTATE_PARALLEL_LIMIT = int(os.getenv("ANNOTATE_PARALLEL_LIMIT", os.getenv("LLM_PARALLEL_LIMIT", "8")))
+# commit ลง DB ทุก ๆ N change ที่เสร็จ (งานถูกยกเลิก/ล่มกลางทาง ผลที่ได้แล้วไม่หาย)
+ANNOTATE_COMMIT_EVERY = int(os.getenv("ANNOTATE_COMMIT_EVERY", "20"))
+
+ANNOTATE_MODEL = model_name("annotate")
+
+
+# ==================================================
+# LLM call (async: slot + metrics ใน gateway, backoff + breaker ใน llm_retry)
+# ==================================================
+async def acall_llm(prompt: str) -> str:
+    return await acomplete("annotate", prompt, system="...")
+
+
+class EmptyLLMResponse(RuntimeError):
+    """model ตอบว่าง → นับเป็น call ที่ล้ม (retry ได้)"""
+
+
+async def acall_llm_checked(prompt: str) -> str:
+    raw = await acall_llm(prompt)
+    if not (raw or "").strip():
+        raise EmptyLLMResponse("empty response from annotate model")
+    return raw
+
+
+async def acall_llm_with_retry(prompt: str, retries: int = 2, delay: float = 1.0) -> str:
+    """
+    backoff + breaker ของ llm_retry — error สุดท้าย (รวม CircuitOpenError / ตอบว่าง) ส่งต่อให้ผู้เรียก
+    → annotate_one นับเป็น failed และไม่บันทึกคะแนน default ลง change นั้น
+    """
+    return await aretry(
+        lambda: acall_llm_checked(prompt),
+        role="annotate",
+        model=ANNOTATE_MODEL,
+        policy=RetryPolicy(max_retries=retries, base_delay=delay),
+    )
+
+
+def _risk_level(avg: float) -> str:
+    if avg >= 3.6:
+        return "HIGH"
+    if avg >= 2:
+        return "MEDIUM"
+    return "LOW"
+
+
+def _apply_scores(ch, impact_comment: str, rewrite_suggestion: str, scores: Dict) -> None:
+    ch.ai_comment = impact_comment
+    ch.ai_suggestion = rewrite_suggestion
+
+    ch.legal_score = scores.get("legal", 0)
+    ch.financial_score = scores.get("financial", 0)
+    ch.operational_score = scores.get("operational", 0)
+
+    avg = (ch.legal_score + ch.financial_score + ch.operational_score) / 3
+    ch.risk_level = _risk_level(avg)
+
+
+def _apply_comparison_averages(comp) -> None:
+    def avg_list(xs):
+        xs = [x for x in xs if x is not None]
+        return sum(xs) / len(xs) if xs else 0
+
+    comp.legal_score_avg = round(avg_list([c.legal_score for c in comp.changes]), 2)
+    comp.financial_score_avg = round(avg_list([c.financial_score for c in comp.changes]), 2)
+    comp.operational_score_avg = round(avg_list([c.operational_score for c in comp.changes]), 2)
+
+    overall_avg = (
+        comp.legal_score_avg
+        + comp.financial_score_avg
+        + comp.operational_score_avg
+    ) / 3
+    comp.overall_risk_level = _risk_level(overall_avg)
+
+
+# ==================================================
+# Annotate job
+# ==================================================
+async def run_annotate(
+    comparison_id: int,
+    progress_callback=None,
+    cancel_token: Optional[CancellationToken] = None,
+) -> dict:
+    """
+    วิเคราะห์ความเสี่ยง + rewrite suggestion ของทุก change ใน comparison (พร้อมกัน)
+    - ผลของแต่ละ change ถูกเขียนลง ORM ทันที และ commit เป็นชุด ๆ ทุก ANNOTATE_COMMIT_EVERY รายการ
+    - ทุก task รันใน event loop เดียวกัน → ใช้ Session เดียวได้ (ไม่มี thread อื่นแตะ)
+    """
+
+    def log(msg, progress=None):
+        print(msg)
+        if progress_callback:
+            progress_callback(msg, progress)
+
+    start_time = time.perf_counter()
+    call_tracker = begin_call_tracking()
+    db = SessionLocal()
+    try:
+        comp = get_comparison_with_changes(db, comparison_id=comparison_id)
+        if comp is None:
+            raise ValueError(f"Comparison {comparison_id} not found")
+
+        changes = list(comp.changes)
+        total = len(changes)
+        log(f"🤖 เริ่ม annotate {total} changes (comparison {comparison_id})", 0)
+
+        semaphore = asyncio.Semaphore(ANNOTATE_PARALLEL_LIMIT)
+        state = {"done": 0, "failed": 0, "uncommitted": 0, "commits": 0}
+        failed_ids = []
+
+        def commit_batch(final: bool = False) -> None:
+            if not final and state["uncommitted"] < ANNOTATE_COMMIT_EVERY:
+                return
+            try:
+                db.commit()
+                state["commits"] += 1
+                state["uncommitted"] = 0
+            except Exception:
+                db.rollback()
+                raise
+
+        async def annotate_one(ch) -> None:
+            async with semaphore:
+                try:
+                    impact_comment, rewrite_suggestion, scores = await agenerate_rewrite_suggestion_for_row(
+                        change_type=ch.change_type,
+                        section_label=ch.section_label,
+                        old_text=ch.old_text,
+                        new_text=ch.new_text,
+                        risk_level=ch.risk_level,
+                        acall_llm=acall_llm_with_retry,
+                    )
+                except CircuitOpenError as e:
+                    logger.warning("annotate skipped for change id=%s: %s", ch.id, e)
+                    impact_comment = None
+                except Exception as e:
+                    logger.exception("annotate error for change id=%s: %s", ch.id, e)
+                    impact_comment = None
+
+            if impact_comment is None:
+                # LLM ล้ม → ไม่เขียนคะแนน default ทับ (change คงค่าเดิม) นับเป็น failed
+                state["failed"] += 1
+                failed_ids.append(ch.id)
+                log(f"  ❌ annotate ล้ม change id={ch.id} ({state['failed']} รายการ)")
+                return
+
+            _apply_scores(ch, impact_comment, rewrite_suggestion, scores)
+            state["done"] += 1
+            state["uncommitted"] += 1
+            commit_batch()
+
+            # progress 0–95 (5% สุดท้าย = คะแนนรวม + commit)
+            finished = state["done"] + state["failed"]
+            log(f"  ✅ annotate {state['done']}/{total}", int(finished * 95 / max(total, 1)))
+
+        try:
+            await gather_cancellable([annotate_one(ch) for ch in changes], cancel_token)
+        finally:
+            # ยกเลิก/ล่มกลางทาง → เก็บผลที่ได้แล้วไว้
+            if state["uncommitted"]:
+                commit_batch(final=True)
+
+        _apply_comparison_averages(comp)
+        commit_batch(final=True)
+
+        elapsed = time.perf_counter() - start_time
+        log(f"💾 annotate เสร็จ {state['done']} changes ใน {elapsed:.1f}s ({state['commits']} commits)", 100)
+
+        return {
+            "comparison_id": comparison_id,
+            "updated_count": state["done"],
+            "failed_count": state["failed"],
+            "failed_change_ids": failed_ids,
+            "message": f"annotated {state['done']} changes with AI comments, suggestions & scores",
+            "elapsed_sec": round(elapsed, 2),
+            "llm_usage": call_tracker.summary(),
+        }
+    finally:
+        # ถูกยกเลิก/ล่มกลางทาง → call ที่ทำไปแล้วก็ยังถูกบันทึก
+        try:
+            save_llm_calls(db, call_tracker.to_list(), comparison_id=comparison_id)
+        except Exception as e:
+            db.rollback()
+            logger.warning("save llm calls failed: %s", e)
+        db.close()
@@ -0,0 +1,83 @@
+import asyncio
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+
+class JobCancelled(Exception):
+    """ถูกยกเลิกโดยผู้ใช้ (DELETE job) ระหว่างรัน pipeline"""
+
+
+class CancellationToken:
+    """
+    token สำหรับยกเลิกงานแบบ cooperative
+    - ฝั่ง API เรียก cancel() จาก thread ไหนก็ได้
+    - ฝั่ง pipeline เรียก raise_if_cancelled() ระหว่าง stage
+    - task ที่ attach ไว้ (เช่น LLM calls ใน asyncio.gather) จะถูก cancel ทันที
+      ทำให้ HTTP request ที่ค้างอยู่กับ model server ถูกตัดไปด้วย
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._tasks: List[Tuple[asyncio.AbstractEventLoop, asyncio.Task]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        self._event.set()
+        with self._lock:
+            tasks = list(self._tasks)
+            self._tasks.clear()
+
+        for loop, task in tasks:
+            if loop.is_closed():
+                continue
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                # loop ปิดไปแล้วระหว่างทาง
+                pass
+
+    def raise_if_cancelled(self, stage: Optional[str] = None) -> None:
+        if self._event.is_set():
+            raise JobCancelled(f"job cancelled{f' at {stage}' if stage else ''}")
+
+    def attach(self, tasks: Iterable[asyncio.Task]) -> None:
+        """ผูก task ของ event loop ปัจจุบัน ถ้ายกเลิกไปแล้วจะ cancel ทันที"""
+        loop = asyncio.get_running_loop()
+        pairs = [(loop, t) for t in tasks]
+
+        with self._lock:
+            if not self._event.is_set():
+                self._tasks.extend(pairs)
+                return
+
+        for _, task in pairs:
+            task.cancel()
+
+    def detach(self, tasks: Iterable[asyncio.Task]) -> None:
+        done = set(id(t) for t in tasks)
+        with self._lock:
+            self._tasks = [(l, t) for l, t in self._tasks if id(t) not in done]
+
+
+async def gather_cancellable(coros, cancel_token: Optional[CancellationToken] = None):
+    """
+    asyncio.gather(..., return_exceptions=True) ที่ผูกกับ CancellationToken
+    - ถ้าถูกยกเลิก → task ที่ค้างถูก cancel แล้ว raise JobCancelled
+    """
+    tasks = [asyncio.ensure_future(c) for c in coros]
+
+    if cancel_token is None:
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    cancel_token.attach(tasks)
+    try:
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        cancel_token.detach(tasks)
+
+    cancel_token.raise_if_cancelled()
+    return results
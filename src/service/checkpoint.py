@@ -0,0 +1,225 @@
+import json
+import os
+import shutil
+import threading
+import time
+import logging
+from dataclasses import asdict, fields
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.diff.diff import Change
+from src.match.paragraph_match import MatchResult
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DIR = os.getenv("COMPARE_CHECKPOINT_DIR", "data/checkpoints")
+CHECKPOINT_TTL_SEC = float(os.getenv("COMPARE_CHECKPOINT_TTL_SEC", str(7 * 24 * 3600)))
+
+# field ที่ AI stage เติมลงบน Change (ไม่อยู่ใน dataclass)
+AI_FIELDS = (
+    "ai_comment",
+    "ai_suggestion",
+    "paragraph_topic",
+    "change_category",
+    "change_details",
+    "ai_status",
+    "model_route",
+    # ชนิดการแก้เชิงรูปแบบที่ triage ตอบเอง (ai_status_of → triaged / category_source → triage)
+    "triage",
+    # กลุ่มการแก้ซ้ำ (ตั้งตอน diff, ตัวแทน / สมาชิก)
+    "cluster_id",
+    "cluster_role",
+    # หมวดที่ kNN เดาไว้ก่อนเรียก LLM (category_knn)
+    "category_prefill",
+)
+
+
+# ==================================================
+# (de)serialize helpers
+# ==================================================
+def pages_to_json(pages) -> List[dict]:
+    return [{"page_number": p.page_number, "text": p.text} for p in pages]
+
+
+def pages_from_json(rows: List[dict]):
+    from src.ingestion.document_load import PageText
+    return [PageText(page_number=r["page_number"], text=r["text"]) for r in rows]
+
+
+def matches_to_json(matches: List[MatchResult]) -> List[dict]:
+    return [asdict(m) | {"edit_severity": getattr(m, "edit_severity", None)} for m in matches]
+
+
+def matches_from_json(rows: List[dict]) -> List[MatchResult]:
+    names = {f.name for f in fields(MatchResult)}
+    out = []
+    for r in rows:
+        m = MatchResult(**{k: v for k, v in r.items() if k in names})
+        if r.get("edit_severity") is not None:
+            m.edit_severity = r["edit_severity"]
+        out.append(m)
+    return out
+
+
+def change_to_json(c: Change) -> dict:
+    data = asdict(c)
+    for f in AI_FIELDS:
+        if hasattr(c, f):
+            data[f] = getattr(c, f)
+    return data
+
+
+def change_from_json(row: dict) -> Change:
+    names = {f.name for f in fields(Change)}
+    c = Change(**{k: v for k, v in row.items() if k in names})
+    for f in AI_FIELDS:
+        if row.get(f) is not None:
+            setattr(c, f, row[f])
+    return c
+
+
+# ==================================================
+# Checkpoint store
+# ==================================================
+class CompareCheckpoint:
+    """
+    checkpoint ของงาน compare 1 งาน (1 โฟลเดอร์ต่อ job_id)
+
+    - inputs.json + v1.bin / v2.bin : ข้อมูลตั้งต้น (ใช้ resume หลัง container restart)
+    - <stage>.json                  : ผลของ stage ที่เสร็จแล้ว (pages / matches / changes / ...)
+    - ai_fields.jsonl               : ผล AI ของแต่ละ change (append ทันทีที่ได้)
+    - state.json                    : running / failed / complete
+    """
+
+    def __init__(self, job_id: str, base_dir: str = CHECKPOINT_DIR):
+        self.job_id = job_id
+        self.dir = Path(base_dir) / job_id
+        self._lock = threading.Lock()
+
+    # --------------------------------------------------
+    # low-level
+    # --------------------------------------------------
+    def _write_json(self, name: str, data: Any) -> None:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.dir / f".{name}.tmp"
+        tmp.write_text(json.dumps(data, ensure_ascii=False, default=str), encoding="utf-8")
+        os.replace(tmp, self.dir / name)
+
+    def _read_json(self, name: str) -> Any:
+        return json.loads((self.dir / name).read_text(encoding="utf-8"))
+
+    @property
+    def exists(self) -> bool:
+        return (self.dir / "inputs.json").exists()
+
+    # --------------------------------------------------
+    # inputs
+    # --------------------------------------------------
+    def save_inputs(self, meta: Dict[str, Any], v1_bytes: bytes, v2_bytes: bytes) -> None:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        (self.dir / "v1.bin").write_bytes(v1_bytes)
+        (self.dir / "v2.bin").write_bytes(v2_bytes)
+        self._write_json("inputs.json", meta)
+        self.set_state("running")
+
+    def load_inputs(self) -> Tuple[Dict[str, Any], bytes, bytes]:
+        meta = self._read_json("inputs.json")
+        return meta, (self.dir / "v1.bin").read_bytes(), (self.dir / "v2.bin").read_bytes()
+
+    # --------------------------------------------------
+    # state
+    # --------------------------------------------------
+    def set_state(self, state: str, **extra) -> None:
+        self._write_json("state.json", {"state": state, "updated_at": time.time(), **extra})
+
+    def state(self) -> Dict[str, Any]:
+        try:
+            return self._read_json("state.json")
+        except (OSError, ValueError):
+            return {"state": "unknown", "updated_at": 0}
+
+    # --------------------------------------------------
+    # stages
+    # --------------------------------------------------
+    def has(self, stage: str) -> bool:
+        return (self.dir / f"{stage}.json").exists()
+
+    def save_stage(self, stage: str, data: Any) -> None:
+        self._write_json(f"{stage}.json", data)
+
+    def load_stage(self, stage: str) -> Any:
+        return self._read_json(f"{stage}.json")
+
+    # --------------------------------------------------
+    # per-change AI fields
+    # --------------------------------------------------
+    def record_ai_fields(self, index: int, change: Change, names: Tuple[str, ...] = AI_FIELDS) -> None:
+        row = {"index": index}
+        for f in names:
+            if hasattr(change, f):
+                row[f] = getattr(change, f)
+
+        line = json.dumps(row, ensure_ascii=False, default=str)
+        with self._lock:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            with open(self.dir / "ai_fields.jsonl", "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def apply_ai_fields(self, changes: List[Change]) -> int:
+        """เติมผล AI ที่บันทึกไว้กลับเข้า changes คืนจำนวน change ที่ได้รับผล"""
+        path = self.dir / "ai_fields.jsonl"
+        if not path.exists():
+            return 0
+
+        touched = set()
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    # บรรทัดสุดท้ายอาจเขียนไม่ครบตอน process ตาย
+                    continue
+                idx = row.pop("index", None)
+                if idx is None or not (0 <= idx < len(changes)):
+                    continue
+                for k, v in row.items():
+                    setattr(changes[idx], k, v)
+                touched.add(idx)
+        return len(touched)
+
+    # --------------------------------------------------
+    # cleanup
+    # --------------------------------------------------
+    def discard(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    @classmethod
+    def list_resumable(cls, base_dir: str = CHECKPOINT_DIR, states=("running",)) -> List["CompareCheckpoint"]:
+        root = Path(base_dir)
+        if not root.exists():
+            return []
+        out = []
+        for d in sorted(root.iterdir()):
+            if not d.is_dir():
+                continue
+            ckpt = cls(d.name, base_dir)
+            if ckpt.exists and ckpt.state().get("state") in states:
+                out.append(ckpt)
+        return out
+
+    @classmethod
+    def prune(cls, base_dir: str = CHECKPOINT_DIR, ttl_sec: float = CHECKPOINT_TTL_SEC) -> int:
+        root = Path(base_dir)
+        if not root.exists():
+            return 0
+        removed = 0
+        now = time.time()
+        for d in root.iterdir():
+            if not d.is_dir():
+                continue
+            ckpt = cls(d.name, base_dir)
+            if now - ckpt.state().get("updated_at", 0) > ttl_sec:
+                ckpt.discard()
+                removed += 1
+        return removed
@@ -11,6 +11,8 @@ from src.db.ops import (
     create_comparison,
     bulk_insert_changes,
     save_document_pages,
+    save_stage_profiles,
+    save_llm_calls,
 )
 from src.ingestion.document_load import DocumentLoader
 from src.ingestion.paragraph import ParagraphSplitter
@@ -27,10 +29,31 @@ from src.AI.ai_comment import (
 from src.AI.ai_suggestion import (
     run_generate_ai_suggestion_parallel,
 )
-from src.AI.ai_sum import build_summary_text
+from src.AI.ai_sum import abuild_summary_text, pending_summary
+from src.service.cancellation import CancellationToken
+from src.service.profiler import StageProfiler
+from src.AI.llm_cache import begin_cache_scope
+from src.AI.llm_accounting import begin_call_tracking
+from src.AI.prompt_compress import begin_compression_scope
+from src.AI.ai_schedule import LLMBudget, apply_budget, ai_status_of, mark_pending
+from src.AI.model_router import route_json, routing_summary
+from src.diff.triage import TrivialEditTriage, TRIAGE_ENABLED
+from src.diff.cluster import CLUSTER_ENABLED, EditClusterer, paragraph_embeddings, propagate_clusters
+from src.AI.category_knn import category_of, category_source_of, index_comparison, prefill_categories
+from src.service.checkpoint import (
+    CompareCheckpoint,
+    pages_to_json,
+    pages_from_json,
+    matches_to_json,
+    matches_from_json,
+    change_to_json,
+    change_from_json,
+)
 
 logger = logging.getLogger(__name__)
 
+# full = diff + AI ครบ / fast = เฉพาะผล deterministic (AI ทีละ change + summary เมื่อถูกขอ)
+COMPARE_MODES = ("full", "fast")
 
 
 async def run_compare(
@@ -42,7 +65,22 @@ async def run_compare(
     v1_label: str = "v1",
     v2_label: str = "v2",
     progress_callback=None,   # ⭐ เพิ่มอันเดียว
+    cancel_token: Optional[CancellationToken] = None,
+    checkpoint: Optional[CompareCheckpoint] = None,
+    refresh_cache: bool = False,
+    llm_budget: Optional[LLMBudget] = None,
+    mode: str = "full",
 ) -> dict:
+    """
+    llm_budget: งบ LLM call/token ของ comparison นี้ (None = ค่าจาก env) เกินงบ → change ที่ไม่รุนแรงถูก defer
+    mode: "full" = diff + AI ครบ / "fast" = เฉพาะผล deterministic (match / severity / diff) ไม่เรียก LLM
+          change ได้ ai_status = "pending" → วิเคราะห์ทีละ change ด้วย POST /changes/{id}/enrich
+          และขอสรุปด้วย POST /comparisons/{id}/summary
+
+    ถ้าส่ง checkpoint มา:
+    - stage ที่เคยเสร็จแล้ว (pages / matches / changes / summary / saved) จะโหลดจาก checkpoint แทน
+    - ผล AI ของแต่ละ change ถูกบันทึกทันทีที่ได้ และ change ที่มีผลแล้วจะไม่ถูกส่งเข้า LLM ซ้ำ
+    """
 
     # ⭐ helper log (ไม่กระทบของเดิม)
     def log(msg, progress=None):
@@ -50,81 +88,254 @@ async def run_compare(
         if progress_callback:
             progress_callback(msg, progress)
 
+    # ⭐ เช็คการยกเลิกงานระหว่าง stage
+    def check_cancel(stage: str):
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled(stage)
+
+    # ⭐ checkpoint helpers
+    def resumable(stage: str) -> bool:
+        if checkpoint is not None and checkpoint.has(stage):
+            log(f"♻️ ใช้ผลจาก checkpoint: {stage}")
+            return True
+        return False
+
+    def save_checkpoint(stage: str, data) -> None:
+        if checkpoint is not None:
+            checkpoint.save_stage(stage, data)
+
     start_time = time.perf_counter()
+    profiler = StageProfiler()
+    # ⭐ นับ hit/miss ของ LLM cache เฉพาะ comparison นี้ (refresh_cache=True → ไม่อ่าน cache)
+    cache_stats = begin_cache_scope(refresh=refresh_cache)
+    # ⭐ บันทึกทุก LLM call ของ comparison นี้ (role / token / latency / retry / cache hit)
+    call_tracker = begin_call_tracking()
+    # ⭐ token ที่ประหยัดได้จากการบีบ old/new ใน prompt ของ comparison นี้
+    compression_stats = begin_compression_scope()
     log("\n🕒 เริ่มจับเวลาการทำงาน ...", 0)
 
     # ==================================================
     # Load PDFs
     # ==================================================
+    check_cancel("load")
     log("📄 กำลังอ่านเอกสาร...", 5)
-    loader = DocumentLoader()
-    try:
-        pages_old = loader.load_from_bytes(v1_file_bytes)
-        pages_new = loader.load_from_bytes(v2_file_bytes)
-
-        v1_filename = v1_filename or f"{doc_name}_{v1_label}.pdf"
-        v2_filename = v2_filename or f"{doc_name}_{v2_label}.pdf"
+    v1_filename = v1_filename or f"{doc_name}_{v1_label}.pdf"
+    v2_filename = v2_filename or f"{doc_name}_{v2_label}.pdf"
+
+    if resumable("pages"):
+        data = checkpoint.load_stage("pages")
+        pages_old = pages_from_json(data["old"])
+        pages_new = pages_from_json(data["new"])
+    else:
+        profiler.begin("load")
+        loader = DocumentLoader()
+        try:
+            pages_old = loader.load_from_bytes(v1_file_bytes)
+            pages_new = loader.load_from_bytes(v2_file_bytes)
+
+            log(
+                f"  Loaded {len(pages_old)} pages from V1, {len(pages_new)} pages from V2"
+            )
 
-        log(
-            f"  Loaded {len(pages_old)} pages from V1, {len(pages_new)} pages from V2"
+        except Exception as e:
+            logger.exception("❌ Failed to load PDFs")
+            raise RuntimeError(f"Failed to load PDFs: {e}")
+        profiler.end(items=len(pages_old) + len(pages_new))
+        save_checkpoint("pages", {"old": pages_to_json(pages_old), "new": pages_to_json(pages_new)})
+
+    # ย่อหน้า (พร้อม embedding) มีเฉพาะตอนไม่ได้ resume จาก checkpoint ของ matches
+    old_paragraphs = new_paragraphs = None
+    if resumable("matches"):
+        data = checkpoint.load_stage("matches")
+        resolved_matches = matches_from_json(data["resolved"])
+        paragraphs_v1_count = data["paragraphs_v1"]
+        paragraphs_v2_count = data["paragraphs_v2"]
+    else:
+        # ==================================================
+        # Split paragraphs
+        # ==================================================
+        check_cancel("split")
+        log("📄 กำลังอ่านเอกสาร...", 15)
+        profiler.begin("split")
+        splitter = ParagraphSplitter()
+        old_paragraphs = splitter.split(pages_old)
+        new_paragraphs = splitter.split(pages_new)
+        profiler.end(items=len(old_paragraphs) + len(new_paragraphs))
+        paragraphs_v1_count = len(old_paragraphs)
+        paragraphs_v2_count = len(new_paragraphs)
+
+        # ==================================================
+        # Embedding
+        # ==================================================
+        check_cancel("embed")
+        log("🔍 กำลังตรวจสอบการเปลี่ยนแปลงของเอกสาร...", 30)
+        profiler.begin("embed")
+        embedder = EmbeddingService()
+        embedder.embed_paragraphs(old_paragraphs)
+        check_cancel("embed")
+        embedder.embed_paragraphs(new_paragraphs)
+        profiler.end(items=len(old_paragraphs) + len(new_paragraphs))
+
+        # ==================================================
+        # Matching
+        # ==================================================
+        check_cancel("match")
+        log("🔍 กำลังตรวจสอบการเปลี่ยนแปลงของเอกสาร...", 45)
+        profiler.begin("match")
+        matcher = ParagraphMatcher(threshold=0.75)
+        stage1_matches = matcher.match(old_paragraphs, new_paragraphs)
+        profiler.end(items=len(stage1_matches))
+
+        # ==================================================
+        # Resolve
+        # ==================================================
+        check_cancel("resolve")
+        log("🔍 กำลังตรวจสอบการเปลี่ยนแปลงของเอกสาร...", 60)
+        profiler.begin("resolve")
+        resolver = MatchResolver(chunk_threshold=0.85)
+        resolved_matches = resolver.resolve(
+            stage1_matches, old_paragraphs, new_paragraphs
         )
-
-    except Exception as e:
-        logger.exception("❌ Failed to load PDFs")
-        raise RuntimeError(f"Failed to load PDFs: {e}")
-
-    # ==================================================
-    # Split paragraphs
-    # ==================================================
-    log("📄 กำลังอ่านเอกสาร...", 15)
-    splitter = ParagraphSplitter()
-    old_paragraphs = splitter.split(pages_old)
-    new_paragraphs = splitter.split(pages_new)
-
-    # ==================================================
-    # Embedding
-    # ==================================================
-    log("🔍 กำลังตรวจสอบการเปลี่ยนแปลงของเอกสาร...", 30)
-    embedder = EmbeddingService()
-    embedder.embed_paragraphs(old_paragraphs)
-    embedder.embed_paragraphs(new_paragraphs)
-
-    # ==================================================
-    # Matching
-    # ==================================================
-    log("🔍 กำลังตรวจสอบการเปลี่ยนแปลงของเอกสาร...", 45)
-    matcher = ParagraphMatcher(threshold=0.75)
-    stage1_matches = matcher.match(old_paragraphs, new_paragraphs)
-
-    # ==================================================
-    # Resolve
-    # ==================================================
-    log("🔍 กำลังตรวจสอบการเปลี่ยนแปลงของเอกสาร...", 60)
-    resolver = MatchResolver(chunk_threshold=0.85)
-    resolved_matches = resolver.resolve(
-        stage1_matches, old_paragraphs, new_paragraphs
-    )
+        profiler.end(items=len(resolved_matches))
+        save_checkpoint("matches", {
+            "resolved": matches_to_json(resolved_matches),
+            "paragraphs_v1": paragraphs_v1_count,
+            "paragraphs_v2": paragraphs_v2_count,
+        })
 
     # ==================================================
     # Diff
     # ==================================================
+    check_cancel("diff")
     log("🔍 กำลังตรวจสอบการเปลี่ยนแปลงของเอกสาร...", 70)
-    diff_engine = DiffEngine()
-    changes: List[DiffChange] = diff_engine.build_changes(resolved_matches)
+    if resumable("changes"):
+        data = checkpoint.load_stage("changes")
+        changes: List[DiffChange] = [change_from_json(c) for c in data["changes"]]
+        edit_intensity = data["edit_intensity"]
+        triage_stats = data.get("triage")
+        cluster_stats = data.get("cluster")
+        category_stats = data.get("category_knn")
+        restored = checkpoint.apply_ai_fields(changes)
+        log(f"♻️ มีผล AI เดิมแล้ว {restored}/{len(changes)} รายการ")
+    else:
+        profiler.begin("diff")
+        diff_engine = DiffEngine()
+        changes: List[DiffChange] = diff_engine.build_changes(resolved_matches)
+
+        edit_intensity = diff_engine.compute_edit_intensity(changes)
+        profiler.end(items=len(changes))
+
+        # ==================================================
+        # Triage (แก้เว้นวรรค/วรรคตอน/เลขไทย/สะกด → ไม่ต้องเรียก LLM)
+        # ==================================================
+        triage_stats = None
+        if TRIAGE_ENABLED:
+            profiler.begin("triage")
+            triage_stats = TrivialEditTriage().triage(changes)
+            profiler.end(items=len(changes))
+            log(
+                f"⚡ triage: {triage_stats['triaged']} รายการไม่ต้องใช้ AI "
+                f"(ประหยัด {triage_stats['llm_calls_saved']} LLM calls) {triage_stats['by_kind']}"
+            )
+
+        # ==================================================
+        # Cluster (การแก้แบบเดียวกันซ้ำหลายย่อหน้า → LLM วิเคราะห์เฉพาะตัวแทน)
+        # ==================================================
+        cluster_stats = None
+        if CLUSTER_ENABLED:
+            profiler.begin("cluster")
+            cluster_stats = EditClusterer().cluster(
+                changes, paragraph_embeddings(old_paragraphs), paragraph_embeddings(new_paragraphs)
+            )
+            profiler.end(items=len(changes))
+            if cluster_stats["clusters"]:
+                log(
+                    f"🧬 cluster: {cluster_stats['members']} รายการใช้ผลจากตัวแทน {cluster_stats['clusters']} กลุ่ม "
+                    f"(ประหยัด {cluster_stats['llm_calls_saved']} LLM calls)"
+                )
+
+        # ==================================================
+        # Category kNN (หมวดจาก ChangeItem ในอดีต → LLM ไม่ต้องจัดหมวด)
+        # ==================================================
+        profiler.begin("category_knn")
+        category_stats = prefill_categories(
+            changes, paragraph_embeddings(old_paragraphs), paragraph_embeddings(new_paragraphs)
+        )
+        profiler.end(items=len(changes))
+        if category_stats:
+            log(
+                f"🏷️ category kNN: เดาหมวดได้ {category_stats['prefilled']}/{category_stats['predicted']} รายการ "
+                f"({category_stats['elapsed_ms']} ms, index {category_stats['index_size']} แถว)"
+            )
 
-    edit_intensity = diff_engine.compute_edit_intensity(changes)
+        save_checkpoint("changes", {
+            "changes": [change_to_json(c) for c in changes],
+            "edit_intensity": edit_intensity,
+            "triage": triage_stats,
+            "cluster": cluster_stats,
+            "category_knn": category_stats,
+        })
     log(f"✏️ ระดับของการเปลี่ยนแปลง: {edit_intensity}")
 
-    # ==================================================
-    # AI summary + Risk
-    # ==================================================
-    log("🤖 กำลังวิเคราะห์การเปลี่ยนแปลงที่เกิดขึ้นด้วย AI ...", 75)
-    await run_generate_ai_comment_parallel(changes)
-    log("🤖 กำลังวิเคราะห์และให้คำแนะนำด้วย AI ...", 80)
-    await run_generate_ai_suggestion_parallel(changes)
+    # ⭐ บันทึกผล AI ของแต่ละ change ทันทีที่ได้
+    on_ai_done = (
+        (lambda i, c: checkpoint.record_ai_fields(i, c))
+        if checkpoint is not None else None
+    )
 
-    log("📊 กำลังสรุปผลการเปรียบเทียบ...", 85)
-    summary_result = build_summary_text(changes)
+    budget_stats = None
+    if mode == "fast":
+        # ==================================================
+        # mode=fast: ข้าม AI ทั้งหมด (วิเคราะห์ / สรุปเมื่อถูกขอ)
+        # ==================================================
+        pending = mark_pending(changes)
+        log(f"⚡ mode=fast: ข้ามการวิเคราะห์ด้วย AI ({pending} รายการรอวิเคราะห์เมื่อถูกขอ)", 85)
+        summary_result = pending_summary(changes)
+    else:
+        # ==================================================
+        # งบ LLM (change รุนแรงก่อน, เกินงบ → defer change ที่ไม่รุนแรง)
+        # ==================================================
+        budget_stats = apply_budget(changes, llm_budget or LLMBudget.resolve(), on_deferred=on_ai_done)
+        if budget_stats["deferred"]:
+            log(
+                f"💸 เกินงบ LLM {budget_stats['budget']}: เลื่อนการวิเคราะห์ {budget_stats['deferred']} รายการ "
+                f"(วางแผน {budget_stats['planned_calls']} calls / ~{budget_stats['planned_tokens']} tokens)"
+            )
+
+        # ==================================================
+        # AI summary + Risk
+        # ==================================================
+        check_cancel("ai_comment")
+        log("🤖 กำลังวิเคราะห์การเปลี่ยนแปลงที่เกิดขึ้นด้วย AI ...", 75)
+        profiler.begin("ai_comment")
+        await run_generate_ai_comment_parallel(
+            changes, cancel_token=cancel_token, on_done=on_ai_done
+        )
+        profiler.end(items=len(changes))
+        check_cancel("ai_suggestion")
+        log("🤖 กำลังวิเคราะห์และให้คำแนะนำด้วย AI ...", 80)
+        profiler.begin("ai_suggestion")
+        await run_generate_ai_suggestion_parallel(
+            changes, cancel_token=cancel_token, on_done=on_ai_done
+        )
+        profiler.end(items=len(changes))
+
+        # ⭐ ผลของตัวแทน → สมาชิกในกลุ่ม / ตัวแทนล้ม → สมาชิกถูกปลดแล้ววิเคราะห์เอง
+        detached = propagate_clusters(changes, ai_status_of, on_done=on_ai_done)
+        if detached:
+            log(f"🧬 ตัวแทนวิเคราะห์ไม่สำเร็จ: วิเคราะห์สมาชิก {len(detached)} รายการแยกกัน")
+            await run_generate_ai_comment_parallel(changes, cancel_token=cancel_token, on_done=on_ai_done)
+            await run_generate_ai_suggestion_parallel(changes, cancel_token=cancel_token, on_done=on_ai_done)
+
+        check_cancel("summary")
+        log("📊 กำลังสรุปผลการเปรียบเทียบ...", 85)
+        if resumable("summary"):
+            summary_result = checkpoint.load_stage("summary")
+        else:
+            profiler.begin("summary")
+            summary_result = await abuild_summary_text(changes, cancel_token=cancel_token)
+            profiler.end(items=len(changes))
+            save_checkpoint("summary", summary_result)
 
     summary_text = summary_result["summary_text"]
     overall_risk_level = summary_result["overall_risk_level"]
@@ -134,90 +345,116 @@ async def run_compare(
     # ==================================================
     # DB SAVE
     # ==================================================
+    check_cancel("db_save")
     log("💾 บันทึกข้อมูลลง...", 90)
-    db = SessionLocal()
-    try:
-        last_id = db.query(Document.id).order_by(Document.id.desc()).first()
-        if last_id is None:
-            new_id = 1
-        else:
-            new_id = last_id[0] + 1
-
-        log(f"🆔 Using document_id = {new_id}")
-
-        real_doc = Document(id=new_id, name=doc_name)
-        db.add(real_doc)
-        db.flush()
-
-        save_document_pages(
-            db=db,
-            document_id=new_id,
-            pages=pages_old,
-            pdf_name=v1_filename,
-            version_pdf="old",
-        )
-
-        save_document_pages(
-            db=db,
-            document_id=new_id,
-            pages=pages_new,
-            pdf_name=v2_filename,
-            version_pdf="new",
-        )
+    if resumable("saved"):
+        run_id = checkpoint.load_stage("saved")["run_id"]
+    else:
+        profiler.begin("db_save")
+        db = SessionLocal()
+        try:
+            last_id = db.query(Document.id).order_by(Document.id.desc()).first()
+            if last_id is None:
+                new_id = 1
+            else:
+                new_id = last_id[0] + 1
+
+            log(f"🆔 Using document_id = {new_id}")
+
+            real_doc = Document(id=new_id, name=doc_name)
+            db.add(real_doc)
+            db.flush()
+
+            save_document_pages(
+                db=db,
+                document_id=new_id,
+                pages=pages_old,
+                pdf_name=v1_filename,
+                version_pdf="old",
+            )
 
-        ver1 = create_document_version(db, real_doc, v1_label, v1_filename)
-        ver2 = create_document_version(db, real_doc, v2_label, v2_filename)
+            save_document_pages(
+                db=db,
+                document_id=new_id,
+                pages=pages_new,
+                pdf_name=v2_filename,
+                version_pdf="new",
+            )
 
-        comp = create_comparison(
-            db, real_doc, ver1, ver2, overall_risk_level, summary_text
-        )
+            ver1 = create_document_version(db, real_doc, v1_label, v1_filename)
+            ver2 = create_document_version(db, real_doc, v2_label, v2_filename)
 
-        comp.edit_intensity = edit_intensity
-        comp.scope_impact_score = impact_scores["scope_impact_score"]
-        comp.timeline_impact_score = impact_scores["timeline_impact_score"]
-        comp.cost_impact_score = impact_scores["cost_impact_score"]
-        comp.resource_impact_score = impact_scores["resource_impact_score"]
-        comp.risk_impact_score = impact_scores["risk_impact_score"]
-        comp.contract_impact_score = impact_scores["contract_impact_score"]
-        comp.stakeholder_impact_score = impact_scores["stakeholder_impact_score"]
-        comp.architecture_impact_score = impact_scores["architecture_impact_score"]
-        comp.risk_comment = risk_comment
-        comp.overall_risk_level = overall_risk_level
-
-        change_dicts: List[dict] = []
-        for c in changes:
-            change_dicts.append(
-                {
-                    "change_type": c.change_type,
-                    "section_label": c.section_label,
-                    "old_text": c.old_text,
-                    "new_text": c.new_text,
-                    "edit_severity": getattr(c, "edit_severity", None),
-                    "ai_comment": getattr(c, "ai_comment", None),
-                    "ai_suggestion": getattr(c, "ai_suggestion", None),
-                    "paragraph_topic": getattr(c, "paragraph_topic", None),
-                    "change_category": getattr(c, "change_category", None),
-                    "change_details": json.dumps(
-                    getattr(c, "change_details", []),
-                    ensure_ascii=False
-                    ),
-                }
+            comp = create_comparison(
+                db, real_doc, ver1, ver2, overall_risk_level, summary_text
             )
 
-        bulk_insert_changes(db, comp, change_dicts)
-        db.commit()
-        run_id = comp.id
-
-    except Exception:
-        db.rollback()
-        raise
-    finally:
-        db.close()
+            comp.edit_intensity = edit_intensity
+            comp.scope_impact_score = impact_scores["scope_impact_score"]
+            comp.timeline_impact_score = impact_scores["timeline_impact_score"]
+            comp.cost_impact_score = impact_scores["cost_impact_score"]
+            comp.resource_impact_score = impact_scores["resource_impact_score"]
+            comp.risk_impact_score = impact_scores["risk_impact_score"]
+            comp.contract_impact_score = impact_scores["contract_impact_score"]
+            comp.stakeholder_impact_score = impact_scores["stakeholder_impact_score"]
+            comp.architecture_impact_score = impact_scores["architecture_impact_score"]
+            comp.risk_comment = risk_comment
+            comp.overall_risk_level = overall_risk_level
+
+            change_dicts: List[dict] = []
+            for c in changes:
+                change_dicts.append(
+                    {
+                        "change_type": c.change_type,
+                        "section_label": c.section_label,
+                        "old_text": c.old_text,
+                        "new_text": c.new_text,
+                        "edit_severity": getattr(c, "edit_severity", None),
+                        "ai_comment": getattr(c, "ai_comment", None),
+                        "ai_suggestion": getattr(c, "ai_suggestion", None),
+                        "paragraph_topic": getattr(c, "paragraph_topic", None),
+                        "change_category": category_of(c),
+                        "category_source": category_source_of(c),
+                        "change_details": json.dumps(
+                        getattr(c, "change_details", []),
+                        ensure_ascii=False
+                        ),
+                        "ai_status": ai_status_of(c),
+                        "model_route": route_json(c),
+                        "cluster_id": getattr(c, "cluster_id", None),
+                    }
+                )
+
+            bulk_insert_changes(db, comp, change_dicts)
+            db.commit()
+            run_id = comp.id
+
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        profiler.end(items=len(changes))
+        save_checkpoint("saved", {"run_id": run_id})
+
+        # ⭐ หมวดที่ LLM เพิ่งตัดสิน → เข้า index ของ category kNN (ไม่สำเร็จก็ไม่กระทบผลของงานนี้)
+        if old_paragraphs is None or new_paragraphs is None:
+            # resume จาก checkpoint ไม่มี embedding ในหน่วยความจำ → python -m src.AI.category_knn เก็บตกภายหลัง
+            log("⏭️ ข้าม category index (resume จาก checkpoint ไม่มี embedding)")
+        else:
+            try:
+                added = index_comparison(
+                    run_id, changes, paragraph_embeddings(old_paragraphs), paragraph_embeddings(new_paragraphs)
+                )
+                if added:
+                    log(f"🏷️ category index: +{added} แถว")
+            except Exception as e:
+                log(f"⚠️ อัปเดต category index ไม่สำเร็จ: {e}")
 
     # ==================================================
     # Build reports
     # ==================================================
     log("📁 กำลังสร้างรายงาน...", 95)
+    profiler.begin("report")
     reporter = ReportBuilder()
     json_path = Path(reporter.save_json(doc_name, v1_label, v2_label, changes))
     html_path = Path(
@@ -231,6 +468,51 @@ async def run_compare(
             edit_intensity,
         )
     )
+    profiler.end(items=len(changes))
+
+    # ==================================================
+    # Stage profile → DB
+    # ==================================================
+    stage_profile = profiler.to_list()
+    log("📈 เวลาแยกตาม stage:\n" + profiler.format_table())
+
+    llm_cache_stats = cache_stats.to_dict()
+    log(
+        f"🗃️ LLM cache: hit {llm_cache_stats['hits']}/{llm_cache_stats['lookups']} "
+        f"({round(llm_cache_stats['hit_rate'] * 100, 1)}%)"
+    )
+
+    llm_calls = call_tracker.to_list()
+    llm_usage = call_tracker.summary()
+    log(
+        f"🧾 LLM calls: {llm_usage['model_calls']} (+{llm_usage['cache_hits']} cache hit) "
+        f"tokens {llm_usage['prompt_tokens']}/{llm_usage['completion_tokens']}"
+    )
+    compression = compression_stats.to_dict()
+    if compression["compressed"]:
+        log(
+            f"✂️ prompt compression: {compression['compressed']}/{compression['changes']} changes "
+            f"ประหยัด ~{compression['saved_tokens']} tokens ({round(compression['saved_ratio'] * 100, 1)}%)"
+        )
+
+    # ⭐ resume หลังบันทึกไปแล้ว → ไม่ insert profile / LLM call ของ run_id เดิมซ้ำ
+    # (แต่ละส่วน commit แยกกัน → จำไว้ใน checkpoint ทีละส่วน)
+    telemetry = checkpoint.load_stage("telemetry") if resumable("telemetry") else {}
+    db = SessionLocal()
+    try:
+        if not telemetry.get("stage_profiles"):
+            save_stage_profiles(db, run_id, stage_profile)
+            telemetry["stage_profiles"] = True
+            save_checkpoint("telemetry", telemetry)
+        if not telemetry.get("llm_calls"):
+            save_llm_calls(db, llm_calls, comparison_id=run_id)
+            telemetry["llm_calls"] = True
+            save_checkpoint("telemetry", telemetry)
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"save stage profile failed: {e}")
+    finally:
+        db.close()
 
     end_time = time.perf_counter()
     elapsed_seconds = end_time - start_time
@@ -249,8 +531,8 @@ async def run_compare(
         "v2_label": v2_label,
         "pages_v1": len(pages_old),
         "pages_v2": len(pages_new),
-        "paragraphs_v1": len(old_paragraphs),
-        "paragraphs_v2": len(new_paragraphs),
+        "paragraphs_v1": paragraphs_v1_count,
+        "paragraphs_v2": paragraphs_v2_count,
         "changes_count": len(changes),
         "edit_intensity": edit_intensity,
         "summary_text": summary_text,
@@ -264,4 +546,15 @@ async def run_compare(
         "json_report_url": f"/reports/{json_path.name}",
         "runtime_minutes": minutes,
         "runtime_seconds": round(seconds, 2),
+        "stage_profile": stage_profile,
+        "llm_cache": llm_cache_stats,
+        "llm_usage": llm_usage,
+        "triage": triage_stats,
+        "clusters": cluster_stats,
+        "category_knn": category_stats,
+        "llm_budget": budget_stats,
+        "routing": routing_summary(changes),
+        "prompt_compression": compression,
+        "summary_stats": summary_result.get("summary_stats"),
+        "mode": mode,
     }
@@ -1,4 +1,5 @@
 from pathlib import Path
+import json
 import logging
 import time
 import hashlib
@@ -17,6 +18,8 @@ from src.db.ops import (
     create_comparison,
     bulk_insert_changes,
     save_document_pages,
+    save_stage_profiles,
+    save_llm_calls,
 )
 from src.ingestion.document_load import DocumentLoader
 from src.ingestion.paragraph import ParagraphSplitter
@@ -29,7 +32,17 @@ from src.report.report_builder import ReportBuilder
 
 from src.AI.ai_comment import run_generate_ai_comment_parallel
 from src.AI.ai_suggestion import run_generate_ai_suggestion_parallel
-from src.AI.ai_sum import build_summary_text
+from src.AI.ai_sum import abuild_summary_text, pending_summary
+from src.service.cancellation import CancellationToken
+from src.service.profiler import StageProfiler
+from src.AI.llm_cache import begin_cache_scope
+from src.AI.llm_accounting import begin_call_tracking
+from src.AI.prompt_compress import begin_compression_scope
+from src.AI.ai_schedule import LLMBudget, apply_budget, ai_status_of, mark_pending
+from src.AI.model_router import route_json, routing_summary
+from src.diff.triage import TrivialEditTriage, TRIAGE_ENABLED
+from src.diff.cluster import CLUSTER_ENABLED, EditClusterer, paragraph_embeddings, propagate_clusters
+from src.AI.category_knn import category_of, category_source_of, index_comparison, prefill_categories
 
 logger = logging.getLogger(__name__)
 
@@ -39,7 +52,14 @@ async def run_compare_v2(
     v2_file_bytes: Optional[bytes] = None,
     v2_label: str = "v2",
     progress_callback=None,
+    cancel_token: Optional[CancellationToken] = None,
+    refresh_cache: bool = False,
+    llm_budget: Optional[LLMBudget] = None,
+    mode: str = "full",
 ) -> dict:
+    """
+    mode: "full" = diff + AI ครบ / "fast" = เฉพาะผล deterministic ไม่เรียก LLM (เหมือน run_compare)
+    """
 
     def update(step: str, progress: int | None = None):
         logger.info(step)
@@ -50,7 +70,18 @@ async def run_compare_v2(
             except Exception as e:
                 logger.warning(f"Progress callback failed: {e}")
 
+    def check_cancel(stage: str):
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled(stage)
+
     start_time = time.perf_counter()
+    profiler = StageProfiler()
+    # ⭐ นับ hit/miss ของ LLM cache เฉพาะ comparison นี้ (refresh_cache=True → ไม่อ่าน cache)
+    cache_stats = begin_cache_scope(refresh=refresh_cache)
+    # ⭐ บันทึกทุก LLM call ของ comparison นี้ (role / token / latency / retry / cache hit)
+    call_tracker = begin_call_tracking()
+    # ⭐ token ที่ประหยัดได้จากการบีบ old/new ใน prompt ของ comparison นี้
+    compression_stats = begin_compression_scope()
     update("🚀 เริ่มการทำงาน...", 1)
 
     if v2_file_bytes is None:
@@ -59,7 +90,9 @@ async def run_compare_v2(
     # ==================================================
     # 1) LOAD BASELINE
     # ==================================================
+    check_cancel("load_baseline")
     update("📄 กำลังอ่านเอกสาร...", 5)
+    profiler.begin("load")
 
     db = SessionLocal()
     try:
@@ -112,16 +145,20 @@ async def run_compare_v2(
     # ==================================================
     # 2) LOAD NEW FILE
     # ==================================================
+    check_cancel("load")
     update("📄 กำลังอ่านเอกสาร...", 10)
 
     loader = DocumentLoader()
     pages_new = loader.load_from_bytes(v2_file_bytes)
     full_text_new = "\n".join(p.text for p in pages_new if p.text)
+    profiler.end(items=len(pages_old) + len(pages_new))
 
     # ==================================================
     # 3) CREATE DOCUMENT
     # ==================================================
+    check_cancel("create_document")
     update("🆕 กำลังสร้างเอกสารใหม่...", 15)
+    profiler.begin("create_document")
 
     db = SessionLocal()
     try:
@@ -143,15 +180,19 @@ async def run_compare_v2(
         db.commit()
     finally:
         db.close()
+    profiler.end(items=len(pages_new))
 
     # ==================================================
     # 4) SPLIT
     # ==================================================
+    check_cancel("split")
     update("✂ กำลังอ่านเอกสาร...", 25)
 
+    profiler.begin("split")
     splitter = ParagraphSplitter()
     old_paragraphs = splitter.split(pages_old)
     new_paragraphs = splitter.split(pages_new)
+    profiler.end(items=len(old_paragraphs) + len(new_paragraphs))
 
     pages_v1_count = len(pages_old)
     pages_v2_count = len(pages_new)
@@ -161,51 +202,134 @@ async def run_compare_v2(
     # ==================================================
     # 5) EMBEDDING
     # ==================================================
+    check_cancel("embed")
     update("🔍 กำลังตรวจสอบการเปลี่ยนแปลงของเอกสาร...", 40)
 
+    profiler.begin("embed")
     embedder = EmbeddingService()
     embedder.embed_paragraphs(old_paragraphs)
+    check_cancel("embed")
     embedder.embed_paragraphs(new_paragraphs)
+    profiler.end(items=len(old_paragraphs) + len(new_paragraphs))
 
     # ==================================================
     # 6) MATCH
     # ==================================================
+    check_cancel("match")
     update("🔍 กำลังตรวจสอบการเปลี่ยนแปลงของเอกสาร...", 55)
 
+    profiler.begin("match")
     matcher = ParagraphMatcher(threshold=0.75)
     stage1_matches = matcher.match(old_paragraphs, new_paragraphs)
+    profiler.end(items=len(stage1_matches))
 
     # ==================================================
     # 7) RESOLVE
     # ==================================================
+    check_cancel("resolve")
     update("🔍 กำลังตรวจสอบการเปลี่ยนแปลงของเอกสาร...", 65)
 
+    profiler.begin("resolve")
     resolver = MatchResolver(chunk_threshold=0.85)
     resolved_matches = resolver.resolve(
         stage1_matches, old_paragraphs, new_paragraphs
     )
+    profiler.end(items=len(resolved_matches))
 
     # ==================================================
     # 8) DIFF
     # ==================================================
+    check_cancel("diff")
     update("📝 🔍 กำลังตรวจสอบการเปลี่ยนแปลงของเอกสาร...", 75)
 
+    profiler.begin("diff")
     diff_engine = DiffEngine()
     changes: List[DiffChange] = diff_engine.build_changes(resolved_matches)
     edit_intensity = diff_engine.compute_edit_intensity(changes)
+    profiler.end(items=len(changes))
+
+    # ⚡ triage: การแก้ไขเชิงรูปแบบล้วน ๆ ไม่ต้องเรียก LLM
+    triage_stats = None
+    if TRIAGE_ENABLED:
+        profiler.begin("triage")
+        triage_stats = TrivialEditTriage().triage(changes)
+        profiler.end(items=len(changes))
+        update(
+            f"⚡ triage: {triage_stats['triaged']} รายการไม่ต้องใช้ AI "
+            f"(ประหยัด {triage_stats['llm_calls_saved']} LLM calls) {triage_stats['by_kind']}"
+        )
 
-    # ==================================================
-    # 9) AI
-    # ==================================================
-    update("🤖 กำลังวิเคราะห์การเปลี่ยนแปลงที่เกิดขึ้นด้วย AI ...", 80)
+    # 🧬 cluster: การแก้แบบเดียวกันซ้ำหลายย่อหน้า → LLM วิเคราะห์เฉพาะตัวแทน
+    cluster_stats = None
+    if CLUSTER_ENABLED:
+        profiler.begin("cluster")
+        cluster_stats = EditClusterer().cluster(
+            changes, paragraph_embeddings(old_paragraphs), paragraph_embeddings(new_paragraphs)
+        )
+        profiler.end(items=len(changes))
+        if cluster_stats["clusters"]:
+            update(
+                f"🧬 cluster: {cluster_stats['members']} รายการใช้ผลจากตัวแทน {cluster_stats['clusters']} กลุ่ม "
+                f"(ประหยัด {cluster_stats['llm_calls_saved']} LLM calls)"
+            )
+
+    # 🏷️ category kNN: หมวดจาก ChangeItem ในอดีต มั่นใจพอ → LLM ไม่ต้องจัดหมวด
+    profiler.begin("category_knn")
+    category_stats = prefill_categories(
+        changes, paragraph_embeddings(old_paragraphs), paragraph_embeddings(new_paragraphs)
+    )
+    profiler.end(items=len(changes))
+    if category_stats:
+        update(
+            f"🏷️ category kNN: เดาหมวดได้ {category_stats['prefilled']}/{category_stats['predicted']} รายการ "
+            f"({category_stats['elapsed_ms']} ms, index {category_stats['index_size']} แถว)"
+        )
+
+    budget_stats = None
+    if mode == "fast":
+        # ==================================================
+        # 9) mode=fast: ข้าม AI ทั้งหมด (วิเคราะห์ / สรุปเมื่อถูกขอ)
+        # ==================================================
+        pending = mark_pending(changes)
+        update(f"⚡ mode=fast: ข้ามการวิเคราะห์ด้วย AI ({pending} รายการรอวิเคราะห์เมื่อถูกขอ)", 88)
+        summary_result = pending_summary(changes)
+    else:
+        # ==================================================
+        # 9) AI (change รุนแรงก่อน, เกินงบ LLM → defer change ที่ไม่รุนแรง)
+        # ==================================================
+        budget_stats = apply_budget(changes, llm_budget or LLMBudget.resolve())
+        if budget_stats["deferred"]:
+            update(
+                f"💸 เกินงบ LLM {budget_stats['budget']}: เลื่อนการวิเคราะห์ {budget_stats['deferred']} รายการ "
+                f"(วางแผน {budget_stats['planned_calls']} calls / ~{budget_stats['planned_tokens']} tokens)"
+            )
+
+        check_cancel("ai_comment")
+        update("🤖 กำลังวิเคราะห์การเปลี่ยนแปลงที่เกิดขึ้นด้วย AI ...", 80)
+
+        profiler.begin("ai_comment")
+        await run_generate_ai_comment_parallel(changes, cancel_token=cancel_token)
+        profiler.end(items=len(changes))
+        check_cancel("ai_suggestion")
+        update("🤖 กำลังวิเคราะห์และให้คำแนะนำด้วย AI ...", 85)
+        profiler.begin("ai_suggestion")
+        await run_generate_ai_suggestion_parallel(changes, cancel_token=cancel_token)
+        profiler.end(items=len(changes))
+
+        # ผลของตัวแทน → สมาชิกในกลุ่ม / ตัวแทนล้ม → สมาชิกถูกปลดแล้ววิเคราะห์เอง
+        detached = propagate_clusters(changes, ai_status_of)
+        if detached:
+            update(f"🧬 ตัวแทนวิเคราะห์ไม่สำเร็จ: วิเคราะห์สมาชิก {len(detached)} รายการแยกกัน")
+            await run_generate_ai_comment_parallel(changes, cancel_token=cancel_token)
+            await run_generate_ai_suggestion_parallel(changes, cancel_token=cancel_token)
 
-    await run_generate_ai_comment_parallel(changes)
-    update("🤖 กำลังวิเคราะห์และให้คำแนะนำด้วย AI ...", 85)
-    await run_generate_ai_suggestion_parallel(changes)
+        check_cancel("summary")
+        update("📊 กำลังสรุปผลการเปรียบเทียบ...", 88)
 
-    update("📊 กำลังสรุปผลการเปรียบเทียบ...", 88)
+        profiler.begin("summary")
+        summary_result = await abuild_summary_text(changes, cancel_token=cancel_token)
+        profiler.end(items=len(changes))
 
-    summary_result = build_summary_text(changes)
     summary_text = summary_result.get("summary_text", "")
     overall_risk_level = summary_result.get("overall_risk_level", "LOW")
     impact_scores = summary_result.get("impact_scores", {})
@@ -214,7 +338,9 @@ async def run_compare_v2(
     # ==================================================
     # 10) SAVE DB
     # ==================================================
+    check_cancel("db_save")
     update("💾 กำลังบันทึกข้อมูล...", 92)
+    profiler.begin("db_save")
 
     db = SessionLocal()
     try:
@@ -266,8 +392,17 @@ async def run_compare_v2(
                     "section_label": c.section_label,
                     "old_text": c.old_text,
                     "new_text": c.new_text,
+                    "edit_severity": getattr(c, "edit_severity", None),
                     "ai_comment": getattr(c, "ai_comment", None),
                     "ai_suggestion": getattr(c, "ai_suggestion", None),
+                    # หมวดจาก LLM / kNN (mode=fast) + ที่มา → rebuild_from_db ของ category kNN ใช้แถวเหล่านี้ได้
+                    "paragraph_topic": getattr(c, "paragraph_topic", None),
+                    "change_category": category_of(c),
+                    "category_source": category_source_of(c),
+                    "change_details": json.dumps(getattr(c, "change_details", []), ensure_ascii=False),
+                    "ai_status": ai_status_of(c),
+                    "model_route": route_json(c),
+                    "cluster_id": getattr(c, "cluster_id", None),
                 }
                 for c in changes
             ],
@@ -277,12 +412,20 @@ async def run_compare_v2(
         run_id = comp.id
     finally:
         db.close()
+    profiler.end(items=len(changes))
+
+    # หมวดที่ LLM เพิ่งตัดสิน → เข้า index ของ category kNN (ไม่สำเร็จก็ไม่กระทบผลของงานนี้)
+    try:
+        index_comparison(run_id, changes, paragraph_embeddings(old_paragraphs), paragraph_embeddings(new_paragraphs))
+    except Exception as e:
+        update(f"⚠️ อัปเดต category index ไม่สำเร็จ: {e}")
 
     # ==================================================
     # 11) REPORT
     # ==================================================
     update("📁 กำลังสร้างรายงาน...", 97)
 
+    profiler.begin("report")
     reporter = ReportBuilder()
     json_path = reporter.save_json(doc_name, v1_label, v2_label, changes)
     html_path = reporter.save_html(
@@ -294,6 +437,39 @@ async def run_compare_v2(
         overall_risk_level,
         edit_intensity,
     )
+    profiler.end(items=len(changes))
+
+    stage_profile = profiler.to_list()
+    update("📈 เวลาแยกตาม stage:\n" + profiler.format_table())
+
+    llm_cache_stats = cache_stats.to_dict()
+    update(
+        f"🗃️ LLM cache: hit {llm_cache_stats['hits']}/{llm_cache_stats['lookups']} "
+        f"({round(llm_cache_stats['hit_rate'] * 100, 1)}%)"
+    )
+
+    llm_calls = call_tracker.to_list()
+    llm_usage = call_tracker.summary()
+    update(
+        f"🧾 LLM calls: {llm_usage['model_calls']} (+{llm_usage['cache_hits']} cache hit) "
+        f"tokens {llm_usage['prompt_tokens']}/{llm_usage['completion_tokens']}"
+    )
+    compression = compression_stats.to_dict()
+    if compression["compressed"]:
+        update(
+            f"✂️ prompt compression: {compression['compressed']}/{compression['changes']} changes "
+            f"ประหยัด ~{compression['saved_tokens']} tokens ({round(compression['saved_ratio'] * 100, 1)}%)"
+        )
+
+    db = SessionLocal()
+    try:
+        save_stage_profiles(db, run_id, stage_profile)
+        save_llm_calls(db, llm_calls, comparison_id=run_id)
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"save stage profile failed: {e}")
+    finally:
+        db.close()
 
     end_time = time.perf_counter()
     runtime = end_time - start_time
@@ -323,4 +499,15 @@ async def run_compare_v2(
         "run_id": run_id,
         "runtime_minutes": minutes,
         "runtime_seconds": seconds,
+        "stage_profile": stage_profile,
+        "llm_cache": llm_cache_stats,
+        "llm_usage": llm_usage,
+        "triage": triage_stats,
+        "clusters": cluster_stats,
+        "category_knn": category_stats,
+        "llm_budget": budget_stats,
+        "routing": routing_summary(changes),
+        "prompt_compression": compression,
+        "summary_stats": summary_result.get("summary_stats"),
+        "mode": mode,
     }
@@ -0,0 +1,297 @@
+"""
+วิเคราะห์ด้วย AI เมื่อถูกขอ (คู่กับ compare mode=fast)
+
+- enrich_change: ai_comment + ai_suggestion ของ change เดียว แล้วเก็บผลลง ChangeItem
+  (ครั้งถัดไปคืนผลเดิมจาก DB ไม่เรียก LLM ซ้ำ เว้นแต่ force=True)
+  change ที่อยู่ในกลุ่มการแก้ซ้ำ (cluster_id) → ผลถูกคัดลอกให้ change อื่นในกลุ่มที่ยังรออยู่ด้วย
+- run_comparison_summary: summary + impact ของ comparison จากผลที่มีอยู่ใน DB
+  (enrich=True → วิเคราะห์ change ที่ยังรออยู่ให้ครบก่อนสรุป)
+"""
+
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, List, Optional
+
+from src.db.models import ChangeItem
+from src.db.session import SessionLocal
+from src.db.ops import get_comparison_with_changes, save_llm_calls
+from src.diff.diff import Change as DiffChange
+from src.AI.ai_comment import generate_ai_comment_async, run_generate_ai_comment_parallel
+from src.AI.ai_suggestion import generate_ai_suggestion_async, run_generate_ai_suggestion_parallel
+from src.AI.ai_sum import abuild_summary_text
+from src.AI.llm_accounting import begin_call_tracking
+from src.AI.ai_schedule import (
+    AI_STATUS_CLUSTERED,
+    AI_STATUS_DEFERRED,
+    AI_STATUS_FAILED,
+    AI_STATUS_PENDING,
+    ai_status_of,
+)
+from src.AI.model_router import route_json
+from src.AI.category_knn import CATEGORY_SOURCE_KNN, category_of, category_source_of
+from src.diff.cluster import copy_analysis, propagate_clusters, restore_cluster_roles
+from src.service.cancellation import CancellationToken
+
+logger = logging.getLogger(__name__)
+
+# ai_status ที่ถือว่ายังไม่ได้วิเคราะห์ (run_comparison_summary(enrich=True) จะวิเคราะห์ให้)
+UNANALYZED_STATUSES = (AI_STATUS_PENDING, AI_STATUS_DEFERRED)
+
+AI_FIELDS = ("ai_comment", "ai_suggestion", "paragraph_topic", "change_category", "change_details")
+
+
+# ==================================================
+# ChangeItem ↔ Change
+# ==================================================
+def _load_details(raw: Optional[str]) -> list:
+    try:
+        return json.loads(raw) if raw else []
+    except (TypeError, ValueError):
+        return []
+
+
+def change_from_item(item: ChangeItem) -> DiffChange:
+    """สร้าง Change จากแถวใน DB (ผล AI ที่มีอยู่ติดมาด้วย)"""
+    c = DiffChange(
+        change_type=item.change_type,
+        section_label=item.section_label,
+        old_text=item.old_text,
+        new_text=item.new_text,
+        edit_severity=item.edit_severity,
+    )
+    if item.cluster_id is not None:
+        c.cluster_id = item.cluster_id
+    if item.category_source == CATEGORY_SOURCE_KNN and item.change_category:
+        # หมวดจาก kNN ตอน compare → ai_comment ใช้ prompt แบบไม่จัดหมวดเหมือนตอน compare
+        c.category_prefill = {"category": item.change_category}
+    if item.ai_status in UNANALYZED_STATUSES:
+        # template ของ defer ไม่ใช่ผลวิเคราะห์จริง
+        c.ai_status = item.ai_status
+        return c
+
+    for field in ("ai_comment", "ai_suggestion", "paragraph_topic", "change_category"):
+        value = getattr(item, field, None)
+        if value is not None:
+            setattr(c, field, value)
+    if item.change_details:
+        c.change_details = _load_details(item.change_details)
+    if item.ai_status:
+        c.ai_status = item.ai_status
+    return c
+
+
+def apply_to_item(item: ChangeItem, change: DiffChange) -> None:
+    item.ai_comment = getattr(change, "ai_comment", None)
+    item.ai_suggestion = getattr(change, "ai_suggestion", None)
+    item.paragraph_topic = getattr(change, "paragraph_topic", None)
+    item.change_category = category_of(change)
+    item.category_source = category_source_of(change)
+    item.change_details = json.dumps(getattr(change, "change_details", []), ensure_ascii=False)
+    item.ai_status = ai_status_of(change)
+    item.model_route = route_json(change)
+
+
+def item_ai_fields(item: ChangeItem) -> Dict:
+    return {
+        "change_id": item.id,
+        "comparison_id": item.comparison_id,
+        "ai_status": item.ai_status,
+        "ai_comment": item.ai_comment,
+        "ai_suggestion": item.ai_suggestion,
+        "paragraph_topic": item.paragraph_topic,
+        "change_category": item.change_category,
+        "change_details": _load_details(item.change_details),
+        "model_route": json.loads(item.model_route) if item.model_route else None,
+        "cluster_id": item.cluster_id,
+    }
+
+
+def _reset_for_analysis(change: DiffChange) -> None:
+    """ล้างผลเดิม (force / defer) ให้ runner วิเคราะห์ใหม่ (เลือก model ใหม่ตามคิวตอนนี้)"""
+    for field in AI_FIELDS + ("ai_status", "triage", "model_route"):
+        if hasattr(change, field):
+            delattr(change, field)
+
+
+# ==================================================
+# Enrich ทีละ change
+# ==================================================
+def _propagate_to_siblings(db, item: ChangeItem, change: DiffChange) -> List[int]:
+    """คัดลอกผลของ change นี้ให้ change อื่นในกลุ่มเดียวกันที่ยังไม่ได้วิเคราะห์ คืน id ที่ได้ผล"""
+    if item.cluster_id is None or ai_status_of(change) == AI_STATUS_FAILED:
+        return []
+    siblings = (
+        db.query(ChangeItem)
+        .filter(
+            ChangeItem.comparison_id == item.comparison_id,
+            ChangeItem.cluster_id == item.cluster_id,
+            ChangeItem.id != item.id,
+        )
+        .all()
+    )
+    done = []
+    for sib in siblings:
+        if sib.ai_comment and sib.ai_status not in UNANALYZED_STATUSES:
+            continue
+        sib_change = change_from_item(sib)
+        _reset_for_analysis(sib_change)
+        copy_analysis(change, sib_change, AI_STATUS_CLUSTERED)
+        apply_to_item(sib, sib_change)
+        done.append(sib.id)
+    return done
+
+
+async def enrich_change(change_id: int, force: bool = False) -> Optional[Dict]:
+    """
+    ai_comment → ai_suggestion ของ change เดียว (suggestion ใช้ผล comment เป็น input)
+    คืน None ถ้าไม่พบ change / คืนผลเดิมถ้าวิเคราะห์แล้ว (cached=True)
+    """
+    db = SessionLocal()
+    call_tracker = begin_call_tracking()
+    item = None
+    try:
+        item = db.query(ChangeItem).filter(ChangeItem.id == change_id).first()
+        if item is None:
+            return None
+
+        if not force and item.ai_comment and item.ai_status not in UNANALYZED_STATUSES:
+            return {**item_ai_fields(item), "cached": True, "elapsed_sec": 0.0}
+
+        start = time.perf_counter()
+        change = change_from_item(item)
+        _reset_for_analysis(change)
+
+        semaphore = asyncio.Semaphore(1)
+        await generate_ai_comment_async(change, semaphore)
+        await generate_ai_suggestion_async(change, semaphore)
+
+        apply_to_item(item, change)
+        propagated = _propagate_to_siblings(db, item, change)
+        db.commit()
+        elapsed = time.perf_counter() - start
+        print(
+            f"🤖 enrich change {change_id}: {item.ai_status} ใน {elapsed:.1f}s"
+            + (f" (+{len(propagated)} change ในกลุ่มเดียวกัน)" if propagated else "")
+        )
+
+        return {
+            **item_ai_fields(item),
+            "propagated_to": propagated,
+            "cached": False,
+            "elapsed_sec": round(elapsed, 2),
+        }
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        try:
+            comparison_id = item.comparison_id if item is not None else None
+            save_llm_calls(db, call_tracker.to_list(), comparison_id=comparison_id)
+        except Exception as e:
+            db.rollback()
+            logger.warning("save llm calls failed: %s", e)
+        db.close()
+
+
+# ==================================================
+# Summary เมื่อถูกขอ
+# ==================================================
+async def run_comparison_summary(
+    comparison_id: int,
+    enrich: bool = False,
+    progress_callback=None,
+    cancel_token: Optional[CancellationToken] = None,
+) -> dict:
+    """
+    summary + impact ของ comparison จากผล AI ใน DB แล้วเขียนทับค่าเดิมของ Comparison
+    - enrich=False: สรุปเท่าที่มี (change ที่ยังไม่ได้วิเคราะห์ใช้ข้อมูล deterministic อย่างเดียว)
+    - enrich=True : วิเคราะห์ change ที่ยัง pending / deferred ก่อน (บันทึกผลลง ChangeItem ด้วย)
+    """
+
+    def log(msg, progress=None):
+        print(msg)
+        if progress_callback:
+            progress_callback(msg, progress)
+
+    def check_cancel(stage: str):
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled(stage)
+
+    start_time = time.perf_counter()
+    call_tracker = begin_call_tracking()
+    db = SessionLocal()
+    try:
+        comp = get_comparison_with_changes(db, comparison_id=comparison_id)
+        if comp is None:
+            raise ValueError(f"Comparison {comparison_id} not found")
+
+        items: List[ChangeItem] = list(comp.changes)
+        changes = [change_from_item(i) for i in items]
+        # ตัวแทนของกลุ่ม = change แรกในเอกสาร (สมาชิกรอรับผลจากตัวแทน)
+        restore_cluster_roles(changes)
+        log(f"📊 เริ่มสรุป comparison {comparison_id} ({len(changes)} changes)", 0)
+
+        enriched = 0
+        if enrich:
+            todo = [
+                (item, c) for item, c in zip(items, changes)
+                if not getattr(c, "ai_comment", None)
+            ]
+            for _, c in todo:
+                _reset_for_analysis(c)
+            if todo:
+                check_cancel("ai_comment")
+                log(f"🤖 วิเคราะห์ {len(todo)} change ที่ยังรออยู่ ...", 10)
+                pending = [c for _, c in todo]
+                await run_generate_ai_comment_parallel(pending, cancel_token=cancel_token)
+                check_cancel("ai_suggestion")
+                log("🤖 กำลังวิเคราะห์และให้คำแนะนำด้วย AI ...", 50)
+                await run_generate_ai_suggestion_parallel(pending, cancel_token=cancel_token)
+                # ตัวแทนอาจวิเคราะห์ไว้แล้วก่อนหน้า → propagate จาก changes ทั้งหมด
+                detached = propagate_clusters(changes, ai_status_of)
+                if detached:
+                    await run_generate_ai_comment_parallel(detached, cancel_token=cancel_token)
+                    await run_generate_ai_suggestion_parallel(detached, cancel_token=cancel_token)
+                for item, c in todo:
+                    apply_to_item(item, c)
+                db.commit()
+                enriched = len(todo)
+
+        check_cancel("summary")
+        log("📊 กำลังสรุปผลการเปรียบเทียบ...", 80)
+        # change ที่ยังไม่ได้วิเคราะห์ไม่ถูกเติมใน summary (ขอ enrich=True แทน)
+        summary_result = await abuild_summary_text(changes, enrich=False)
+
+        impact_scores = summary_result["impact_scores"]
+        comp.summary_text = summary_result["summary_text"]
+        comp.overall_risk_level = summary_result["overall_risk_level"]
+        comp.risk_comment = summary_result["risk_comment"]
+        for key, value in impact_scores.items():
+            setattr(comp, key, value)
+        db.commit()
+
+        elapsed = time.perf_counter() - start_time
+        log(f"💾 สรุป comparison {comparison_id} เสร็จใน {elapsed:.1f}s", 100)
+
+        pending_left = sum(1 for c in changes if getattr(c, "ai_status", None) in UNANALYZED_STATUSES)
+        return {
+            "comparison_id": comparison_id,
+            "summary_text": comp.summary_text,
+            "overall_risk_level": comp.overall_risk_level,
+            "impact_scores": impact_scores,
+            "risk_comment": comp.risk_comment,
+            "summary_stats": summary_result.get("summary_stats"),
+            "enriched_count": enriched,
+            "pending_count": pending_left,
+            "elapsed_sec": round(elapsed, 2),
+            "llm_usage": call_tracker.summary(),
+        }
+    finally:
+        try:
+            save_llm_calls(db, call_tracker.to_list(), comparison_id=comparison_id)
+        except Exception as e:
+            db.rollback()
+            logger.warning("save llm calls failed: %s", e)
+        db.close()
@@ -0,0 +1,297 @@
+import json
+import os
+import sys
+import threading
+import time
+import logging
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.monitoring.metrics import track_job_registry
+
+logger = logging.getLogger(__name__)
+
+# ==================================================
+# Config (ปรับได้ผ่าน env)
+# ==================================================
+JOB_MAX_LOGS = int(os.getenv("JOB_MAX_LOGS", "200"))
+JOB_MAX_JOBS = int(os.getenv("JOB_MAX_JOBS", "100"))
+JOB_TTL_SEC = float(os.getenv("JOB_TTL_SEC", str(6 * 3600)))
+JOB_RESULT_OFFLOAD_BYTES = int(os.getenv("JOB_RESULT_OFFLOAD_BYTES", str(64 * 1024)))
+JOB_RESULT_DIR = os.getenv("JOB_RESULT_DIR", "data/job_results")
+
+FINISHED_STATUSES = {"done", "error", "cancelled"}
+
+
+def _status_value(status: Any) -> str:
+    # รองรับทั้ง str ธรรมดาและ Enum (history.JobStatus)
+    return str(getattr(status, "value", status))
+
+
+def _approx_size(obj: Any, _seen: Optional[set] = None) -> int:
+    """ประมาณขนาดหน่วยความจำ (bytes) ของ dict/list/str แบบ recursive"""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_approx_size(k, _seen) + _approx_size(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, deque)):
+        size += sum(_approx_size(v, _seen) for v in obj)
+    return size
+
+
+class JobRegistry:
+    """
+    ที่เก็บสถานะงาน (in-memory) แบบมีขอบเขต
+    - จำกัดจำนวน log ต่องาน
+    - จำกัดจำนวนงาน + อายุงาน (ลบงานที่จบแล้วแบบ LRU / TTL)
+    - result ขนาดใหญ่เขียนลงดิสก์ แล้วค่อยโหลดตอนขอผลลัพธ์
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_jobs: int = JOB_MAX_JOBS,
+        ttl_sec: float = JOB_TTL_SEC,
+        max_logs: int = JOB_MAX_LOGS,
+        offload_bytes: int = JOB_RESULT_OFFLOAD_BYTES,
+        result_dir: str = JOB_RESULT_DIR,
+    ):
+        self.name = name
+        self.max_jobs = max_jobs
+        self.ttl_sec = ttl_sec
+        self.max_logs = max_logs
+        self.offload_bytes = offload_bytes
+        self.result_dir = Path(result_dir) / name
+
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._evicted = 0
+
+        track_job_registry(self)
+
+    # --------------------------------------------------
+    # dict-like access
+    # --------------------------------------------------
+    def __contains__(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._jobs
+
+    def __getitem__(self, job_id: str) -> Dict[str, Any]:
+        with self._lock:
+            job = self._jobs[job_id]
+            self._jobs.move_to_end(job_id)
+            return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if job_id not in self._jobs:
+                return None
+            return self[job_id]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._jobs)
+
+    def items(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """snapshot ของ (job_id, job) ทั้งหมด (ไม่เลื่อนลำดับ LRU)"""
+        with self._lock:
+            return list(self._jobs.items())
+
+    # --------------------------------------------------
+    # lifecycle
+    # --------------------------------------------------
+    def create(self, job_id: str, status: Any = "processing", **extra) -> Dict[str, Any]:
+        now = time.time()
+        job = {
+            "status": status,
+            "result": None,
+            "result_path": None,
+            "error": None,
+            "logs": deque(maxlen=self.max_logs),
+            "progress": 0,
+            "current_step": "starting",
+            "created_at": now,
+            "updated_at": now,
+            "finished_at": None,
+        }
+        job.update(extra)
+
+        if not isinstance(job["logs"], deque):
+            job["logs"] = deque(job["logs"], maxlen=self.max_logs)
+
+        with self._lock:
+            self._jobs[job_id] = job
+            self.evict()
+        return job
+
+    def push_log(self, job_id: str, message: str, progress: Optional[int] = None) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["logs"].append(message)
+            job["current_step"] = message
+            job["updated_at"] = time.time()
+            if progress is not None:
+                job["progress"] = progress
+
+    def tail_logs(self, job_id: str, n: int = 50) -> List[str]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return []
+            logs = list(job["logs"])
+        return logs[-n:]
+
+    def set_status(self, job_id: str, status: Any, error: Optional[str] = None) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["status"] = status
+            job["updated_at"] = time.time()
+            if error is not None:
+                job["error"] = error
+            if _status_value(status) in FINISHED_STATUSES:
+                job["finished_at"] = job["updated_at"]
+
+    def is_cancelled(self, job_id: str) -> bool:
+        """งานถูกยกเลิกแล้ว (DELETE ตั้ง status หรือ cancel_token ถูก cancel)"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+            token = job.get("cancel_token")
+            return _status_value(job["status"]) == "cancelled" or bool(getattr(token, "cancelled", False))
+
+    def set_result(self, job_id: str, result: Any, status: Any = "done") -> None:
+        """
+        เก็บผลลัพธ์ ถ้าใหญ่เกิน offload_bytes จะเขียนลงดิสก์แทน
+        งานที่ถูกยกเลิกไปแล้ว (worker จบทีหลัง DELETE) → ไม่ทำอะไร สถานะยังเป็น "cancelled"
+        """
+        if self.is_cancelled(job_id):
+            logger.info("job %s already cancelled, result discarded", job_id)
+            return
+
+        payload = json.dumps(result, ensure_ascii=False, default=str)
+        result_path = None
+
+        if len(payload) >= self.offload_bytes:
+            try:
+                self.result_dir.mkdir(parents=True, exist_ok=True)
+                result_path = self.result_dir / f"{job_id}.json"
+                result_path.write_text(payload, encoding="utf-8")
+            except OSError as e:
+                logger.warning("offload result failed for job %s: %s", job_id, e)
+                result_path = None
+
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["result"] = None if result_path else result
+            job["result_path"] = str(result_path) if result_path else None
+            job["result_bytes"] = len(payload)
+        self.set_status(job_id, status)
+
+    def load_result(self, job_id: str) -> Any:
+        """คืน result (โหลดจากดิสก์ถ้าถูก offload ไว้ ไม่เก็บกลับเข้า memory)"""
+        with self._lock:
+            job = self[job_id]
+            result = job.get("result")
+            result_path = job.get("result_path")
+
+        if result is None and result_path:
+            return json.loads(Path(result_path).read_text(encoding="utf-8"))
+        return result
+
+    # --------------------------------------------------
+    # eviction
+    # --------------------------------------------------
+    def _drop(self, job_id: str) -> None:
+        job = self._jobs.pop(job_id, None)
+        if job is None:
+            return
+        self._evicted += 1
+        result_path = job.get("result_path")
+        if result_path:
+            try:
+                Path(result_path).unlink(missing_ok=True)
+            except OSError as e:
+                logger.warning("remove offloaded result failed (%s): %s", result_path, e)
+
+    def evict(self) -> int:
+        """ลบงานที่จบแล้ว: หมดอายุ (TTL) ก่อน แล้วค่อยตัดตาม LRU ให้เหลือ max_jobs"""
+        now = time.time()
+        removed = 0
+
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                finished_at = job.get("finished_at")
+                if finished_at is not None and now - finished_at > self.ttl_sec:
+                    self._drop(job_id)
+                    removed += 1
+
+            if len(self._jobs) > self.max_jobs:
+                # OrderedDict เรียงจากใช้ล่าสุดน้อยที่สุด → มากที่สุด
+                for job_id, job in list(self._jobs.items()):
+                    if len(self._jobs) <= self.max_jobs:
+                        break
+                    if _status_value(job["status"]) in FINISHED_STATUSES:
+                        self._drop(job_id)
+                        removed += 1
+
+        return removed
+
+    # --------------------------------------------------
+    # stats
+    # --------------------------------------------------
+    def status_counts(self) -> Dict[str, int]:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                status = _status_value(job["status"])
+                counts[status] = counts.get(status, 0) + 1
+            return counts
+
+    def stats(self) -> Dict[str, Any]:
+        self.evict()
+
+        with self._lock:
+            by_status: Dict[str, int] = {}
+            log_lines = 0
+            in_memory_bytes = 0
+            offloaded_jobs = 0
+            offloaded_bytes = 0
+
+            for job in self._jobs.values():
+                status = _status_value(job["status"])
+                by_status[status] = by_status.get(status, 0) + 1
+                log_lines += len(job["logs"])
+                in_memory_bytes += _approx_size(job)
+                if job.get("result_path"):
+                    offloaded_jobs += 1
+                    offloaded_bytes += job.get("result_bytes", 0)
+
+            return {
+                "registry": self.name,
+                "jobs": len(self._jobs),
+                "by_status": by_status,
+                "log_lines": log_lines,
+                "approx_memory_bytes": in_memory_bytes,
+                "offloaded_results": offloaded_jobs,
+                "offloaded_bytes": offloaded_bytes,
+                "evicted_total": self._evicted,
+                "limits": {
+                    "max_jobs": self.max_jobs,
+                    "ttl_sec": self.ttl_sec,
+                    "max_logs": self.max_logs,
+                    "offload_bytes": self.offload_bytes,
+                },
+            }
@@ -0,0 +1,106 @@
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
+
+try:
+    import resource  # Unix only
+except ImportError:  # pragma: no cover - Windows dev machine
+    resource = None
+
+
+def _peak_rss_mb() -> float:
+    """
+    peak RSS ของทั้ง process (MB) — ru_maxrss บน Linux เป็น KB
+    ⚠️ server รันหลายงานพร้อมกัน → ค่านี้รวมทุกงาน ไม่ใช่ของงานเดียว
+    """
+    if resource is None:
+        return 0.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+@dataclass
+class StageProfile:
+    stage: str
+    wall_seconds: float
+    cpu_seconds: float          # CPU ของ thread ที่รันงานนี้ (ไม่รวม thread อื่น / งานอื่น)
+    peak_rss_delta_mb: float    # peak RSS ที่เพิ่มขึ้นของทั้ง process (process-wide)
+    items: Optional[int] = None
+
+
+class StageProfiler:
+    """
+    เก็บเวลา/ทรัพยากรต่อ stage ของ pipeline compare
+    - wall time (perf_counter)
+    - CPU time ของ thread ที่รันงาน (thread_time) — งานอื่นที่รันพร้อมกันไม่ปนเข้ามา
+      แต่ไม่รวมงานที่ส่งไป thread อื่น (asyncio.to_thread / thread ภายในของ torch)
+    - peak RSS ที่เพิ่มขึ้นระหว่าง stage (ของทั้ง process: มีงานอื่นรันพร้อมกัน → ค่ารวมของทุกงาน)
+    - จำนวน item ที่ stage นั้นประมวลผล
+
+    ใช้แบบต่อเนื่อง: begin("load") ... end(items=...) หรือ with profiler.stage("load")
+    """
+
+    def __init__(self):
+        self.stages: List[StageProfile] = []
+        self._current: Optional[Dict] = None
+
+    def begin(self, stage: str) -> None:
+        if self._current is not None:
+            self.end()
+        self._current = {
+            "stage": stage,
+            "wall": time.perf_counter(),
+            "cpu": time.thread_time(),
+            "rss": _peak_rss_mb(),
+        }
+
+    def end(self, items: Optional[int] = None) -> Optional[StageProfile]:
+        cur = self._current
+        if cur is None:
+            return None
+        self._current = None
+
+        profile = StageProfile(
+            stage=cur["stage"],
+            wall_seconds=round(time.perf_counter() - cur["wall"], 4),
+            cpu_seconds=round(time.thread_time() - cur["cpu"], 4),
+            peak_rss_delta_mb=round(max(_peak_rss_mb() - cur["rss"], 0.0), 2),
+            items=items,
+        )
+        self.stages.append(profile)
+        return profile
+
+    @contextmanager
+    def stage(self, name: str):
+        self.begin(name)
+        holder = {"items": None}
+        try:
+            yield holder
+        finally:
+            self.end(items=holder["items"])
+
+    def to_list(self) -> List[dict]:
+        return [asdict(p) for p in self.stages]
+
+    def format_table(self) -> str:
+        lines = []
+        for p in self.stages:
+            lines.append(
+                f"  {p.stage:<14} wall={p.wall_seconds:>8.2f}s "
+                f"cpu={p.cpu_seconds:>8.2f}s "
+                f"rssΔ={p.peak_rss_delta_mb:>7.1f}MB "
+                f"items={p.items if p.items is not None else '-'}"
+            )
+        return "\n".join(lines)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    percentile (q = 0–100) แบบไม่ interpolate: ค่าจริงที่ตำแหน่ง round(q/100 × (n-1)) ของข้อมูลที่เรียงแล้ว
+    (ไม่ใช่ nearest-rank แบบ ceil(q/100 × n))
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(q / 100.0 * (len(ordered) - 1)))))
+    return float(ordered[k])
@@ -0,0 +1,146 @@
+# bench_prompt_prefix.py
+"""
+วัด time-to-first-token (TTFT) ของ prompt ai_comment 2 แบบ กับ OpenAI-compatible server (vLLM / Ollama / stub)
+
+- legacy : rubric + ข้อมูล change อยู่ใน human message เดียว (แบบเดิม)
+- prefix : rubric อยู่ใน system message (prefix เดียวกันทุก call) + ข้อมูล change ใน human message
+
+server ที่มี prefix caching (vLLM --enable-prefix-caching, Ollama keep-alive) ควรได้ TTFT ของแบบ prefix ต่ำกว่า
+เพราะไม่ต้องประมวลผล rubric ซ้ำทุก call
+
+นอกจากนี้วัดเวลาสร้าง template: from_template ทุก call (แบบเดิม) vs compile ครั้งเดียวตอน import
+
+ใช้งาน:
+    python -m test.bench_prompt_prefix --n 20
+    python -m test.bench_prompt_prefix --base-url http://localhost:8000/v1 --model qwen2.5-7b
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from dotenv import load_dotenv
+from openai import OpenAI
+from langchain_core.prompts import ChatPromptTemplate
+
+from src.AI.ai_comment import COMMENT_RUBRIC, SINGLE_CHANGE_HUMAN, SINGLE_CHANGE_PROMPT
+
+load_dotenv()
+
+_ROLE = {"system": "system", "human": "user", "ai": "assistant"}
+
+LEGACY_TEMPLATE = COMMENT_RUBRIC + SINGLE_CHANGE_HUMAN
+
+
+def sample_changes(n: int):
+    """change สมมติ (ข้อความไม่ซ้ำกัน → ไม่มี cache ของ suffix)"""
+    changes = []
+    for i in range(n):
+        changes.append({
+            "change_type": "MODIFIED",
+            "old_text": f"ผู้รับจ้างต้องส่งมอบเครื่องคอมพิวเตอร์จำนวน {40 + i} เครื่อง ภายใน {30 + i} วัน นับจากวันลงนามในสัญญา",
+            "new_text": f"ผู้รับจ้างต้องส่งมอบเครื่องคอมพิวเตอร์จำนวน {42 + i} เครื่อง ภายใน {45 + i} วัน นับจากวันลงนามในสัญญา",
+        })
+    return changes
+
+
+def legacy_messages(inputs: dict):
+    prompt = ChatPromptTemplate.from_template(LEGACY_TEMPLATE)
+    return prompt.format_messages(**inputs)
+
+
+def prefix_messages(inputs: dict):
+    return SINGLE_CHANGE_PROMPT.format_messages(**inputs)
+
+
+def to_openai(messages):
+    return [{"role": _ROLE.get(m.type, "user"), "content": m.content} for m in messages]
+
+
+def measure_ttft(client: OpenAI, model: str, messages, max_tokens: int) -> float:
+    start = time.perf_counter()
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=0.0,
+        stream=True,
+    )
+    ttft = None
+    for chunk in stream:
+        if ttft is None and chunk.choices and (chunk.choices[0].delta.content or ""):
+            ttft = time.perf_counter() - start
+    return ttft if ttft is not None else time.perf_counter() - start
+
+
+def summarize(name: str, values):
+    values = sorted(values)
+    p95 = values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))]
+    print(
+        f"  {name:<8} n={len(values):<3} mean={statistics.mean(values) * 1000:8.1f} ms  "
+        f"p50={statistics.median(values) * 1000:8.1f} ms  p95={p95 * 1000:8.1f} ms"
+    )
+
+
+def bench_templates(changes, rounds: int = 200):
+    print("\n🧪 เวลาสร้าง messages (ไม่รวม LLM)")
+    inputs = changes[0]
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        legacy_messages(inputs)
+    legacy = (time.perf_counter() - start) / rounds
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        prefix_messages(inputs)
+    prefix = (time.perf_counter() - start) / rounds
+
+    print(f"  from_template ทุก call : {legacy * 1e6:8.1f} µs/call")
+    print(f"  compile ตอน import     : {prefix * 1e6:8.1f} µs/call")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default=os.getenv("LOCALMODEL_BASE_URL", "http://localhost:11434/v1"))
+    parser.add_argument("--api-key", default=os.getenv("LOCALMODEL_API_KEY") or "local-dev-key")
+    parser.add_argument("--model", default=os.getenv("LOCALMODEL_MODEL_COMMENT") or os.getenv("LOCALMODEL_MODEL", "openai/gpt-oss-120b"))
+    parser.add_argument("--n", type=int, default=10, help="จำนวน request ต่อแบบ")
+    parser.add_argument("--max-tokens", type=int, default=8)
+    parser.add_argument("--skip-llm", action="store_true", help="วัดเฉพาะเวลาสร้าง template")
+    args = parser.parse_args()
+
+    changes = sample_changes(args.n)
+    bench_templates(changes)
+
+    if args.skip_llm:
+        return
+
+    print(f"\n🚀 TTFT → {args.base_url} model={args.model}")
+    client = OpenAI(base_url=args.base_url, api_key=args.api_key, max_retries=0)
+
+    # warm-up: โหลด model + ให้ server เห็น prefix ของแต่ละแบบก่อน
+    measure_ttft(client, args.model, to_openai(legacy_messages(changes[0])), args.max_tokens)
+    measure_ttft(client, args.model, to_openai(prefix_messages(changes[0])), args.max_tokens)
+
+    results = {"legacy": [], "prefix": []}
+    # สลับแบบทีละ request เพื่อไม่ให้ภาระของ server ช่วงใดช่วงหนึ่งเข้าข้างแบบใดแบบหนึ่ง
+    for inputs in changes:
+        results["legacy"].append(
+            measure_ttft(client, args.model, to_openai(legacy_messages(inputs)), args.max_tokens)
+        )
+        results["prefix"].append(
+            measure_ttft(client, args.model, to_openai(prefix_messages(inputs)), args.max_tokens)
+        )
+
+    print("\n📊 TTFT")
+    summarize("legacy", results["legacy"])
+    summarize("prefix", results["prefix"])
+
+    gain = 1 - statistics.median(results["prefix"]) / statistics.median(results["legacy"])
+    print(f"\n✅ prefix layout ลด TTFT (p50) ได้ {gain * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
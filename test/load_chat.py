@@ -0,0 +1,82 @@
+# load_chat.py
+"""
+load test ของ chat service (/changes/{id}/chat) — ใช้คู่กับ LLM stub เพื่อไม่ต้องยิง model server จริง
+
+    uvicorn src.api.llm_stub:app --port 8090
+    LOCALMODEL_BASE_URL=http://localhost:8090/v1 uvicorn src.api.server_ai_chat:app --port 8030
+    python -m test.load_chat --change-id 1 --users 20 --requests 100
+
+วัด time-to-first-chunk (event แรกที่ไม่ใช่ status) และเวลาทั้ง stream ต่อ request
+"""
+
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def one_chat(base_url: str, change_id: int, question: str, timeout: float):
+    started = time.perf_counter()
+    first_chunk = None
+    ok = True
+    try:
+        with requests.post(
+            f"{base_url}/changes/{change_id}/chat",
+            json={"question": question},
+            stream=True,
+            timeout=timeout,
+        ) as resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines(decode_unicode=True):
+                if first_chunk is None and line == "event: chunk":
+                    first_chunk = time.perf_counter() - started
+                if line and line.startswith("data: [ERROR]"):
+                    ok = False
+    except Exception as e:
+        print(f"❌ {e}")
+        ok = False
+    total = time.perf_counter() - started
+    return ok, first_chunk if first_chunk is not None else total, total
+
+
+def summarize(name: str, values):
+    if not values:
+        print(f"  {name:<12} (ไม่มีข้อมูล)")
+        return
+    values = sorted(values)
+    p95 = values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))]
+    print(
+        f"  {name:<12} mean={statistics.mean(values):7.2f}s  "
+        f"p50={statistics.median(values):7.2f}s  p95={p95:7.2f}s  max={values[-1]:7.2f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://localhost:8030")
+    parser.add_argument("--change-id", type=int, default=1)
+    parser.add_argument("--users", type=int, default=10, help="จำนวน request พร้อมกัน")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    print(f"🚀 {args.requests} requests / {args.users} concurrent → {args.base_url}")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        futures = [
+            pool.submit(one_chat, args.base_url, args.change_id, f"change_id: {args.change_id} คำถามที่ {i}", args.timeout)
+            for i in range(args.requests)
+        ]
+        results = [f.result() for f in futures]
+    wall = time.perf_counter() - started
+
+    ok = [r for r in results if r[0]]
+    print(f"\n📊 สำเร็จ {len(ok)}/{len(results)} ใน {wall:.1f}s ({len(results) / wall:.2f} req/s)")
+    summarize("first chunk", [r[1] for r in ok])
+    summarize("total", [r[2] for r in ok])
+
+
+if __name__ == "__main__":
+    main()
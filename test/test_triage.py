@@ -0,0 +1,49 @@
+# test_triage.py
+# python -m test.test_triage
+
+from src.diff.triage import TrivialEditTriage
+
+
+# การแก้ที่เปลี่ยนความหมาย → ต้องส่ง LLM (classify คืน None)
+MATERIAL_EDITS = [
+    ("ให้เพิ่มค่าบริการ increase 5%", "ให้เพิ่มค่าบริการ decrease 5%"),
+    ("The minimum order is 100 units.", "The maximum order is 100 units."),
+    ("ผู้ว่าจ้าง ต้องชำระเงินภายใน 30 วัน", "ผู้รับจ้าง ต้องชำระเงินภายใน 30 วัน"),
+    ("ค่าปรับ วันละ 1,000 บาท", "ค้าปรับ วันละ 1,000 บาท"),
+    ("The buyer shall pay within 30 days.", "The buyer may pay within 30 days."),
+    ("Payment within 30 days.", "Payment within 60 days."),
+    ("The contractor shall deliver.", "The subcontractor shall deliver."),
+]
+
+# การแก้เชิงรูปแบบ → triage ตอบเองได้
+TRIVIAL_EDITS = [
+    ("The buyer shall recieve the goods.", "The buyer shall receive the goods.", "spelling"),
+    ("The goverment agency.", "The government agency.", "spelling"),
+    ("ผู้ซื้อ  ต้องชำระ", "ผู้ซื้อ ต้องชำระ", "whitespace"),
+    ("ภายใน ๓๐ วัน", "ภายใน 30 วัน", "digit_format"),
+]
+
+
+def main():
+    triage = TrivialEditTriage()
+    failed = 0
+
+    for old, new in MATERIAL_EDITS:
+        result = triage.classify(old, new)
+        ok = result is None
+        failed += not ok
+        print(f"{'✅' if ok else '❌'} material : {old!r} → {new!r} = {result}")
+
+    for old, new, kind in TRIVIAL_EDITS:
+        result = triage.classify(old, new)
+        ok = result is not None and result[0] == kind
+        failed += not ok
+        print(f"{'✅' if ok else '❌'} {kind:<9}: {old!r} → {new!r} = {result}")
+
+    print("=" * 80)
+    print(f"FAILED: {failed}")
+    assert failed == 0
+
+
+if __name__ == "__main__":
+    main()